@@ -11,13 +11,29 @@ License: Apache 2.0
 """
 
 import os
+import queue
+import threading
+import time
 import zipfile
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 import gradio as gr
 
-from main import main as run_pipeline
+from main import main as run_pipeline, run_stats
+from src.generation.overlay import ProjectOverlay
+from src.models.backends import set_backend
+from src.service.client import WorkerClient
+from src.utils.archive import RawMember, attach_raw, directory_entries, export_archive, raw_members
+from src.utils.metrics import get_metrics, prometheus_text
+
+# Updated project of the last local run, kept in memory instead of written to 'project_new'.
+# None when the project is on disk (no run yet, or a run on the worker daemon).
+_project: Optional[ProjectOverlay] = None
+
+# Members of the uploaded ZIP by their path in 'project_old'. The download copies the
+# compressed bytes of the files still unchanged instead of compressing them again.
+_upload: Dict[str, RawMember] = {}
 
 
 def generate_tree(path: str, prefix: str = "") -> str:
@@ -83,12 +99,46 @@ def display_tree(dummy_input: Optional[str] = None) -> str:
     """
     project_path = "project_new"
 
+    if _project is not None:
+        return f"📁 {project_path}/\n{_project.tree()}"
+
     if not os.path.exists(project_path):
         return f"❌ The '{project_path}' folder does not exist yet. Generate a feature first."
 
     return f"📁 {project_path}/\n{generate_tree(project_path)}"
 
 
+def display_changes(dummy_input: Optional[str] = None) -> str:
+    """
+    Show the changes of the last run as a unified diff against 'project_old'.
+
+    Args:
+        dummy_input: Unused parameter (required by Gradio button callback).
+
+    Returns:
+        The diff, or a message if there is no in-memory result to compare.
+    """
+    if _project is None:
+        return "❌ No generated changes in memory. Generate a feature first."
+    return _project.diff() or "No file was changed."
+
+
+def save_project() -> str:
+    """
+    Write the updated project kept in memory to the 'project_new' folder.
+
+    Returns:
+        Success or error message string.
+    """
+    if _project is None:
+        return "❌ No generated changes in memory. Generate a feature first."
+    try:
+        path = _project.flush("project_new")
+        return f"✅ Project saved to '{path}' ({len(_project.changes)} files changed)."
+    except Exception as e:
+        return f"❌ Error saving project: {str(e)}"
+
+
 def unzip_file(file_obj: gr.File) -> str:
     """
     Unzip an uploaded ZIP file to the 'project_old' folder.
@@ -107,10 +157,15 @@ def unzip_file(file_obj: gr.File) -> str:
         >>> print(result)
         '✅ File unzipped successfully! Extracted 15 files.'
     """
+    global _project, _upload
+
     if not file_obj:
         return "❌ No file uploaded. Please upload a ZIP file."
 
     try:
+        # The in-memory result belongs to the project being replaced
+        _project = None
+        _upload = {}
         target_dir = Path("project_old")
 
         # Remove existing project_old if it exists
@@ -122,6 +177,7 @@ def unzip_file(file_obj: gr.File) -> str:
         target_dir.mkdir(parents=True, exist_ok=True)
 
         file_count = 0
+        extracted = {}
 
         with zipfile.ZipFile(file_obj.name, "r") as zip_ref:
             for member in zip_ref.namelist():
@@ -148,7 +204,9 @@ def unzip_file(file_obj: gr.File) -> str:
                     with open(target_path, "wb") as f:
                         f.write(zip_ref.read(member))
                     file_count += 1
+                    extracted[member_path] = member
 
+        _upload = raw_members(file_obj.name, extracted, str(target_dir))
         return f"✅ File unzipped successfully! Extracted {file_count} files to '{target_dir}'."
 
     except zipfile.BadZipFile:
@@ -161,7 +219,11 @@ def unzip_file(file_obj: gr.File) -> str:
 
 def zip_folder() -> Tuple[str, Optional[str]]:
     """
-    Create a ZIP archive of the 'project_new' folder.
+    Create a ZIP archive of the updated project.
+
+    Archives are named after their content (see ``src.utils.archive``), so
+    downloading the same result again reuses the archive built the first time.
+    Files unchanged since the upload are copied compressed from the uploaded ZIP.
 
     Returns:
         Tuple of (status_message, zip_file_path).
@@ -173,21 +235,17 @@ def zip_folder() -> Tuple[str, Optional[str]]:
         '✅ Project zipped successfully! 25 files archived.'
     """
     project_path = Path("project_new")
-    zip_path = "project_new.zip"
 
-    if not project_path.exists():
+    if _project is None and not project_path.exists():
         return "❌ Folder 'project_new' was not found. Generate a feature first.", None
 
     try:
-        file_count = 0
-
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(project_path):
-                for filename in files:
-                    file_path = Path(root) / filename
-                    arc_name = file_path.relative_to(project_path)
-                    zipf.write(file_path, arc_name)
-                    file_count += 1
+        if _project is not None:
+            entries = _project.archive_entries()
+        else:
+            entries = directory_entries(str(project_path))
+        zip_path = export_archive(attach_raw(entries, _upload), "project_new")
+        file_count = len(entries)
 
         return (
             f"✅ Project zipped successfully! {file_count} files archived to '{zip_path}'.",
@@ -198,36 +256,123 @@ def zip_folder() -> Tuple[str, Optional[str]]:
         return f"❌ Error zipping folder: {str(e)}", None
 
 
-def run_pipeline_wrapper(user_request: str) -> str:
+# Minimum delay between UI refreshes while tokens are streaming
+_STREAM_REFRESH_SECONDS = 0.25
+# Maximum number of characters of live output kept in the UI
+_STREAM_TAIL_CHARS = 20000
+
+
+def run_pipeline_wrapper(user_request: str) -> Iterator[Tuple[str, str]]:
     """
-    Execute the Factory Feature pipeline with error handling.
+    Execute the Factory Feature pipeline in streaming mode with error handling.
+
+    The pipeline runs in a background thread and this generator yields the
+    progress log and the live LLM output as they are produced, so the UI gives
+    feedback within seconds instead of after the whole run. The updated project
+    is kept in memory for the tree view, diff and download rather than written to
+    'project_new' and read back. If ``FACTORY_WORKER_ADDRESS`` is set, the request
+    is submitted to that worker daemon instead, which writes 'project_new', and
+    its progress log is shown.
 
     Args:
         user_request: Natural language description of the feature to integrate.
 
-    Returns:
-        Success or error message string.
+    Yields:
+        Tuple of (status_log, live_output).
 
     Example:
-        >>> result = run_pipeline_wrapper("Add logging to all modules")
-        >>> print(result)
+        >>> for status, output in run_pipeline_wrapper("Add logging to all modules"):
+        ...     pass
+        >>> print(status.splitlines()[-1])
         '✅ Pipeline executed successfully!'
     """
+    global _project
+
     if not user_request or not user_request.strip():
-        return "❌ Error: Feature request cannot be empty. Please provide a description."
+        yield "❌ Error: Feature request cannot be empty. Please provide a description.", ""
+        return
 
     if not Path("project_old").exists():
-        return "❌ Error: 'project_old' folder not found. Please upload a project first."
-
-    try:
-        run_pipeline(user_request.strip())
-        return "✅ Pipeline executed successfully! The updated project is ready for download."
-    except FileNotFoundError as e:
-        return f"❌ File not found error: {str(e)}"
-    except ValueError as e:
-        return f"❌ Invalid input: {str(e)}"
-    except Exception as e:
-        return f"❌ Error during pipeline execution: {str(e)}"
+        yield "❌ Error: 'project_old' folder not found. Please upload a project first.", ""
+        return
+
+    events: "queue.Queue[Tuple[str, object]]" = queue.Queue()
+    _project = None
+
+    def run_on_worker(address: str) -> None:
+        # A resident worker daemon keeps the models loaded between requests
+        client = WorkerClient(address)
+        job = client.submit(
+            user_request.strip(),
+            project_path="project_old",
+            output_path="project_new",
+        )
+        events.put(("status", f"Submitted job {job['id']} to worker at {client.address}"))
+        for line in client.follow(job["id"]):
+            events.put(("status", line))
+        result = client.result(job["id"])
+        if result["status"] != "succeeded":
+            raise RuntimeError(result["error"])
+
+    def worker() -> None:
+        try:
+            address = os.getenv("FACTORY_WORKER_ADDRESS")
+            if address:
+                run_on_worker(address)
+            else:
+                run_pipeline(
+                    user_request.strip(),
+                    stream=True,
+                    on_event=lambda kind, data: events.put((kind, data)),
+                    in_memory=True,
+                )
+            events.put(("done", None))
+        except BaseException as e:  # sys.exit() in the pipeline raises SystemExit
+            events.put(("error", e))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    status_lines = []
+    output = ""
+    last_refresh = 0.0
+
+    while True:
+        kind, data = events.get()
+
+        if kind == "status":
+            status_lines.append(str(data))
+        elif kind == "file":
+            output += f"\n\n===== {data} =====\n"
+        elif kind == "project":
+            _project = data
+            continue
+        elif kind == "token":
+            output += str(data)
+            output = output[-_STREAM_TAIL_CHARS:]
+            # Throttle refreshes for token events; status events are shown immediately
+            if time.monotonic() - last_refresh < _STREAM_REFRESH_SECONDS:
+                continue
+        elif kind == "done":
+            status_lines.append(
+                "✅ Pipeline executed successfully! The updated project is ready for download."
+            )
+            yield "\n".join(status_lines), output
+            return
+        elif kind == "error":
+            if isinstance(data, FileNotFoundError):
+                message = f"❌ File not found error: {str(data)}"
+            elif isinstance(data, ValueError):
+                message = f"❌ Invalid input: {str(data)}"
+            elif isinstance(data, SystemExit):
+                message = "❌ Error during pipeline execution. Check the logs for details."
+            else:
+                message = f"❌ Error during pipeline execution: {str(data)}"
+            status_lines.append(message)
+            yield "\n".join(status_lines), output
+            return
+
+        last_refresh = time.monotonic()
+        yield "\n".join(status_lines), output
 
 
 def submit_settings(api_key: str, project_id: str, watsonx_url: str) -> str:
@@ -254,11 +399,33 @@ def submit_settings(api_key: str, project_id: str, watsonx_url: str) -> str:
         os.environ["WATSONX_APIKEY"] = api_key.strip()
         os.environ["PROJECT_ID"] = project_id.strip()
         os.environ["WATSONX_URL"] = watsonx_url.strip()
+        # Recreate the LLM backend on next use so it picks up the new credentials
+        set_backend(None)
         return "✅ Environment variables loaded successfully!"
     except Exception as e:
         return f"❌ Error setting environment variables: {str(e)}"
 
 
+def show_metrics() -> Tuple[Dict[str, Any], str]:
+    """
+    Collect the metrics of the pipeline runs of this process for the admin view.
+
+    Returns:
+        Tuple of (overview, prometheus_text): per-stage and per-call timing
+        aggregates, token and byte counters and the LLM cache, resilience and
+        output statistics, and the same metrics in Prometheus text format.
+    """
+    snapshot = get_metrics().snapshot()
+    stats = run_stats()
+    overview = {
+        "uptime_seconds": round(snapshot["uptime_seconds"], 1),
+        "spans": snapshot["summary"],
+        "counters": snapshot["counters"],
+        "stats": stats,
+    }
+    return overview, prometheus_text(snapshot, stats)
+
+
 # Application constants
 _TITLE = "Factory Feature"
 _DESCRIPTION = """
@@ -298,6 +465,7 @@ _INSTRUCTIONS = """
 
 5. **💾 Download Result**:
    - Click **Display Results** to preview the updated structure
+   - Click **Show Changes** to review the generated changes as a diff
    - Click **Download New Project** to get the ZIP file
 
 ---
@@ -355,7 +523,12 @@ with gr.Blocks(title=_TITLE, theme=gr.themes.Soft()) as demo:
                         lines=5,
                         placeholder="Describe the feature you want to add...",
                     )
-                    pipeline_output = gr.Textbox(label="🔄 Pipeline Status", interactive=False)
+                    pipeline_output = gr.Textbox(
+                        label="🔄 Pipeline Status", lines=8, max_lines=8, interactive=False
+                    )
+                    live_output = gr.Textbox(
+                        label="📝 Live Output", lines=10, max_lines=10, interactive=False
+                    )
                     pipeline_button = gr.Button("🚀 Generate Feature", variant="primary")
 
                 with gr.Column(scale=5):
@@ -364,6 +537,10 @@ with gr.Blocks(title=_TITLE, theme=gr.themes.Soft()) as demo:
                         label="📁 Updated Project Structure", lines=15, interactive=False
                     )
                     tree_button = gr.Button("👁️ Display Results", variant="secondary")
+                    changes_output = gr.Textbox(
+                        label="🔍 Changes", lines=15, max_lines=30, interactive=False
+                    )
+                    changes_button = gr.Button("🔍 Show Changes", variant="secondary")
 
                     gr.Markdown("---")
 
@@ -371,6 +548,7 @@ with gr.Blocks(title=_TITLE, theme=gr.themes.Soft()) as demo:
                     zip_output = gr.Textbox(label="📦 Archive Status", interactive=False)
                     zip_download = gr.File(label="💾 Download Project ZIP")
                     zip_button = gr.Button("⬇️ Download New Project", variant="primary")
+                    save_button = gr.Button("💾 Save to project_new", variant="secondary")
 
         # Settings Tab
         with gr.TabItem("⚙️ Settings"):
@@ -401,14 +579,34 @@ with gr.Blocks(title=_TITLE, theme=gr.themes.Soft()) as demo:
                 settings_output = gr.Textbox(label="⚙️ Settings Status", interactive=False)
                 submit_button = gr.Button("✅ Submit Settings", variant="primary")
 
+        # Metrics Tab
+        with gr.TabItem("📊 Metrics"):
+            with gr.Column():
+                gr.Markdown(
+                    """
+                ### Pipeline Metrics
+
+                Timing of every stage, LLM call, retrieval and embedding build, token and
+                cache counters of the runs since the application started.
+                """
+                )
+                metrics_overview = gr.JSON(label="📈 Overview")
+                metrics_prometheus = gr.Code(label="📄 Prometheus Text", interactive=False)
+                metrics_button = gr.Button("🔄 Refresh Metrics", variant="secondary")
+
     # Event handlers
     unzip_button.click(unzip_file, inputs=unzip_input, outputs=unzip_output)
-    pipeline_button.click(run_pipeline_wrapper, inputs=user_request, outputs=pipeline_output)
+    pipeline_button.click(
+        run_pipeline_wrapper, inputs=user_request, outputs=[pipeline_output, live_output]
+    )
     tree_button.click(display_tree, inputs=None, outputs=tree_output)
+    changes_button.click(display_changes, inputs=None, outputs=changes_output)
+    save_button.click(save_project, outputs=zip_output)
     zip_button.click(zip_folder, outputs=[zip_output, zip_download])
     submit_button.click(
         submit_settings, inputs=[api_key, project_id, watsonx_url], outputs=settings_output
     )
+    metrics_button.click(show_metrics, outputs=[metrics_overview, metrics_prometheus])
 
 # Launch application
 if __name__ == "__main__":
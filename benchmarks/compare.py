@@ -0,0 +1,122 @@
+"""
+Compares two benchmark results files (see ``benchmarks.run``).
+
+Stages are matched by name and project size. For each pair the median
+latency, throughput and peak memory of both runs are listed with the relative
+change; a stage whose median latency grew by more than ``--threshold`` percent
+is flagged as a regression.
+
+Usage::
+
+    python -m benchmarks.compare BASE.json NEW.json [--threshold 10] [--fail-on-regression]
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_THRESHOLD = 10.0
+
+
+def load_results(path: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    """
+    Reads a results file into ``{(stage, files): result}``.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {(result["stage"], result["files"]): result for result in report["results"]}
+
+
+def _change(base: float, new: float) -> Optional[float]:
+    return (new - base) / base * 100 if base else None
+
+
+def compare_results(
+    base: Dict[Tuple[str, int], Dict[str, Any]],
+    new: Dict[Tuple[str, int], Dict[str, Any]],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> List[Dict[str, Any]]:
+    """
+    Compares the stages present in both results.
+
+    Returns:
+        List[Dict[str, Any]]: Per stage and size: the base and new median latency
+        (ms), throughput (items/s) and peak memory (MB), their relative changes in
+        percent, and ``regression`` if the latency grew by more than ``threshold``.
+    """
+    rows = []
+    for key in [key for key in base if key in new]:
+        before, after = base[key], new[key]
+        if before.get("error") or after.get("error"):
+            continue
+        latency = _change(before["latency_ms"]["p50"], after["latency_ms"]["p50"])
+        rows.append(
+            {
+                "stage": key[0],
+                "files": key[1],
+                "base_p50_ms": before["latency_ms"]["p50"],
+                "new_p50_ms": after["latency_ms"]["p50"],
+                "latency_change": latency,
+                "base_items_per_second": before["items_per_second"],
+                "new_items_per_second": after["items_per_second"],
+                "throughput_change": _change(before["items_per_second"], after["items_per_second"]),
+                "base_peak_memory_mb": before["peak_memory_mb"],
+                "new_peak_memory_mb": after["peak_memory_mb"],
+                "memory_change": _change(before["peak_memory_mb"], after["peak_memory_mb"]),
+                "regression": latency is not None and latency > threshold,
+            }
+        )
+    return rows
+
+
+def format_comparison(rows: List[Dict[str, Any]]) -> str:
+    """
+    Formats compared stages as a text table.
+    """
+
+    def percent(value: Optional[float]) -> str:
+        return f"{value:+.1f}%" if value is not None else "n/a"
+
+    lines = [
+        f"{'stage':>9} {'files':>7} {'p50 base':>12} {'p50 new':>12} {'change':>8} "
+        f"{'items/s':>10} {'memory':>8}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['stage']:>9} {row['files']:>7} {row['base_p50_ms']:>9.2f} ms "
+            f"{row['new_p50_ms']:>9.2f} ms {percent(row['latency_change']):>8} "
+            f"{percent(row['throughput_change']):>10} {percent(row['memory_change']):>8}"
+            + ("  REGRESSION" if row["regression"] else "")
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files")
+    parser.add_argument("base", help="Results of the baseline commit")
+    parser.add_argument("new", help="Results of the commit under test")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Median latency increase (percent) reported as a regression",
+    )
+    parser.add_argument(
+        "--fail-on-regression", action="store_true", help="Exit with status 1 on a regression"
+    )
+    args = parser.parse_args(argv)
+
+    rows = compare_results(load_results(args.base), load_results(args.new), args.threshold)
+    if not rows:
+        print("No stage was measured by both results files.")
+        return 0
+    print(format_comparison(rows))
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"{len(regressions)} regressions above {args.threshold:.0f}%")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
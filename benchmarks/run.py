@@ -0,0 +1,501 @@
+"""
+Benchmark suite of the Factory Feature pipeline on synthetic projects.
+
+For each project size, a synthetic project is generated (see
+``benchmarks.synthetic``) and every stage of the pipeline is run on it with
+the stub LLM backend, so results only measure this code base:
+
+    parse     ``parse_project`` over the whole project
+    index     ``build_vector_database`` (embedding and Chroma insertion)
+    query     ``query_vector_database``, one call per query
+    tree      ``get_tree`` and ``list_tree_paths``
+    generate  Step 7 task prompts and ``query_llm`` calls, one per modified file
+    update    ``update_project_structure`` (clone and write the modified files)
+    zip       ``zip_directory`` of the updated project
+
+Each stage runs once under ``tracemalloc`` to measure its peak Python memory,
+then ``--repeat`` times for timing. Results (throughput, latency percentiles,
+peak memory) are written to a JSON file that ``benchmarks.compare`` compares
+across commits.
+
+Usage::
+
+    python -m benchmarks.run --files 10,1000,10000
+    python -m benchmarks.run --files 50000 --stages parse,tree,update,zip --repeat 1
+    python -m benchmarks.compare benchmarks/results/BASE.json benchmarks/results/NEW.json
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.synthetic import DEFAULT_MIX, DEFAULT_SIZES, ProjectSpec, generate_project
+
+STAGES = ("parse", "index", "query", "tree", "generate", "update", "zip")
+DEFAULT_FILES = (10, 100, 1000)
+DEFAULT_REPEAT = 3
+DEFAULT_QUERIES = 20
+# Files modified by the synthetic plan (at most)
+DEFAULT_MODIFIED = 50
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+QUERIES = (
+    "Add logging to all services",
+    "Where are requests handled?",
+    "Add retries to the request handlers",
+    "Document the configuration options",
+    "Add input validation to compute functions",
+)
+
+
+@dataclass
+class StageResult:
+    """
+    Benchmark result of one stage on one project size.
+
+    Attributes:
+        stage: Stage name (see ``STAGES``).
+        files: Number of files of the project.
+        items: Work items per run (files, queries or LLM calls).
+        runs: Timed runs.
+        seconds: Wall-clock seconds of each timed run.
+        latency_ms: Percentiles of the latency of one item (query and generate)
+            or of one run (other stages): p50, p90, p99, mean, min and max.
+        items_per_second: Items processed per second (median run).
+        mb_per_second: Project megabytes processed per second (median run).
+        peak_memory_mb: Peak Python memory allocated by one run (tracemalloc).
+        error: Why the stage could not run (e.g. a missing optional dependency).
+    """
+
+    stage: str
+    files: int
+    items: int = 0
+    runs: int = 0
+    seconds: List[float] = field(default_factory=list)
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+    items_per_second: float = 0.0
+    mb_per_second: float = 0.0
+    peak_memory_mb: float = 0.0
+    error: str = ""
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """
+    Returns the ``q``-th percentile (0-100) of ``samples``, linearly interpolated.
+    """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarizes latencies in seconds as milliseconds.
+    """
+    if not samples:
+        return {}
+    summary = {f"p{q}": percentile(samples, q) for q in (50, 90, 99)}
+    summary.update(mean=sum(samples) / len(samples), min=min(samples), max=max(samples))
+    return {key: round(value * 1000, 3) for key, value in summary.items()}
+
+
+def _measure(run: Callable[[], List[float]], repeat: int) -> Tuple[float, List[float], List[float]]:
+    # One traced run for peak memory, then untraced timed runs. ``run`` returns
+    # the latency of each item it processed (empty if it has a single item).
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds, latencies = [], []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        latencies += run()
+        seconds.append(time.perf_counter() - started)
+    return peak / (1024 * 1024), seconds, latencies
+
+
+class Benchmark:
+    """
+    Runs the stages of the pipeline on one synthetic project.
+
+    Attributes:
+        spec: Shape of the synthetic project.
+        work_dir: Scratch directory of the project and the stage outputs.
+        repeat: Timed runs per stage.
+        queries: Queries per run of the query stage.
+        modified: Files modified by the synthetic plan.
+        fake_embeddings: Use deterministic fake embeddings instead of the
+            sentence-transformers model, to measure the vector store alone.
+    """
+
+    def __init__(
+        self,
+        spec: ProjectSpec,
+        work_dir: str,
+        repeat: int = DEFAULT_REPEAT,
+        queries: int = DEFAULT_QUERIES,
+        modified: int = DEFAULT_MODIFIED,
+        fake_embeddings: bool = False,
+    ):
+        self.spec = spec
+        self.work_dir = work_dir
+        self.repeat = repeat
+        self.queries = queries
+        self.modified = modified
+        self.fake_embeddings = fake_embeddings
+        self.project_path = os.path.join(work_dir, "project_old")
+        self.output_path = os.path.join(work_dir, "project_new")
+        self.project = generate_project(self.project_path, spec)
+        self.project_data: List[Dict[str, str]] = []
+        self.vector_db: Any = None
+        self.plan = ""
+        self.responses: List[str] = []
+
+    def run(self, stages: Sequence[str]) -> List[StageResult]:
+        """
+        Runs ``stages`` in pipeline order and returns their results.
+
+        A stage that fails (e.g. because Chroma is not installed) is recorded
+        with its error, and the stages depending on it are skipped.
+        """
+        results = []
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            result = StageResult(stage, self.spec.files)
+            try:
+                items, run = getattr(self, f"_{stage}")()
+                peak, seconds, latencies = _measure(run, self.repeat)
+            except Exception as e:
+                result.error = f"{e.__class__.__name__}: {e}"
+                results.append(result)
+                continue
+            median = percentile(seconds, 50)
+            result.items = items
+            result.runs = len(seconds)
+            result.seconds = [round(value, 6) for value in seconds]
+            result.latency_ms = latency_summary(latencies or seconds)
+            result.items_per_second = round(items / median, 3) if median else 0.0
+            result.mb_per_second = (
+                round(self.project.total_bytes / (1024 * 1024) / median, 3)
+                if median and stage in ("parse", "index", "tree", "update", "zip")
+                else 0.0
+            )
+            result.peak_memory_mb = round(peak, 3)
+            results.append(result)
+        return results
+
+    def _parse(self):
+        from src.analysis.project_parser import parse_project
+
+        def run() -> List[float]:
+            self.project_data = parse_project(self.project_path)
+            return []
+
+        return self.spec.files, run
+
+    def _index(self):
+        from src.vector_database import db_builder
+
+        if self.fake_embeddings:
+            from langchain_community.embeddings import DeterministicFakeEmbedding
+
+            db_builder.get_embedding_function = lambda *args: DeterministicFakeEmbedding(size=384)
+        project_data = self.project_data or self._load_project_data()
+        builds = iter(range(self.repeat + 1))
+
+        def run() -> List[float]:
+            # Chroma keeps clients of a path open: every build gets a new directory
+            persist_directory = os.path.join(self.work_dir, f"chroma_db_{next(builds)}")
+            self.vector_db = db_builder.build_vector_database(
+                project_data, persist_directory=persist_directory
+            )
+            return []
+
+        return len(project_data), run
+
+    def _query(self):
+        from src.vector_database.db_query import query_vector_database
+
+        if self.vector_db is None:
+            raise RuntimeError("the index stage did not run")
+        queries = [QUERIES[index % len(QUERIES)] for index in range(self.queries)]
+
+        def run() -> List[float]:
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                query_vector_database(self.vector_db, query)
+                latencies.append(time.perf_counter() - started)
+            return latencies
+
+        return len(queries), run
+
+    def _tree(self):
+        from src.analysis.tree import get_tree, list_tree_paths
+
+        def run() -> List[float]:
+            list_tree_paths(get_tree(self.project_path))
+            return []
+
+        return self.spec.files, run
+
+    def _generate(self):
+        from src.generation.task_prompts import generate_task_prompts
+        from src.models.backends import StubBackend, set_backend
+        from src.models.llm_cache import configure_cache
+        from src.models.llm_inference import query_llm
+
+        set_backend(StubBackend())
+        configure_cache(enabled=False)
+        modified = self.project.paths[: self.modified]
+        existing_files = []
+        for path in modified:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            existing_files.append(
+                {"file_path": path, "task": "Add logging to this module", "content": content}
+            )
+        plan = {
+            "feature_request": "Add logging to all modules",
+            "analysis_results": "Every module gets a module-level logger.",
+            "existing_files": existing_files,
+            "new_files": [],
+        }
+        prompts = generate_task_prompts(json.dumps(plan))
+        # Step 8 reads the plan without the file contents
+        tasks = [{"file_path": item["file_path"], "task": item["task"]} for item in existing_files]
+        self.plan = json.dumps({**plan, "existing_files": tasks})
+
+        def run() -> List[float]:
+            latencies, responses = [], []
+            for prompt in prompts:
+                started = time.perf_counter()
+                responses.append(query_llm(user_input=prompt, use_cache=False))
+                latencies.append(time.perf_counter() - started)
+            self.responses = responses
+            return latencies
+
+        return len(prompts), run
+
+    def _update(self):
+        from src.generation.project_structure import update_project_structure
+
+        if not self.plan:
+            raise RuntimeError("the generate stage did not run")
+
+        def run() -> List[float]:
+            update_project_structure(
+                self.plan, self.responses, self.project_path, self.output_path
+            )
+            return []
+
+        return self.spec.files, run
+
+    def _zip(self):
+        from src.utils.file_operations import zip_directory
+
+        source = self.output_path if os.path.isdir(self.output_path) else self.project_path
+        zip_path = os.path.join(self.work_dir, "project_new.zip")
+
+        def run() -> List[float]:
+            zip_directory(source, zip_path)
+            return []
+
+        return self.spec.files, run
+
+    def _load_project_data(self) -> List[Dict[str, str]]:
+        from src.analysis.project_parser import parse_project
+
+        self.project_data = parse_project(self.project_path)
+        return self.project_data
+
+
+def _git_commit() -> str:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], check=False).returncode != 0
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return result.stdout.strip() + ("-dirty" if dirty else "")
+
+
+def run_suite(
+    files: Sequence[int] = DEFAULT_FILES,
+    stages: Sequence[str] = STAGES,
+    mix: str = DEFAULT_MIX,
+    sizes: str = DEFAULT_SIZES,
+    repeat: int = DEFAULT_REPEAT,
+    queries: int = DEFAULT_QUERIES,
+    modified: int = DEFAULT_MODIFIED,
+    fake_embeddings: bool = False,
+    seed: int = 0,
+    on_result: Optional[Callable[[StageResult], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Runs the benchmark for each project size.
+
+    Args:
+        files: Project sizes in files.
+        stages: Stages to run (see ``STAGES``).
+        mix: Language mix of the synthetic projects.
+        sizes: File size distribution of the synthetic projects.
+        repeat: Timed runs per stage.
+        queries: Queries per run of the query stage.
+        modified: Files modified by the synthetic plan.
+        fake_embeddings: Use fake embeddings in the index stage.
+        seed: Seed of the synthetic projects.
+        on_result: Optional callback receiving each stage result.
+
+    Returns:
+        Dict[str, Any]: ``{"meta": {...}, "results": [...]}``, the results file content.
+    """
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}; use {', '.join(STAGES)}")
+
+    results = []
+    for count in files:
+        spec = ProjectSpec(count, mix=mix, sizes=sizes, seed=seed)
+        with tempfile.TemporaryDirectory(prefix="factory-bench-") as work_dir:
+            benchmark = Benchmark(spec, work_dir, repeat, queries, modified, fake_embeddings)
+            for result in benchmark.run(stages):
+                results.append(result)
+                if on_result:
+                    on_result(result)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "mix": mix,
+            "sizes": sizes,
+            "repeat": repeat,
+            "queries": queries,
+            "modified": modified,
+            "fake_embeddings": fake_embeddings,
+            "seed": seed,
+        },
+        "results": [asdict(result) for result in results],
+    }
+
+
+def format_result(result: StageResult) -> str:
+    """
+    Formats a stage result as one line of the progress output.
+    """
+    if result.error:
+        return f"{result.stage:>9} {result.files:>7} files  skipped: {result.error}"
+    return (
+        f"{result.stage:>9} {result.files:>7} files  "
+        f"p50 {result.latency_ms['p50']:>10.2f} ms  p99 {result.latency_ms['p99']:>10.2f} ms  "
+        f"{result.items_per_second:>10.1f} items/s  {result.mb_per_second:>8.2f} MB/s  "
+        f"peak {result.peak_memory_mb:>8.1f} MB"
+    )
+
+
+def _parse_files(value: str) -> List[int]:
+    try:
+        files = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected comma-separated file counts, got '{value}'")
+    if not files or any(count < 1 for count in files):
+        raise argparse.ArgumentTypeError("file counts must be positive")
+    return files
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Factory Feature pipeline benchmarks")
+    parser.add_argument(
+        "--files",
+        type=_parse_files,
+        default=list(DEFAULT_FILES),
+        metavar="N[,N...]",
+        help="Project sizes in files (default: 10,100,1000)",
+    )
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help=f"Comma-separated stages to run (default: {','.join(STAGES)})",
+    )
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Language mix, LANG=WEIGHT pairs")
+    parser.add_argument(
+        "--sizes",
+        default=DEFAULT_SIZES,
+        help="File size distribution in bytes: fixed:N, uniform:A,B or lognormal:MEDIAN,SIGMA",
+    )
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per stage")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="Queries per run")
+    parser.add_argument(
+        "--modified", type=int, default=DEFAULT_MODIFIED, help="Files modified by the plan"
+    )
+    parser.add_argument(
+        "--fake-embeddings",
+        action="store_true",
+        help="Index with deterministic fake embeddings (measures Chroma without the model)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic projects")
+    parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help=f"Results file (default: {RESULTS_DIR}/<time>-<commit>.json)",
+    )
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    # Keep per-file INFO logging of the pipeline out of the measurements' output
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("src.generation.project_structure").setLevel(logging.WARNING)
+
+    try:
+        report = run_suite(
+            files=args.files,
+            stages=[stage.strip() for stage in args.stages.split(",") if stage.strip()],
+            mix=args.mix,
+            sizes=args.sizes,
+            repeat=args.repeat,
+            queries=args.queries,
+            modified=args.modified,
+            fake_embeddings=args.fake_embeddings,
+            seed=args.seed,
+            on_result=lambda result: print(format_result(result), flush=True),
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""
+Synthetic projects for the benchmark suite.
+
+``generate_project`` writes a deterministic project of any size: source files
+in a configurable mix of languages, with sizes drawn from a configurable
+distribution, spread over nested packages of bounded fan-out like a real
+repository.
+
+Language mixes are given as ``LANG=WEIGHT`` pairs, e.g.
+``python=0.6,javascript=0.2,markdown=0.1,json=0.1``. File sizes (in bytes)
+follow one of:
+
+    ``fixed:N``: every file has N bytes.
+    ``uniform:A,B``: uniformly distributed between A and B bytes.
+    ``lognormal:MEDIAN,SIGMA``: log-normally distributed around MEDIAN bytes, the
+        long-tailed shape of real source trees.
+"""
+
+import json
+import math
+import os
+import random
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+DEFAULT_MIX = "python=0.6,javascript=0.2,markdown=0.1,json=0.1"
+DEFAULT_SIZES = "lognormal:3000,1.0"
+
+# Files per directory and sub-packages per package
+FILES_PER_DIRECTORY = 20
+PACKAGES_PER_DIRECTORY = 10
+
+# Bounds of generated file sizes in bytes
+MIN_FILE_BYTES = 64
+MAX_FILE_BYTES = 512 * 1024
+
+
+def _python_block(rng: random.Random, index: int) -> str:
+    if index % 4 == 0:
+        return (
+            f"class Service{index}:\n"
+            f'    """Handles requests of kind {index}."""\n\n'
+            f"    def __init__(self, limit={rng.randint(1, 100)}):\n"
+            f"        self.limit = limit\n\n"
+            f"    def handle(self, items):\n"
+            f"        return [item * {rng.randint(2, 9)} for item in items[: self.limit]]\n\n\n"
+        )
+    return (
+        f"def compute_{index}(values, factor={rng.randint(1, 50)}):\n"
+        f'    """Scales and sums values (step {index})."""\n'
+        f"    total = 0\n"
+        f"    for value in values:\n"
+        f"        total += value * factor\n"
+        f"    return total\n\n\n"
+    )
+
+
+def _javascript_block(rng: random.Random, index: int) -> str:
+    return (
+        f"export function handler{index}(request, "
+        f"options = {{ retries: {rng.randint(1, 5)} }}) {{\n"
+        f"  const items = request.items.filter((item) => item.weight > {rng.randint(1, 20)});\n"
+        f"  return items.map((item) => ({{ ...item, score: item.weight * options.retries }}));\n"
+        f"}}\n\n"
+    )
+
+
+def _markdown_block(rng: random.Random, index: int) -> str:
+    return (
+        f"## Section {index}\n\n"
+        f"This section describes component {rng.randint(1, 1000)} and how it is configured. "
+        f"Set `option_{index}` to enable it and restart the service.\n\n"
+    )
+
+
+def _json_block(rng: random.Random, index: int) -> str:
+    entry = {
+        "id": index,
+        "name": f"item-{index}",
+        "weight": rng.randint(1, 100),
+        "tags": ["a", "b"],
+    }
+    return json.dumps(entry) + ",\n"
+
+
+# Extension and content generator of each language
+LANGUAGES: Dict[str, tuple] = {
+    "python": (".py", _python_block),
+    "javascript": (".js", _javascript_block),
+    "markdown": (".md", _markdown_block),
+    "json": (".json", _json_block),
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """
+    Parses a language mix such as ``python=0.7,markdown=0.3``.
+
+    Raises:
+        ValueError: If a language is unknown or the weights are not positive.
+    """
+    mix = {}
+    for part in spec.split(","):
+        language, _, weight = part.strip().partition("=")
+        if language not in LANGUAGES:
+            raise ValueError(f"Unknown language '{language}'; use {', '.join(LANGUAGES)}")
+        try:
+            mix[language] = float(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight '{weight}' for {language}")
+    if not mix or any(weight <= 0 for weight in mix.values()):
+        raise ValueError(f"Invalid language mix '{spec}'")
+    return mix
+
+
+def size_sampler(spec: str, rng: random.Random) -> Callable[[], int]:
+    """
+    Returns a function drawing file sizes in bytes from the distribution ``spec``.
+
+    Raises:
+        ValueError: If the specification is not recognised.
+    """
+    kind, _, raw_args = spec.strip().lower().partition(":")
+    try:
+        args = [float(value) for value in raw_args.split(",")] if raw_args else []
+    except ValueError:
+        raise ValueError(f"Invalid size distribution '{spec}'")
+    expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+    if kind not in expected or len(args) != expected[kind]:
+        raise ValueError(
+            f"Unknown size distribution '{spec}'; "
+            "use fixed:N, uniform:A,B or lognormal:MEDIAN,SIGMA"
+        )
+
+    def clamp(value: float) -> int:
+        return int(min(max(value, MIN_FILE_BYTES), MAX_FILE_BYTES))
+
+    if kind == "fixed":
+        return lambda: clamp(args[0])
+    if kind == "uniform":
+        return lambda: clamp(rng.uniform(args[0], args[1]))
+    return lambda: clamp(rng.lognormvariate(math.log(args[0]), args[1]))
+
+
+@dataclass
+class ProjectSpec:
+    """
+    Shape of a synthetic project.
+
+    Attributes:
+        files: Number of source files.
+        mix: Language mix (see ``parse_mix``).
+        sizes: File size distribution (see ``size_sampler``).
+        seed: Seed of the generator; the same spec always yields the same project.
+    """
+
+    files: int
+    mix: str = DEFAULT_MIX
+    sizes: str = DEFAULT_SIZES
+    seed: int = 0
+
+
+@dataclass
+class GeneratedProject:
+    """
+    A synthetic project written to disk.
+
+    Attributes:
+        path: Root directory of the project.
+        spec: The spec it was generated from.
+        paths: Paths of the generated source files.
+        total_bytes: Total size of the source files.
+        languages: Number of files per language.
+    """
+
+    path: str
+    spec: ProjectSpec
+    paths: List[str] = field(default_factory=list)
+    total_bytes: int = 0
+    languages: Dict[str, int] = field(default_factory=dict)
+
+
+def _directory(index: int) -> str:
+    # Nested packages with at most FILES_PER_DIRECTORY files each
+    directory = index // FILES_PER_DIRECTORY
+    parts = []
+    while directory:
+        directory, package = divmod(directory - 1, PACKAGES_PER_DIRECTORY)
+        parts.append(f"pkg{package}")
+    return os.path.join("src", *reversed(parts))
+
+
+def generate_project(path: str, spec: ProjectSpec) -> GeneratedProject:
+    """
+    Writes a synthetic project into ``path`` (which should not exist yet).
+
+    Besides the source files, the project has a ``requirements.txt`` and a
+    ``package.json`` so dependency resolution has something to read.
+
+    Args:
+        path: Root directory of the project.
+        spec: Number of files, language mix, size distribution and seed.
+
+    Returns:
+        GeneratedProject: The generated file paths and their total size.
+    """
+    rng = random.Random(spec.seed)
+    mix = parse_mix(spec.mix)
+    languages = list(mix)
+    weights = [mix[language] for language in languages]
+    sample_size = size_sampler(spec.sizes, rng)
+    project = GeneratedProject(path, spec)
+
+    for index in range(spec.files):
+        language = rng.choices(languages, weights)[0]
+        extension, block = LANGUAGES[language]
+        target = sample_size()
+        parts, size, block_index = [], 0, 0
+        while size < target:
+            text = block(rng, block_index)
+            parts.append(text)
+            size += len(text)
+            block_index += 1
+        content = "".join(parts)
+
+        file_path = os.path.join(path, _directory(index), f"module_{index}{extension}")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        project.paths.append(file_path)
+        project.total_bytes += len(content.encode("utf-8"))
+        project.languages[language] = project.languages.get(language, 0) + 1
+
+    with open(os.path.join(path, "requirements.txt"), "w", encoding="utf-8") as f:
+        f.write("requests==2.32.3\nnumpy>=1.26\n")
+    with open(os.path.join(path, "package.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": "synthetic", "dependencies": {"express": "^4.19.2"}}, f, indent=2)
+    return project
@@ -10,32 +10,26 @@ License: Apache 2.0
 """
 
 import argparse
-import json
 import logging
+import os
 import sys
-from typing import Any, Dict, List, Optional
-
-from src.analysis.dependency_resolver import resolve_dependencies
-from src.analysis.feature_mapper import map_features_to_components
-from src.analysis.project_parser import parse_project
-from src.analysis.tree import get_tree
-from src.generation.preprocessing import extract_json_from_response, get_prompt_request
-from src.generation.project_generator import generate_project
-from src.generation.project_structure import (
-    create_expected_files_from_json,
-    update_project_structure,
-    validate_project_consistency,
-)
-from src.generation.task_prompts import generate_task_prompts
-from src.models.llm_inference import query_llm
-from src.models.prompt_templates import get_prompt_template, get_prompt_template_feature
-from src.utils.file_operations import read_file, write_file
+from typing import Any, Callable, Dict, Optional
+
+from src.generation.task_prompts import OUTPUT_MODES
+from src.models.backends import create_backend
+from src.models.cassette import RECORD, REPLAY, use_cassette
+from src.models.llm_cache import configure_cache, get_default_cache
+from src.models.llm_inference import MODEL_ID
+from src.models.output_governor import output_stats
+from src.models.resilience import get_resilient_caller
+from src.pipeline.batch import DEFAULT_OUTPUT_ROOT, SUCCEEDED, load_requests, run_batch
+from src.pipeline.dag import CACHED, Pipeline, StageError, StageMemo, path_fingerprint
+from src.pipeline.planner import estimate_run, format_plan
+from src.pipeline.stages import ANALYSIS_MODES, FeatureOptions, FeatureStages, add_project_stages
+from src.service.client import WorkerClient
 from src.utils.logger import logger
-from src.utils.tools import count_tasks_from_json, extract_file_content
-from src.vector_database.db_builder import build_vector_database
-from src.vector_database.db_load import load_vector_database
-from src.vector_database.db_query import query_vector_database
-from src.vector_database.display_content import display_first_five_documents
+from src.utils.metrics import Metrics, get_metrics, run_metrics, write_report
+from src.utils.profiling import PROFILE_DIR, StageProfiler, format_profile
 
 # Configure additional logging for CLI
 logging.basicConfig(
@@ -44,8 +38,108 @@ logging.basicConfig(
 )
 cli_logger = logging.getLogger(__name__)
 
+# Options that shape a run's stages; a resumed run keeps the ones it was started with
+RUN_OPTION_DEFAULTS = {
+    "analysis_mode": "separate",
+    "output_mode": "full",
+    "shard_large_files": False,
+    "early_dispatch": False,
+}
+
+
+def run_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Collect the statistics of the process: LLM response cache, call resilience
+    and output governor counters.
+    """
+    return {
+        "llm_cache": get_default_cache().stats(),
+        "llm_calls": get_resilient_caller().stats(),
+        "llm_output": output_stats(),
+    }
+
+
+def write_run_metrics(run_dir: str, recorder: Metrics, **metadata: Any) -> None:
+    """
+    Write the metrics of a run to ``metrics.json`` and ``metrics.prom`` in ``run_dir``.
+
+    The report holds the timing spans of the run's pipeline stages, LLM calls,
+    retrieval and embedding, its token and byte counters (``recorder``, see
+    ``run_metrics``), and the process's ``run_stats``.
+    """
+    json_path, prometheus_path = write_report(run_dir, run_stats(), recorder=recorder, **metadata)
+    logger.info(f"✓ Metrics written to {json_path} and {prometheus_path}")
+
+
+def write_run_profile(
+    profiler: StageProfiler, run_dir: str, report: Callable[[str], None] = logger.info
+) -> None:
+    """
+    Write the stage profiles of a run to ``<run_dir>/profile`` and report their summary.
+    """
+    summary_path = profiler.write(os.path.join(run_dir, PROFILE_DIR))
+    report("Stage profiles:\n" + format_profile(profiler.summary()))
+    report(f"✓ Profiles written to {os.path.dirname(summary_path)}")
+
+
+def log_run_summary() -> None:
+    """
+    Log a summary of the run: LLM response cache and call resilience counters.
+    """
+    cache = get_default_cache()
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = (stats["hits"] / lookups * 100) if lookups else 0.0
+    status = "enabled" if cache.enabled else "bypassed"
+    if cache.enabled and cache.refresh:
+        status = "refresh"
+
+    logger.info("Run summary:")
+    logger.info(
+        f"  LLM cache ({status}): {stats['hits']} hits, {stats['misses']} misses "
+        f"({hit_rate:.0f}% hit rate), {stats['writes']} writes, "
+        f"{stats['evictions']} evictions"
+    )
+
+    resilience = get_resilient_caller().stats()
+    logger.info(
+        f"  LLM calls: {resilience['calls']} calls, {resilience['attempts']} attempts, "
+        f"{resilience['retries']} retries ({resilience['retry_after_waits']} Retry-After waits), "
+        f"{resilience['hedges_launched']} hedges ({resilience['hedge_wins']} won), "
+        f"{resilience['breaker_rejections']} breaker rejections, "
+        f"circuit {resilience['circuit_state']}"
+    )
+
+    output = output_stats()
+    logger.info(
+        f"  LLM output: {output['truncations']} truncated responses, "
+        f"{output['continuations']} continuations, {output['unrecovered']} left truncated"
+    )
+
+    metrics = get_metrics()
+    logger.info(
+        f"  LLM tokens: {metrics.total('llm_prompt_tokens'):.0f} prompt, "
+        f"{metrics.total('llm_completion_tokens'):.0f} completion (cached responses excluded)"
+    )
+
 
-def main(user_request: str) -> None:
+def main(
+    user_request: Optional[str],
+    stream: bool = False,
+    on_event: Optional[Callable[[str, Any], None]] = None,
+    analysis_mode: Optional[str] = None,
+    output_mode: Optional[str] = None,
+    shard_large_files: Optional[bool] = None,
+    early_dispatch: Optional[bool] = None,
+    run_id: Optional[str] = None,
+    resume: bool = False,
+    project_path: str = "project_old",
+    output_path: str = "project_new",
+    memo: Optional[StageMemo] = None,
+    metrics: bool = False,
+    profile: bool = False,
+    in_memory: bool = False,
+) -> str:
     """
     Main orchestration function for the Factory Feature pipeline.
 
@@ -53,198 +147,278 @@ def main(user_request: str) -> None:
     1. Parse the existing project structure
     2. Build a vector database for context retrieval
     3. Resolve project dependencies
-    4. Analyze feature impact and generate tasks
-    5. Execute LLM-powered code generation
-    6. Update project structure with new features
-    7. Validate the consistency of the updated project
+    4. Build the project context and retrieve relevant files once
+    5. Analyze feature impact and generate tasks
+    6. Execute LLM-powered code generation
+    7. Update project structure with new features
+    8. Validate the consistency of the updated project
+
+    The steps run as a DAG of checkpointed stages (see ``src.pipeline``):
+    Steps 2 and 3 and the project tree are built in parallel, and every stage
+    output is saved under ``runs/<run_id>``. Resuming a run re-executes only
+    the stages whose inputs or options changed, or that failed.
 
     Args:
         user_request: Natural language description of the feature to integrate.
+            May be None when resuming; the request of the resumed run is used.
+        stream: If True, LLM responses are streamed and Step 7 writes each
+            generated file to its output path while it is being generated.
+        on_event: Optional callback receiving ``(kind, payload)`` progress events:
+            ``("status", message)`` for pipeline progress, ``("file", path)`` when a
+            streamed file starts and ``("token", text)`` for streamed output. With
+            ``in_memory``, ``("project", overlay)`` delivers the updated project.
+        analysis_mode: ``"separate"`` asks for the feature nodes, edges and impact
+            report in three calls; ``"combined"`` asks for all three in a single
+            structured JSON call, falling back to three calls if it cannot be parsed.
+        output_mode: ``"full"`` regenerates every modified file completely;
+            ``"patch"`` asks for edit blocks and applies them in Step 8.
+        shard_large_files: If True, existing files too large for a single prompt are
+            split into regions by class and function and only the regions the task
+            touches are regenerated, in parallel.
+        early_dispatch: If True, the Step 6 plan is streamed and parsed incrementally,
+            and each file task is dispatched as soon as its plan entry is complete.
+            These four options default to the ones of the resumed run, otherwise to
+            ``RUN_OPTION_DEFAULTS``.
+        run_id: Identifier of the run directory (a new one is generated by default).
+        resume: If True, continue the run ``run_id`` from its checkpoints.
+        project_path: Directory of the existing project.
+        output_path: Directory receiving the updated project.
+        memo: Optional in-memory stage outputs shared with earlier runs of the
+            process (the worker daemon keeps the parsed and indexed project warm).
+        metrics: If True, write the timing, token and cache metrics of the run to
+            ``metrics.json`` and ``metrics.prom`` in the run directory, also when a
+            stage fails.
+        profile: If True, profile every stage that runs (cProfile, stack samples
+            and tracemalloc, see ``src.utils.profiling``) and write the profiles to
+            ``profile/`` in the run directory.
+        in_memory: If True, the updated project is not written to ``output_path``.
+            Step 8 returns it as a ``ProjectOverlay`` (see ``src.generation.overlay``),
+            passed to ``on_event``, which can render, diff, archive or flush it.
+
+    Returns:
+        str: The run identifier, to pass to ``--resume``.
 
     Raises:
-        FileNotFoundError: If the project directory is not found.
-        ValueError: If JSON extraction or preprocessing fails.
-        RuntimeError: If any critical step in the pipeline fails.
+        FileNotFoundError: If the run to resume does not exist.
+        ValueError: If no feature request is given.
+        StageError: If a pipeline stage fails. The run can be resumed.
 
     Example:
         >>> main("Add logging functionality to all major modules")
     """
-    logger.info(f"Processing feature request: {user_request}")
-
-    # Define project paths
-    OLD_PROJECT_PATH = "project_old"
-    NEW_PROJECT_PATH = "project_new"
-
-    logger.info("=" * 80)
-    logger.info("Starting Factory Feature Pipeline")
-    logger.info("=" * 80)
 
-    # Step 1: Parse the project structure
-    logger.info("[Step 1/8] Parsing project structure...")
-    try:
-        project_data = parse_project(OLD_PROJECT_PATH)
-        logger.info(f"✓ Project parsed successfully ({len(project_data)} files)")
-    except FileNotFoundError as e:
-        logger.error(f"✗ Failed to parse project: {e}")
-        logger.error(f"Please ensure '{OLD_PROJECT_PATH}' directory exists")
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"✗ Unexpected error during project parsing: {e}")
-        sys.exit(1)
-
-    # Step 2: Build vector database for RAG
-    logger.info("[Step 2/8] Building vector database for context retrieval...")
-    try:
-        vector_db = build_vector_database(project_data, persist_directory="./chroma_db")
-        logger.info("✓ Vector database created successfully")
-    except Exception as e:
-        logger.error(f"✗ Failed to build vector database: {e}")
-        sys.exit(1)
-
-    # Step 3: Resolve project dependencies
-    logger.info("[Step 3/8] Resolving project dependencies...")
-    try:
-        dependencies = resolve_dependencies(OLD_PROJECT_PATH)
-        dep_types = list(dependencies.keys())
-        logger.info(f"✓ Dependencies resolved: {', '.join(dep_types) if dep_types else 'None'}")
-    except Exception as e:
-        logger.error(f"✗ Dependency resolution failed: {e}")
-        sys.exit(1)
+    def report(message: str) -> None:
+        logger.info(message)
+        if on_event:
+            on_event("status", message)
+
+    profiler = StageProfiler() if profile else None
+    pipeline = Pipeline(
+        run_id,
+        resume=resume,
+        on_reuse=lambda name: report(f"✓ Stage '{name}' reused from checkpoint"),
+        memo=memo,
+        profiler=profiler,
+    )
+    user_request = user_request or pipeline.metadata.get("user_request")
+    if not user_request:
+        raise ValueError("A feature request is required")
+    given = {
+        "analysis_mode": analysis_mode,
+        "output_mode": output_mode,
+        "shard_large_files": shard_large_files,
+        "early_dispatch": early_dispatch,
+    }
+    run_options = {
+        key: given[key] if given[key] is not None else pipeline.metadata.get(key, default)
+        for key, default in RUN_OPTION_DEFAULTS.items()
+    }
+    pipeline.set_metadata(
+        user_request=user_request, project_fingerprint=path_fingerprint(project_path), **run_options
+    )
 
-    # Step 4: Build project context for LLM
-    logger.info("[Step 4/8] Building project context...")
-    try:
-        project_context = "\n".join([f"{key}: {value}" for key, value in dependencies.items()])
-        tree = get_tree(OLD_PROJECT_PATH)
-        project_context += f"\n\nProject Structure:\n{tree}"
-        logger.info("✓ Project context built successfully")
-    except Exception as e:
-        logger.error(f"✗ Failed to build project context: {e}")
-        sys.exit(1)
+    report(f"Processing feature request: {user_request}")
 
-    # Step 5: Perform AI-powered feature analysis
-    logger.info("[Step 5/8] Performing AI-powered feature analysis...")
-    try:
-        # Get prompt templates
-        feature_nodes_template = get_prompt_template("feature_analysis_nodes")
-        feature_edges_template = get_prompt_template("feature_analysis_edges")
-        impact_report_template = get_prompt_template("feature_impact_report")
-
-        # Format prompts with context
-        feature_nodes_prompt = feature_nodes_template.format(
-            feature_request=user_request, project_context=project_context
-        )
-        feature_edges_prompt = feature_edges_template.format(
-            feature_request=user_request, project_context=project_context
-        )
-        impact_report_prompt = impact_report_template.format(
-            feature_request=user_request, project_context=project_context
+    # Define project paths
+    OLD_PROJECT_PATH = project_path
+    NEW_PROJECT_PATH = output_path
+
+    report("=" * 80)
+    report("Starting Factory Feature Pipeline")
+    report(f"Run {pipeline.run_id} ({'resumed' if resume else 'new'}): {pipeline.run_dir}")
+    report("=" * 80)
+
+    add_project_stages(pipeline, OLD_PROJECT_PATH, report)
+    FeatureStages(
+        FeatureOptions(
+            user_request,
+            stream=stream,
+            on_event=on_event,
+            old_project_path=OLD_PROJECT_PATH,
+            new_project_path=NEW_PROJECT_PATH,
+            in_memory=in_memory,
+            **run_options,
         )
+    ).add_to(pipeline)
+
+    if profiler:
+        profiler.start()
+    # Other runs of the process (worker jobs, web requests) are left out of this run's metrics
+    with run_metrics() as recorder:
+        try:
+            status = pipeline.run()
+        except StageError as e:
+            logger.error(str(e))
+            logger.error(f"Resume with: python main.py --resume {e.run_id}")
+            raise
+        finally:
+            if profiler:
+                profiler.stop()
+                write_run_profile(profiler, pipeline.run_dir, report)
+            if metrics:
+                write_run_metrics(
+                    pipeline.run_dir, recorder, run_id=pipeline.run_id, user_request=user_request
+                )
 
-        # Query LLM for analysis
-        logger.info("  - Analyzing feature nodes...")
-        feature_nodes_response = query_llm(user_input=feature_nodes_prompt, vector_db=vector_db)
-
-        logger.info("  - Analyzing feature edges...")
-        feature_edges_response = query_llm(user_input=feature_edges_prompt, vector_db=vector_db)
-
-        logger.info("  - Generating impact report...")
-        impact_report_response = query_llm(user_input=impact_report_prompt, vector_db=vector_db)
-
-        # Combine analysis results
-        analysis_results = (
-            f"Nodes:\n{feature_nodes_response}\n\n"
-            f"Edges:\n{feature_edges_response}\n\n"
-            f"Impact Report:\n{impact_report_response}"
-        )
-        logger.info("✓ Feature analysis completed successfully")
-    except Exception as e:
-        logger.error(f"✗ Feature analysis failed: {e}")
-        sys.exit(1)
+    # Success message
+    reused = [name for name, state in status.items() if state == CACHED]
+    report("=" * 80)
+    report("✓ Feature integration completed successfully!")
+    if in_memory:
+        overlay = pipeline.value("update")
+        report(f"✓ Updated project kept in memory: {len(overlay.changes)} files changed")
+        if on_event:
+            on_event("project", overlay)
+    else:
+        report(f"✓ Updated project saved in: {NEW_PROJECT_PATH}")
+    if reused:
+        report(f"✓ Reused {len(reused)} stages from checkpoints: {', '.join(reused)}")
+    log_run_summary()
+    report("=" * 80)
+    return pipeline.run_id
+
+
+def main_batch(
+    batch_path: str,
+    output_root: str = DEFAULT_OUTPUT_ROOT,
+    concurrency: Optional[int] = None,
+    run_id: Optional[str] = None,
+    resume: bool = False,
+    metrics: bool = False,
+    profile: bool = False,
+    **options,
+) -> bool:
+    """
+    Run every feature request of a JSON Lines batch file against ``project_old``.
 
-    # Step 6: Preprocessing and task extraction
-    logger.info("[Step 6/8] Preprocessing analysis results and extracting tasks...")
-    try:
-        preprocessing_template = get_prompt_request("preprocessing_request")
-        preprocessing_prompt = preprocessing_template.format(
-            feature_request=user_request,
-            analysis_results=analysis_results,
-        )
-        preprocessing_response = query_llm(
-            user_input=preprocessing_prompt, vector_db=vector_db
-        )
+    The project is parsed, indexed and analyzed once; each request writes its
+    updated project to ``<output_root>/<request id>`` (see ``src.pipeline.batch``).
 
-        # Extract JSON object from response
-        json_object = extract_json_from_response(preprocessing_response)
-        if not json_object:
-            raise ValueError("No valid JSON found in preprocessing response")
+    Args:
+        batch_path: JSON Lines file with one ``{"id": ..., "prompt": ...}`` object per line.
+        output_root: Directory receiving one output tree per request.
+        concurrency: Pipeline stages run in parallel.
+        run_id: Identifier of the run directory (a new one is generated by default).
+        resume: If True, continue the run ``run_id`` from its checkpoints.
+        metrics: If True, write the metrics of the batch to the run directory.
+        profile: If True, write per-stage profiles of the batch to the run directory.
+        **options: ``analysis_mode``, ``output_mode``, ``shard_large_files`` and
+            ``early_dispatch`` defaults for every request (None: those of the resumed
+            batch, see ``run_batch``).
 
-        # Enrich JSON with file contents
-        for file_info in json_object.get("existing_files", []):
-            file_path = file_info.get("file_path", "")
-            if file_path:
-                file_info["content"] = extract_file_content(file_path)
+    Returns:
+        bool: True if every request succeeded.
+    """
+    requests = load_requests(batch_path)
+    profiler = StageProfiler() if profile else None
+    if profiler:
+        profiler.start()
+    with run_metrics() as recorder:
+        try:
+            report = run_batch(
+                requests,
+                output_root=output_root,
+                concurrency=concurrency,
+                run_id=run_id,
+                resume=resume,
+                profiler=profiler,
+                **options,
+            )
+        finally:
+            if profiler:
+                profiler.stop()
 
-        # Count and log tasks
-        json_data = json.dumps(json_object, indent=4)
-        task_count = count_tasks_from_json(json_data)
-        logger.info(f"✓ Preprocessing completed: {task_count} tasks identified")
+    logger.info("=" * 80)
+    for result in report.results:
+        mark = "✓" if result.status == SUCCEEDED else "✗"
+        reused = f" ({len(result.reused)} stages reused)" if result.reused else ""
+        logger.info(f"{mark} {result.request_id}: {result.status} -> {result.output_path}{reused}")
+        if result.error:
+            logger.error(f"    {result.error}")
+    logger.info(f"{len(report.results) - len(report.failed)}/{len(report.results)} requests succeeded")
+    if report.failed:
+        logger.error(f"Resume with: python main.py --batch {batch_path} --resume {report.run_id}")
+    if profiler:
+        write_run_profile(profiler, report.run_dir)
+    if metrics:
+        write_run_metrics(report.run_dir, recorder, run_id=report.run_id, batch=batch_path)
+    log_run_summary()
+    logger.info("=" * 80)
+    return not report.failed
 
-    except ValueError as e:
-        logger.error(f"✗ JSON extraction failed: {e}")
-        sys.exit(1)
-    except Exception as e:
-        logger.error(f"✗ Preprocessing failed: {e}")
-        sys.exit(1)
 
-    # Step 7: Generate and execute task prompts
-    logger.info("[Step 7/8] Generating task prompts and executing code generation...")
-    try:
-        task_prompts = generate_task_prompts(json_data)
-        task_responses: List[str] = []
+def main_plan(user_request: str, project_path: str = "project_old", **options) -> None:
+    """
+    Print the predicted LLM calls, tokens and duration of a feature request without running it.
 
-        logger.info(f"  - Executing {len(task_prompts)} LLM queries...")
-        for i, task_prompt in enumerate(task_prompts, start=1):
-            logger.info(f"    Processing task {i}/{len(task_prompts)}...")
-            task_response = query_llm(user_input=task_prompt)
-            task_responses.append(task_response)
+    Nothing is sent to the LLM: the prompts of Steps 5 to 7 are built from the
+    project and the Step 7 fan-out is taken from a previous run of the same
+    request or estimated (see ``src.pipeline.planner``).
 
-        logger.info("✓ All tasks executed successfully")
+    Args:
+        user_request: The feature request.
+        project_path: Directory of the existing project.
+        **options: ``analysis_mode`` and ``output_mode`` (None for the default).
+    """
+    options = {key: value for key, value in options.items() if value is not None}
+    print(format_plan(estimate_run(user_request, project_path, **options)))
 
-    except Exception as e:
-        logger.error(f"✗ Task execution failed: {e}")
-        sys.exit(1)
 
-    # Step 8: Update project structure
-    logger.info("[Step 8/8] Updating project structure with generated code...")
-    try:
-        update_project_structure(json_data, task_responses, OLD_PROJECT_PATH, NEW_PROJECT_PATH)
-        logger.info("✓ Project files updated successfully")
-    except Exception as e:
-        logger.error(f"✗ Failed to update project structure: {e}")
-        sys.exit(1)
+def main_remote(address: Optional[str], user_request: Optional[str], **options) -> bool:
+    """
+    Submit a feature request to a running worker daemon and follow its progress.
 
-    # Final validation
-    logger.info("Validating updated project structure...")
-    try:
-        expected_files = create_expected_files_from_json(json_data)
-        is_valid = validate_project_consistency(NEW_PROJECT_PATH, expected_files)
+    The worker (``python -m src.service.worker``) keeps the pipeline imported and
+    its models warm, so the job starts without the start-up cost of this process.
 
-        if is_valid:
-            logger.info("✓ Project structure validation passed")
-        else:
-            logger.warning("⚠ Project structure has inconsistencies")
-            sys.exit(1)
+    Args:
+        address: ``HOST:PORT`` or ``unix:PATH`` of the worker (default:
+            ``FACTORY_WORKER_ADDRESS``).
+        user_request: The feature request (optional when resuming).
+        **options: ``main`` options (``analysis_mode``, ``output_mode``, ...).
 
-    except Exception as e:
-        logger.error(f"✗ Validation failed: {e}")
-        sys.exit(1)
+    Returns:
+        bool: True if the job succeeded.
+    """
+    client = WorkerClient(address)
+    job = client.submit(
+        user_request,
+        project_path="project_old",
+        output_path="project_new",
+        **options,
+    )
+    logger.info(f"Submitted job {job['id']} to worker at {client.address}")
+    for line in client.follow(job["id"]):
+        logger.info(line)
 
-    # Success message
-    logger.info("=" * 80)
-    logger.info("✓ Feature integration completed successfully!")
-    logger.info(f"✓ Updated project saved in: {NEW_PROJECT_PATH}")
-    logger.info("=" * 80)
+    result = client.result(job["id"])
+    if result["status"] != "succeeded":
+        logger.error(f"✗ Job {job['id']} failed: {result['error']}")
+        if result["run_id"]:
+            logger.error(f"Resume with: python main.py --worker --resume {result['run_id']}")
+        return False
+    logger.info(f"✓ Updated project saved in: {result['output_path']} ({len(result['files'])} files)")
+    return True
 
 
 def parse_arguments() -> argparse.Namespace:
@@ -267,27 +441,251 @@ Examples:
   python main.py --prompt "Add logging functionality to all major modules"
   python main.py --prompt "Implement user authentication with JWT"
   python main.py --prompt "Add comprehensive error handling"
+  python main.py --prompt "Add logging" --refresh-llm-cache
+  python main.py --prompt "Add logging" --analysis-mode combined
+  python main.py --prompt "Add logging" --output-mode patch
+  python main.py --prompt "Add logging" --shard-large-files
+  python main.py --prompt "Add logging" --early-dispatch
+  python main.py --prompt "Add logging" --record-cassette runs/logging.cassette
+  python main.py --prompt "Add logging" --replay-cassette runs/logging.cassette
+  python main.py --resume 20250101-120000-a1b2c3
+  python main.py --batch requests.jsonl --concurrency 4
+  python main.py --prompt "Add logging" --worker unix:/tmp/factory-worker.sock
+  python main.py --prompt "Add logging" --metrics
+  python main.py --prompt "Add logging" --plan
+  python main.py --profile-startup
 
 For more information, visit: https://ruslanmv.com
         """,
     )
     parser.add_argument(
         "--prompt",
-        required=True,
-        help="Natural language description of the feature to integrate",
+        help="Natural language description of the feature to integrate "
+        "(optional with --resume)",
         metavar="FEATURE_REQUEST",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--batch",
+        metavar="PATH",
+        help="Run every request of a JSON Lines file ({\"id\": ..., \"prompt\": ...} per line) "
+        "against one parsed and indexed project",
+    )
+    parser.add_argument(
+        "--batch-output",
+        metavar="DIR",
+        default=DEFAULT_OUTPUT_ROOT,
+        help="Directory receiving one updated project per batch request",
+    )
+    parser.add_argument(
+        "--worker",
+        nargs="?",
+        const="",
+        metavar="ADDRESS",
+        help="Submit the request to a running worker daemon (HOST:PORT or unix:PATH; "
+        "default: FACTORY_WORKER_ADDRESS) instead of running it in this process",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        metavar="N",
+        default=None,
+        help="Batch mode: pipeline stages run in parallel, bounding the requests in flight",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="RUN_ID",
+        help="Resume a failed or changed run, re-running only the invalidated stages",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream LLM output and write generated files while they are being generated",
+    )
+    parser.add_argument(
+        "--analysis-mode",
+        choices=ANALYSIS_MODES,
+        default=None,
+        help="Step 5 analysis: three calls (separate, default) or one structured JSON call "
+        "(combined). Resumed runs keep their modes unless given",
+    )
+    parser.add_argument(
+        "--output-mode",
+        choices=OUTPUT_MODES,
+        default=None,
+        help="Step 7 output for modified files: complete files (full, default) or edit blocks "
+        "(patch)",
+    )
+    parser.add_argument(
+        "--shard-large-files",
+        action="store_true",
+        default=None,
+        help="Edit large files region by region (by class and function) in parallel",
+    )
+    parser.add_argument(
+        "--early-dispatch",
+        action="store_true",
+        default=None,
+        help="Stream the Step 6 plan and start each file task as soon as its entry is complete",
+    )
+    parser.add_argument(
+        "--record-cassette",
+        metavar="PATH",
+        help="Record every LLM request/response pair into a cassette file",
+    )
+    parser.add_argument(
+        "--replay-cassette",
+        metavar="PATH",
+        help="Serve LLM responses from a recorded cassette instead of the backend",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        metavar="SPEC",
+        default=None,
+        help="Simulated replay latency: none, recorded, recorded*F, fixed:S, "
+        "uniform:A,B, normal:MEAN,STD or lognormal:MU,SIGMA",
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Bypass the persistent LLM response cache (no reads, no writes)",
+    )
+    parser.add_argument(
+        "--refresh-llm-cache",
+        action="store_true",
+        help="Ignore cached LLM responses and overwrite them with fresh ones",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Write per-stage timing, token and cache metrics of the run to "
+        "runs/<run_id>/metrics.json and a Prometheus textfile (metrics.prom)",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the LLM calls, prompt tokens and predicted duration of the request "
+        "without running it or calling the LLM",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile every stage (cProfile, stack samples and tracemalloc) and write "
+        ".prof files, folded stacks for flame graphs and a summary to runs/<run_id>/profile/",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report the import time of the CLI and of the modules its stages load lazily, "
+        "then exit",
+    )
+    args = parser.parse_args()
+    if args.profile_startup:
+        return args
+    if args.prompt and args.batch:
+        parser.error("--prompt and --batch are mutually exclusive")
+    if args.worker is not None and (args.batch or args.stream):
+        parser.error("--worker does not support --batch or --stream")
+    if args.plan and not args.prompt:
+        parser.error("--plan requires --prompt")
+    if not args.prompt and not args.resume and not args.batch:
+        parser.error("--prompt is required unless --batch or --resume is given")
+    return args
 
 
 if __name__ == "__main__":
     try:
         args = parse_arguments()
-        main(args.prompt)
+        if args.profile_startup:
+            from src.utils.startup_profile import format_startup_profile, profile_startup
+
+            print(format_startup_profile(profile_startup()))
+            sys.exit(0)
+        if args.record_cassette and args.replay_cassette:
+            cli_logger.error("--record-cassette and --replay-cassette are mutually exclusive")
+            sys.exit(2)
+        if args.record_cassette:
+            # Skip cache reads so every call reaches the backend and is recorded
+            configure_cache(refresh=True)
+            use_cassette(
+                args.record_cassette,
+                mode=RECORD,
+                inner=create_backend(os.getenv("LLM_BACKEND", "watsonx").lower(), MODEL_ID),
+            )
+        elif args.replay_cassette:
+            # Bypass the cache so replayed calls exercise the full call path
+            configure_cache(enabled=False)
+            use_cassette(args.replay_cassette, mode=REPLAY, latency=args.replay_latency)
+        if args.no_llm_cache or args.refresh_llm_cache:
+            configure_cache(
+                enabled=False if args.no_llm_cache else None,
+                refresh=True if args.refresh_llm_cache else None,
+            )
+        if args.plan:
+            main_plan(args.prompt, analysis_mode=args.analysis_mode, output_mode=args.output_mode)
+            sys.exit(0)
+        if args.batch:
+            succeeded = main_batch(
+                args.batch,
+                output_root=args.batch_output,
+                concurrency=args.concurrency,
+                run_id=args.resume,
+                resume=bool(args.resume),
+                metrics=args.metrics,
+                profile=args.profile,
+                analysis_mode=args.analysis_mode,
+                output_mode=args.output_mode,
+                shard_large_files=args.shard_large_files,
+                early_dispatch=args.early_dispatch,
+            )
+            sys.exit(0 if succeeded else 1)
+        if args.worker is not None:
+            succeeded = main_remote(
+                args.worker or None,
+                args.prompt,
+                analysis_mode=args.analysis_mode,
+                output_mode=args.output_mode,
+                shard_large_files=args.shard_large_files,
+                early_dispatch=args.early_dispatch,
+                run_id=args.resume,
+                resume=bool(args.resume) or None,
+                metrics=args.metrics or None,
+                profile=args.profile or None,
+            )
+            sys.exit(0 if succeeded else 1)
+        if args.stream:
+            main(
+                args.prompt,
+                stream=True,
+                on_event=lambda kind, data: print(data, end="", flush=True)
+                if kind == "token"
+                else None,
+                analysis_mode=args.analysis_mode,
+                output_mode=args.output_mode,
+                shard_large_files=args.shard_large_files,
+                early_dispatch=args.early_dispatch,
+                run_id=args.resume,
+                resume=bool(args.resume),
+                metrics=args.metrics,
+                profile=args.profile,
+            )
+        else:
+            main(
+                args.prompt,
+                analysis_mode=args.analysis_mode,
+                output_mode=args.output_mode,
+                shard_large_files=args.shard_large_files,
+                early_dispatch=args.early_dispatch,
+                run_id=args.resume,
+                resume=bool(args.resume),
+                metrics=args.metrics,
+                profile=args.profile,
+            )
         sys.exit(0)
     except KeyboardInterrupt:
         cli_logger.info("\n\nOperation cancelled by user")
         sys.exit(130)
+    except StageError:
+        sys.exit(1)  # already logged with the command to resume the run
     except SystemExit as e:
         if e.code == 2:  # Argument parsing error
             cli_logger.error("Argument parsing failed. Use --help for usage information.")
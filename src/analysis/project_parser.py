@@ -1,5 +1,7 @@
 import os
 
+from src.utils.metrics import get_metrics
+
 def parse_project(project_path):
     """
     Parses a project directory, reading the content of each file.
@@ -12,6 +14,7 @@ def parse_project(project_path):
       and contains the file path and its content.
     """
     project_data = []
+    bytes_read = 0
     for root, dirs, files in os.walk(project_path):
         # Skip __pycache__ directories
         if '__pycache__' in dirs:
@@ -22,7 +25,10 @@ def parse_project(project_path):
             try:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     content = f.read()
+                    bytes_read += os.fstat(f.fileno()).st_size
                 project_data.append({"path": file_path, "content": content})
             except UnicodeDecodeError:
                 print(f"Skipping binary file: {file_path}")
+    get_metrics().count("bytes_read", bytes_read, stage="parse")
+    get_metrics().count("files_read", len(project_data), stage="parse")
     return project_data
\ No newline at end of file
@@ -56,6 +56,31 @@ def get_tree(folder_path, content=False, exclude_folders=None):
         "structure": build_tree(folder_path)
     }
 
+def list_tree_paths(tree):
+    """
+    Flattens a tree produced by ``get_tree`` into a list of file paths.
+
+    This is a compact rendering of the project structure, used when the full
+    nested dictionary does not fit in a prompt.
+
+    Args:
+        tree (dict): Tree structure returned by ``get_tree``.
+
+    Returns:
+        list: File paths in traversal order.
+    """
+    paths = []
+
+    def walk(items):
+        for item in items:
+            if item["type"] == "directory":
+                walk(item.get("children", []))
+            else:
+                paths.append(item["path"])
+
+    walk(tree.get("structure", []))
+    return paths
+
 if __name__ == "__main__":
     old_project_path = "project_old"
     try:
@@ -0,0 +1,178 @@
+"""
+In-memory view of an updated project.
+
+The web interface used to write ``project_new`` to disk only to walk it again
+for the tree view and read it back for the ZIP download. A ``ProjectOverlay``
+keeps the generated files in memory on top of the original project, which is
+read from disk only for the files the feature left unchanged. It renders the
+tree, reads files, diffs them against the original and exports the archive
+directly. ``flush`` writes it to disk on demand.
+"""
+
+import difflib
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.utils.archive import ArchiveEntry, write_zip
+from src.utils.materialize import materialize_tree
+from src.utils.output_writer import ProjectWriter
+
+
+class ProjectOverlay:
+    """
+    The original project plus the files a feature changed or added.
+
+    Paths are relative to the project root and use ``/`` separators.
+
+    Attributes:
+        base: Directory of the original project.
+        name: Name of the updated project, and the default ``flush`` target.
+        changes: Content of every changed or new file by path.
+    """
+
+    def __init__(self, base: str, name: str = "project_new"):
+        self.base = base
+        self.name = name
+        self.changes: Dict[str, str] = {}
+        self._snapshot: Optional[Tuple[Set[str], Set[str]]] = None
+
+    @staticmethod
+    def _key(path: str) -> str:
+        key = os.path.normpath(path).replace(os.sep, "/")
+        if key == "." or key.startswith("../") or key == ".." or os.path.isabs(key):
+            raise ValueError(f"Path {path} is outside of the project")
+        return key
+
+    def _base_snapshot(self) -> Tuple[Set[str], Set[str]]:
+        # Files and directories of the original project, listed once
+        if self._snapshot is None:
+            files, directories = set(), set()
+            for root, dirs, names in os.walk(self.base):
+                relative = os.path.relpath(root, self.base)
+                prefix = "" if relative == "." else relative.replace(os.sep, "/") + "/"
+                directories.update(prefix + name for name in dirs)
+                files.update(prefix + name for name in names)
+            self._snapshot = (files, directories)
+        return self._snapshot
+
+    def write(self, path: str, content: str) -> None:
+        """
+        Sets the content of a changed or new file.
+        """
+        self.changes[self._key(path)] = content
+
+    def exists(self, path: str) -> bool:
+        key = self._key(path)
+        return key in self.changes or key in self._base_snapshot()[0]
+
+    def read(self, path: str) -> str:
+        """
+        Returns the content of a file, from memory if it changed, else from the original project.
+
+        Raises:
+            FileNotFoundError: If the project has no such file.
+        """
+        key = self._key(path)
+        if key in self.changes:
+            return self.changes[key]
+        if key not in self._base_snapshot()[0]:
+            raise FileNotFoundError(f"{path} is not part of {self.name}")
+        with open(os.path.join(self.base, key), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def files(self) -> List[str]:
+        """
+        Returns the paths of every file of the updated project, sorted.
+        """
+        return sorted(self._base_snapshot()[0] | set(self.changes))
+
+    def changed(self) -> List[str]:
+        """
+        Returns the paths of the changed and new files, sorted.
+        """
+        return sorted(self.changes)
+
+    def tree(self) -> str:
+        """
+        Renders the directory tree of the updated project (as ``app.generate_tree`` does).
+        """
+        files, directories = self._base_snapshot()
+        children: Dict[str, Set[str]] = {}
+        for path in directories | files | set(self.changes):
+            parts = path.split("/")
+            for depth in range(len(parts)):
+                children.setdefault("/".join(parts[:depth]), set()).add(parts[depth])
+
+        def render(directory: str, prefix: str) -> str:
+            lines = ""
+            entries = sorted(children.get(directory, ()))
+            for i, entry in enumerate(entries):
+                is_last = i == len(entries) - 1
+                lines += f"{prefix}{'└── ' if is_last else '├── '}{entry}\n"
+                path = f"{directory}/{entry}" if directory else entry
+                if path in children:
+                    lines += render(path, prefix + ("    " if is_last else "│   "))
+            return lines
+
+        return render("", "")
+
+    def diff(self, path: Optional[str] = None) -> str:
+        """
+        Returns a unified diff of the changed files (or of one file) against the original.
+        """
+        paths = [self._key(path)] if path else self.changed()
+        base_files = self._base_snapshot()[0]
+        chunks = []
+        for key in paths:
+            if key not in self.changes:
+                continue
+            original = ""
+            if key in base_files:
+                with open(os.path.join(self.base, key), "r", encoding="utf-8") as f:
+                    original = f.read()
+            chunks.extend(
+                difflib.unified_diff(
+                    original.splitlines(keepends=True),
+                    self.changes[key].splitlines(keepends=True),
+                    fromfile=f"a/{key}" if key in base_files else "/dev/null",
+                    tofile=f"b/{key}",
+                )
+            )
+        return "".join(chunk if chunk.endswith("\n") else chunk + "\n" for chunk in chunks)
+
+    def archive_entries(self) -> List[ArchiveEntry]:
+        """
+        Lists the files of the updated project for ``src.utils.archive``.
+        """
+        return [
+            ArchiveEntry(key, data=self.changes[key].encode("utf-8"))
+            if key in self.changes
+            else ArchiveEntry(key, path=os.path.join(self.base, key))
+            for key in self.files()
+        ]
+
+    def write_zip(self, zip_path: str) -> int:
+        """
+        Writes the updated project into a ZIP archive (replaced if it exists).
+
+        Returns:
+            int: Number of files archived.
+        """
+        return write_zip(self.archive_entries(), zip_path)
+
+    def flush(self, path: Optional[str] = None) -> str:
+        """
+        Writes the updated project to disk (see ``materialize_tree`` and ``ProjectWriter``).
+
+        Args:
+            path: Directory to write (default: ``name``).
+
+        Returns:
+            str: The directory written.
+        """
+        path = path or self.name
+        writer = ProjectWriter(path)
+        for key, content in self.changes.items():
+            writer.add(os.path.join(path, key), content)
+        writer.commit(prepare=lambda: materialize_tree(self.base, path, exclude=self.changes))
+        return path
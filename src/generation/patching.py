@@ -0,0 +1,354 @@
+"""
+Patch-mode output for code-generation tasks.
+
+Instead of regenerating a whole file, the model can answer a modification
+task with SEARCH/REPLACE edit blocks::
+
+    <<<<<<< SEARCH
+    def greet():
+        print("hi")
+    =======
+    def greet():
+        logger.info("hi")
+    >>>>>>> REPLACE
+
+or with a unified diff (``@@ -12,3 +12,4 @@`` hunks). Both are converted to
+``Edit`` objects and applied to the original file with increasingly lenient
+matching: exact, then ignoring whitespace, then fuzzy (``difflib`` similarity
+above a threshold). Edits that cannot be located are reported as
+``PatchConflict`` objects instead of being applied at a guessed position.
+
+A response without edits is taken to be the whole new file, unless the file
+the model was shown had been truncated to fit its prompt: echoing it back would
+drop the truncated middle, so that is reported as a conflict too.
+"""
+
+import difflib
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from src.models.token_budget import TRUNCATION_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Minimum similarity for a fuzzy match of a SEARCH block
+DEFAULT_FUZZ_THRESHOLD = 0.8
+
+MODE_FULL = "full"
+MODE_SEARCH_REPLACE = "search_replace"
+MODE_UNIFIED_DIFF = "unified_diff"
+
+_SEARCH_REPLACE_BLOCK = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE,
+)
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_OPENING_FENCE = re.compile(r"^```[\w+-]*[ \t]*$")
+_TRUNCATED = re.compile(
+    re.escape(TRUNCATION_MARKER.strip()).replace(re.escape("{count}"), r"\d+")
+)
+
+
+@dataclass
+class Edit:
+    """
+    A single replacement of ``search`` lines by ``replace`` lines.
+
+    Attributes:
+        search: Lines to locate in the original file (empty to append).
+        replace: Lines to put in their place.
+        line_hint: 1-based line where ``search`` is expected (from a diff hunk).
+    """
+
+    search: List[str]
+    replace: List[str]
+    line_hint: Optional[int] = None
+
+
+@dataclass
+class PatchConflict:
+    """
+    An edit that could not be applied.
+
+    Attributes:
+        index: Position of the edit in the response (1-based).
+        search: The text that could not be located.
+        reason: Why the edit was rejected.
+        best_ratio: Similarity of the closest candidate region.
+    """
+
+    index: int
+    search: str
+    reason: str
+    best_ratio: float = 0.0
+
+
+@dataclass
+class PatchResult:
+    """
+    Outcome of applying a model response to a file.
+
+    Attributes:
+        content: The patched file content.
+        mode: ``search_replace``, ``unified_diff`` or ``full`` (the response was
+            a complete file rather than a patch).
+        applied: Number of edits applied.
+        fuzzy: Number of edits applied through whitespace-insensitive or fuzzy matching.
+        conflicts: Edits that could not be applied.
+    """
+
+    content: str
+    mode: str
+    applied: int = 0
+    fuzzy: int = 0
+    conflicts: List[PatchConflict] = field(default_factory=list)
+
+
+def _strip_outer_fence(text: str) -> str:
+    """
+    Removes a code fence wrapping the whole response.
+
+    Fences inside the response are kept: they may be content of the file being
+    edited (e.g. a Markdown file), and fences between edit blocks or around
+    hunks are skipped by the parsers anyway.
+    """
+    lines = text.strip().splitlines()
+    if len(lines) >= 2 and _OPENING_FENCE.match(lines[0]) and lines[-1].strip() == "```":
+        return "\n".join(lines[1:-1]) + "\n"
+    return text
+
+
+def parse_search_replace_blocks(text: str) -> List[Edit]:
+    """
+    Extracts SEARCH/REPLACE edit blocks from a model response.
+    """
+    return [
+        Edit(search.splitlines(), replace.splitlines())
+        for search, replace in _SEARCH_REPLACE_BLOCK.findall(_strip_outer_fence(text))
+    ]
+
+
+def parse_unified_diff(text: str) -> List[Edit]:
+    """
+    Extracts the hunks of a unified diff as edits.
+
+    File headers (``---``/``+++``/``diff``) before the first hunk are ignored
+    since every task targets a single file. After it, ``--- x`` is a removed
+    line reading ``-- x`` (e.g. an SQL or Lua comment), not a header. Hunk line
+    counts are not trusted; a hunk ends at the next ``@@`` or ``diff`` line or
+    at the first line that is not part of a hunk body.
+    """
+    edits: List[Edit] = []
+    current: Optional[Edit] = None
+    for line in _strip_outer_fence(text).splitlines():
+        header = _HUNK_HEADER.match(line)
+        if header:
+            current = Edit([], [], line_hint=int(header.group(1)))
+            edits.append(current)
+            continue
+        if current is None:
+            continue
+        if line.startswith("diff "):
+            current = None
+        elif line.startswith("\\"):
+            continue  # "\ No newline at end of file"
+        elif line.startswith("-"):
+            current.search.append(line[1:])
+        elif line.startswith("+"):
+            current.replace.append(line[1:])
+        elif line.startswith(" ") or line == "":
+            current.search.append(line[1:])
+            current.replace.append(line[1:])
+        else:
+            current = None
+    for edit in edits:
+        # Blank lines after the last hunk are read as empty context; drop them
+        while edit.search and edit.replace and edit.search[-1] == edit.replace[-1] == "":
+            edit.search.pop()
+            edit.replace.pop()
+    return [edit for edit in edits if edit.search or edit.replace]
+
+
+def parse_patch(text: str) -> Tuple[str, List[Edit]]:
+    """
+    Detects the patch format of a response and parses it.
+
+    Returns:
+        Tuple[str, List[Edit]]: The format (``search_replace``, ``unified_diff``
+        or ``full`` when no edits are found) and the parsed edits.
+    """
+    edits = parse_search_replace_blocks(text)
+    if edits:
+        return MODE_SEARCH_REPLACE, edits
+    edits = parse_unified_diff(text)
+    if edits:
+        return MODE_UNIFIED_DIFF, edits
+    return MODE_FULL, []
+
+
+def _indent(line: str) -> str:
+    return line[: len(line) - len(line.lstrip())]
+
+
+def _reindent(replace: List[str], search_first: str, matched_first: str) -> List[str]:
+    """
+    Shifts ``replace`` by the indentation difference between the SEARCH block
+    and the region it matched, so whitespace-insensitive matches keep the
+    file's indentation.
+    """
+    found, expected = _indent(matched_first), _indent(search_first)
+    if found == expected:
+        return replace
+    adjusted = []
+    for line in replace:
+        if not line.strip():
+            adjusted.append(line)
+        elif line.startswith(expected):
+            adjusted.append(found + line[len(expected):])
+        else:
+            adjusted.append(found + line.lstrip())
+    return adjusted
+
+
+def _closest(candidates: List[int], hint: Optional[int]) -> int:
+    if hint is None:
+        return candidates[0]
+    return min(candidates, key=lambda start: abs(start - hint))
+
+
+def _locate(
+    lines: List[str], search: List[str], hint: Optional[int], threshold: float
+) -> Tuple[Optional[int], str, float]:
+    """
+    Finds the start of ``search`` in ``lines``.
+
+    Returns:
+        Tuple[Optional[int], str, float]: Start index (None if not found), the
+        match kind (``exact``, ``whitespace`` or ``fuzzy``) and its similarity.
+    """
+    size = len(search)
+    starts = range(len(lines) - size + 1)
+
+    exact = [start for start in starts if lines[start:start + size] == search]
+    if exact:
+        return _closest(exact, hint), "exact", 1.0
+
+    stripped_search = [line.strip() for line in search]
+    stripped_lines = [line.strip() for line in lines]
+    loose = [start for start in starts if stripped_lines[start:start + size] == stripped_search]
+    if loose:
+        return _closest(loose, hint), "whitespace", 1.0
+
+    target = "\n".join(stripped_search)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(target)
+    best_start, best_ratio = None, 0.0
+    for start in starts:
+        matcher.set_seq1("\n".join(stripped_lines[start:start + size]))
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+            continue
+        ratio = matcher.ratio()
+        # Prefer the candidate nearest the hint among equally similar regions
+        if ratio > best_ratio or (
+            ratio == best_ratio
+            and best_start is not None
+            and hint is not None
+            and abs(start - hint) < abs(best_start - hint)
+        ):
+            best_start, best_ratio = start, ratio
+    if best_start is not None and best_ratio >= threshold:
+        return best_start, "fuzzy", best_ratio
+    return None, "", best_ratio
+
+
+def apply_edits(
+    content: str, edits: List[Edit], threshold: float = DEFAULT_FUZZ_THRESHOLD
+) -> PatchResult:
+    """
+    Applies edits to ``content`` in order.
+
+    Args:
+        content: Original file content.
+        edits: Edits to apply.
+        threshold: Minimum ``difflib`` similarity for a fuzzy match.
+
+    Returns:
+        PatchResult: The patched content and the edits that conflicted.
+    """
+    lines = content.splitlines()
+    result = PatchResult(content=content, mode=MODE_SEARCH_REPLACE)
+    # Line hints refer to the original file; track how earlier edits moved them
+    offset = 0
+
+    for index, edit in enumerate(edits, start=1):
+        if not edit.search:
+            lines.extend(edit.replace)
+            result.applied += 1
+            continue
+
+        hint = edit.line_hint - 1 + offset if edit.line_hint else None
+        start, kind, ratio = _locate(lines, edit.search, hint, threshold)
+        if start is None:
+            result.conflicts.append(
+                PatchConflict(
+                    index=index,
+                    search="\n".join(edit.search),
+                    reason="search text not found in file",
+                    best_ratio=round(ratio, 3),
+                )
+            )
+            continue
+
+        replace = edit.replace
+        if kind != "exact":
+            replace = _reindent(replace, edit.search[0], lines[start])
+            result.fuzzy += 1
+        lines[start:start + len(edit.search)] = replace
+        offset += len(replace) - len(edit.search)
+        result.applied += 1
+
+    trailing_newline = "\n" if content.endswith("\n") or not content else ""
+    result.content = "\n".join(lines) + (trailing_newline if lines else "")
+    return result
+
+
+def apply_patch(
+    content: str,
+    response: str,
+    threshold: float = DEFAULT_FUZZ_THRESHOLD,
+    allow_full: bool = True,
+) -> PatchResult:
+    """
+    Applies a model response in patch format to ``content``.
+
+    A response without any edit blocks or diff hunks is taken to be the
+    complete new file, so models that ignore the patch instructions still
+    produce a usable result. It is rejected (``content`` is kept, with a
+    conflict) if it contains a truncation marker or ``allow_full`` is False.
+
+    Args:
+        content: Original file content.
+        response: The model's answer (SEARCH/REPLACE blocks, a unified diff or a full file).
+        threshold: Minimum ``difflib`` similarity for a fuzzy match.
+        allow_full: Whether a full file is acceptable, i.e. the prompt had the whole
+            of ``content`` rather than a truncated version.
+
+    Returns:
+        PatchResult: The patched content, match statistics and conflicts.
+    """
+    mode, edits = parse_patch(response)
+    if mode == MODE_FULL:
+        if _TRUNCATED.search(response):
+            reason = "whole-file response contains a truncation marker"
+        elif not allow_full:
+            reason = "whole-file response to a prompt with truncated file content"
+        else:
+            return PatchResult(content=response, mode=MODE_FULL)
+        return PatchResult(
+            content=content, mode=MODE_FULL, conflicts=[PatchConflict(1, "", reason)]
+        )
+    result = apply_edits(content, edits, threshold=threshold)
+    result.mode = mode
+    return result
@@ -0,0 +1,293 @@
+"""
+Incremental, tolerant parsing of the Step 6 JSON plan.
+
+``PlanStreamParser`` is fed the preprocessing response chunk by chunk while
+the model is still writing it. Every ``existing_files``/``new_files`` entry is
+emitted as soon as its closing brace arrives, so the pipeline can build and
+dispatch the entry's task prompt without waiting for the rest of the plan.
+
+``repair_json`` fixes the malformations models commonly produce (prose or
+code fences around the object, comments, trailing or missing commas, single
+quotes, Python literals, raw newlines in strings, and output truncated before
+the closing brackets) so a slightly broken plan does not require another call.
+"""
+
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PLAN_SECTIONS = ("existing_files", "new_files")
+
+# Top-level string fields the task prompts need
+PLAN_FIELDS = ("feature_request", "analysis_results")
+
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _strip_wrapping(text: str) -> str:
+    """
+    Returns the text from the first ``{`` on, without a surrounding code fence or prose.
+    """
+    fenced = re.search(r"```(?:json)?[ \t]*\n(.*?)(?:```|$)", text, re.DOTALL)
+    if fenced and "{" in fenced.group(1):
+        text = fenced.group(1)
+    start = text.find("{")
+    return text[start:] if start != -1 else ""
+
+
+def repair_json(text: str) -> str:
+    """
+    Rewrites almost-JSON into valid JSON.
+
+    Args:
+        text: Model output containing a JSON object, possibly malformed or truncated.
+
+    Returns:
+        str: The repaired JSON text (an empty string if no object was found).
+    """
+    text = _strip_wrapping(text)
+    out: List[str] = []
+    stack: List[str] = []
+    quote = ""
+    i = 0
+    length = len(text)
+
+    def last_significant() -> str:
+        for char in reversed(out):
+            if not char.isspace():
+                return char[-1]
+        return ""
+
+    while i < length:
+        char = text[i]
+
+        if quote:
+            if char == "\\" and i + 1 < length:
+                escaped = text[i + 1]
+                # A \' escape is only valid inside single-quoted strings
+                out.append("'" if escaped == "'" else char + escaped)
+                i += 2
+                continue
+            if char == quote:
+                out.append('"')
+                quote = ""
+            elif char == '"':
+                out.append('\\"')  # double quote inside a single-quoted string
+            elif char == "\n":
+                out.append("\\n")
+            elif char == "\r":
+                out.append("\\r")
+            elif char == "\t":
+                out.append("\\t")
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in "\"'":
+            if last_significant() in ('"', "}", "]") or last_significant().isalnum():
+                out.append(",")  # missing comma between values
+            quote = char
+            out.append('"')
+        elif char == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = length if end == -1 else end
+            continue
+        elif char == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = length if end == -1 else end + 2
+            continue
+        elif char in "{[":
+            if last_significant() in ('"', "}", "]"):
+                out.append(",")
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            if not stack:
+                break  # text after the object
+            # Close whatever the model left open inside this container
+            while True:
+                while out and out[-1].isspace():
+                    out.pop()
+                if out and out[-1] == ",":
+                    out.pop()  # trailing comma
+                closer = stack.pop()
+                out.append(closer)
+                if closer == char or not stack:
+                    break
+            if not stack:
+                break
+        elif char.isalpha() or char == "_":
+            word = re.match(r"[A-Za-z_][A-Za-z0-9_]*", text[i:]).group(0)
+            if re.match(r"\s*:", text[i + len(word):]):
+                if last_significant() in ('"', "}", "]"):
+                    out.append(",")
+                out.append(f'"{word}"')  # unquoted key
+            else:
+                out.append(_PYTHON_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    if quote:
+        out.append('"')
+    # Truncated output: drop a dangling key or separator, then close open containers
+    body = "".join(out).rstrip()
+    closers = "".join(reversed(stack))
+    candidates = [
+        body,
+        re.sub(r"[,:]\s*$", "", body),
+        re.sub(r',?\s*"(?:[^"\\]|\\.)*"\s*:?\s*$', "", body),
+    ]
+    for candidate in candidates:
+        try:
+            json.loads(candidate + closers)
+            return candidate + closers
+        except json.JSONDecodeError:
+            continue
+    return body + closers
+
+
+def parse_json_tolerant(text: str) -> Optional[Any]:
+    """
+    Parses the JSON object in ``text``, repairing it if necessary.
+
+    Returns:
+        The parsed object, or None if it could not be parsed even after repair.
+    """
+    candidate = _strip_wrapping(text)
+    if not candidate:
+        return None
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = json.loads(repair_json(candidate))
+    except json.JSONDecodeError as e:
+        logger.warning(f"Could not repair JSON: {e}")
+        return None
+    logger.info("Parsed JSON after repairing malformed model output")
+    return value
+
+
+class PlanStreamParser:
+    """
+    Incremental parser emitting plan entries while the plan is being streamed.
+
+    Usage::
+
+        parser = PlanStreamParser()
+        for chunk in stream:
+            for section, index, entry in parser.feed(chunk):
+                dispatch(section, index, entry)
+        plan = parser.close()
+
+    Attributes:
+        fields: Completed top-level string fields (``feature_request``, ``analysis_results``).
+        emitted: Number of entries emitted per section.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.emitted: Dict[str, int] = {section: 0 for section in PLAN_SECTIONS}
+        self._buffer = ""
+        self._position = 0
+        self._started = False
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._last_string = ""
+        self._key = ""
+        self._entry_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, int, Dict[str, Any]]]:
+        """
+        Consumes a chunk of the streamed response.
+
+        Returns:
+            List[Tuple[str, int, Dict[str, Any]]]: ``(section, index, entry)`` for every
+            entry completed by this chunk.
+        """
+        self._buffer += chunk
+        events = []
+        while self._position < len(self._buffer):
+            event = self._consume(self._buffer[self._position])
+            self._position += 1
+            if event:
+                events.append(event)
+        return events
+
+    def _consume(self, char: str) -> Optional[Tuple[str, int, Dict[str, Any]]]:
+        if not self._started:
+            if char == "{":
+                self._started = True
+                self._stack.append("{")
+            return None
+
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                self._finish_string()
+            return None
+
+        depth = len(self._stack)
+        if char == '"':
+            self._in_string = True
+            self._string_start = self._position
+        elif char == ":" and depth == 1:
+            self._key = self._last_string
+        elif char == "," and depth == 1:
+            self._key = ""
+        elif char in "{[":
+            if char == "{" and depth == 2 and self._stack[-1] == "[" and self._key in PLAN_SECTIONS:
+                self._entry_start = self._position
+            self._stack.append(char)
+        elif char in "}]" and self._stack:
+            self._stack.pop()
+            if char == "}" and len(self._stack) == 2 and self._entry_start is not None:
+                entry_text = self._buffer[self._entry_start:self._position + 1]
+                self._entry_start = None
+                return self._emit(entry_text)
+            if not self._stack:
+                self._started = False  # the plan is complete; ignore trailing text
+        return None
+
+    def _finish_string(self) -> None:
+        raw = self._buffer[self._string_start:self._position + 1]
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw[1:-1]
+        self._last_string = value
+        if len(self._stack) == 1 and self._key in PLAN_FIELDS:
+            self.fields[self._key] = value
+
+    def _emit(self, entry_text: str) -> Optional[Tuple[str, int, Dict[str, Any]]]:
+        entry = parse_json_tolerant(entry_text)
+        if not isinstance(entry, dict):
+            logger.warning(f"Skipping unparseable plan entry: {entry_text[:80]}")
+            return None
+        index = self.emitted[self._key]
+        self.emitted[self._key] += 1
+        return self._key, index, entry
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """
+        Parses the complete response, repairing it if needed.
+
+        Returns:
+            The plan, or None if no JSON object could be recovered.
+        """
+        plan = parse_json_tolerant(self._buffer)
+        return plan if isinstance(plan, dict) else None
@@ -54,6 +54,8 @@ def get_prompt_request(stage: str):
 import json
 import re
 
+from src.generation.plan_stream import parse_json_tolerant
+
 def extract_json_from_response(response_text):
   """
   Extracts the JSON file from the given LLM response.
@@ -61,6 +63,9 @@ def extract_json_from_response(response_text):
   Args:
     response_text: The LLM response containing the JSON file.
 
+  Malformed or truncated JSON (and JSON without a fenced block) is repaired
+  with ``parse_json_tolerant`` instead of being rejected.
+
   Returns:
     A Python dictionary representing the JSON object, or None if no JSON is found.
   """
@@ -72,8 +77,64 @@ def extract_json_from_response(response_text):
       # Parse the JSON string
       json_object = json.loads(json_string)
       return json_object
-    else:
-      return None
   except json.JSONDecodeError as e:
     print(f"Error decoding JSON: {e}")
-    return None
\ No newline at end of file
+  json_object = parse_json_tolerant(response_text)
+  return json_object if isinstance(json_object, dict) else None
+
+
+def _analysis_section_text(value):
+  """
+  Renders a section of the combined analysis (string, list or mapping) as text.
+  """
+  if isinstance(value, str):
+    return value.strip()
+  if isinstance(value, list):
+    lines = []
+    for item in value:
+      if isinstance(item, dict):
+        item = ", ".join(f"{key}: {val}" for key, val in item.items())
+      lines.append(f"- {str(item).strip()}")
+    return "\n".join(lines)
+  if isinstance(value, dict):
+    return "\n".join(f"- {key}: {val}" for key, val in value.items())
+  return str(value).strip() if value is not None else ""
+
+
+def parse_feature_analysis(response_text):
+  """
+  Parses the single-call feature analysis into its nodes, edges and impact report.
+
+  The JSON object is read with ``parse_json_tolerant``, so a fenced block,
+  surrounding prose and malformed JSON are all accepted. Key names are matched
+  case-insensitively, and list or mapping values are rendered as bullet lists.
+
+  Args:
+    response_text: The LLM response to the ``feature_analysis_combined`` prompt.
+
+  Returns:
+    A dictionary with ``nodes``, ``edges`` and ``impact_report`` text, or None
+    if the response cannot be parsed or a section is missing.
+  """
+  if not response_text:
+    return None
+
+  data = parse_json_tolerant(response_text)
+  if not isinstance(data, dict):
+    return None
+
+  aliases = {
+    "nodes": ("nodes", "impacted_nodes"),
+    "edges": ("edges", "impacted_edges", "dependencies"),
+    "impact_report": ("impact_report", "impact", "report"),
+  }
+  normalized = {str(key).strip().lower().replace(" ", "_"): value for key, value in data.items()}
+  analysis = {}
+  for section, names in aliases.items():
+    value = next((normalized[name] for name in names if name in normalized), None)
+    text = _analysis_section_text(value)
+    if not text:
+      logger.warning(f"Combined feature analysis is missing the '{section}' section")
+      return None
+    analysis[section] = text
+  return analysis
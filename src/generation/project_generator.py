@@ -1,14 +1,20 @@
 import os
-import shutil
 
-def generate_project(old_project_path, new_project_path, feature_instructions):
-    # Copy old project structure to new directory
-    if os.path.exists(new_project_path):
-        shutil.rmtree(new_project_path)
-    shutil.copytree(old_project_path, new_project_path)
+from src.utils.materialize import materialize_tree
+from src.utils.output_writer import ProjectWriter
 
+def generate_project(old_project_path, new_project_path, feature_instructions):
     # Apply feature instructions
+    writer = ProjectWriter(new_project_path)
     for instruction in feature_instructions:
-        file_path = os.path.join(new_project_path, instruction["file"])
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(instruction["content"])
+        writer.add(os.path.join(new_project_path, instruction["file"]), instruction["content"])
+
+    # Once they are staged, copy the old project structure to the new directory,
+    # skipping the files about to be written
+    writer.commit(
+        prepare=lambda: materialize_tree(
+            old_project_path,
+            new_project_path,
+            exclude=[instruction["file"] for instruction in feature_instructions],
+        )
+    )
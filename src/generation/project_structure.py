@@ -1,13 +1,156 @@
 import os
-import shutil
 import logging
 import json
 
+from src.generation.overlay import ProjectOverlay
+from src.generation.patching import apply_patch
+from src.utils.materialize import materialize_tree
+from src.utils.output_writer import ProjectWriter
+
 # Initialize the logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def update_project_structure(json_data: str, task_responses: list, old_project_path: str, new_project_path: str, overwrite: bool = True):
+def resolve_new_file_path(file_path: str, old_project_path: str, new_project_path: str) -> str:
+    """
+    Maps a file path from the original project to its path in the new project.
+
+    Args:
+        file_path (str): File path as reported in the preprocessing JSON.
+        old_project_path (str): Path to the original project directory.
+        new_project_path (str): Path to the new project directory.
+
+    Returns:
+        str: The corresponding path inside the new project directory.
+    """
+    old_prefix = old_project_path.rstrip("/") + "/"
+    if file_path.startswith(old_prefix):
+        return os.path.join(new_project_path, file_path[len(old_prefix):])
+    return os.path.join(new_project_path, file_path.lstrip("/"))
+
+
+def clone_project(old_project_path: str, new_project_path: str, rewritten: list = ()):
+    """
+    Makes the new project directory a copy of the original project.
+
+    An existing new project is reused: only the files that differ from the
+    original are placed again (see ``materialize_tree``).
+
+    Args:
+        old_project_path (str): Path to the original project directory.
+        new_project_path (str): Path to the new project directory.
+        rewritten (list): File paths (as reported in the preprocessing JSON) that are about
+            to be rewritten. They are not copied, and their current version in the new
+            project is left in place until it is replaced.
+
+    Returns:
+        MaterializeStats: Files kept, placed and removed.
+    """
+    logger.info("Cloning the original project structure")
+    excluded = [
+        os.path.relpath(
+            resolve_new_file_path(file_path, old_project_path, new_project_path),
+            new_project_path,
+        )
+        for file_path in rewritten
+        if file_path
+    ]
+    return materialize_tree(old_project_path, new_project_path, exclude=excluded)
+
+
+def apply_task_responses(tasks: list, old_project_path: str, new_project_path: str, output_mode: str = "full", read_new: bool = True, truncated=()):
+    """
+    Computes the updated content of existing files from their task responses.
+
+    Args:
+        tasks (list): ``(file_info, task_response)`` pairs of the existing files to update.
+        old_project_path (str): Path to the original project directory.
+        new_project_path (str): Path to the new project directory.
+        output_mode (str): ``"full"`` if task responses are complete files, ``"patch"`` if
+            they are edit blocks or unified diffs to apply.
+        read_new (bool): In patch mode, apply the edits to the file in the new project if it
+            exists. Otherwise (or if it does not exist) they apply to the original file.
+        truncated (set): In patch mode, file paths whose task prompt showed truncated content.
+            A whole-file response for them is reported as a conflict instead of written.
+
+    Returns:
+        tuple: The updated content by new file path, and in patch mode the ``PatchResult``
+            of every file by new file path.
+    """
+    updated = {}
+    patch_results = {}
+    for file_info, updated_content in tasks:
+        old_file_path = file_info["file_path"]
+        new_file_path = resolve_new_file_path(old_file_path, old_project_path, new_project_path)
+
+        # Apply the patch to the original content in patch mode
+        if output_mode == "patch":
+            base_path = new_file_path if read_new and os.path.exists(new_file_path) else old_file_path
+            original = ""
+            if os.path.exists(base_path):
+                with open(base_path, "r", encoding="utf-8") as f:
+                    original = f.read()
+            result = apply_patch(
+                original, updated_content, allow_full=old_file_path not in truncated
+            )
+            patch_results[new_file_path] = result
+            updated_content = result.content
+            logger.info(
+                f"Patch ({result.mode}) for {new_file_path}: {result.applied} edits applied "
+                f"({result.fuzzy} fuzzy), {len(result.conflicts)} conflicts"
+            )
+            for conflict in result.conflicts:
+                logger.warning(
+                    f"Patch conflict in {new_file_path}, edit {conflict.index}: {conflict.reason} "
+                    f"(best similarity {conflict.best_ratio:.2f}):\n{conflict.search}"
+                )
+        updated[new_file_path] = updated_content
+    return updated, patch_results
+
+
+def build_overlay(json_data: str, task_responses: list, old_project_path: str, new_project_path: str, output_mode: str = "full", truncated=()):
+    """
+    Builds the updated project in memory instead of writing it to disk.
+
+    Unlike ``update_project_structure``, the new files of the plan are included
+    (task responses after the existing files), as streaming writes them in Step 7.
+
+    Args:
+        json_data (str): JSON data as a string.
+        task_responses (list): List of source code responses for each task.
+        old_project_path (str): Path to the original project directory.
+        new_project_path (str): Name of the new project (the default ``flush`` target).
+        output_mode (str): ``"full"`` or ``"patch"`` (see ``update_project_structure``).
+        truncated (set): See ``apply_task_responses``.
+
+    Returns:
+        tuple: The ``ProjectOverlay`` and, in patch mode, the ``PatchResult`` of every
+            existing file by new file path.
+    """
+    data = json.loads(json_data)
+    existing_files = data.get("existing_files", [])
+    new_files = data.get("new_files", [])
+    updated, patch_results = apply_task_responses(
+        list(zip(existing_files, task_responses)),
+        old_project_path,
+        new_project_path,
+        output_mode,
+        read_new=False,
+        truncated=truncated,
+    )
+    for file_info, content in zip(new_files, task_responses[len(existing_files):]):
+        if file_info.get("file_path"):
+            path = resolve_new_file_path(file_info["file_path"], old_project_path, new_project_path)
+            updated[path] = content
+
+    overlay = ProjectOverlay(old_project_path, new_project_path)
+    for path, content in updated.items():
+        overlay.write(os.path.relpath(path, new_project_path), content)
+    logger.info(f"Updated project kept in memory: {len(overlay.changes)} files changed")
+    return overlay, patch_results
+
+
+def update_project_structure(json_data: str, task_responses: list, old_project_path: str, new_project_path: str, overwrite: bool = True, clone: bool = True, output_mode: str = "full", truncated=(), new_files: bool = False):
     """
     Updates the project structure by cloning the original project, modifying files based on task responses,
     and saving the updated files into a new project directory.
@@ -18,55 +161,80 @@ def update_project_structure(json_data: str, task_responses: list, old_project_p
         old_project_path (str): Path to the original project directory.
         new_project_path (str): Path to save the new project directory.
         overwrite (bool): Whether to overwrite existing files in the new project structure.
+        clone (bool): Whether to re-clone the original project first. Disable it when the
+            new project was already cloned (e.g. when Step 7 streamed files into it).
+        output_mode (str): ``"full"`` if task responses are complete files, ``"patch"`` if
+            responses for existing files are edit blocks or unified diffs to apply.
+        truncated (set): See ``apply_task_responses``.
+        new_files (bool): Also write the new files of the plan (task responses after the
+            existing files), as ``build_overlay`` does. Needed when Step 7 streamed them
+            but the project is cloned again, which would remove them.
+
+    Returns:
+        dict: In patch mode, the ``PatchResult`` of every existing file by new file path
+            (edits that could not be applied are listed in its ``conflicts``). Empty otherwise.
+
+    Raises:
+        OSError: If the updated files cannot be written. They are staged before the
+            project is cloned, and moved into place together, so the new project is
+            left untouched if staging fails.
     """
     # Step 1: Parse the JSON data
     data = json.loads(json_data)
     existing_files = data.get("existing_files", [])
 
-    # Step 2: Clone the original project structure
-    logger.info("Cloning the original project structure")
-    if os.path.exists(new_project_path):
-        shutil.rmtree(new_project_path)
-    shutil.copytree(old_project_path, new_project_path)
+    # Step 2: Clone the original project structure once the updated files are staged
+    # (Step 3.3). Files that are kept rather than rewritten must be in place first.
+    rewritten = [file_info["file_path"] for file_info in existing_files] if overwrite else []
+    if clone and not overwrite:
+        clone_project(old_project_path, new_project_path)
 
     # Step 3: Update modified files with task responses
     logger.info("Updating modified files based on task responses")
+    tasks = []
     for i, file_info in enumerate(existing_files):
-        old_file_path = file_info["file_path"]
-        new_file_path = old_file_path.replace("project_old/", "project_new/")
-        updated_content = task_responses[i]
+        new_file_path = resolve_new_file_path(file_info["file_path"], old_project_path, new_project_path)
 
         # Check if file exists and handle overwrite flag
         if not overwrite and os.path.exists(new_file_path):
             logger.info(f"File exists and overwrite is disabled: {new_file_path}. Keeping the original file.")
             continue
-        # Step 3.1:  Ensure the new file directory exists
-        logger.info("Ensure the new file directory exists")
-        try:
- 
-            new_file_dir = os.path.dirname(new_file_path)
-            if not os.path.exists(new_file_dir):
-                os.makedirs(new_file_dir)
-        except Exception as e:
-            logger.error(f"Failed to creating directories: {e}")
-            exit(1)
-
-        # Step 3.2:  Write the updated content to the new file
-        logger.info("Write the updated content to the new file")
-        try:         
-           
-            with open(new_file_path, "w") as f:
-                f.write(updated_content)
+        tasks.append((file_info, task_responses[i]))
+
+    # Step 3.1:  Apply the patches to the original content in patch mode
+    updated, patch_results = apply_task_responses(
+        tasks, old_project_path, new_project_path, output_mode, read_new=False, truncated=truncated
+    )
+
+    # Step 3.2:  Queue the updated content for the new files, and the files the plan adds
+    writer = ProjectWriter(new_project_path)
+    for new_file_path, updated_content in updated.items():
+        writer.add(new_file_path, updated_content)
+    if new_files:
+        added = zip(data.get("new_files", []), task_responses[len(existing_files):])
+        for file_info, content in added:
+            if file_info.get("file_path"):
+                path = resolve_new_file_path(file_info["file_path"], old_project_path, new_project_path)
+                writer.add(path, content)
+                rewritten.append(file_info["file_path"])  # kept in place until replaced
+
+    # Step 3.3:  Stage all updated files, clone, then replace (never write through) the
+    # cloned ones
+    def prepare():
+        if clone and overwrite:
+            clone_project(old_project_path, new_project_path, rewritten=rewritten)
+
+    logger.info(f"Writing {len(writer)} updated files")
+    try:
+        for new_file_path in writer.commit(prepare=prepare):
             logger.info(f"Updated file saved: {new_file_path}")
-        except Exception as e:
-            logger.error(f"Failed Updated file save: {e}")
-            exit(1)
+    except OSError as e:
+        logger.error(f"Failed to save the updated files: {e}")
+        raise
 
-    # Step 4: Verify the new project structure
-    logger.info("New project structure generated successfully")
-    for root, _, files in os.walk(new_project_path):
-        for file in files:
-            logger.info(f"File in new project: {os.path.join(root, file)}")
+    # Step 4: Report the new project structure
+    logger.info(f"New project structure generated successfully in {new_project_path}")
+    return patch_results
 
 
 import os
@@ -91,13 +259,14 @@ def create_expected_files_from_json(json_data: str) -> list:
     existing_files = data.get("existing_files", [])
     expected_files = [file["file_path"].replace("project_old/", "") for file in existing_files]
     return expected_files
-def validate_project_consistency(new_project_path: str, expected_files: list):
+def validate_project_consistency(new_project_path: str, expected_files: list, overlay=None):
     """
     Validates the consistency of the new project structure by checking for expected files.
 
     Args:
         new_project_path (str): Path to the new project directory.
         expected_files (list): List of expected file paths relative to the project root.
+        overlay (ProjectOverlay): The new project, if it is kept in memory instead of on disk.
 
     Returns:
         bool: True if all expected files are present, False otherwise.
@@ -107,7 +276,8 @@ def validate_project_consistency(new_project_path: str, expected_files: list):
 
     for expected_file in expected_files:
         expected_path = os.path.join(new_project_path, expected_file)
-        if not os.path.exists(expected_path):
+        exists = overlay.exists(expected_file) if overlay else os.path.exists(expected_path)
+        if not exists:
             missing_files.append(expected_path)
 
     if missing_files:
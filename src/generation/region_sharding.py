@@ -0,0 +1,426 @@
+"""
+Region-sharded generation for very large files.
+
+A file that is too large for a single Step 7 prompt (or response) is split
+into regions: the module header, top-level functions and classes, and for big
+classes their individual methods. The regions a task touches are selected
+statically (names mentioned in the task, feature request or analysis) and by
+retrieval (lexical similarity between the task and each region). Selected
+regions are edited by the model in parallel; all other regions are copied
+verbatim. The result is stitched back together and checked for consistency:
+it must still parse, and every definition of an edited region must survive
+unless the task asked for its removal. Regions that break the file are
+reverted to their original text.
+
+Environment variables:
+    REGION_SHARD_MIN_LINES: Files with at least this many lines are sharded (default: 400).
+    REGION_SHARD_MAX_REGIONS: Maximum number of regions edited per file (default: 8).
+    REGION_SHARD_WORKERS: Parallel region edits (default: 4).
+"""
+
+import ast
+import logging
+import math
+import os
+import re
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set
+
+from src.generation.task_prompts import _fit_task_prompt
+from src.utils.metrics import bind_run_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_LINES = 400
+DEFAULT_MAX_REGIONS = 8
+DEFAULT_WORKERS = 4
+
+# Classes longer than this are split into their methods
+MAX_REGION_LINES = 120
+
+# Regions of other languages are cut at blank lines once they reach this size
+FALLBACK_REGION_LINES = 80
+
+# Retrieved regions must score at least this fraction of the best match
+MIN_RELATIVE_SCORE = 0.5
+
+REGION_PROMPT = (
+    "You are an expert at writing source code. Perform the following task on one region of a large file:\n\n"
+    "Task Request: {task}\n\n"
+    "Feature Request: {feature_request}\n\n"
+    "File Path: {file_path}\n\n"
+    "File Outline (regions of the file, the one to edit is marked with >):\n{outline}\n\n"
+    "Region Content ({region}):\n{content}\n\n"
+    "Analysis Results: {analysis_results}\n\n"
+    "Output ONLY the complete modified source code of this region, keeping its indentation. "
+    "Do not output other regions, comments, explanations, or any other text."
+)
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CODE_FENCE = re.compile(r"^```[\w+-]*[ \t]*\n?", re.MULTILINE)
+_REMOVAL_WORDS = ("remove", "delete", "drop", "rename")
+
+
+@dataclass
+class Region:
+    """
+    A contiguous range of lines of a file.
+
+    Attributes:
+        name: Qualified name (``Class.method``) or ``<module>`` for code between definitions.
+        kind: ``header``, ``module``, ``class``, ``function`` or ``block``.
+        start: Index of the first line (0-based).
+        end: Index after the last line.
+        text: Source text of the region, including line endings.
+        defines: Names defined by the region.
+    """
+
+    name: str
+    kind: str
+    start: int
+    end: int
+    text: str
+    defines: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ShardedResult:
+    """
+    Outcome of a region-sharded edit.
+
+    Attributes:
+        content: The stitched file content.
+        edited: Names of the regions rewritten by the model.
+        copied: Number of regions copied verbatim.
+        reverted: Regions whose edit was discarded by the consistency check, with the reason.
+        consistent: Whether the stitched file passed the consistency check.
+    """
+
+    content: str
+    edited: List[str] = field(default_factory=list)
+    copied: int = 0
+    reverted: Dict[str, str] = field(default_factory=dict)
+    consistent: bool = True
+
+
+def should_shard(content: str, min_lines: Optional[int] = None) -> bool:
+    """
+    Returns True if ``content`` is large enough to be edited region by region.
+    """
+    if min_lines is None:
+        min_lines = int(os.getenv("REGION_SHARD_MIN_LINES", str(DEFAULT_MIN_LINES)))
+    return content.count("\n") + 1 >= min_lines
+
+
+def _node_start(node: ast.AST) -> int:
+    decorators = getattr(node, "decorator_list", None) or []
+    return min([node.lineno] + [decorator.lineno for decorator in decorators]) - 1
+
+
+def _defined_names(node: ast.AST) -> List[str]:
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    names = []
+    for target in getattr(node, "targets", None) or [getattr(node, "target", None)]:
+        if isinstance(target, ast.Name):
+            names.append(target.id)
+    return names
+
+
+def _regions_from_nodes(
+    lines: List[str], nodes: List[ast.stmt], start: int, end: int, prefix: str, gap_kind: str
+) -> List[Region]:
+    """
+    Cuts ``lines[start:end]`` into one region per definition in ``nodes`` plus the code between them.
+    """
+    regions: List[Region] = []
+    cursor = start
+
+    def add_gap(until: int, gap_nodes: List[ast.stmt]) -> None:
+        if until <= cursor:
+            return
+        text = "".join(lines[cursor:until])
+        if not text.strip() and regions:
+            # Blank lines between definitions stay with the preceding region
+            regions[-1].end = until
+            regions[-1].text += text
+            return
+        defines = [name for node in gap_nodes for name in _defined_names(node)]
+        regions.append(Region(f"{prefix}<{gap_kind}>", gap_kind, cursor, until, text, defines))
+
+    pending: List[ast.stmt] = []
+    for node in nodes:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            pending.append(node)
+            continue
+        node_start, node_end = _node_start(node), node.end_lineno
+        add_gap(node_start, pending)
+        pending = []
+        name = f"{prefix}{node.name}"
+
+        if isinstance(node, ast.ClassDef) and node_end - node_start > MAX_REGION_LINES:
+            if any(isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)) for child in node.body):
+                regions.extend(
+                    _regions_from_nodes(lines, node.body, node_start, node_end, f"{name}.", "class")
+                )
+                cursor = node_end
+                continue
+
+        kind = "class" if isinstance(node, ast.ClassDef) else "function"
+        regions.append(
+            Region(name, kind, node_start, node_end, "".join(lines[node_start:node_end]), [node.name])
+        )
+        cursor = node_end
+    add_gap(end, pending)
+    return regions
+
+
+def _split_by_blank_lines(lines: List[str]) -> List[Region]:
+    regions: List[Region] = []
+    start = 0
+    for index, line in enumerate(lines):
+        if index + 1 - start >= FALLBACK_REGION_LINES and not line.strip():
+            text = "".join(lines[start:index + 1])
+            regions.append(Region(f"<block {len(regions) + 1}>", "block", start, index + 1, text))
+            start = index + 1
+    if start < len(lines):
+        text = "".join(lines[start:])
+        regions.append(Region(f"<block {len(regions) + 1}>", "block", start, len(lines), text))
+    return regions
+
+
+def split_regions(content: str, file_path: str = "") -> List[Region]:
+    """
+    Splits a file into contiguous regions covering every line exactly once.
+
+    Python files are split by class and function with ``ast``; the code before
+    the first definition becomes the ``header`` region. Other files, and
+    Python files that do not parse, are split at blank lines.
+
+    Args:
+        content: File content.
+        file_path: Path of the file, used to pick the splitting strategy.
+
+    Returns:
+        List[Region]: Regions in file order.
+    """
+    lines = content.splitlines(keepends=True)
+    if not lines:
+        return []
+    tree = None
+    if not file_path or file_path.endswith(".py"):
+        try:
+            tree = ast.parse(content)
+        except SyntaxError:
+            logger.info(f"{file_path or 'File'} does not parse; splitting at blank lines")
+    if tree is None:
+        return _split_by_blank_lines(lines)
+
+    regions = _regions_from_nodes(lines, tree.body, 0, len(lines), "", "module")
+    if regions and regions[0].kind == "module" and regions[0].start == 0:
+        regions[0].kind = "header"
+        regions[0].name = "<header>"
+    return regions
+
+
+def _tokens(text: str) -> List[str]:
+    tokens = []
+    for identifier in _IDENTIFIER.findall(text):
+        # Split snake_case and CamelCase so "add_user" matches "user"
+        for part in re.split(r"_|(?<=[a-z0-9])(?=[A-Z])", identifier):
+            if len(part) > 2:
+                tokens.append(part.lower())
+    return tokens
+
+
+def select_regions(
+    regions: List[Region],
+    task: str,
+    feature_request: str = "",
+    context: str = "",
+    max_regions: Optional[int] = None,
+) -> List[Region]:
+    """
+    Chooses the regions a task is likely to touch.
+
+    Regions whose names are mentioned in the task or feature request are
+    always selected (statically), as is the header when the file has one, so
+    imports can be added. The remaining slots go to the regions most similar
+    to the task by TF-IDF retrieval over the regions, with names mentioned in
+    ``context`` (retrieved context, analysis results) used as a boost.
+
+    Args:
+        regions: Regions of the file.
+        task: Task description for the file.
+        feature_request: The feature request.
+        context: Additional text such as retrieved context and analysis results.
+        max_regions: Maximum number of regions to select.
+
+    Returns:
+        List[Region]: Selected regions in file order.
+    """
+    if max_regions is None:
+        max_regions = int(os.getenv("REGION_SHARD_MAX_REGIONS", str(DEFAULT_MAX_REGIONS)))
+    query = f"{task}\n{feature_request}"
+    mentioned = set(_IDENTIFIER.findall(query))
+    context_names = set(_IDENTIFIER.findall(context))
+
+    selected: Set[int] = set()
+    for index, region in enumerate(regions):
+        if region.kind == "header" or any(name in mentioned for name in region.defines):
+            selected.add(index)
+
+    # Retrieval: TF-IDF similarity between the query and each region
+    documents = [Counter(_tokens(" ".join(region.defines) + "\n" + region.text)) for region in regions]
+    frequency = Counter(token for document in documents for token in document)
+    query_tokens = Counter(_tokens(query))
+    scores = []
+    for index, (region, document) in enumerate(zip(regions, documents)):
+        length = math.sqrt(sum(document.values())) or 1.0
+        score = sum(
+            weight * document[token] * math.log(1 + len(regions) / frequency[token])
+            for token, weight in query_tokens.items()
+            if token in document
+        ) / length
+        if any(name in context_names for name in region.defines):
+            score *= 1.5
+        scores.append((score, index))
+
+    ranked = sorted(scores, reverse=True)
+    best = ranked[0][0] if ranked else 0.0
+    for score, index in ranked:
+        if len(selected) >= max_regions or score <= 0 or score < best * MIN_RELATIVE_SCORE:
+            break
+        selected.add(index)
+
+    if len(selected) > max_regions:
+        logger.warning(
+            f"Task mentions {len(selected)} regions; editing all of them exceeds the limit of {max_regions}"
+        )
+    return [regions[index] for index in sorted(selected)]
+
+
+def _outline(regions: List[Region], current: Region) -> str:
+    return "\n".join(
+        f"{'>' if region is current else ' '} {region.name} (lines {region.start + 1}-{region.end})"
+        for region in regions
+    )
+
+
+def _clean_response(response: str, original: str) -> str:
+    text = _CODE_FENCE.sub("", response).strip("\n")
+    if not text.strip():
+        return original
+    # Keep the trailing blank lines of the original so regions stay separated
+    trailing = original[len(original.rstrip("\n")):] or "\n"
+    return text + trailing
+
+
+def _check(content: str, file_path: str) -> Optional[str]:
+    if file_path and not file_path.endswith(".py"):
+        return None
+    try:
+        ast.parse(content)
+    except SyntaxError as e:
+        return f"syntax error at line {e.lineno}: {e.msg}"
+    return None
+
+
+def generate_sharded(
+    file_path: str,
+    content: str,
+    task: str,
+    feature_request: str,
+    analysis_results: str,
+    generate: Callable[[str, str], str],
+    context: str = "",
+    max_workers: Optional[int] = None,
+    max_regions: Optional[int] = None,
+    budget=None,
+) -> ShardedResult:
+    """
+    Applies a task to a large file region by region.
+
+    Args:
+        file_path: Path of the file.
+        content: Current content of the file.
+        task: Task description for the file.
+        feature_request: The feature request.
+        analysis_results: Feature analysis results, passed to every region prompt.
+        generate: Function sending a prompt to the model and returning its answer. It
+            also receives the region's source text, to size the output of the call.
+        context: Retrieved context used to rank regions.
+        max_workers: Number of regions edited in parallel.
+        max_regions: Maximum number of regions edited.
+        budget: Optional ``PromptBudget``, or a function returning the budget of a
+            region prompt from the region's source text. The outline and analysis
+            results are truncated to fit it, never the region.
+
+    Returns:
+        ShardedResult: The stitched content and what happened to each region.
+
+    Raises:
+        PromptTooLargeError: If a selected region does not fit the budget by itself.
+    """
+    if max_workers is None:
+        max_workers = int(os.getenv("REGION_SHARD_WORKERS", str(DEFAULT_WORKERS)))
+    regions = split_regions(content, file_path)
+    targets = select_regions(
+        regions, task, feature_request, f"{context}\n{analysis_results}", max_regions=max_regions
+    )
+    logger.info(
+        f"Region sharding {file_path}: {len(regions)} regions, editing "
+        f"{', '.join(region.name for region in targets) or 'none'}"
+    )
+
+    def edit(region: Region) -> str:
+        fields = {
+            "task": task,
+            "feature_request": feature_request,
+            "file_path": file_path,
+            "outline": _outline(regions, region),
+            "region": region.name,
+            "content": region.text.rstrip("\n"),
+            "analysis_results": analysis_results,
+        }
+        region_budget = budget(region.text) if callable(budget) else budget
+        prompt = _fit_task_prompt(
+            REGION_PROMPT, fields, region_budget, f"Step 7 {file_path} {region.name}"
+        )
+        return _clean_response(generate(prompt, region.text), region.text)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        edited_texts = dict(zip((id(region) for region in targets), executor.map(bind_run_metrics(edit), targets)))
+
+    result = ShardedResult(content=content)
+    texts = [edited_texts.get(id(region), region.text) for region in regions]
+    result.edited = [region.name for region in targets]
+    result.copied = len(regions) - len(targets)
+
+    # Consistency check: definitions of edited regions must survive unless the task removes them
+    removal_requested = any(word in task.lower() for word in _REMOVAL_WORDS)
+    for index, region in enumerate(regions):
+        if id(region) not in edited_texts or removal_requested:
+            continue
+        missing = [name for name in region.defines if not re.search(rf"\b{re.escape(name)}\b", texts[index])]
+        if missing:
+            result.reverted[region.name] = f"edit dropped {', '.join(missing)}"
+            texts[index] = region.text
+
+    error = _check("".join(texts), file_path)
+    for index, region in enumerate(regions):
+        if error is None:
+            break
+        if id(region) in edited_texts and region.name not in result.reverted:
+            texts[index] = region.text
+            result.reverted[region.name] = error
+            error = _check("".join(texts), file_path)
+
+    for name, reason in result.reverted.items():
+        logger.warning(f"Region sharding {file_path}: reverted {name} ({reason})")
+    result.edited = [name for name in result.edited if name not in result.reverted]
+    result.consistent = error is None
+    result.content = "".join(texts)
+    return result
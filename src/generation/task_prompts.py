@@ -1,42 +1,174 @@
 import json
-def generate_task_prompts(json_data: str) -> list:
+import logging
+
+from src.models.token_budget import PromptSection
+
+logger = logging.getLogger(__name__)
+
+EXISTING_FILE_PROMPT = (
+    "You are an expert at writing source code. Perform the following task:\n\n"
+    "Task Request: {task}\n\n"
+    "Feature Request: {feature_request}\n\n"
+    "File Path: {file_path}\n\n"
+    "File Content:\n{content}\n\n"
+    "Analysis Results: {analysis_results}\n\n"
+    "Output ONLY the complete modified source code for the specified file. Do not include comments, explanations, or any other text."
+)
+
+EXISTING_FILE_PATCH_PROMPT = (
+    "You are an expert at writing source code. Perform the following task:\n\n"
+    "Task Request: {task}\n\n"
+    "Feature Request: {feature_request}\n\n"
+    "File Path: {file_path}\n\n"
+    "File Content:\n{content}\n\n"
+    "Analysis Results: {analysis_results}\n\n"
+    "Output ONLY the changes to the specified file as one or more edit blocks in this format:\n"
+    "<<<<<<< SEARCH\n"
+    "exact lines copied from the file, with enough context to be unique\n"
+    "=======\n"
+    "the lines that replace them\n"
+    ">>>>>>> REPLACE\n"
+    "Use an empty SEARCH section to append to the end of the file. "
+    "Do not repeat unchanged parts of the file and do not include explanations or any other text."
+)
+
+NEW_FILE_PROMPT = (
+    "You are an expert at writing source code. Perform the following task:\n\n"
+    "Task Request: Create a new file for {purpose}\n\n"
+    "Feature Request: {feature_request}\n\n"
+    "File Path: {file_path}\n\n"
+    "Analysis Results: {analysis_results}\n\n"
+    "Output ONLY the complete source code for the new file. Do not include comments, explanations, or any other text."
+)
+
+
+class PromptTooLargeError(ValueError):
+    """
+    Raised when a task prompt only fits its budget by truncating the source the
+    model must reproduce.
+    """
+
+
+def _fit_task_prompt(
+    template: str, fields: dict, budget, label: str, truncate_content: bool = False
+) -> str:
+    """
+    Formats a task prompt, shrinking the analysis results (and outline) to the budget.
+
+    The file content is only truncated if ``truncate_content`` is set. A model
+    asked for the complete modified file (or region) would return it without
+    the truncated part, and that would be written over the original.
+
+    Args:
+        template (str): Task prompt template.
+        fields (dict): Values for the template placeholders.
+        budget (PromptBudget): Token budget of the call, or None for no limit.
+        label (str): Name of the call, used in budget log messages.
+        truncate_content (bool): Whether the file content may be truncated (patch mode,
+            where the model only quotes the lines it changes).
+
+    Returns:
+        str: The formatted prompt.
+
+    Raises:
+        PromptTooLargeError: If the prompt does not fit without truncating the content.
+    """
+    if budget is None:
+        return template.format(**fields)
+
+    reducible = {"outline": 20, "analysis_results": 10}
+    if truncate_content:
+        reducible["content"] = 30
+    fixed_fields = {key: ("" if key in reducible else value) for key, value in fields.items()}
+    sections = [PromptSection("instructions", template.format(**fixed_fields), fixed=True)]
+    sections += [
+        PromptSection(key, fields[key], priority=priority)
+        for key, priority in reducible.items()
+        if key in fields
+    ]
+    fitted = budget.fit(sections, label=label)
+    prompt = template.format(**{**fields, **{key: fitted[key] for key in reducible if key in fields}})
+    if not truncate_content and "content" in fields:
+        tokens = budget.counter.count(prompt)
+        if tokens > budget.max_tokens:
+            raise PromptTooLargeError(
+                f"{label} needs {tokens} prompt tokens with the whole file "
+                f"(budget {budget.max_tokens})"
+            )
+    return prompt
+
+
+# Output modes for modification tasks: the whole file, or edit blocks only
+OUTPUT_MODES = ("full", "patch")
+
+
+def generate_task_prompts(json_data: str, budget=None, output_mode: str = "full") -> list:
     """
     Generates prompts for each task based on the provided JSON data.
 
     Args:
         json_data (str): JSON data as a string.
+        budget (PromptBudget): Optional token budget. When given, analysis results
+            are truncated so each prompt fits the model, and file contents too in
+            patch mode. It can also be a function returning the budget of a task
+            from its file entry and whether the file exists, so each prompt leaves
+            room for the output of its own task.
+        output_mode (str): ``"full"`` asks for the complete modified source of
+            existing files; ``"patch"`` asks for SEARCH/REPLACE edit blocks, so
+            output tokens scale with the size of the change. New files are
+            always generated in full.
 
     Returns:
-        list: A list of prompts, one for each task.
+        list: A list of prompts, one for each task. The prompt of an existing file
+            that does not fit in full mode is None: the file must be edited region by
+            region (see ``src.generation.region_sharding``).
     """
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode '{output_mode}'; use one of {', '.join(OUTPUT_MODES)}")
+    existing_file_prompt = EXISTING_FILE_PATCH_PROMPT if output_mode == "patch" else EXISTING_FILE_PROMPT
     data = json.loads(json_data)
     feature_request = data["feature_request"]
     analysis_results = data["analysis_results"]
     prompts = []
 
+    def task_budget(file: dict, existing: bool):
+        return budget(file, existing) if callable(budget) else budget
+
     # Generate prompts for existing files
     for file in data.get("existing_files", []):
-        task_prompt = (
-            f"You are an expert at writing source code. Perform the following task:\n\n"
-            f"Task Request: {file['task']}\n\n"
-            f"Feature Request: {feature_request}\n\n"
-            f"File Path: {file['file_path']}\n\n"
-            f"File Content:\n{file['content']}\n\n"
-            f"Analysis Results: {analysis_results}\n\n"
-            f"Output ONLY the complete modified source code for the specified file. Do not include comments, explanations, or any other text."
-        )
-        prompts.append(task_prompt)
+        fields = {
+            "task": file["task"],
+            "feature_request": feature_request,
+            "file_path": file["file_path"],
+            "content": file["content"],
+            "analysis_results": analysis_results,
+        }
+        try:
+            prompts.append(
+                _fit_task_prompt(
+                    existing_file_prompt,
+                    fields,
+                    task_budget(file, True),
+                    f"Step 7 {file['file_path']}",
+                    truncate_content=output_mode == "patch",
+                )
+            )
+        except PromptTooLargeError as e:
+            logger.warning(f"{e}; editing it region by region")
+            prompts.append(None)
 
     # Generate prompts for new files
     for file in data.get("new_files", []):
-        task_prompt = (
-            f"You are an expert at writing source code. Perform the following task:\n\n"
-            f"Task Request: Create a new file for {file['purpose']}\n\n"
-            f"Feature Request: {feature_request}\n\n"
-            f"File Path: {file['file_path']}\n\n"
-            f"Analysis Results: {analysis_results}\n\n"
-            f"Output ONLY the complete source code for the new file. Do not include comments, explanations, or any other text."
+        fields = {
+            "purpose": file["purpose"],
+            "feature_request": feature_request,
+            "file_path": file["file_path"],
+            "analysis_results": analysis_results,
+        }
+        prompts.append(
+            _fit_task_prompt(
+                NEW_FILE_PROMPT, fields, task_budget(file, False), f"Step 7 {file['file_path']}"
+            )
         )
-        prompts.append(task_prompt)
 
-    return prompts
\ No newline at end of file
+    return prompts
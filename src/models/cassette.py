@@ -0,0 +1,312 @@
+"""
+Record/replay cassettes for LLM traffic.
+
+In record mode every request sent to the LLM backend (the fully formatted
+prompt, which includes the retrieved context, and the decoding parameters) is
+stored with its response and latency in a compact gzip-compressed JSON Lines
+file. Each record is appended as its own gzip member, so recording costs the
+same however large the cassette grows. In replay mode those responses are
+served from the cassette without any network access, optionally with
+simulated latency, so the rest of the pipeline can be benchmarked, regression-tested and load-tested deterministically.
+
+Environment variables:
+    LLM_CASSETTE: Path of the cassette file. Enables cassette mode when set.
+    LLM_CASSETTE_MODE: ``record`` or ``replay`` (default: ``replay``).
+    LLM_CASSETTE_LATENCY: Simulated replay latency (see ``LatencyModel.parse``).
+"""
+
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.models.backends import LLMBackend, set_backend
+from src.models.llm_cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+RECORD = "record"
+REPLAY = "replay"
+
+# Size of the chunks yielded when a replayed response is streamed
+_REPLAY_CHUNK_CHARS = 16
+
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode when a request is not in the cassette.
+    """
+
+
+class LatencyModel:
+    """
+    Simulated latency for replayed responses.
+
+    Supported specifications:
+        ``none``: no delay (default).
+        ``recorded``: the latency measured when the call was recorded.
+        ``recorded*F``: the recorded latency scaled by factor ``F``.
+        ``fixed:S``: a constant delay of ``S`` seconds.
+        ``uniform:A,B``: uniformly distributed between ``A`` and ``B`` seconds.
+        ``normal:MEAN,STD``: normally distributed (truncated at zero).
+        ``lognormal:MU,SIGMA``: log-normally distributed, a good fit for LLM latency.
+    """
+
+    def __init__(self, kind: str = "none", args: Optional[List[float]] = None, seed: Optional[int] = None):
+        self.kind = kind
+        self.args = args or []
+        self._random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec: Optional[str], seed: Optional[int] = None) -> "LatencyModel":
+        """
+        Builds a latency model from a specification string.
+
+        Raises:
+            ValueError: If the specification is not recognised.
+        """
+        spec = (spec or "none").strip().lower()
+        if spec in ("", "none", "0"):
+            return cls("none", seed=seed)
+        if spec == "recorded":
+            return cls("recorded", [1.0], seed=seed)
+        if spec.startswith("recorded*"):
+            return cls("recorded", [float(spec.split("*", 1)[1])], seed=seed)
+
+        kind, _, raw_args = spec.partition(":")
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected:
+            raise ValueError(f"Unknown latency model '{spec}'")
+        args = [float(value) for value in raw_args.split(",") if value.strip()]
+        if len(args) != expected[kind]:
+            raise ValueError(f"Latency model '{kind}' expects {expected[kind]} parameter(s)")
+        return cls(kind, args, seed=seed)
+
+    def sample(self, recorded: float = 0.0) -> float:
+        """
+        Returns a delay in seconds for one replayed call.
+        """
+        if self.kind == "recorded":
+            return max(recorded * self.args[0], 0.0)
+        if self.kind == "fixed":
+            return max(self.args[0], 0.0)
+        if self.kind == "uniform":
+            return self._random.uniform(self.args[0], self.args[1])
+        if self.kind == "normal":
+            return max(self._random.gauss(self.args[0], self.args[1]), 0.0)
+        if self.kind == "lognormal":
+            return self._random.lognormvariate(self.args[0], self.args[1])
+        return 0.0
+
+
+def request_key(prompt: str, params: Dict[str, Any]) -> str:
+    """
+    Returns the cassette key of a backend request.
+    """
+    return make_cache_key("", params, prompt)
+
+
+class Cassette:
+    """
+    In-memory view of a cassette file.
+
+    Attributes:
+        path: Location of the cassette file.
+        entries: Recorded interactions by request key.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.model_id = ""
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "Cassette":
+        """
+        Reads a cassette file.
+
+        Raises:
+            FileNotFoundError: If the cassette does not exist.
+        """
+        cassette = cls(path)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    cassette._read_record(json.loads(line))
+            except (EOFError, json.JSONDecodeError):
+                # A recording interrupted mid-write leaves an incomplete last member
+                logger.warning(f"Ignoring the incomplete last record of cassette '{path}'")
+        return cassette
+
+    def _read_record(self, record: Dict[str, Any]) -> None:
+        if record.get("type") == "header":
+            self.model_id = self.model_id or record.get("model_id", "")
+            return
+        entry = self.entries.get(record["key"])
+        if entry is None:
+            self.entries[record["key"]] = record
+        else:
+            # Repeated requests only record their latency
+            entry["latencies"].extend(record.get("latencies", []))
+
+    def add(self, prompt: str, params: Dict[str, Any], response: str, latency: float, model_id: str) -> None:
+        """
+        Records an interaction and appends it to the cassette file.
+        """
+        key = request_key(prompt, params)
+        latency = round(latency, 4)
+        with self._lock:
+            self.model_id = self.model_id or model_id
+            records = []
+            if not os.path.exists(self.path):
+                header = {"type": "header", "version": CASSETTE_VERSION, "model_id": self.model_id}
+                records.append(header)
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {
+                    "key": key,
+                    "params": params,
+                    "prompt": prompt,
+                    "response": response,
+                    "latencies": [latency],
+                }
+                self.entries[key] = entry
+                records.append(entry)
+            else:
+                entry["latencies"].append(latency)
+                records.append({"key": key, "latencies": [latency]})
+            self._append(records)
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def lookup(self, prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the recorded interaction for a request.
+
+        Raises:
+            CassetteMissError: If the request was not recorded.
+        """
+        entry = self.entries.get(request_key(prompt, params))
+        if entry is None:
+            raise CassetteMissError(
+                f"Request not found in cassette '{self.path}'. "
+                "Re-record it after changing prompts, parameters or the project."
+            )
+        return entry
+
+
+class CassetteBackend(LLMBackend):
+    """
+    Backend that records the traffic of another backend or replays a cassette.
+
+    Attributes:
+        mode: ``record`` or ``replay``.
+        cassette: The cassette being recorded or replayed.
+        latency: Simulated latency used in replay mode.
+    """
+
+    name = "cassette"
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = REPLAY,
+        inner: Optional[LLMBackend] = None,
+        latency: Optional[LatencyModel] = None,
+    ):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode '{mode}'; use 'record' or 'replay'")
+        if mode == RECORD and inner is None:
+            raise ValueError("Record mode needs a backend to record")
+
+        if mode == REPLAY:
+            self.cassette = Cassette.load(path)
+        elif os.path.exists(path):
+            # Keep earlier recordings so a cassette can be extended over several runs
+            self.cassette = Cassette.load(path)
+        else:
+            self.cassette = Cassette(path)
+
+        super().__init__(inner.model_id if inner else self.cassette.model_id or "cassette")
+        self.mode = mode
+        self.inner = inner
+        self.latency = latency or LatencyModel()
+        self._replay_counts: Dict[str, itertools.count] = {}
+        self._lock = threading.Lock()
+
+    def _replay_delay(self, entry: Dict[str, Any]) -> float:
+        latencies = entry.get("latencies") or [0.0]
+        with self._lock:
+            counter = self._replay_counts.setdefault(entry["key"], itertools.count())
+            index = next(counter)
+        return self.latency.sample(latencies[index % len(latencies)])
+
+    def generate(self, prompt: str, params: Dict[str, Any]) -> str:
+        if self.mode == REPLAY:
+            entry = self.cassette.lookup(prompt, params)
+            delay = self._replay_delay(entry)
+            if delay:
+                time.sleep(delay)
+            return entry["response"]
+
+        started = time.monotonic()
+        response = self.inner.generate(prompt, params)
+        self.cassette.add(prompt, params, response, time.monotonic() - started, self.model_id)
+        return response
+
+    def stream(self, prompt: str, params: Dict[str, Any]) -> Iterator[str]:
+        if self.mode == REPLAY:
+            entry = self.cassette.lookup(prompt, params)
+            response = entry["response"]
+            chunks = [
+                response[start:start + _REPLAY_CHUNK_CHARS]
+                for start in range(0, len(response), _REPLAY_CHUNK_CHARS)
+            ] or [""]
+            delay = self._replay_delay(entry) / len(chunks)
+            for chunk in chunks:
+                if delay:
+                    time.sleep(delay)
+                yield chunk
+            return
+
+        started = time.monotonic()
+        parts = []
+        for chunk in self.inner.stream(prompt, params):
+            parts.append(chunk)
+            yield chunk
+        self.cassette.add(prompt, params, "".join(parts), time.monotonic() - started, self.model_id)
+
+
+def use_cassette(
+    path: str,
+    mode: str = REPLAY,
+    latency: Optional[str] = None,
+    inner: Optional[LLMBackend] = None,
+) -> CassetteBackend:
+    """
+    Installs a cassette backend as the process-wide LLM backend.
+
+    Args:
+        path: Cassette file to record to or replay from.
+        mode: ``record`` or ``replay``.
+        latency: Simulated replay latency specification (see ``LatencyModel``).
+        inner: Backend to record. Required in record mode.
+
+    Returns:
+        CassetteBackend: The installed backend.
+    """
+    backend = CassetteBackend(path, mode=mode, inner=inner, latency=LatencyModel.parse(latency))
+    set_backend(backend)
+    logger.info(f"LLM cassette {mode} mode: {path} ({len(backend.cassette.entries)} entries)")
+    return backend
@@ -0,0 +1,341 @@
+"""
+Persistent, content-addressed cache for LLM responses.
+
+``query_llm`` uses greedy decoding, so the same model, decoding parameters,
+prompt and retrieved context always produce the same completion. This module
+stores those completions on disk so that re-running the pipeline after a late
+failure does not pay for the earlier LLM calls again.
+
+Entries are keyed by a SHA-256 digest of the model id, the decoding parameters,
+the fully formatted prompt and a hash of the retrieved context. The cache is
+bounded in size; when it grows past ``max_bytes`` the least recently used
+entries are evicted.
+
+Environment variables:
+    LLM_CACHE: Set to ``off`` (or ``0``/``false``) to bypass the cache entirely.
+    LLM_CACHE_REFRESH: Set to ``1`` to ignore existing entries and overwrite them.
+    LLM_CACHE_DIR: Directory where entries are stored (default: ``.llm_cache``).
+    LLM_CACHE_MAX_BYTES: Maximum size of the cache on disk (default: 512 MiB).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = ".llm_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+_FALSE_VALUES = {"0", "off", "false", "no"}
+_TRUE_VALUES = {"1", "on", "true", "yes"}
+
+
+def hash_context(documents: Optional[Iterable[Any]]) -> str:
+    """
+    Computes a stable hash of retrieved context documents.
+
+    Args:
+        documents: Retrieved documents. Items may be LangChain ``Document``
+            objects (``page_content``/``metadata``) or plain strings.
+
+    Returns:
+        str: Hex digest of the documents in retrieval order, or an empty
+        string if there is no context.
+    """
+    if not documents:
+        return ""
+
+    digest = hashlib.sha256()
+    for doc in documents:
+        content = getattr(doc, "page_content", doc)
+        metadata = getattr(doc, "metadata", None) or {}
+        digest.update(str(metadata.get("source", "")).encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(str(content).encode("utf-8"))
+        digest.update(b"\x01")
+    return digest.hexdigest()
+
+
+def make_cache_key(
+    model_id: str,
+    params: Dict[str, Any],
+    formatted_prompt: str,
+    context_hash: str = "",
+) -> str:
+    """
+    Builds the content address of an LLM call.
+
+    Args:
+        model_id: Identifier of the model that serves the call.
+        params: Decoding parameters passed to the model.
+        formatted_prompt: The fully formatted prompt sent to the model.
+        context_hash: Hash of the retrieved context (see ``hash_context``).
+
+    Returns:
+        str: Hex digest identifying the call.
+    """
+    payload = json.dumps(
+        {
+            "model_id": model_id,
+            "params": params,
+            "prompt": formatted_prompt,
+            "context": context_hash,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Disk-backed LLM response cache with size-based LRU eviction.
+
+    Each entry is a small JSON file stored under ``<cache_dir>/<key[:2]>/``.
+    Reads refresh the entry's modification time, which is used as the
+    recency signal for eviction.
+
+    Attributes:
+        cache_dir: Directory holding the cache entries.
+        max_bytes: Size budget of the cache on disk.
+        enabled: When False the cache is bypassed (no reads, no writes).
+        refresh: When True existing entries are ignored and overwritten.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        enabled: bool = True,
+        refresh: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0}
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached response.
+
+        Args:
+            key: Cache key produced by ``make_cache_key``.
+
+        Returns:
+            Optional[str]: The cached response, or None on a miss, when the
+            cache is disabled, or when refresh mode is active.
+        """
+        if not self.enabled:
+            self._count("bypassed")
+            return None
+        if self.refresh:
+            self._count("misses")
+            return None
+
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return entry.get("response")
+
+    def put(self, key: str, response: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Stores a response and evicts old entries if the cache is over budget.
+
+        Args:
+            key: Cache key produced by ``make_cache_key``.
+            response: The model response to store.
+            metadata: Optional extra fields saved alongside the response.
+        """
+        if not self.enabled:
+            return
+
+        entry = {"key": key, "created": time.time(), "response": response}
+        if metadata:
+            entry.update(metadata)
+        data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write LLM cache entry {key[:12]}: {e}")
+            return
+
+        with self._lock:
+            self._stats["writes"] += 1
+            if self._size is not None:
+                self._size += len(data) - previous
+        self.evict()
+
+    def _scan(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cache entries on disk, in bytes.
+        """
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            return self._size
+
+    def evict(self) -> int:
+        """
+        Removes least recently used entries until the cache fits ``max_bytes``.
+
+        Returns:
+            int: Number of evicted entries.
+        """
+        if self.size() <= self.max_bytes:
+            return 0
+
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._size = total
+            self._stats["evictions"] += evicted
+        if evicted:
+            logger.info(f"LLM cache evicted {evicted} entries ({total} bytes remaining)")
+        return evicted
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the cache.
+        """
+        for _, _, path in self._scan():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit/miss accounting since the last ``reset_stats`` call.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self) -> None:
+        """
+        Resets the hit/miss counters.
+        """
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in _FALSE_VALUES:
+        return False
+    if value in _TRUE_VALUES:
+        return True
+    return default
+
+
+_default_cache: Optional[LLMResponseCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> LLMResponseCache:
+    """
+    Returns the process-wide cache, creating it from the environment on first use.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMResponseCache(
+                cache_dir=os.getenv("LLM_CACHE_DIR", DEFAULT_CACHE_DIR),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+                enabled=_env_flag("LLM_CACHE", True),
+                refresh=_env_flag("LLM_CACHE_REFRESH", False),
+            )
+        return _default_cache
+
+
+def configure_cache(
+    enabled: Optional[bool] = None,
+    refresh: Optional[bool] = None,
+    cache_dir: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+) -> LLMResponseCache:
+    """
+    Overrides settings of the process-wide cache (e.g. from CLI flags).
+
+    Args:
+        enabled: Enable or bypass the cache.
+        refresh: Ignore and overwrite existing entries.
+        cache_dir: Directory where entries are stored.
+        max_bytes: Size budget of the cache on disk.
+
+    Returns:
+        LLMResponseCache: The configured process-wide cache.
+    """
+    cache = get_default_cache()
+    if enabled is not None:
+        cache.enabled = enabled
+    if refresh is not None:
+        cache.refresh = refresh
+    if cache_dir is not None and cache_dir != cache.cache_dir:
+        cache.cache_dir = cache_dir
+        cache._size = None
+    if max_bytes is not None:
+        cache.max_bytes = max_bytes
+    return cache
@@ -1,20 +1,42 @@
 # llm_inference.py
-import os
+import itertools
+import logging
 from dotenv import load_dotenv
-from langchain.chains import RetrievalQA
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_ibm import WatsonxLLM
-from chromadb import PersistentClient
-import torch
-
-# Load credentials from .env file
+
+from src.models.backends import WatsonxBackend, get_backend
+from src.models.llm_cache import get_default_cache, hash_context, make_cache_key
+from src.models.output_governor import (
+    MIN_OUTPUT_TOKENS,
+    continue_prompt,
+    is_truncated,
+    record_call,
+    record_truncation,
+)
+from src.models.resilience import resilient_call
+from src.models.token_budget import PROMPT_OVERHEAD_TOKENS, get_context_window, get_token_counter
+from src.utils.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Load credentials from .env file. They are validated when a backend is
+# created, so this module can be imported without them (e.g. offline).
 load_dotenv()
-WATSONX_APIKEY = os.getenv("WATSONX_APIKEY")
-PROJECT_ID = os.getenv("PROJECT_ID")
 
-if not WATSONX_APIKEY or not PROJECT_ID:
-    raise ValueError("API key or Project ID is missing. Please check your .env file.")
+# Model and decoding parameters used by query_llm and stream_llm
+MODEL_ID = "meta-llama/llama-3-70b-instruct"
+MAX_NEW_TOKENS = 900
+MIN_NEW_TOKENS = 50
+DECODING_METHOD = "greedy"
+TEMPERATURE = 0.2  # Lowered for factual and concise responses
+
+# Prompt of LangChain's "stuff" RetrievalQA chain, used for vector_db queries
+RETRIEVAL_QA_PROMPT = (
+    "Use the following pieces of context to answer the question at the end. "
+    "If you don't know the answer, just say that you don't know, don't try to make up an answer.\n\n"
+    "{context}\n\n"
+    "Question: {question}\n"
+    "Helpful Answer:"
+)
 
 def generate_prompt(user_input, grounding=None, system_message="You are a helpful assistant that avoids causing harm. When you do not know the answer to a question, you say 'I don't know'."):
     """
@@ -39,16 +61,13 @@ def get_lang_chain_model(model_type, max_tokens, min_tokens, decoding_method, te
     """
     Initializes and returns a WatsonxLLM instance with the specified parameters.
     """
-    return WatsonxLLM(
-        model_id=model_type,
-        url="https://eu-gb.ml.cloud.ibm.com",
-        project_id=PROJECT_ID,
-        params={
+    return WatsonxBackend(model_type).get_model(
+        {
             "max_new_tokens": max_tokens,
             "min_new_tokens": min_tokens,
             "decoding_method": decoding_method,
             "temperature": temperature,
-        },
+        }
     )
 
 # Answer questions using a vector database
@@ -56,6 +75,12 @@ def answer_questions_from_dataframe(question, collection_name, persist_directory
     """
     Answers a question using a LangChain model and retrieves relevant documents from a Chroma collection.
     """
+    from chromadb import PersistentClient
+    import torch
+    from langchain.chains import RetrievalQA
+    from langchain_chroma import Chroma
+    from langchain_huggingface import HuggingFaceEmbeddings
+
     # Specify model parameters
     model_type = "meta-llama/llama-3-1-70b-instruct"
     max_tokens = 300
@@ -111,94 +136,254 @@ def answer_questions_from_dataframe(question, collection_name, persist_directory
 
 # Query the LLM directly
 
-def query_llm(user_input, vector_db=None, grounding=None,system_message=None):
+def get_model_params(max_new_tokens=None, output=None):
+    """
+    Returns the decoding parameters used by query_llm and stream_llm.
+
+    :param max_new_tokens: Optional. Output token limit overriding MAX_NEW_TOKENS.
+    :param output: Optional. OutputBudget setting the token limits and stop sequences.
+    """
+    params = {
+        "max_new_tokens": max_new_tokens or MAX_NEW_TOKENS,
+        "min_new_tokens": MIN_NEW_TOKENS,
+        "decoding_method": DECODING_METHOD,
+        "temperature": TEMPERATURE,
+    }
+    if output is not None:
+        params.update(output.params())
+    return params
+
+def _fit_output(output, model_prompt):
+    """
+    Shrinks an output budget so the prompt and the response fit the context window.
+    """
+    if output is None:
+        return None
+    prompt_tokens = get_token_counter(MODEL_ID).count(model_prompt) + PROMPT_OVERHEAD_TOKENS
+    return output.fit_context(prompt_tokens, get_context_window())
+
+def _continue_truncated(backend, model_prompt, text, output, stream=False):
+    """
+    Continues a response that was cut off by its token limit.
+
+    Yields the text of each continuation (streamed in chunks if ``stream``)
+    until the response is complete, the budget's continuations are used up or
+    the context window is full. Each continuation resends the prompt and the
+    partial response and is limited to ``output.continuation_tokens``.
+    Truncations and continuations are counted in the output governor's
+    statistics.
+    """
+    if output is None:
+        return
+    record_call(output)
+    budget = _fit_output(output, model_prompt)
+    continuations = 0
+    piece = text
+    # Only the latest piece is measured against the token limit of its call
+    while is_truncated(piece, budget, MODEL_ID):
+        prompt = continue_prompt(model_prompt, text)
+        available = get_context_window() - PROMPT_OVERHEAD_TOKENS - get_token_counter(MODEL_ID).count(prompt)
+        if continuations >= output.max_continuations or available < MIN_OUTPUT_TOKENS:
+            if continuations >= output.max_continuations:
+                reason = "no continuations left"
+            else:
+                reason = "context window full"
+            logger.warning(
+                f"{output.task_type} response still truncated after {continuations} "
+                f"continuations ({reason})"
+            )
+            record_truncation(continued=False)
+            return
+        record_truncation(continued=True)
+        continuations += 1
+        budget = _fit_output(output.for_continuation(), prompt)
+        params = get_model_params(output=budget)
+        logger.info(
+            f"{output.task_type} response truncated, requesting continuation {continuations} "
+            f"({budget.max_new_tokens} tokens)"
+        )
+        if stream:
+            piece = ""
+            for chunk in backend.stream(prompt, params):
+                piece += chunk
+                yield chunk
+        else:
+            piece = resilient_call(lambda: backend.generate(prompt, params))
+            yield piece
+        if not piece.strip():
+            return
+        text += piece
+
+def _build_prompt(user_input, vector_db=None, grounding=None, system_message=None):
+    """
+    Builds the prompt of a query_llm or stream_llm call, retrieving from the vector database.
+
+    Documents are retrieved for the formatted prompt and stuffed into
+    RETRIEVAL_QA_PROMPT, as LangChain's RetrievalQA chain did. They are
+    retrieved up front so that the retrieved context can be part of the cache key.
+
+    :return: The formatted prompt, the prompt sent to the model and the hash of the
+        retrieved context ("" without a vector database).
+    """
+    formatted_prompt = generate_prompt(user_input, grounding, system_message)
+    if not vector_db:
+        return formatted_prompt, formatted_prompt, ""
+    retriever = vector_db.as_retriever(search_kwargs={"k": 5})
+    documents = retriever.invoke(formatted_prompt)
+    model_prompt = RETRIEVAL_QA_PROMPT.format(
+        context="\n\n".join(doc.page_content for doc in documents),
+        question=formatted_prompt,
+    )
+    return formatted_prompt, model_prompt, hash_context(documents)
+
+def _task_type(output):
+    """
+    Returns the metrics name of a call: the task type of its output budget.
+    """
+    return output.task_type if output is not None else "default"
+
+def _record_llm_metrics(span, model_prompt, result, cached):
     """
-    Queries the WatsonxLLM model. If a vector database is provided, it performs
+    Adds the token counts of an LLM call to its metrics span and counters.
+
+    Tokens of cached responses are only recorded on the span; the counters
+    total the tokens actually sent to and generated by the backend.
+    """
+    counter = get_token_counter(MODEL_ID)
+    prompt_tokens = counter.count(model_prompt)
+    completion_tokens = counter.count(result)
+    span.set(cached=cached, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    metrics = get_metrics()
+    metrics.count("llm_calls", task_type=span.name, cached=str(cached).lower())
+    if not cached:
+        metrics.count("llm_prompt_tokens", prompt_tokens, task_type=span.name)
+        metrics.count("llm_completion_tokens", completion_tokens, task_type=span.name)
+
+def query_llm(user_input, vector_db=None, grounding=None,system_message=None, use_cache=True, stream=False, max_new_tokens=None, output=None):
+    """
+    Queries the configured LLM backend (WatsonX by default, see
+    ``src.models.backends``). If a vector database is provided, it performs
     a retrieval-augmented generation. Otherwise, it performs a simple inference.
 
+    Responses of greedy calls are served from the persistent LLM cache
+    (see ``src.models.llm_cache``) when the same model, parameters, prompt and
+    retrieved context have been seen before.
+
     :param user_input: The user-provided input for the model.
     :param vector_db: Optional. The vector database object for retrieval-augmented generation.
     :param grounding: Optional. Contextual grounding information to improve the response.
     :param system_message: Optional.The system-level instruction for the assistant.    
-    :return: The response from the model as a string.
+    :param use_cache: Optional. Set to False to bypass the response cache for this call.
+    :param stream: Optional. If True, return a generator of text chunks (see ``stream_llm``).
+    :param max_new_tokens: Optional. Output token limit for this call (default: MAX_NEW_TOKENS).
+    :param output: Optional. OutputBudget (see ``src.models.output_governor``) with the
+        token limits and stop sequences of this call. Truncated responses are continued.
+    :return: The response from the model as a string, or a chunk generator when streaming.
     """
+    if stream:
+        return stream_llm(user_input, vector_db, grounding, system_message, use_cache, max_new_tokens, output)
+
     try:
-        # Debug: Log the initial prompt and vector_db state
-        print(f"Debug: Received prompt: {user_input}")
-        print(f"Debug: Vector DB provided: {bool(vector_db)}")
-
-        # Specify model parameters
-        model_type = "meta-llama/llama-3-70b-instruct"
-        max_tokens = 900
-        min_tokens = 50
-        decoding_method = "greedy"
-        temperature = 0.2  # Lowered for factual and concise responses
-
-        # Generate the formatted prompt
-        formatted_prompt = (
-            f"<|begin_of_text|><|start_header_id|>system<|end_header_id|>\n"
-            f"You are a helpful assistant that answers concisely. If unsure, say 'I don't know.'<|eot_id|>\n"
-            f"<|start_header_id|>user<|end_header_id|>\n{user_input}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n"
-        )
+        with get_metrics().span(_task_type(output), kind="llm") as span:
+            logger.debug(f"Received prompt (vector DB: {bool(vector_db)}): {user_input}")
+            backend = get_backend(MODEL_ID)
+            formatted_prompt, model_prompt, context_hash = _build_prompt(
+                user_input, vector_db, grounding, system_message
+            )
 
-        # Generate the formatted prompt
-        formatted_prompt = generate_prompt(user_input, grounding,system_message)        
+            logger.debug(f"Formatted prompt:\n{formatted_prompt}")
+            params = get_model_params(max_new_tokens, _fit_output(output, model_prompt))
 
-        # Debug: Log the formatted prompt
-        print(f"Debug: Formatted prompt:\n{formatted_prompt}")
+            # Only deterministic (greedy) completions are safe to reuse
+            cache = get_default_cache()
+            cacheable = use_cache and DECODING_METHOD == "greedy"
+            cache_key = make_cache_key(backend.model_id, params, formatted_prompt, context_hash)
+            if cacheable:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("Returning cached response")
+                    _record_llm_metrics(span, model_prompt, cached, cached=True)
+                    return cached
 
-        # Initialize the WatsonxLLM model
-        model = get_lang_chain_model(model_type, max_tokens, min_tokens, decoding_method, temperature)
+            response = resilient_call(lambda: backend.generate(model_prompt, params))
+            response += "".join(_continue_truncated(backend, model_prompt, response, output))
 
-        if vector_db:
-            # Retrieval-augmented generation
-            retriever = vector_db.as_retriever(search_kwargs={"k": 5})
-            qa = RetrievalQA.from_chain_type(
-                llm=model,
-                chain_type="stuff",
-                retriever=retriever,
-            )
+            logger.debug(f"Raw response from {backend.name} backend: {response}")
 
-            # Debug: Log that we're using vector DB
-            print("Debug: Querying using vector database...")
-            try:
-                response = qa.invoke({"query": formatted_prompt})
-                # Debug: Log the raw response from vector DB
-                print(f"Debug: Raw response from vector DB: {response}")
-                #return response
-                # Extract only the LLM result
-                if isinstance(response, dict) and "result" in response:
-                    result = response["result"].strip()
-                    # Debug: Log the extracted result
-                    print(f"Debug: Extracted result: {result}")
-                    return result
-                else:
-                    raise ValueError(f"Unexpected response format: {response}")
-            except:
-                raise ValueError(f"Unexpected response type from vector DB: {response}")
-        else:
-            # Simple inference without vector database
-            print("Debug: Querying without vector database...")
-            response = model.invoke(formatted_prompt)
-
-            # Debug: Log the raw response
-            print(f"Debug: Raw response from model: {response}")
-
-            # Handle the response format
-            if isinstance(response, dict):
-                result = response.get("result") or response.get("text", "").strip()
-                if not result:
-                    raise ValueError("No 'result' or 'text' key found in response.")
-                # Debug: Log the extracted result
-                print(f"Debug: Extracted result from response: {result}")
-                return result
-            elif isinstance(response, str):
-                # Debug: Log the string response
-                print(f"Debug: Response as string: {response.strip()}")
-                return response.strip()
-            else:
-                raise ValueError(f"Unexpected response type from model: {type(response)}")
+            result = response.strip()
+            if not result:
+                raise ValueError(f"Empty response from {backend.name} backend.")
+
+            if cacheable:
+                cache.put(cache_key, result, {"model_id": backend.model_id})
+            _record_llm_metrics(span, model_prompt, result, cached=False)
+            return result
     except Exception as e:
-        # Debug: Log the exception
-        print(f"Debug: Exception occurred: {e}")
+        logger.debug(f"Model query failed: {e}")
         raise RuntimeError(f"Error during model querying: {e}")
+
+
+def stream_llm(user_input, vector_db=None, grounding=None, system_message=None, use_cache=True, max_new_tokens=None, output=None):
+    """
+    Streams the completion of the configured LLM backend as it is generated.
+
+    The prompt, retrieval and cache key are the same as query_llm's for the same
+    call. Cached responses are yielded as a single chunk, and streamed
+    completions are stored in the cache once they finish.
+
+    :param user_input: The user-provided input for the model.
+    :param vector_db: Optional. The vector database object for retrieval-augmented generation.
+    :param grounding: Optional. Contextual grounding information to improve the response.
+    :param system_message: Optional. The system-level instruction for the assistant.
+    :param use_cache: Optional. Set to False to bypass the response cache for this call.
+    :param max_new_tokens: Optional. Output token limit for this call (default: MAX_NEW_TOKENS).
+    :param output: Optional. OutputBudget with the token limits and stop sequences of this call.
+    :return: A generator yielding text chunks of the response.
+    """
+    try:
+        with get_metrics().span(_task_type(output), kind="llm", stream=True) as span:
+            backend = get_backend(MODEL_ID)
+            formatted_prompt, model_prompt, context_hash = _build_prompt(
+                user_input, vector_db, grounding, system_message
+            )
+            params = get_model_params(max_new_tokens, _fit_output(output, model_prompt))
+
+            cache = get_default_cache()
+            cacheable = use_cache and DECODING_METHOD == "greedy"
+            cache_key = make_cache_key(backend.model_id, params, formatted_prompt, context_hash)
+            if cacheable:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    _record_llm_metrics(span, model_prompt, cached, cached=True)
+                    yield cached
+                    return
+
+            def open_stream():
+                # Retries only cover the request up to its first chunk
+                iterator = iter(backend.stream(model_prompt, params))
+                return iterator, next(iterator, None)
+
+            iterator, first = resilient_call(open_stream, hedge=False)
+            stream = iterator if first is None else itertools.chain([first], iterator)
+
+            chunks = []
+            for text in stream:
+                # Drop leading whitespace so the stream matches the stripped query_llm result
+                if not chunks:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                chunks.append(text)
+                yield text
+            for text in _continue_truncated(backend, model_prompt, "".join(chunks), output, stream=True):
+                chunks.append(text)
+                yield text
+
+            result = "".join(chunks).strip()
+            if not result:
+                raise ValueError("Empty response from model stream.")
+            if cacheable:
+                cache.put(cache_key, result, {"model_id": backend.model_id})
+            _record_llm_metrics(span, model_prompt, result, cached=False)
+    except Exception as e:
+        raise RuntimeError(f"Error during model streaming: {e}")
@@ -0,0 +1,225 @@
+"""
+Adaptive output-length governor for LLM calls.
+
+A single ``max_new_tokens``/``min_new_tokens`` pair for every call makes
+analyses pad to the minimum and cuts long file rewrites off. ``OutputBudget``
+describes the output of one call: its token limit derived from the task type
+and the size of the file being written, stop sequences that end the call as
+soon as the answer is complete, and how many times a truncated answer may be
+continued.
+
+``query_llm``/``stream_llm`` use ``continue_prompt`` and ``is_truncated`` to
+detect responses that hit the token limit and ask the model to continue where
+it stopped. A continuation resends the prompt and the partial answer, so each
+one is given its own, smaller limit (``continuation_tokens``), and prompts are
+fitted against ``reserved_tokens``: the response plus its continuations.
+Truncations and continuations are counted in ``output_stats``.
+
+Environment variables:
+    LLM_MAX_OUTPUT_TOKENS: Upper limit of any output budget (default: 4096).
+    LLM_MAX_CONTINUATIONS: Continuations allowed per call (default: 2).
+"""
+
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+from src.models.token_budget import get_token_counter
+
+DEFAULT_MAX_OUTPUT_TOKENS = 4096
+DEFAULT_MAX_CONTINUATIONS = 2
+
+# Closing code fence: ends a fenced plan or source file
+FENCE_STOP = "\n```\n"
+
+# Smallest output budget worth requesting (also used for continuations)
+MIN_OUTPUT_TOKENS = 64
+
+# A response within this fraction of its limit is considered cut off
+TRUNCATION_RATIO = 0.97
+
+# Each continuation may add this fraction (1/n) of the response's token limit
+CONTINUATION_FRACTION = 4
+
+TASK_TYPES = ("analysis", "plan", "code", "patch", "new_file", "default")
+
+
+@dataclass(frozen=True)
+class OutputBudget:
+    """
+    Output limits of a single LLM call.
+
+    Attributes:
+        task_type: Kind of call, used in metrics.
+        max_new_tokens: Token limit of the response.
+        min_new_tokens: Minimum response length (0 lets the model stop when done).
+        stop_sequences: Sequences that end the response.
+        max_continuations: How many times a truncated response is continued.
+        continuation_tokens: Token limit of each continuation (default: ``max_new_tokens``).
+    """
+
+    task_type: str
+    max_new_tokens: int
+    min_new_tokens: int = 0
+    stop_sequences: tuple = ()
+    max_continuations: int = DEFAULT_MAX_CONTINUATIONS
+    continuation_tokens: int = 0
+
+    def reserved_tokens(self) -> int:
+        """
+        Returns the tokens to leave free after the prompt: the response and its continuations.
+        """
+        return self.max_new_tokens + self.max_continuations * self.continuation_limit()
+
+    def continuation_limit(self) -> int:
+        """
+        Returns the token limit of each continuation.
+        """
+        return self.continuation_tokens or self.max_new_tokens
+
+    def for_continuation(self) -> "OutputBudget":
+        """
+        Returns the budget of one continuation of a truncated response.
+        """
+        limit = self.continuation_limit()
+        return replace(self, max_new_tokens=limit, min_new_tokens=0)
+
+    def params(self) -> Dict[str, object]:
+        """
+        Returns the decoding parameters controlled by the budget.
+        """
+        params: Dict[str, object] = {
+            "max_new_tokens": self.max_new_tokens,
+            "min_new_tokens": self.min_new_tokens,
+        }
+        if self.stop_sequences:
+            params["stop_sequences"] = list(self.stop_sequences)
+        return params
+
+    def fit_context(self, prompt_tokens: int, context_window: int) -> "OutputBudget":
+        """
+        Lowers the token limit so prompt and response fit the context window.
+        """
+        available = max(context_window - prompt_tokens, MIN_OUTPUT_TOKENS)
+        if self.max_new_tokens <= available:
+            return self
+        return replace(self, max_new_tokens=available, min_new_tokens=min(self.min_new_tokens, available))
+
+
+def _max_output_tokens() -> int:
+    return int(os.getenv("LLM_MAX_OUTPUT_TOKENS", str(DEFAULT_MAX_OUTPUT_TOKENS)))
+
+
+def output_budget(
+    task_type: str,
+    source_text: str = "",
+    model_id: Optional[str] = None,
+    max_new_tokens: Optional[int] = None,
+) -> OutputBudget:
+    """
+    Derives the output budget of a call from its task type and the size of its source.
+
+    Args:
+        task_type: ``analysis``, ``plan``, ``code`` (rewrite of ``source_text``),
+            ``patch`` (edit blocks for ``source_text``), ``new_file`` or ``default``.
+        source_text: The file or region being rewritten, for ``code`` and ``patch``.
+        model_id: Model whose tokenizer measures ``source_text``.
+        max_new_tokens: Explicit token limit overriding the derived one.
+
+    Returns:
+        OutputBudget: The budget for the call.
+
+    Raises:
+        ValueError: If the task type is unknown.
+    """
+    if task_type not in TASK_TYPES:
+        raise ValueError(f"Unknown task type '{task_type}'; use one of {', '.join(TASK_TYPES)}")
+    continuations = int(os.getenv("LLM_MAX_CONTINUATIONS", str(DEFAULT_MAX_CONTINUATIONS)))
+    source_tokens = get_token_counter(model_id or "").count(source_text) if source_text else 0
+
+    if task_type == "analysis":
+        # Analyses are prose: no padding, no continuation beyond one
+        tokens, minimum, stops, continuations = 700, 0, (), min(continuations, 1)
+    elif task_type == "plan":
+        tokens, minimum, stops = 1200, 0, (FENCE_STOP,)
+    elif task_type == "code":
+        # A rewrite is about as long as its source, plus room for the change
+        tokens, minimum, stops = int(source_tokens * 1.25) + 256, 0, (FENCE_STOP,)
+    elif task_type == "patch":
+        tokens, minimum, stops = int(source_tokens * 0.5) + 256, 0, ()
+    elif task_type == "new_file":
+        tokens, minimum, stops = 1500, 0, (FENCE_STOP,)
+    else:
+        tokens, minimum, stops = 900, 50, ()
+
+    if max_new_tokens:
+        tokens = max_new_tokens
+    tokens = max(MIN_OUTPUT_TOKENS, min(tokens, _max_output_tokens()))
+    # Continuations finish an answer that overran its estimate by a little
+    continuation_tokens = max(MIN_OUTPUT_TOKENS, tokens // CONTINUATION_FRACTION)
+    return OutputBudget(task_type, tokens, minimum, stops, continuations, continuation_tokens)
+
+
+def is_truncated(text: str, budget: OutputBudget, model_id: Optional[str] = None) -> bool:
+    """
+    Returns True if ``text`` looks cut off by the token limit.
+
+    Backends only return text, so a response counts as truncated when it used
+    (nearly) all of its tokens and does not end with a stop sequence.
+    """
+    stripped = text.rstrip()
+    balanced = stripped.count("```") % 2 == 0
+    for stop in budget.stop_sequences:
+        if stop.strip() and stripped.endswith(stop.strip()) and balanced:
+            return False
+    used = get_token_counter(model_id or "").count(text)
+    return used >= budget.max_new_tokens * TRUNCATION_RATIO
+
+
+def continue_prompt(model_prompt: str, partial: str) -> str:
+    """
+    Returns the prompt asking the model to continue ``partial``.
+
+    The partial answer is appended after the assistant header of the original
+    prompt, so the model resumes exactly where it stopped.
+    """
+    return model_prompt + partial
+
+
+_stats: Dict[str, object] = {"calls": {}, "truncations": 0, "continuations": 0, "unrecovered": 0}
+_stats_lock = threading.Lock()
+
+
+def record_call(budget: OutputBudget) -> None:
+    """
+    Counts a call governed by ``budget``.
+    """
+    with _stats_lock:
+        _stats["calls"][budget.task_type] = _stats["calls"].get(budget.task_type, 0) + 1
+
+
+def record_truncation(continued: bool) -> None:
+    """
+    Counts a truncated response, and whether it was continued or left truncated.
+    """
+    with _stats_lock:
+        _stats["truncations"] += 1
+        _stats["continuations" if continued else "unrecovered"] += 1
+
+
+def output_stats() -> Dict[str, object]:
+    """
+    Returns the governor's counters: calls per task type, truncations detected,
+    continuations requested and responses left truncated.
+    """
+    with _stats_lock:
+        return {**_stats, "calls": dict(_stats["calls"])}
+
+
+def reset_output_stats() -> None:
+    """
+    Resets the governor's counters.
+    """
+    with _stats_lock:
+        _stats.update({"calls": {}, "truncations": 0, "continuations": 0, "unrecovered": 0})
@@ -105,6 +105,23 @@ def get_prompt_template(stage: str):
             "Project Context: {project_context}\n\n"
             "Include risks, suggestions for modular implementation, and expected changes."
         ),
+        "feature_analysis_combined": (
+            "Analyze the project context for the following feature request and produce, in a single answer, "
+            "the impacted nodes, the impacted dependencies (edges) and an impact report:\n\n"
+            "Feature Request: {feature_request}\n\n"
+            "Project Context: {project_context}\n\n"
+            "- nodes: the files or components impacted by the feature request and their roles in the project.\n"
+            "- edges: the impacted dependencies between components and their significance.\n"
+            "- impact_report: risks, suggestions for modular implementation, and expected changes.\n\n"
+            "Output ONLY a JSON object with the following format:\n\n"
+            "```json\n"
+            "{{\n"
+            "  \"nodes\": [\"path/to/file.extension: role of the file\"],\n"
+            "  \"edges\": [\"component A -> component B: significance\"],\n"
+            "  \"impact_report\": \"Detailed impact report\"\n"
+            "}}\n"
+            "```"
+        ),
         "preprocessing_step": (
             "Using the results of the feature analysis, identify the specific files to be handled for the following feature request:\n\n"
             "Feature Request: {feature_request}\n\n"
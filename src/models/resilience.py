@@ -0,0 +1,424 @@
+"""
+Resilience layer for LLM calls.
+
+Wraps model invocations with:
+
+- jittered exponential backoff for transient errors (timeouts, connection
+  errors, HTTP 429/5xx), honouring ``Retry-After`` on rate-limit responses
+  (a call whose ``Retry-After`` exceeds the maximum delay fails instead);
+- optional hedged requests: when a call runs longer than a latency percentile
+  of recent calls, a duplicate is launched and the first success wins;
+- a circuit breaker shared by every caller in the process, so concurrent
+  sessions (e.g. several Gradio users) stop hammering a failing endpoint.
+
+Counters are kept per process and exported with the run summary.
+
+Environment variables:
+    LLM_MAX_RETRIES: Retries after the first attempt (default: 4).
+    LLM_RETRY_BASE_DELAY: Base backoff delay in seconds (default: 1.0).
+    LLM_RETRY_MAX_DELAY: Maximum backoff delay, and longest ``Retry-After`` waited for, in
+        seconds (default: 30.0).
+    LLM_HEDGE: Set to ``1`` to enable hedged requests (default: off).
+    LLM_HEDGE_PERCENTILE: Latency percentile that triggers a hedge (default: 95).
+    LLM_BREAKER_THRESHOLD: Consecutive failures that open the circuit (default: 5).
+    LLM_BREAKER_RESET: Seconds before an open circuit allows a trial call (default: 30).
+"""
+
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+_TRANSIENT_MESSAGES = (
+    "timed out",
+    "timeout",
+    "too many requests",
+    "rate limit",
+    "temporarily unavailable",
+    "service unavailable",
+    "connection refused",
+    "connection reset",
+    "connection aborted",
+    "bad gateway",
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when a call is rejected because the circuit breaker is open.
+    """
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for source in (exc, getattr(exc, "response", None)):
+        for attr in ("status_code", "status", "code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    Returns True if ``exc`` looks like a transient failure worth retrying.
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status = _status_code(exc)
+    if status is not None:
+        return status in TRANSIENT_STATUS_CODES
+    message = str(exc).lower()
+    return "429" in message or any(text in message for text in _TRANSIENT_MESSAGES)
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    Extracts the ``Retry-After`` delay from an HTTP error, if present.
+
+    Args:
+        exc: The exception raised by the model client.
+
+    Returns:
+        Optional[float]: Delay in seconds, or None if the header is absent.
+    """
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter.
+
+    Attributes:
+        max_retries: Retries after the first attempt.
+        base_delay: Delay of the first retry before jitter, in seconds.
+        max_delay: Upper bound of any single delay, in seconds. A longer
+            ``Retry-After`` is not waited for.
+    """
+
+    def __init__(self, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, exc: Optional[BaseException] = None) -> Optional[float]:
+        """
+        Returns the delay before retry number ``attempt`` (starting at 1).
+
+        A ``Retry-After`` value on the error takes precedence over backoff and is
+        honoured in full: retrying earlier would only be rate limited again. If it
+        exceeds ``max_delay``, None is returned and the call should not be retried.
+        """
+        if exc is not None:
+            retry_after = retry_after_seconds(exc)
+            if retry_after is not None:
+                return retry_after if retry_after <= self.max_delay else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    After ``failure_threshold`` consecutive transient failures the circuit
+    opens and calls are rejected for ``reset_timeout`` seconds. Then a single
+    trial call is let through (half-open); its outcome closes or re-opens
+    the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Returns True if a call may proceed.
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """
+        Records a transient failure.
+
+        Returns:
+            bool: True if this failure opened the circuit.
+        """
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                opened = self._state != self.OPEN
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                return opened
+            return False
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of call latencies to compute percentiles.
+    """
+
+    def __init__(self, window: int = 100):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent: float, min_samples: int = 5) -> Optional[float]:
+        """
+        Returns the ``percent`` latency percentile, or None with too few samples.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < min_samples:
+            return None
+        index = min(int(round(percent / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
+
+
+class ResilientCaller:
+    """
+    Runs callables with retries, hedging and circuit breaking.
+
+    Attributes:
+        policy: Backoff policy for transient errors.
+        breaker: Circuit breaker shared by all callers of the process.
+        hedge: Whether hedged duplicate requests are enabled.
+        hedge_percentile: Latency percentile after which a hedge is launched.
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        breaker: CircuitBreaker,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        max_hedge_workers: int = 8,
+    ):
+        self.policy = policy
+        self.breaker = breaker
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.latency = LatencyTracker()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._max_hedge_workers = max_hedge_workers
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "transient_errors": 0,
+            "retry_after_waits": 0,
+            "hedges_launched": 0,
+            "hedge_wins": 0,
+            "breaker_rejections": 0,
+            "breaker_opens": 0,
+            "failures": 0,
+        }
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the resilience counters and the current circuit state.
+        """
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["circuit_state"] = self.breaker.state
+        return stats
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def _hedged(self, fn: Callable[[], T], hedge: bool) -> T:
+        threshold = self.latency.percentile(self.hedge_percentile)
+        if not (self.hedge and hedge) or threshold is None:
+            return fn()
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._max_hedge_workers, thread_name_prefix="llm-hedge"
+                )
+            executor = self._executor
+
+        primary = executor.submit(fn)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        logger.info(f"LLM call exceeded p{self.hedge_percentile:g} ({threshold:.1f}s); hedging")
+        self._count("hedges_launched")
+        hedge = executor.submit(fn)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+        assert error is not None
+        raise error
+
+    def call(self, fn: Callable[[], T], hedge: bool = True) -> T:
+        """
+        Calls ``fn`` with the resilience policies applied.
+
+        Args:
+            fn: Zero-argument callable performing one model request.
+            hedge: Allow hedged duplicates of this call (disable for calls
+                with side effects, such as opening a stream).
+
+        Returns:
+            The result of the first successful attempt.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker rejects the call.
+            Exception: The last error if it is not transient or retries are exhausted.
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("breaker_rejections")
+                raise CircuitOpenError("LLM circuit breaker is open; endpoint is failing")
+
+            attempt += 1
+            self._count("attempts")
+            started = time.monotonic()
+            try:
+                result = self._hedged(fn, hedge)
+            except Exception as e:
+                if not is_transient_error(e):
+                    # The endpoint answered; only transient failures count against it
+                    self.breaker.record_success()
+                    self._count("failures")
+                    raise
+                self._count("transient_errors")
+                if self.breaker.record_failure():
+                    self._count("breaker_opens")
+                    logger.warning("LLM circuit breaker opened after repeated failures")
+                if attempt > self.policy.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self.policy.delay(attempt, e)
+                if delay is None:
+                    self._count("failures")
+                    logger.warning(
+                        f"LLM endpoint asks to retry after {retry_after_seconds(e):.0f}s, longer "
+                        f"than the maximum delay of {self.policy.max_delay:.0f}s; giving up"
+                    )
+                    raise
+                if retry_after_seconds(e) is not None:
+                    self._count("retry_after_waits")
+                logger.warning(
+                    f"Transient LLM error (attempt {attempt}/{self.policy.max_retries + 1}): "
+                    f"{e}; retrying in {delay:.1f}s"
+                )
+                self._count("retries")
+                time.sleep(delay)
+                continue
+
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            return result
+
+
+_default_caller: Optional[ResilientCaller] = None
+_default_caller_lock = threading.Lock()
+
+
+def get_resilient_caller() -> ResilientCaller:
+    """
+    Returns the process-wide caller, configured from the environment on first use.
+    """
+    global _default_caller
+    with _default_caller_lock:
+        if _default_caller is None:
+            _default_caller = ResilientCaller(
+                policy=RetryPolicy(
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+                    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0")),
+                    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "30.0")),
+                ),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+                    reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+                ),
+                hedge=os.getenv("LLM_HEDGE", "0").strip().lower() in {"1", "on", "true", "yes"},
+                hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+            )
+        return _default_caller
+
+
+def resilient_call(fn: Callable[[], T], hedge: bool = True) -> T:
+    """
+    Calls ``fn`` through the process-wide ``ResilientCaller``.
+    """
+    return get_resilient_caller().call(fn, hedge=hedge)
@@ -0,0 +1,265 @@
+"""
+Token-accurate prompt budgeting.
+
+Prompts in the pipeline are assembled from sections of very different value:
+the feature request and task instructions must always be sent, while
+dependency listings, the project tree, retrieved context and full file bodies
+can be summarised or truncated when the prompt would not fit the model's
+context window.
+
+``TokenCounter`` counts tokens with the target model's tokenizer (loaded via
+``transformers`` when available) and falls back to a character heuristic.
+The tokenizer is only loaded from the local Hugging Face cache: a token counter
+never downloads anything (the default tokenizers are gated, and without network
+access the client would retry for most of a minute). Download it once with
+``huggingface-cli download <name>`` to count exactly.
+``PromptBudget`` allocates the available budget across ``PromptSection``
+objects by priority and logs every decision it makes.
+
+Environment variables:
+    MODEL_CONTEXT_WINDOW: Context window of the target model (default: 8192).
+    TOKENIZER_NAME: Hugging Face tokenizer to use instead of the default mapping.
+"""
+
+import logging
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Tokens reserved for the chat template wrapped around every prompt
+PROMPT_OVERHEAD_TOKENS = 64
+
+# Hugging Face tokenizers matching the WatsonX model ids used by the pipeline
+TOKENIZER_NAMES = {
+    "meta-llama/llama-3-70b-instruct": "meta-llama/Meta-Llama-3-70B-Instruct",
+    "meta-llama/llama-3-1-70b-instruct": "meta-llama/Llama-3.1-70B-Instruct",
+}
+
+# Average characters per token used when no tokenizer can be loaded
+_CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = "\n... [truncated {count} tokens] ...\n"
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in tokens of a specific model.
+
+    Attributes:
+        model_id: Identifier of the target model.
+        exact: True if a real tokenizer was loaded, False for the heuristic.
+    """
+
+    def __init__(self, model_id: str, tokenizer_name: Optional[str] = None):
+        self.model_id = model_id
+        self._tokenizer = None
+        name = tokenizer_name or os.getenv("TOKENIZER_NAME") or TOKENIZER_NAMES.get(model_id)
+        if name:
+            try:
+                from transformers import AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(name, local_files_only=True)
+            except Exception as e:
+                logger.warning(
+                    f"Tokenizer '{name}' unavailable ({e}); using a character-based estimate"
+                )
+        self.exact = self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        """
+        Returns the number of tokens in ``text``.
+        """
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Shortens ``text`` to at most ``max_tokens`` tokens.
+
+        The head and the tail of the text are kept (two thirds / one third)
+        and a marker records how many tokens were dropped in between.
+
+        Args:
+            text: Text to truncate.
+            max_tokens: Token budget for the result.
+
+        Returns:
+            str: The truncated text (unchanged if it already fits).
+        """
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        if max_tokens <= 0:
+            return ""
+
+        marker_tokens = self.count(TRUNCATION_MARKER.format(count=total))
+        keep = max(max_tokens - marker_tokens, 0)
+        head_tokens = keep * 2 // 3
+        tail_tokens = keep - head_tokens
+        marker = TRUNCATION_MARKER.format(count=total - keep)
+
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)
+            head = self._tokenizer.decode(ids[:head_tokens])
+            tail = self._tokenizer.decode(ids[len(ids) - tail_tokens:]) if tail_tokens else ""
+        else:
+            head = text[: head_tokens * _CHARS_PER_TOKEN]
+            tail = text[len(text) - tail_tokens * _CHARS_PER_TOKEN:] if tail_tokens else ""
+        return f"{head}{marker}{tail}"
+
+
+def get_context_window() -> int:
+    """
+    Returns the context window of the target model (``MODEL_CONTEXT_WINDOW`` or 8192).
+    """
+    return int(os.getenv("MODEL_CONTEXT_WINDOW", str(DEFAULT_CONTEXT_WINDOW)))
+
+
+_counters: Dict[str, TokenCounter] = {}
+_counters_lock = threading.Lock()
+
+
+def get_token_counter(model_id: str) -> TokenCounter:
+    """
+    Returns a shared ``TokenCounter`` for ``model_id`` (tokenizers load once).
+    """
+    with _counters_lock:
+        if model_id not in _counters:
+            _counters[model_id] = TokenCounter(model_id)
+        return _counters[model_id]
+
+
+@dataclass
+class PromptSection:
+    """
+    A named part of a prompt competing for the token budget.
+
+    Attributes:
+        name: Section name, used as key in the result and in log messages.
+        text: Full text of the section.
+        priority: Higher values are kept longer; the lowest priority sections
+            are reduced first.
+        fixed: Fixed sections (instructions, the feature request) are never reduced.
+        summarize: Optional callable returning a cheaper rendering of the
+            section, tried before plain truncation.
+    """
+
+    name: str
+    text: str
+    priority: int = 0
+    fixed: bool = False
+    summarize: Optional[Callable[[str], str]] = None
+
+
+class PromptBudget:
+    """
+    Allocates a prompt token budget across sections by priority.
+
+    Attributes:
+        counter: Token counter of the target model.
+        max_tokens: Tokens available for the prompt.
+    """
+
+    def __init__(self, counter: TokenCounter, max_tokens: int):
+        self.counter = counter
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def for_model(
+        cls,
+        model_id: str,
+        max_new_tokens: int,
+        context_window: Optional[int] = None,
+    ) -> "PromptBudget":
+        """
+        Creates a budget for ``model_id`` leaving room for the completion.
+
+        Args:
+            model_id: Identifier of the target model.
+            max_new_tokens: Tokens reserved for the model's output.
+            context_window: Context window of the model. Defaults to the
+                ``MODEL_CONTEXT_WINDOW`` environment variable or 8192.
+
+        Returns:
+            PromptBudget: Budget for the prompt of a single call.
+        """
+        if context_window is None:
+            context_window = get_context_window()
+        max_tokens = context_window - max_new_tokens - PROMPT_OVERHEAD_TOKENS
+        return cls(get_token_counter(model_id), max_tokens)
+
+    def fit(self, sections: List[PromptSection], label: str = "prompt") -> Dict[str, str]:
+        """
+        Reduces sections until their combined size fits the budget.
+
+        Sections are processed from the lowest priority upwards. Each one is
+        first replaced by its summary (if a summariser is given and the
+        summary is smaller) and then truncated to whatever budget remains
+        once all higher priority sections are accounted for.
+
+        Args:
+            sections: Prompt sections, including fixed ones.
+            label: Name of the call, used in log messages.
+
+        Returns:
+            Dict[str, str]: The (possibly reduced) text of every section, by name.
+        """
+        texts = {section.name: section.text for section in sections}
+        counts = {section.name: self.counter.count(section.text) for section in sections}
+        total = sum(counts.values())
+
+        if total <= self.max_tokens:
+            logger.info(f"Prompt budget [{label}]: {total}/{self.max_tokens} tokens, no reduction")
+            return texts
+
+        logger.info(
+            f"Prompt budget [{label}]: {total}/{self.max_tokens} tokens, "
+            f"reducing lowest priority sections"
+        )
+        reducible = sorted(
+            (section for section in sections if not section.fixed), key=lambda s: s.priority
+        )
+        for section in reducible:
+            if total <= self.max_tokens:
+                break
+            original = counts[section.name]
+            action = "truncated"
+
+            if section.summarize:
+                summary = section.summarize(texts[section.name])
+                summary_tokens = self.counter.count(summary)
+                if summary_tokens < original:
+                    texts[section.name] = summary
+                    counts[section.name] = summary_tokens
+                    total -= original - summary_tokens
+                    action = "summarised"
+
+            if total > self.max_tokens:
+                allowance = max(counts[section.name] - (total - self.max_tokens), 0)
+                texts[section.name] = self.counter.truncate(texts[section.name], allowance)
+                reduced = self.counter.count(texts[section.name])
+                total -= counts[section.name] - reduced
+                counts[section.name] = reduced
+                if action == "summarised":
+                    action = "summarised and truncated"
+
+            logger.info(
+                f"Prompt budget [{label}]: section '{section.name}' (priority {section.priority}) "
+                f"{action}: {original} -> {counts[section.name]} tokens"
+            )
+
+        if total > self.max_tokens:
+            logger.warning(
+                f"Prompt budget [{label}]: fixed sections alone need {total} tokens "
+                f"(budget {self.max_tokens})"
+            )
+        return texts
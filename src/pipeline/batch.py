@@ -0,0 +1,238 @@
+"""
+Batch mode: many feature requests against one project in one process.
+
+``run_batch`` adds the project stages (parsing, vector index, dependencies,
+tree) to a pipeline once and the feature stages of every request after them,
+so all requests share the parsed project, the index, the project context, the
+LLM response cache and the warm LLM backend. Requests run concurrently and
+each writes its own output tree ``<output_root>/<request id>``. A failing
+request only stops its own stages.
+
+Requests are read from a JSON Lines file, one object per line::
+
+    {"id": "logging", "prompt": "Add logging to all major modules"}
+    {"id": "auth", "prompt": "Add JWT authentication", "output_mode": "patch"}
+
+``prompt`` (or ``feature_request``) is required and ``id`` defaults to the line
+number. ``analysis_mode``, ``output_mode``, ``shard_large_files`` and
+``early_dispatch`` override the batch-wide options for one request.
+"""
+
+import json
+import os
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from src.pipeline.dag import CACHED, FAILED, SKIPPED, Pipeline
+from src.pipeline.stages import PROJECT_STAGES, FeatureOptions, FeatureStages, add_project_stages
+from src.utils.logger import logger
+from src.utils.profiling import StageProfiler
+
+DEFAULT_OUTPUT_ROOT = "project_batch"
+RESULTS_NAME = "batch_results.json"
+
+# Per-request overrides accepted in a batch file
+REQUEST_OPTIONS = ("analysis_mode", "output_mode", "shard_large_files", "early_dispatch")
+
+SUCCEEDED = "succeeded"
+
+
+@dataclass
+class BatchRequest:
+    """
+    A feature request of a batch.
+
+    Attributes:
+        request_id: Identifier used for stage names and the output directory.
+        prompt: The feature request.
+        options: Per-request overrides of ``REQUEST_OPTIONS``.
+    """
+
+    request_id: str
+    prompt: str
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class BatchResult:
+    """
+    Outcome of one request of a batch.
+
+    Attributes:
+        request_id: The request identifier.
+        output_path: Directory of the updated project.
+        status: ``succeeded``, ``failed`` or ``skipped`` (a shared stage failed).
+        error: Error message of the failed stage.
+        reused: Stages of the request reused from checkpoints.
+    """
+
+    request_id: str
+    output_path: str
+    status: str
+    error: str = ""
+    reused: List[str] = field(default_factory=list)
+
+
+@dataclass
+class BatchReport:
+    """
+    Outcome of a batch.
+
+    Attributes:
+        run_id: Identifier of the run, to resume it.
+        run_dir: Directory of the run checkpoints and ``batch_results.json``.
+        results: One result per request, in batch order.
+    """
+
+    run_id: str
+    run_dir: str
+    results: List[BatchResult]
+
+    @property
+    def failed(self) -> List[BatchResult]:
+        return [result for result in self.results if result.status != SUCCEEDED]
+
+
+def _request_id(value: str) -> str:
+    # Request ids name checkpoint files and output directories
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", value).strip("-")
+
+
+def load_requests(path: str) -> List[BatchRequest]:
+    """
+    Reads a JSON Lines batch file.
+
+    Raises:
+        ValueError: If a line is not a JSON object with a prompt, or ids repeat.
+    """
+    requests: List[BatchRequest] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}") from e
+            if not isinstance(record, dict):
+                raise ValueError(f"{path}:{line_number}: expected a JSON object")
+            prompt = record.get("prompt") or record.get("feature_request")
+            if not prompt:
+                raise ValueError(f"{path}:{line_number}: missing 'prompt'")
+            request_id = _request_id(str(record.get("id") or line_number))
+            if not request_id or request_id in PROJECT_STAGES:
+                raise ValueError(f"{path}:{line_number}: invalid id '{record.get('id')}'")
+            options = {key: record[key] for key in REQUEST_OPTIONS if key in record}
+            requests.append(BatchRequest(request_id, prompt, options))
+
+    ids = [request.request_id for request in requests]
+    duplicates = sorted({request_id for request_id in ids if ids.count(request_id) > 1})
+    if duplicates:
+        raise ValueError(f"{path}: duplicate request ids: {', '.join(duplicates)}")
+    return requests
+
+
+def run_batch(
+    requests: List[BatchRequest],
+    project_path: str = "project_old",
+    output_root: str = DEFAULT_OUTPUT_ROOT,
+    concurrency: Optional[int] = None,
+    run_id: Optional[str] = None,
+    resume: bool = False,
+    on_event: Optional[Callable[[str, str], None]] = None,
+    profiler: Optional[StageProfiler] = None,
+    **options: Any,
+) -> BatchReport:
+    """
+    Integrates a batch of feature requests into one project.
+
+    Args:
+        requests: The requests to run.
+        project_path: Directory of the existing project, parsed and indexed once.
+        output_root: Each request writes its updated project to ``<output_root>/<id>``.
+        concurrency: Stages run in parallel (default: ``PIPELINE_WORKERS``). Each
+            request's stages run in sequence, so this bounds the requests in flight.
+        run_id: Identifier of the run directory (a new one is generated by default).
+        resume: If True, continue the run ``run_id`` from its checkpoints.
+        on_event: Optional callback receiving ``("status", message)`` events.
+        profiler: Optional ``StageProfiler`` profiling each stage that runs.
+        **options: Defaults of ``analysis_mode``, ``output_mode``,
+            ``shard_large_files`` and ``early_dispatch`` for every request. Options
+            that are None or not given keep their value of the resumed run.
+
+    Returns:
+        BatchReport: The run id and the result of every request. Results are also
+        written to ``batch_results.json`` in the run directory.
+    """
+
+    def report(message: str) -> None:
+        logger.info(message)
+        if on_event:
+            on_event("status", message)
+
+    pipeline = Pipeline(
+        run_id,
+        resume=resume,
+        max_workers=concurrency,
+        on_reuse=lambda name: report(f"✓ Stage '{name}' reused from checkpoint"),
+        profiler=profiler,
+    )
+    # A resumed batch keeps the options it was started with unless they are given again
+    options = {
+        **{key: value for key, value in pipeline.metadata.items() if key in REQUEST_OPTIONS},
+        **{key: value for key, value in options.items() if value is not None},
+    }
+    pipeline.set_metadata(
+        batch=[asdict(request) for request in requests], output_root=output_root, **options
+    )
+    report(f"Batch run {pipeline.run_id}: {len(requests)} requests, outputs in {output_root}/")
+
+    add_project_stages(pipeline, project_path, report)
+    for request in requests:
+        FeatureStages(
+            FeatureOptions(
+                request.prompt,
+                on_event=on_event,
+                old_project_path=project_path,
+                new_project_path=os.path.join(output_root, request.request_id),
+                **{**options, **request.options},
+            ),
+            prefix=f"{request.request_id}.",
+        ).add_to(pipeline)
+
+    pipeline.run(keep_going=True)
+    results = batch_results(pipeline, requests, output_root)
+    with open(os.path.join(pipeline.run_dir, RESULTS_NAME), "w", encoding="utf-8") as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+    return BatchReport(pipeline.run_id, pipeline.run_dir, results)
+
+
+def batch_results(
+    pipeline: Pipeline, requests: List[BatchRequest], output_root: str
+) -> List[BatchResult]:
+    """
+    Summarizes a batch pipeline run per request.
+    """
+    project_errors = [pipeline.errors[name] for name in PROJECT_STAGES if name in pipeline.errors]
+    results = []
+    for request in requests:
+        prefix = f"{request.request_id}."
+        stages = [name for name in pipeline.stages if name.startswith(prefix)]
+        failed = [name for name in stages if pipeline.status.get(name) == FAILED]
+        if failed:
+            status, error = FAILED, str(pipeline.errors[failed[0]])
+        elif any(pipeline.status.get(name) == SKIPPED for name in stages):
+            status, error = SKIPPED, str(project_errors[0]) if project_errors else ""
+        else:
+            status, error = SUCCEEDED, ""
+        results.append(
+            BatchResult(
+                request.request_id,
+                os.path.join(output_root, request.request_id),
+                status,
+                error,
+                [name[len(prefix):] for name in stages if pipeline.status.get(name) == CACHED],
+            )
+        )
+    return results
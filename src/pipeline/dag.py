@@ -0,0 +1,464 @@
+"""
+Checkpointed DAG executor for the Factory Feature pipeline.
+
+The pipeline is a set of ``Stage`` objects with explicit inputs: the names of
+the stages whose outputs they consume. ``Pipeline.run`` starts every stage as
+soon as its inputs are resolved, so independent stages (index build,
+dependency resolution, tree building) run in parallel, and checkpoints each
+stage's output under a run directory::
+
+    runs/<run_id>/manifest.json    fingerprints, digests and timings per stage
+    runs/<run_id>/<stage>.pkl      pickled stage outputs
+
+A stage's fingerprint hashes its name, version, parameters and the digests of
+its inputs' outputs. When a run is resumed, a stage whose fingerprint matches
+its checkpoint is skipped, and its output is only loaded from disk if a stage
+that does run needs it. Changing a parameter or an upstream output
+invalidates the stage and everything downstream of it.
+
+Environment variables:
+    PIPELINE_RUNS_DIR: Directory holding the run directories (default: ``runs``).
+    PIPELINE_WORKERS: Stages executed in parallel (default: 4).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from src.utils.metrics import bind_run_metrics, get_metrics
+from src.utils.profiling import StageProfiler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RUNS_DIR = "runs"
+DEFAULT_WORKERS = 4
+MANIFEST_NAME = "manifest.json"
+
+# Run identifiers are a single path component (see ``new_run_id``)
+_RUN_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Stage states recorded in the manifest
+RUN = "run"
+CACHED = "cached"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class Stage:
+    """
+    A unit of the pipeline.
+
+    Attributes:
+        name: Unique stage name; also the name of its checkpoint file.
+        fn: Called with a mapping of input name to input output; returns the stage output.
+        inputs: Names of the stages this stage depends on.
+        params: JSON-serializable values the output depends on besides its inputs.
+        version: Bump to invalidate checkpoints written by older code.
+        checkpoint: If False the stage runs on every run (stages with side effects).
+        save: Optional ``save(output, run_dir) -> meta`` for outputs that cannot be
+            pickled; ``meta`` must be JSON-serializable.
+        load: ``load(meta, run_dir) -> output``, the counterpart of ``save``.
+        error: Message logged when the stage fails.
+    """
+
+    name: str
+    fn: Callable[[Mapping[str, Any]], Any]
+    inputs: Tuple[str, ...] = ()
+    params: Dict[str, Any] = field(default_factory=dict)
+    version: str = "1"
+    checkpoint: bool = True
+    save: Optional[Callable[[Any, str], Any]] = None
+    load: Optional[Callable[[Any, str], Any]] = None
+    error: str = ""
+
+
+class StageError(RuntimeError):
+    """
+    Raised when a stage fails. The run can be resumed from the failed stage.
+
+    Attributes:
+        stage: Name of the failed stage.
+        run_id: Identifier of the run to resume.
+    """
+
+    def __init__(self, stage: str, run_id: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+        self.run_id = run_id
+
+
+def new_run_id() -> str:
+    """
+    Returns a new, sortable run identifier (``YYYYmmdd-HHMMSS-xxxxxx``).
+    """
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def check_run_id(run_id: str) -> str:
+    """
+    Returns ``run_id`` if it is a valid run identifier: letters, digits, ``_`` and
+    ``-`` only, so its run directory cannot be outside the runs directory.
+
+    Raises:
+        ValueError: If it is not.
+    """
+    if not isinstance(run_id, str) or not _RUN_ID.match(run_id):
+        raise ValueError(f"Invalid run id {run_id!r}: use letters, digits, '_' and '-'")
+    return run_id
+
+
+def runs_dir() -> str:
+    """
+    Returns the directory holding the run directories.
+    """
+    return os.getenv("PIPELINE_RUNS_DIR", DEFAULT_RUNS_DIR)
+
+
+def path_fingerprint(path: str) -> str:
+    """
+    Fingerprints a directory tree from the paths, sizes and modification times
+    of its files, without reading them.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            relative = os.path.relpath(file_path, path)
+            digest.update(f"{relative}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class StageMemo:
+    """
+    In-memory stage outputs shared by the pipelines of a long-running process.
+
+    A pipeline created with a memo reuses the live output of a stage listed in
+    ``names`` when another pipeline already produced it with the same
+    fingerprint (e.g. the parsed and indexed project while it is unchanged),
+    without running the stage or loading its checkpoint.
+
+    Attributes:
+        names: Stages whose outputs are kept.
+        max_entries: Outputs kept; the least recently used are dropped first.
+    """
+
+    def __init__(self, names: Iterable[str], max_entries: int = 16):
+        self.names = set(names)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str, fingerprint: str) -> Optional[Tuple[str, Any]]:
+        """
+        Returns ``(digest, output)`` of a memoized stage, or None.
+        """
+        with self._lock:
+            entry = self._entries.get((name, fingerprint))
+            if entry is not None:
+                self._entries.move_to_end((name, fingerprint))
+            return entry
+
+    def put(self, name: str, fingerprint: str, digest: str, output: Any) -> None:
+        """
+        Keeps the output of a stage if its name is memoized.
+        """
+        if name not in self.names:
+            return
+        with self._lock:
+            self._entries[(name, fingerprint)] = (digest, output)
+            self._entries.move_to_end((name, fingerprint))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _Inputs(Mapping):
+    """
+    Read-only view of a stage's inputs that loads each output on first access.
+    """
+
+    def __init__(self, pipeline: "Pipeline", names: Tuple[str, ...]):
+        self._pipeline = pipeline
+        self._names = names
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._names:
+            raise KeyError(name)
+        return self._pipeline.value(name)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class Pipeline:
+    """
+    A DAG of stages checkpointed under ``<runs_dir>/<run_id>``.
+
+    Usage::
+
+        pipeline = Pipeline(run_id)
+        pipeline.add(Stage("parse", parse))
+        pipeline.add(Stage("index", build_index, inputs=("parse",)))
+        pipeline.run()
+        index = pipeline.value("index")
+
+    Attributes:
+        run_id: Identifier of the run.
+        run_dir: Directory holding the manifest and checkpoints.
+        stages: Stages by name, in insertion order.
+        status: ``run``, ``cached``, ``failed`` or ``skipped`` per stage resolved by ``run``.
+        errors: ``StageError`` per failed stage of the last ``run``.
+        timings: Wall-clock seconds per executed stage.
+        on_reuse: Optional callback receiving the name of each stage reused from its checkpoint.
+        memo: Optional ``StageMemo`` shared with other pipelines of the process.
+        profiler: Optional ``StageProfiler`` profiling each stage that runs.
+    """
+
+    def __init__(
+        self,
+        run_id: Optional[str] = None,
+        base_dir: Optional[str] = None,
+        resume: bool = False,
+        max_workers: Optional[int] = None,
+        on_reuse: Optional[Callable[[str], None]] = None,
+        memo: Optional["StageMemo"] = None,
+        profiler: Optional[StageProfiler] = None,
+    ):
+        self.run_id = check_run_id(run_id) if run_id else new_run_id()
+        base_dir = base_dir or runs_dir()
+        self.run_dir = os.path.join(base_dir, self.run_id)
+        if os.path.dirname(os.path.realpath(self.run_dir)) != os.path.realpath(base_dir):
+            raise ValueError(f"Run directory '{self.run_dir}' is outside '{base_dir}'")
+        if resume and not os.path.isfile(os.path.join(self.run_dir, MANIFEST_NAME)):
+            raise FileNotFoundError(f"No run to resume in '{self.run_dir}'")
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.max_workers = max_workers or int(os.getenv("PIPELINE_WORKERS", str(DEFAULT_WORKERS)))
+        self.on_reuse = on_reuse
+        self.memo = memo
+        self.profiler = profiler
+        self.stages: Dict[str, Stage] = {}
+        self.status: Dict[str, str] = {}
+        self.timings: Dict[str, float] = {}
+        self.errors: Dict[str, StageError] = {}
+        self.manifest = self._read_manifest() if resume else {"run_id": self.run_id, "stages": {}}
+        self._digests: Dict[str, str] = {}
+        self._values: Dict[str, Any] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._manifest_lock = threading.Lock()
+
+    def add(self, stage: Stage) -> Stage:
+        """
+        Adds a stage. Its inputs must have been added before it.
+
+        Raises:
+            ValueError: If the name is taken or an input is unknown.
+        """
+        if stage.name in self.stages:
+            raise ValueError(f"Duplicate stage '{stage.name}'")
+        missing = [name for name in stage.inputs if name not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {', '.join(missing)}")
+        self.stages[stage.name] = stage
+        self._locks[stage.name] = threading.Lock()
+        return stage
+
+    def set_metadata(self, **values: Any) -> None:
+        """
+        Stores run-level values (the request, CLI options) in the manifest.
+        """
+        with self._manifest_lock:
+            self.manifest.setdefault("metadata", {}).update(values)
+            self._write_manifest()
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return dict(self.manifest.get("metadata", {}))
+
+    def run(self, keep_going: bool = False) -> Dict[str, str]:
+        """
+        Resolves every stage, running those without a valid checkpoint.
+
+        Args:
+            keep_going: If True, a failed stage only skips the stages depending on
+                it; independent stages still run and the failures are collected
+                in ``errors`` instead of being raised.
+
+        Returns:
+            Dict[str, str]: ``run``, ``cached``, ``failed`` or ``skipped`` per stage.
+
+        Raises:
+            StageError: If a stage fails and ``keep_going`` is False. Stages already
+                running are allowed to finish and are checkpointed, so a resumed
+                run continues from the failure.
+        """
+        pending = list(self.stages)
+        running: Dict[Future, str] = {}
+        self.errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if keep_going or not self.errors:
+                    # Pending stages are in insertion (topological) order, so skips propagate in one pass
+                    for name in list(pending):
+                        if any(self.status.get(dep) in (FAILED, SKIPPED) for dep in self.stages[name].inputs):
+                            pending.remove(name)
+                            self.status[name] = SKIPPED
+                        elif self._ready(name):
+                            pending.remove(name)
+                            running[executor.submit(bind_run_metrics(self._resolve), name)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        stage = self.stages[name]
+                        message = f"{stage.error or f'Stage {name} failed'}: {error}"
+                        self.errors[name] = StageError(name, self.run_id, message)
+                        self.errors[name].__cause__ = error
+
+        if self.errors and not keep_going:
+            raise next(iter(self.errors.values()))
+        return dict(self.status)
+
+    def value(self, name: str) -> Any:
+        """
+        Returns the output of a resolved stage, loading its checkpoint if needed.
+        """
+        with self._locks[name]:
+            if name not in self._values:
+                self._values[name] = self._load(name)
+            return self._values[name]
+
+    def _ready(self, name: str) -> bool:
+        return all(dep in self._digests for dep in self.stages[name].inputs)
+
+    def _fingerprint(self, stage: Stage) -> str:
+        params = json.dumps(stage.params, sort_keys=True, default=str)
+        inputs = ",".join(f"{dep}={self._digests[dep]}" for dep in stage.inputs)
+        return _hash(stage.name, stage.version, params, inputs)
+
+    def _resolve(self, name: str) -> None:
+        stage = self.stages[name]
+        fingerprint = self._fingerprint(stage)
+        recorded = self.manifest["stages"].get(name, {})
+
+        memoized = self.memo.get(name, fingerprint) if self.memo is not None else None
+        if memoized is not None:
+            self._digests[name], value = memoized
+            with self._locks[name]:
+                self._values[name] = value
+            self.status[name] = CACHED
+            logger.info(f"Stage '{name}' reused from memory")
+            if self.on_reuse:
+                self.on_reuse(name)
+            return
+
+        if (
+            stage.checkpoint
+            and recorded.get("status") in (RUN, CACHED)
+            and recorded.get("fingerprint") == fingerprint
+            and (stage.load or os.path.exists(self._checkpoint_path(name)))
+        ):
+            self.status[name] = CACHED
+            self._digests[name] = recorded["digest"]
+            logger.info(f"Stage '{name}' reused from checkpoint")
+            if self.on_reuse:
+                self.on_reuse(name)
+            return
+
+        started = time.monotonic()
+        try:
+            profile = self.profiler.stage(name) if self.profiler is not None else nullcontext()
+            with get_metrics().span(name, kind="stage"), profile:
+                output = stage.fn(_Inputs(self, stage.inputs))
+        except BaseException:
+            self.status[name] = FAILED
+            self._record(name, {"status": FAILED, "fingerprint": fingerprint})
+            raise
+        seconds = time.monotonic() - started
+
+        entry: Dict[str, Any] = {"status": RUN, "fingerprint": fingerprint, "seconds": round(seconds, 3)}
+        if stage.checkpoint and stage.save:
+            entry["meta"] = stage.save(output, self.run_dir)
+            entry["digest"] = fingerprint
+        elif stage.checkpoint:
+            data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+            self._atomic_write(self._checkpoint_path(name), data)
+            entry["digest"] = hashlib.sha256(data).hexdigest()[:16]
+        else:
+            entry["digest"] = fingerprint
+
+        with self._locks[name]:
+            self._values[name] = output
+        self.timings[name] = seconds
+        self.status[name] = RUN
+        self._digests[name] = entry["digest"]
+        self._record(name, entry)
+        if self.memo is not None:
+            self.memo.put(name, fingerprint, entry["digest"], output)
+
+    def _load(self, name: str) -> Any:
+        stage = self.stages[name]
+        if stage.load:
+            return stage.load(self.manifest["stages"][name].get("meta"), self.run_dir)
+        with open(self._checkpoint_path(name), "rb") as f:
+            return pickle.load(f)
+
+    def _checkpoint_path(self, name: str) -> str:
+        return os.path.join(self.run_dir, f"{name}.pkl")
+
+    def _record(self, name: str, entry: Dict[str, Any]) -> None:
+        with self._manifest_lock:
+            self.manifest["stages"][name] = entry
+            self._write_manifest()
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        with open(os.path.join(self.run_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("stages", {})
+        return manifest
+
+    def _write_manifest(self) -> None:
+        data = json.dumps(self.manifest, indent=2, default=str).encode("utf-8")
+        self._atomic_write(os.path.join(self.run_dir, MANIFEST_NAME), data)
+
+    def _atomic_write(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.run_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def executed(self) -> List[str]:
+        """
+        Returns the stages executed (not reused) by the last ``run``.
+        """
+        return [name for name, status in self.status.items() if status == RUN]
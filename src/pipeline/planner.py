@@ -0,0 +1,436 @@
+"""
+Dry-run planner: what a feature request will cost before it runs.
+
+``estimate_run`` computes the project snapshot and the Step 4 context, then
+builds the prompts of every LLM call in Steps 5 to 7 with the same code the
+pipeline uses, without calling the LLM:
+
+    Step 5: the analysis prompts, from the project context.
+    Step 6: the plan prompt. The analysis results it contains are taken from a
+        previous run of the same request, or stood in for by text as long as
+        the analysis output budget.
+    Step 7: one task prompt per planned file. The plan is taken from a previous
+        run of the same request when there is one; otherwise the files that
+        best match the request are assumed to be modified, plus one new file.
+
+A previous run is only reused if it ran the same request, with the same
+analysis and output modes, on the same project snapshot.
+
+The index is not built: documents are retrieved lexically, by the words the
+request shares with the project files. Latency is predicted from the LLM calls
+recorded in the ``metrics.json`` reports of earlier ``--metrics`` runs: the
+median duration of calls of the same task type.
+
+Usage::
+
+    python main.py --prompt "Add logging" --plan
+"""
+
+import json
+import os
+import pickle
+import re
+import statistics
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.analysis.dependency_resolver import resolve_dependencies
+from src.analysis.project_parser import parse_project
+from src.analysis.tree import get_tree, list_tree_paths
+from src.generation.task_prompts import generate_task_prompts
+from src.models.llm_inference import MODEL_ID, generate_prompt
+from src.models.output_governor import OutputBudget, output_budget
+from src.models.token_budget import get_token_counter
+from src.pipeline.dag import CACHED, MANIFEST_NAME, RUN, path_fingerprint, runs_dir
+from src.pipeline.stages import (
+    COMBINED_ANALYSIS_MAX_NEW_TOKENS,
+    FeatureOptions,
+    FeatureStages,
+    build_context,
+)
+from src.utils.metrics import REPORT_NAME
+from src.vector_database.db_query import format_retrieved_context
+
+# Documents retrieved for a request (see ``retrieve_context``)
+RETRIEVAL_TOP_K = 5
+
+# Existing files the heuristic plan modifies, and new files it creates
+HEURISTIC_MODIFIED_FILES = 3
+HEURISTIC_NEW_FILES = 1
+
+# Words ignored when matching the request against the project files
+_STOP_WORDS = set("add all and for from into new that the this use with".split())
+
+
+@dataclass
+class CallEstimate:
+    """
+    Predicted cost of one LLM call.
+
+    Attributes:
+        step: Pipeline step (5, 6 or 7).
+        label: What the call does (``nodes``, ``plan``, a file path, ...).
+        task_type: Output budget task type, used to match recorded timings.
+        prompt_tokens: Tokens of the complete model prompt.
+        completion_tokens: Expected response tokens (recorded average, or the
+            output budget when no call of this type was recorded).
+        max_completion_tokens: Output budget of the call.
+        seconds: Predicted duration, or None without recorded timings.
+    """
+
+    step: int
+    label: str
+    task_type: str
+    prompt_tokens: int
+    completion_tokens: int
+    max_completion_tokens: int
+    seconds: Optional[float] = None
+
+
+@dataclass
+class RunPlan:
+    """
+    Predicted cost of a feature request.
+
+    Attributes:
+        user_request: The feature request.
+        snapshot: Fingerprint of the project (see ``path_fingerprint``).
+        files: Files in the project.
+        project_bytes: Size of the project files.
+        context_tokens: Tokens of each Step 4 context section.
+        calls: The LLM calls of Steps 5 to 7, in order.
+        fanout_source: ``run <id>`` if the Step 7 plan comes from a previous run,
+            else ``heuristic``.
+        recorded_calls: Recorded LLM calls the latency prediction is based on.
+    """
+
+    user_request: str
+    snapshot: str
+    files: int
+    project_bytes: int
+    context_tokens: Dict[str, int] = field(default_factory=dict)
+    calls: List[CallEstimate] = field(default_factory=list)
+    fanout_source: str = "heuristic"
+    recorded_calls: int = 0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(call.prompt_tokens for call in self.calls)
+
+    @property
+    def completion_tokens(self) -> int:
+        return sum(call.completion_tokens for call in self.calls)
+
+    @property
+    def seconds(self) -> Optional[float]:
+        # Calls run one after another (early dispatch overlaps Steps 6 and 7)
+        known = [call.seconds for call in self.calls if call.seconds is not None]
+        return sum(known) if known else None
+
+
+class CallTimings:
+    """
+    Durations of recorded LLM calls by task type.
+
+    Attributes:
+        seconds: Durations of the calls that reached the backend, by task type.
+        completion_tokens: Response tokens of those calls, by task type.
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, List[float]] = {}
+        self.completion_tokens: Dict[str, List[int]] = {}
+
+    @classmethod
+    def from_runs(cls, directory: Optional[str] = None) -> "CallTimings":
+        """
+        Collects the LLM calls of every ``metrics.json`` under the runs directory.
+        """
+        timings = cls()
+        directory = directory or runs_dir()
+        if not os.path.isdir(directory):
+            return timings
+        for run_id in sorted(os.listdir(directory)):
+            path = os.path.join(directory, run_id, REPORT_NAME)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    spans = json.load(f).get("spans", [])
+            except (OSError, ValueError):
+                continue
+            for span in spans:
+                attributes = span.get("attributes", {})
+                if span.get("kind") != "llm" or span.get("error") or attributes.get("cached"):
+                    continue
+                timings.add(
+                    span["name"], span["wall_seconds"], attributes.get("completion_tokens")
+                )
+        return timings
+
+    def add(self, task_type: str, seconds: float, completion_tokens: Optional[int] = None) -> None:
+        self.seconds.setdefault(task_type, []).append(seconds)
+        if completion_tokens is not None:
+            self.completion_tokens.setdefault(task_type, []).append(completion_tokens)
+
+    def __len__(self) -> int:
+        return sum(len(values) for values in self.seconds.values())
+
+    def predict(self, task_type: str) -> Optional[float]:
+        """
+        Returns the median duration of calls of ``task_type`` (of any type if
+        none was recorded), or None if no call was recorded.
+        """
+        samples = self.seconds.get(task_type) or [
+            seconds for values in self.seconds.values() for seconds in values
+        ]
+        return statistics.median(samples) if samples else None
+
+    def completion(self, task_type: str, budget: OutputBudget) -> int:
+        """
+        Returns the average recorded response length of ``task_type``, or the
+        token limit of ``budget`` if none was recorded.
+        """
+        samples = self.completion_tokens.get(task_type)
+        if not samples:
+            return budget.max_new_tokens
+        return min(round(statistics.mean(samples)), budget.max_new_tokens)
+
+
+def _terms(text: str) -> set:
+    return {word for word in re.findall(r"[a-z][a-z0-9]{2,}", text.lower())} - _STOP_WORDS
+
+
+def rank_files(project_data: List[Dict[str, str]], user_request: str) -> List[Dict[str, str]]:
+    """
+    Ranks project files by the request words their path and content contain.
+
+    Returns:
+        List[Dict[str, str]]: The files matching at least one word, best first.
+    """
+    terms = _terms(user_request)
+    scored = []
+    for item in project_data:
+        path_terms = _terms(item["path"])
+        content_terms = _terms(item["content"])
+        score = 2 * len(terms & path_terms) + len(terms & content_terms)
+        if score:
+            scored.append((-score, item["path"], item))
+    return [item for _, _, item in sorted(scored, key=lambda entry: entry[:2])]
+
+
+def _previous_run(
+    directory: str, **expected: str
+) -> Optional[Tuple[str, Dict[str, Any]]]:
+    # Newest single-request run with the ``expected`` metadata (same request, project
+    # snapshot and modes) whose plan was checkpointed
+    if not os.path.isdir(directory):
+        return None
+    for run_id in sorted(os.listdir(directory), reverse=True):
+        run_dir = os.path.join(directory, run_id)
+        try:
+            with open(os.path.join(run_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            continue
+        stages = manifest.get("stages", {})
+        metadata = manifest.get("metadata", {})
+        if any(metadata.get(key) != value for key, value in expected.items()):
+            continue
+        if stages.get("plan", {}).get("status") not in (RUN, CACHED):
+            continue
+        outputs = {}
+        for name in ("context", "analysis", "plan"):
+            try:
+                with open(os.path.join(run_dir, f"{name}.pkl"), "rb") as f:
+                    outputs[name] = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                pass
+        if "plan" in outputs:
+            return run_id, outputs
+    return None
+
+
+def _filler(tokens: int) -> str:
+    # Text of about ``tokens`` tokens standing in for a response not generated yet
+    counter = get_token_counter(MODEL_ID)
+    unit = "analysis "
+    per_unit = counter.count(unit * 100) / 100
+    return (unit * max(int(tokens / per_unit), 1)).strip()
+
+
+def estimate_run(
+    user_request: str,
+    project_path: str = "project_old",
+    analysis_mode: str = "separate",
+    output_mode: str = "full",
+    base_dir: Optional[str] = None,
+) -> RunPlan:
+    """
+    Predicts the LLM calls, tokens and duration of a feature request without running it.
+
+    Args:
+        user_request: The feature request.
+        project_path: Directory of the existing project.
+        analysis_mode: Step 5 analysis mode (see ``main.main``).
+        output_mode: Step 7 output mode (see ``main.main``).
+        base_dir: Runs directory searched for previous plans and recorded timings
+            (default: ``PIPELINE_RUNS_DIR``).
+
+    Returns:
+        RunPlan: The predicted calls and totals.
+    """
+    base_dir = base_dir or runs_dir()
+    counter = get_token_counter(MODEL_ID)
+    timings = CallTimings.from_runs(base_dir)
+    stages = FeatureStages(
+        FeatureOptions(
+            user_request,
+            analysis_mode=analysis_mode,
+            output_mode=output_mode,
+            old_project_path=project_path,
+        )
+    )
+
+    project_data = parse_project(project_path)
+    project_tree = get_tree(project_path)
+    tree = {"tree": str(project_tree), "summary": "\n".join(list_tree_paths(project_tree))}
+    ranked = rank_files(project_data, user_request)
+    retrieved = [
+        SimpleNamespace(page_content=f"Path: {item['path']}\nContent:\n{item['content']}")
+        for item in ranked[:RETRIEVAL_TOP_K]
+    ]
+    context = build_context(
+        resolve_dependencies(project_path), tree, format_retrieved_context(retrieved)
+    )
+
+    snapshot = path_fingerprint(project_path)
+    plan = RunPlan(
+        user_request,
+        snapshot=snapshot,
+        files=len(project_data),
+        project_bytes=sum(len(item["content"].encode("utf-8")) for item in project_data),
+        recorded_calls=len(timings),
+    )
+    previous = _previous_run(
+        base_dir,
+        user_request=user_request,
+        project_fingerprint=snapshot,
+        analysis_mode=analysis_mode,
+        output_mode=output_mode,
+    )
+    if previous is not None:
+        run_id, outputs = previous
+        plan.fanout_source = f"run {run_id}"
+        context = outputs.get("context", context)
+    plan.context_tokens = {
+        "project_structure": counter.count(context["tree"]),
+        "dependencies": counter.count(context["dependency_context"]),
+        "retrieved_context": counter.count(context["retrieved_context"]),
+    }
+
+    def call(step: int, label: str, prompt: str, budget: OutputBudget, grounding: str = "") -> None:
+        plan.calls.append(
+            CallEstimate(
+                step,
+                label,
+                budget.task_type,
+                counter.count(generate_prompt(prompt, grounding or None)),
+                timings.completion(budget.task_type, budget),
+                budget.max_new_tokens,
+                timings.predict(budget.task_type),
+            )
+        )
+
+    # Step 5
+    prompts = stages.analysis_prompts(context)
+    analysis_budget = output_budget("analysis", model_id=MODEL_ID)
+    if prompts["combined"] is not None:
+        combined_budget = output_budget(
+            "analysis", model_id=MODEL_ID, max_new_tokens=COMBINED_ANALYSIS_MAX_NEW_TOKENS
+        )
+        call(5, "combined analysis", prompts["combined"], combined_budget, prompts["grounding"])
+    else:
+        for label, prompt in prompts["separate"].items():
+            call(5, label, prompt, analysis_budget, prompts["grounding"])
+
+    # Step 6
+    if previous is not None and "analysis" in previous[1]:
+        analysis_results = previous[1]["analysis"]
+    else:
+        analysis_tokens = timings.completion("analysis", analysis_budget)
+        analysis_results = _filler(3 * analysis_tokens)
+    plan_prompt, plan_grounding = stages.plan_prompt(analysis_results, context["retrieved_context"])
+    call(6, "plan", plan_prompt, output_budget("plan", model_id=MODEL_ID), plan_grounding)
+
+    # Step 7
+    if previous is not None:
+        tasks = dict(previous[1]["plan"]["plan"])
+        for file_info in tasks.get("existing_files", []):
+            file_path = file_info.get("file_path", "")
+            if file_path and os.path.isfile(file_path):
+                with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                    file_info["content"] = f.read()
+    else:
+        tasks = {
+            "existing_files": [
+                {"file_path": item["path"], "task": user_request, "content": item["content"]}
+                for item in ranked[:HEURISTIC_MODIFIED_FILES]
+            ],
+            "new_files": [
+                {
+                    "file_path": os.path.join(project_path, f"new_file_{index + 1}"),
+                    "purpose": user_request,
+                }
+                for index in range(HEURISTIC_NEW_FILES)
+            ],
+        }
+    tasks.update(feature_request=user_request, analysis_results=analysis_results)
+    task_prompts = generate_task_prompts(
+        json.dumps(tasks), budget=stages.task_budget, output_mode=output_mode
+    )
+    existing_files = tasks.get("existing_files", [])
+    task_infos = existing_files + tasks.get("new_files", [])
+    for index, (file_info, prompt) in enumerate(zip(task_infos, task_prompts)):
+        existing = index < len(existing_files)
+        if prompt is None:
+            # Too large for one prompt: edited region by region, estimated from the file
+            prompt = file_info.get("content", "")
+        call(7, file_info.get("file_path", ""), prompt, stages.task_output(file_info, existing))
+    return plan
+
+
+def format_plan(plan: RunPlan) -> str:
+    """
+    Formats a ``RunPlan`` as a text report.
+    """
+    lines = [
+        f"Plan for: {plan.user_request}",
+        f"Project: {plan.files} files, {plan.project_bytes / 1024:.1f} KB "
+        f"(snapshot {plan.snapshot})",
+        "Context tokens: "
+        + ", ".join(f"{name} {tokens}" for name, tokens in plan.context_tokens.items()),
+        f"Step 7 fan-out: {sum(call.step == 7 for call in plan.calls)} files "
+        f"({plan.fanout_source})",
+        "",
+        f"{'step':>4}  {'task type':<9} {'prompt':>7} {'output':>7} {'limit':>6} "
+        f"{'seconds':>8}  call",
+    ]
+    for call in plan.calls:
+        seconds = f"{call.seconds:8.1f}" if call.seconds is not None else f"{'?':>8}"
+        lines.append(
+            f"{call.step:>4}  {call.task_type:<9} {call.prompt_tokens:>7} "
+            f"{call.completion_tokens:>7} {call.max_completion_tokens:>6} {seconds}  {call.label}"
+        )
+    lines.append("")
+    lines.append(
+        f"Total: {len(plan.calls)} LLM calls, {plan.prompt_tokens} prompt tokens, "
+        f"~{plan.completion_tokens} completion tokens"
+    )
+    if plan.seconds is None:
+        lines.append("Predicted LLM time: unknown (no recorded calls; run with --metrics first)")
+    else:
+        lines.append(
+            f"Predicted LLM time: ~{plan.seconds:.0f} s "
+            f"(from {plan.recorded_calls} recorded calls)"
+        )
+    return "\n".join(lines)
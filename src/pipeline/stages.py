@@ -0,0 +1,809 @@
+"""
+Stages of the Factory Feature pipeline.
+
+``add_project_stages`` adds the stages that only depend on the existing
+project: parsing (Step 1), the vector index (Step 2), dependency resolution
+(Step 3) and the project tree. ``FeatureStages`` adds the stages that
+integrate a feature request: context retrieval (Step 4), analysis (Step 5),
+the task plan (Step 6), code generation (Step 7), the project update (Step 8)
+and validation.
+
+Stage outputs are checkpointed by ``src.pipeline.dag.Pipeline``; the update
+and validation stages write to the output project and run on every run.
+
+The vector database modules (LangChain, Chroma, sentence-transformers and
+torch) take seconds to import, so they are imported when the index stage runs
+or its checkpoint is loaded, not when this module is imported.
+"""
+
+import json
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from src.analysis.dependency_resolver import resolve_dependencies
+from src.analysis.project_parser import parse_project
+from src.analysis.tree import get_tree, list_tree_paths
+from src.generation.overlay import ProjectOverlay
+from src.generation.plan_stream import PLAN_FIELDS, PlanStreamParser
+from src.generation.preprocessing import (
+    extract_json_from_response,
+    get_prompt_request,
+    parse_feature_analysis,
+)
+from src.generation.project_structure import (
+    build_overlay,
+    clone_project,
+    create_expected_files_from_json,
+    resolve_new_file_path,
+    update_project_structure,
+    validate_project_consistency,
+)
+from src.generation.region_sharding import generate_sharded, should_shard
+from src.generation.task_prompts import generate_task_prompts
+from src.models.llm_inference import MAX_NEW_TOKENS, MODEL_ID, query_llm
+from src.models.output_governor import output_budget
+from src.models.prompt_templates import get_prompt_template
+from src.models.token_budget import PromptBudget, PromptSection
+from src.pipeline.dag import CACHED, Pipeline, Stage, path_fingerprint
+from src.utils.file_operations import stream_to_file
+from src.utils.logger import logger
+from src.utils.metrics import bind_run_metrics
+from src.utils.tools import count_tasks_from_json, extract_file_content
+from src.vector_database.db_query import retrieve_context
+
+# Step 5 analysis modes: three calls (nodes, edges, impact) or one structured call
+ANALYSIS_MODES = ("separate", "combined")
+
+# The combined analysis answers all three questions, so it gets their output budget
+COMBINED_ANALYSIS_MAX_NEW_TOKENS = 3 * MAX_NEW_TOKENS
+
+# Step 7 tasks dispatched in parallel while the Step 6 plan is streaming
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "4"))
+
+# Vector index location inside the run directory
+INDEX_DIRECTORY = "chroma_db"
+
+# Stages shared by every feature request of a pipeline
+PROJECT_STAGES = ("parse", "index", "dependencies", "tree")
+
+Reporter = Callable[[str], None]
+
+
+def add_project_stages(pipeline: Pipeline, project_path: str, report: Reporter) -> None:
+    """
+    Adds the stages that analyze the existing project.
+
+    ``parse`` is fingerprinted from the paths, sizes and modification times of
+    the project files, so editing the project invalidates every later stage.
+    ``index``, ``dependencies`` and ``tree`` only wait for ``parse`` and run in
+    parallel.
+
+    Args:
+        pipeline: The pipeline to add the stages to.
+        project_path: Directory of the existing project.
+        report: Receives progress messages.
+    """
+
+    def parse(inputs: Mapping[str, Any]) -> List[Dict[str, str]]:
+        report("[Step 1/8] Parsing project structure...")
+        project_data = parse_project(project_path)
+        report(f"✓ Project parsed successfully ({len(project_data)} files)")
+        return project_data
+
+    def index(inputs: Mapping[str, Any]):
+        report("[Step 2/8] Building vector database for context retrieval...")
+        persist_directory = os.path.join(pipeline.run_dir, INDEX_DIRECTORY)
+        # A rebuilt index must not add to the documents of an invalidated one
+        shutil.rmtree(persist_directory, ignore_errors=True)
+        from src.vector_database.db_builder import build_vector_database
+
+        vector_db = build_vector_database(inputs["parse"], persist_directory=persist_directory)
+        report("✓ Vector database created successfully")
+        return vector_db
+
+    def load_index(meta: Dict[str, Any], run_dir: str):
+        from src.vector_database.db_load import load_vector_database
+
+        return load_vector_database(os.path.join(run_dir, meta["persist_directory"]))
+
+    def dependencies(inputs: Mapping[str, Any]) -> Dict[str, List[str]]:
+        report("[Step 3/8] Resolving project dependencies...")
+        resolved = resolve_dependencies(project_path)
+        dep_types = list(resolved.keys())
+        report(f"✓ Dependencies resolved: {', '.join(dep_types) if dep_types else 'None'}")
+        return resolved
+
+    def tree(inputs: Mapping[str, Any]) -> Dict[str, str]:
+        project_tree = get_tree(project_path)
+        return {"tree": str(project_tree), "summary": "\n".join(list_tree_paths(project_tree))}
+
+    pipeline.add(
+        Stage(
+            "parse",
+            parse,
+            params={"project": project_path, "snapshot": path_fingerprint(project_path)},
+            error="✗ Failed to parse project",
+        )
+    )
+    pipeline.add(
+        Stage(
+            "index",
+            index,
+            inputs=("parse",),
+            # Chroma persists itself; the checkpoint only records where
+            save=lambda vector_db, run_dir: {"persist_directory": INDEX_DIRECTORY},
+            load=load_index,
+            error="✗ Failed to build vector database",
+        )
+    )
+    pipeline.add(
+        Stage(
+            "dependencies",
+            dependencies,
+            inputs=("parse",),
+            params={"project": project_path},
+            error="✗ Dependency resolution failed",
+        )
+    )
+    pipeline.add(
+        Stage(
+            "tree",
+            tree,
+            inputs=("parse",),
+            params={"project": project_path},
+            error="✗ Failed to build project tree",
+        )
+    )
+
+
+def build_context(
+    dependencies: Mapping[str, List[str]], tree: Mapping[str, str], retrieved_context: str
+) -> Dict[str, Any]:
+    """
+    Assembles the Step 4 project context shared by the Step 5 and Step 6 prompts.
+
+    Args:
+        dependencies: Output of the ``dependencies`` stage.
+        tree: Output of the ``tree`` stage.
+        retrieved_context: Documents retrieved for the feature request, formatted.
+    """
+    return {
+        "dependency_context": "\n".join(f"{key}: {value}" for key, value in dependencies.items()),
+        "dependency_summary": "\n".join(
+            f"{key}: {', '.join(line.strip() for line in value if line.strip())}"
+            for key, value in dependencies.items()
+        ),
+        "tree": tree["tree"],
+        "tree_summary": tree["summary"],
+        "retrieved_context": retrieved_context,
+    }
+
+
+@dataclass
+class FeatureOptions:
+    """
+    Options of a feature integration run (see ``main.main`` for details).
+    """
+
+    user_request: str
+    stream: bool = False
+    on_event: Optional[Callable[[str, str], None]] = None
+    analysis_mode: str = "separate"
+    output_mode: str = "full"
+    shard_large_files: bool = False
+    early_dispatch: bool = False
+    old_project_path: str = "project_old"
+    new_project_path: str = "project_new"
+    in_memory: bool = False
+
+
+class FeatureStages:
+    """
+    The stages integrating one feature request into the parsed project.
+
+    Attributes:
+        options: The run options.
+        prefix: Prepended to the stage names (e.g. ``"req-1."``) so several
+            requests can share one pipeline; empty for a single request.
+        budget: Prompt budget of the Step 5 prompts. Step 6 and Step 7 prompts are
+            fitted per call, leaving room for the output budget of the call (see
+            ``prompt_budget``).
+    """
+
+    def __init__(self, options: FeatureOptions, prefix: str = ""):
+        self.options = options
+        self.prefix = prefix
+        self.budget = self.prompt_budget(output_budget("analysis", model_id=MODEL_ID))
+        self.pipeline: Optional[Pipeline] = None
+
+    def report(self, message: str) -> None:
+        if self.prefix:
+            message = f"[{self.prefix.rstrip('.')}] {message}"
+        logger.info(message)
+        if self.options.on_event:
+            self.options.on_event("status", message)
+
+    def ask(self, prompt: str, **kwargs: Any) -> str:
+        # Query the LLM, forwarding streamed tokens to on_event in streaming mode
+        if not self.options.stream:
+            return query_llm(user_input=prompt, **kwargs)
+        chunks = []
+        for chunk in query_llm(user_input=prompt, stream=True, **kwargs):
+            chunks.append(chunk)
+            if self.options.on_event:
+                self.options.on_event("token", chunk)
+        return "".join(chunks).strip()
+
+    def name(self, stage: str) -> str:
+        """
+        Returns the pipeline name of one of these stages (project stages are shared).
+        """
+        return stage if stage in PROJECT_STAGES else f"{self.prefix}{stage}"
+
+    def add_to(self, pipeline: Pipeline) -> None:
+        """
+        Adds the feature stages after the project stages of ``pipeline``.
+
+        With a ``prefix``, several requests can be added to one pipeline: their
+        stages are named ``<prefix><stage>`` and share the project stages.
+        """
+        self.pipeline = pipeline
+        options = self.options
+        request = {"user_request": options.user_request, "model": MODEL_ID}
+        tasks = {
+            **request,
+            "output_mode": options.output_mode,
+            "shard_large_files": options.shard_large_files,
+        }
+        self._add(
+            "context",
+            self.context,
+            ("index", "dependencies", "tree"),
+            request,
+            "✗ Failed to build project context",
+        )
+        self._add(
+            "analysis",
+            self.analysis,
+            ("context",),
+            {**request, "analysis_mode": options.analysis_mode},
+            "✗ Feature analysis failed",
+        )
+        self._add(
+            "plan",
+            self.plan,
+            ("context", "analysis"),
+            {**tasks, "early_dispatch": options.early_dispatch},
+            "✗ Preprocessing failed",
+        )
+        self._add(
+            "tasks",
+            self.tasks,
+            ("context", "analysis", "plan"),
+            tasks,
+            "✗ Task execution failed",
+        )
+        # Update and validation write the output project, so they run on every run
+        self._add(
+            "update",
+            self.update,
+            ("plan", "tasks"),
+            {**tasks, "output": options.new_project_path},
+            "✗ Failed to update project structure",
+            checkpoint=False,
+        )
+        self._add(
+            "validate",
+            self.validate,
+            ("plan", "update"),
+            {"output": options.new_project_path},
+            "✗ Validation failed",
+            checkpoint=False,
+        )
+
+    def _add(
+        self,
+        stage: str,
+        fn: Callable[[Mapping[str, Any]], Any],
+        inputs: Tuple[str, ...],
+        params: Dict[str, Any],
+        error: str,
+        checkpoint: bool = True,
+    ) -> None:
+        run = fn
+        if self.prefix:
+            # Stage methods read their inputs by unprefixed stage name
+            run = lambda values: fn({name: values[self.name(name)] for name in inputs})
+        self.pipeline.add(
+            Stage(
+                self.name(stage),
+                run,
+                inputs=tuple(self.name(name) for name in inputs),
+                params=params,
+                checkpoint=checkpoint,
+                error=error,
+            )
+        )
+
+    def context(self, inputs: Mapping[str, Any]) -> Dict[str, Any]:
+        self.report("[Step 4/8] Building project context...")
+        # Retrieve once for the feature request; Steps 5 and 6 share this context
+        retrieved_documents, retrieved_context = retrieve_context(
+            inputs["index"], self.options.user_request
+        )
+        self.report(f"  - Retrieved {len(retrieved_documents)} relevant documents")
+        self.report("✓ Project context built successfully")
+        return build_context(inputs["dependencies"], inputs["tree"], retrieved_context)
+
+    def analysis_prompts(self, context: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Builds the Step 5 prompts from the project context.
+
+        Returns:
+            Dict[str, Any]: ``grounding`` (the fitted retrieved context),
+            ``combined`` (the single-call prompt, None in ``separate`` mode) and
+            ``separate`` (the ``nodes``, ``edges`` and ``impact_report`` prompts).
+        """
+        user_request = self.options.user_request
+
+        # Get prompt templates
+        feature_nodes_template = get_prompt_template("feature_analysis_nodes")
+        feature_edges_template = get_prompt_template("feature_analysis_edges")
+        impact_report_template = get_prompt_template("feature_impact_report")
+        combined_template = get_prompt_template("feature_analysis_combined")
+        combined = self.options.analysis_mode == "combined"
+
+        # Fit the project context and retrieved context into the model's context window
+        templates = [feature_nodes_template, feature_edges_template, impact_report_template]
+        analysis_budget = self.budget
+        if combined:
+            templates.append(combined_template)
+            analysis_budget = self.prompt_budget(
+                output_budget(
+                    "analysis", model_id=MODEL_ID, max_new_tokens=COMBINED_ANALYSIS_MAX_NEW_TOKENS
+                )
+            )
+        longest_template = max(templates, key=len)
+        fitted = analysis_budget.fit(
+            [
+                PromptSection(
+                    "instructions",
+                    longest_template.format(feature_request="", project_context=""),
+                    fixed=True,
+                ),
+                PromptSection("feature_request", user_request, fixed=True),
+                PromptSection(
+                    "project_structure",
+                    context["tree"],
+                    priority=30,
+                    summarize=lambda _: context["tree_summary"],
+                ),
+                PromptSection(
+                    "dependencies",
+                    context["dependency_context"],
+                    priority=20,
+                    summarize=lambda _: context["dependency_summary"],
+                ),
+                PromptSection("retrieved_context", context["retrieved_context"], priority=10),
+            ],
+            label="Step 5 analysis",
+        )
+        project_context = (
+            f"{fitted['dependencies']}\n\nProject Structure:\n{fitted['project_structure']}"
+        )
+        return {
+            "grounding": fitted["retrieved_context"],
+            "combined": combined_template.format(
+                feature_request=user_request, project_context=project_context
+            )
+            if combined
+            else None,
+            "separate": {
+                "nodes": feature_nodes_template.format(
+                    feature_request=user_request, project_context=project_context
+                ),
+                "edges": feature_edges_template.format(
+                    feature_request=user_request, project_context=project_context
+                ),
+                "impact_report": impact_report_template.format(
+                    feature_request=user_request, project_context=project_context
+                ),
+            },
+        }
+
+    def analysis(self, inputs: Mapping[str, Any]) -> str:
+        self.report("[Step 5/8] Performing AI-powered feature analysis...")
+        prompts = self.analysis_prompts(inputs["context"])
+        analysis_grounding = prompts["grounding"]
+
+        analysis = None
+        if prompts["combined"] is not None:
+            self.report("  - Analyzing feature nodes, edges and impact in a single call...")
+            analysis = parse_feature_analysis(
+                self.ask(
+                    prompts["combined"],
+                    grounding=analysis_grounding,
+                    output=output_budget(
+                        "analysis", model_id=MODEL_ID, max_new_tokens=COMBINED_ANALYSIS_MAX_NEW_TOKENS
+                    ),
+                )
+            )
+            if analysis is None:
+                logger.warning("⚠ Combined analysis could not be parsed, falling back to three calls")
+
+        if analysis is None:
+            # Query LLM for analysis
+            separate = prompts["separate"]
+            analysis_output = output_budget("analysis", model_id=MODEL_ID)
+            self.report("  - Analyzing feature nodes...")
+            feature_nodes_response = self.ask(
+                separate["nodes"], grounding=analysis_grounding, output=analysis_output
+            )
+
+            self.report("  - Analyzing feature edges...")
+            feature_edges_response = self.ask(
+                separate["edges"], grounding=analysis_grounding, output=analysis_output
+            )
+
+            self.report("  - Generating impact report...")
+            impact_report_response = self.ask(
+                separate["impact_report"], grounding=analysis_grounding, output=analysis_output
+            )
+
+            analysis = {
+                "nodes": feature_nodes_response,
+                "edges": feature_edges_response,
+                "impact_report": impact_report_response,
+            }
+
+        self.report("✓ Feature analysis completed successfully")
+        # Combine analysis results
+        return (
+            f"Nodes:\n{analysis['nodes']}\n\n"
+            f"Edges:\n{analysis['edges']}\n\n"
+            f"Impact Report:\n{analysis['impact_report']}"
+        )
+
+    @staticmethod
+    def prompt_budget(output) -> PromptBudget:
+        """
+        Returns the budget of a prompt whose call has the output budget ``output``.
+
+        The context window keeps room for the response and its continuations.
+        """
+        return PromptBudget.for_model(MODEL_ID, max_new_tokens=output.reserved_tokens())
+
+    def task_budget(self, file_info: Dict[str, Any], existing: bool) -> PromptBudget:
+        """
+        Returns the prompt budget of a Step 7 task (see ``generate_task_prompts``).
+        """
+        return self.prompt_budget(self.task_output(file_info, existing))
+
+    def task_output(self, file_info: Dict[str, Any], existing: bool):
+        # Output budget of a Step 7 task, sized from the file it rewrites
+        if not existing:
+            return output_budget("new_file", model_id=MODEL_ID)
+        task_type = "patch" if self.options.output_mode == "patch" else "code"
+        return output_budget(task_type, file_info.get("content", ""), model_id=MODEL_ID)
+
+    def shards(self, file_info: Dict[str, Any]) -> bool:
+        # Whether --shard-large-files edits this file region by region
+        return self.options.shard_large_files and should_shard(file_info.get("content", ""))
+
+    def execute_task(
+        self,
+        file_info: Dict[str, Any],
+        task_prompt: str,
+        existing: bool,
+        analysis_results: str,
+        retrieved_context: str,
+    ) -> str:
+        # Run one Step 7 task without streaming. Large files, and files whose task prompt
+        # does not fit the model (None), are edited region by region.
+        if existing and (task_prompt is None or self.shards(file_info)):
+            sharded = generate_sharded(
+                file_info.get("file_path", ""),
+                file_info["content"],
+                file_info.get("task", ""),
+                self.options.user_request,
+                analysis_results,
+                generate=lambda prompt, source: query_llm(
+                    user_input=prompt, output=output_budget("code", source, model_id=MODEL_ID)
+                ),
+                context=retrieved_context,
+                budget=lambda source: self.prompt_budget(
+                    output_budget("code", source, model_id=MODEL_ID)
+                ),
+            )
+            self.report(
+                f"      {file_info.get('file_path', '')}: {len(sharded.edited)} regions "
+                f"regenerated, {sharded.copied} copied, {len(sharded.reverted)} reverted"
+            )
+            return sharded.content
+        return query_llm(user_input=task_prompt, output=self.task_output(file_info, existing))
+
+    def plan_prompt(self, analysis_results: str, retrieved_context: str) -> Tuple[str, str]:
+        """
+        Builds the Step 6 prompt from the analysis results.
+
+        Returns:
+            Tuple[str, str]: The prompt and its grounding (the fitted retrieved context).
+        """
+        options = self.options
+        preprocessing_template = get_prompt_request("preprocessing_request")
+        plan_budget = self.prompt_budget(output_budget("plan", model_id=MODEL_ID))
+        fitted = plan_budget.fit(
+            [
+                PromptSection(
+                    "instructions",
+                    preprocessing_template.format(
+                        feature_request=options.user_request, analysis_results=""
+                    ),
+                    fixed=True,
+                ),
+                PromptSection("analysis_results", analysis_results, priority=30),
+                PromptSection("retrieved_context", retrieved_context, priority=10),
+            ],
+            label="Step 6 preprocessing",
+        )
+        preprocessing_prompt = preprocessing_template.format(
+            feature_request=options.user_request,
+            analysis_results=fitted["analysis_results"],
+        )
+        return preprocessing_prompt, fitted["retrieved_context"]
+
+    def plan(self, inputs: Mapping[str, Any]) -> Dict[str, Any]:
+        self.report("[Step 6/8] Preprocessing analysis results and extracting tasks...")
+        options = self.options
+        analysis_results = inputs["analysis"]
+        retrieved_context = inputs["context"]["retrieved_context"]
+
+        preprocessing_prompt, plan_grounding = self.plan_prompt(analysis_results, retrieved_context)
+        plan_output = output_budget("plan", model_id=MODEL_ID)
+
+        # Early dispatch: tasks started from plan entries while Step 6 is still streaming
+        early_tasks: Dict[Tuple[str, int], Tuple[str, Future]] = {}
+
+        executor = ThreadPoolExecutor(max_workers=TASK_WORKERS) if options.early_dispatch else None
+        try:
+            if options.early_dispatch:
+                plan_parser = PlanStreamParser()
+                chunks = []
+                for chunk in query_llm(
+                    user_input=preprocessing_prompt,
+                    grounding=plan_grounding,
+                    stream=True,
+                    output=plan_output,
+                ):
+                    chunks.append(chunk)
+                    if options.stream and options.on_event:
+                        options.on_event("token", chunk)
+                    for section, index, entry in plan_parser.feed(chunk):
+                        if not all(key in plan_parser.fields for key in PLAN_FIELDS):
+                            continue  # dispatched in Step 7 once the whole plan is known
+                        existing = section == "existing_files"
+                        if existing and entry.get("file_path"):
+                            entry["content"] = extract_file_content(entry["file_path"])
+                        entry_plan = {**plan_parser.fields, section: [entry]}
+                        try:
+                            task_prompt = generate_task_prompts(
+                                json.dumps(entry_plan),
+                                budget=self.task_budget,
+                                output_mode=options.output_mode,
+                            )[0]
+                        except (KeyError, ValueError):
+                            continue  # incomplete entry; Step 7 handles it with the full plan
+                        if task_prompt is None:
+                            continue  # too large for one prompt; edited region by region in Step 7
+                        early_tasks[(section, index)] = (
+                            task_prompt,
+                            executor.submit(
+                                bind_run_metrics(self.execute_task),
+                                entry,
+                                task_prompt,
+                                existing,
+                                analysis_results,
+                                retrieved_context,
+                            ),
+                        )
+                preprocessing_response = "".join(chunks).strip()
+                self.report(f"  - Dispatched {len(early_tasks)} tasks while the plan was streaming")
+            else:
+                preprocessing_response = self.ask(
+                    preprocessing_prompt, grounding=plan_grounding, output=plan_output
+                )
+
+            # Extract JSON object from response
+            json_object = extract_json_from_response(preprocessing_response)
+            if not json_object:
+                raise ValueError("No valid JSON found in preprocessing response")
+
+            # Enrich JSON with file contents
+            for file_info in json_object.get("existing_files", []):
+                file_path = file_info.get("file_path", "")
+                if file_path:
+                    file_info["content"] = extract_file_content(file_path)
+
+            # Count and log tasks
+            json_data = json.dumps(json_object, indent=4)
+            task_count = count_tasks_from_json(json_data)
+            self.report(f"✓ Preprocessing completed: {task_count} tasks identified")
+
+            # Early results are checkpointed with the plan; failed ones are rerun in Step 7
+            early: Dict[str, Tuple[str, str]] = {}
+            for (section, index), (task_prompt, future) in early_tasks.items():
+                try:
+                    early[f"{section}/{index}"] = (task_prompt, future.result())
+                except Exception as e:
+                    logger.warning(
+                        f"⚠ Early task {section}[{index}] failed, retrying in Step 7: {e}"
+                    )
+        finally:
+            if executor is not None:
+                # If the plan failed, tasks not started yet are cancelled instead of spending
+                # LLM calls on a plan that is discarded
+                executor.shutdown(cancel_futures=True)
+        return {"plan": json_object, "json_data": json_data, "early": early}
+
+    def tasks(self, inputs: Mapping[str, Any]) -> List[str]:
+        self.report("[Step 7/8] Generating task prompts and executing code generation...")
+        options = self.options
+        plan = inputs["plan"]
+        json_object = plan["plan"]
+        analysis_results = inputs["analysis"]
+        retrieved_context = inputs["context"]["retrieved_context"]
+
+        task_prompts = generate_task_prompts(
+            plan["json_data"], budget=self.task_budget, output_mode=options.output_mode
+        )
+        task_responses: List[str] = []
+
+        # Large files, and files too large for their task prompt, are edited region by region
+        existing_tasks = json_object.get("existing_files", [])
+        task_infos = existing_tasks + json_object.get("new_files", [])
+        sharded_tasks = {
+            index
+            for index, file_info in enumerate(existing_tasks, start=1)
+            if task_prompts[index - 1] is None or self.shards(file_info)
+        }
+        if sharded_tasks:
+            self.report(f"  - Editing {len(sharded_tasks)} large files region by region")
+
+        self.report(f"  - Executing {len(task_prompts)} LLM queries...")
+        if options.stream:
+            task_files = [file_info.get("file_path", "") for file_info in task_infos]
+            # Patches are applied in Step 8; only complete files are streamed to disk
+            patched_tasks = len(existing_tasks) if options.output_mode == "patch" else 0
+        if options.stream and not options.in_memory:
+            # Clone up front so each generated file can be streamed to its output path.
+            # Existing files are all rewritten (streamed here or written in Step 8).
+            clone_project(
+                options.old_project_path,
+                options.new_project_path,
+                rewritten=task_files[: len(existing_tasks)],
+            )
+
+        for i, task_prompt in enumerate(task_prompts, start=1):
+            self.report(f"    Processing task {i}/{len(task_prompts)}...")
+            existing = i <= len(existing_tasks)
+            key = (
+                f"existing_files/{i - 1}"
+                if existing
+                else f"new_files/{i - 1 - len(existing_tasks)}"
+            )
+            early_prompt, early_response = plan["early"].get(key, (None, None))
+            if task_prompt is not None and early_prompt == task_prompt:
+                # Dispatched during Step 6 with the same prompt the full plan produces
+                task_response = early_response
+                if options.stream and not options.in_memory and not existing:
+                    output_path = resolve_new_file_path(
+                        task_files[i - 1], options.old_project_path, options.new_project_path
+                    )
+                    stream_to_file(iter([task_response]), output_path)
+            elif i in sharded_tasks:
+                task_response = self.execute_task(
+                    task_infos[i - 1], task_prompt, existing, analysis_results, retrieved_context
+                )
+            elif options.stream and i <= patched_tasks:
+                task_response = self.ask(
+                    task_prompt, output=self.task_output(task_infos[i - 1], existing)
+                )
+            elif options.stream:
+                output_path = resolve_new_file_path(
+                    task_files[i - 1], options.old_project_path, options.new_project_path
+                )
+                if options.on_event:
+                    options.on_event("file", output_path)
+                output = self.task_output(task_infos[i - 1], existing)
+                if options.in_memory:
+                    # Step 8 keeps the file in memory; only the tokens are streamed
+                    task_response = self.ask(task_prompt, output=output)
+                else:
+                    task_response = stream_to_file(
+                        query_llm(user_input=task_prompt, stream=True, output=output),
+                        output_path,
+                        on_chunk=(lambda chunk: options.on_event("token", chunk))
+                        if options.on_event
+                        else None,
+                    )
+            else:
+                task_response = self.execute_task(
+                    task_infos[i - 1], task_prompt, existing, analysis_results, retrieved_context
+                )
+            task_responses.append(task_response)
+
+        self.report("✓ All tasks executed successfully")
+        return task_responses
+
+    def truncated_files(self, plan: Mapping[str, Any]) -> Set[str]:
+        # Existing files whose patch-mode task prompt showed truncated content: a model that
+        # echoes the file instead of editing it would drop the truncated part. Sharded files
+        # are answered with the whole file, regenerated region by region.
+        if self.options.output_mode != "patch":
+            return set()
+        existing_files = plan["plan"].get("existing_files", [])
+        task_prompts = generate_task_prompts(
+            plan["json_data"], budget=self.task_budget, output_mode="patch"
+        )
+        return {
+            file_info["file_path"]
+            for file_info, task_prompt in zip(existing_files, task_prompts)
+            if task_prompt is not None
+            and not self.shards(file_info)
+            and file_info.get("content", "") not in task_prompt
+        }
+
+    def update(self, inputs: Mapping[str, Any]) -> Any:
+        # Returns the patch results, or the ProjectOverlay of the project kept in memory
+        self.report("[Step 8/8] Updating project structure with generated code...")
+        options = self.options
+        truncated = self.truncated_files(inputs["plan"])
+        if options.in_memory:
+            overlay, patch_results = build_overlay(
+                inputs["plan"]["json_data"],
+                inputs["tasks"],
+                options.old_project_path,
+                options.new_project_path,
+                output_mode=options.output_mode,
+                truncated=truncated,
+            )
+        else:
+            # Streamed files are already in place unless Step 7 was reused from a checkpoint
+            clone = not options.stream or self.pipeline.status.get(self.name("tasks")) == CACHED
+            patch_results = update_project_structure(
+                inputs["plan"]["json_data"],
+                inputs["tasks"],
+                options.old_project_path,
+                options.new_project_path,
+                clone=clone,
+                output_mode=options.output_mode,
+                truncated=truncated,
+                # A new clone would drop the new files streamed by the reused Step 7
+                new_files=options.stream and clone,
+            )
+        if patch_results:
+            conflicts = sum(len(result.conflicts) for result in patch_results.values())
+            applied = sum(result.applied for result in patch_results.values())
+            self.report(f"  - Applied {applied} edits to {len(patch_results)} files")
+            if conflicts:
+                logger.warning(f"⚠ {conflicts} edits could not be applied (see patch conflicts above)")
+        if options.in_memory:
+            self.report(f"✓ Updated project kept in memory ({len(overlay.changes)} files changed)")
+            return overlay
+        self.report("✓ Project files updated successfully")
+        return patch_results
+
+    def validate(self, inputs: Mapping[str, Any]) -> bool:
+        self.report("Validating updated project structure...")
+        expected_files = create_expected_files_from_json(inputs["plan"]["json_data"])
+        update = inputs["update"]
+        overlay = update if isinstance(update, ProjectOverlay) else None
+        if not validate_project_consistency(
+            self.options.new_project_path, expected_files, overlay=overlay
+        ):
+            raise RuntimeError("Project structure has inconsistencies")
+        self.report("✓ Project structure validation passed")
+        return True
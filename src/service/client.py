@@ -0,0 +1,177 @@
+"""
+Client of the pipeline worker's job API (see ``src.service.worker``).
+
+Usage::
+
+    client = WorkerClient("127.0.0.1:8765")   # or "unix:/tmp/factory.sock"; reads the token
+    job = client.submit("Add logging", project_path="project_old", output_path="project_new")
+    for line in client.follow(job["id"]):
+        print(line)
+    result = client.result(job["id"])
+    client.download(job["id"], "project_new.zip")
+"""
+
+import http.client
+import json
+import os
+import socket
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlencode
+
+from src.service.worker import DEFAULT_ADDRESS, load_token, parse_address
+
+
+class WorkerError(RuntimeError):
+    """
+    Raised when the worker rejects a request or cannot be reached.
+
+    Attributes:
+        status: HTTP status of the response (0 if the worker was not reached).
+    """
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+class WorkerClient:
+    """
+    Submits jobs to a running worker and reads their logs and results.
+
+    Attributes:
+        address: ``HOST:PORT`` or ``unix:PATH`` of the worker.
+        timeout: Socket timeout of requests in seconds (log streams wait longer).
+        token: Token of the job API (default: ``src.service.worker.load_token()``).
+    """
+
+    def __init__(
+        self, address: Optional[str] = None, timeout: float = 30.0, token: Optional[str] = None
+    ):
+        self.address = address or os.getenv("FACTORY_WORKER_ADDRESS", DEFAULT_ADDRESS)
+        self.timeout = timeout
+        self.token = token or load_token()
+        self._target: Tuple[str, Any] = parse_address(self.address)
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def _connect(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        kind, target = self._target
+        if kind == "unix":
+            return _UnixHTTPConnection(target, timeout=timeout)
+        return http.client.HTTPConnection(target[0], target[1], timeout=timeout)
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Any:
+        connection = self._connect(self.timeout)
+        try:
+            data = json.dumps(body).encode("utf-8") if body is not None else None
+            headers = self._headers()
+            if data is not None:
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException) as e:
+            raise WorkerError(f"Cannot reach worker at {self.address}: {e}") from e
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise WorkerError(payload.get("error", f"HTTP {response.status}"), response.status)
+        return payload
+
+    def health(self) -> Dict[str, Any]:
+        """
+        Returns the worker status; raises ``WorkerError`` if it is not running.
+        """
+        return self._request("GET", "/health")
+
+    def submit(self, prompt: Optional[str], **options: Any) -> Dict[str, Any]:
+        """
+        Queues a feature request.
+
+        Args:
+            prompt: The feature request (optional when resuming a run).
+            **options: ``project_path``, ``output_path`` and ``main.main`` options
+                (``analysis_mode``, ``output_mode``, ``shard_large_files``,
+                ``early_dispatch``, ``run_id``, ``resume``). None values are omitted.
+
+        Returns:
+            Dict[str, Any]: The queued job.
+        """
+        payload = {"prompt": prompt, **options}
+        payload = {key: value for key, value in payload.items() if value is not None}
+        return self._request("POST", "/jobs", payload)
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def logs(self, job_id: str, since: int = 0) -> Dict[str, Any]:
+        """
+        Returns the log lines of a job from line ``since`` on, and the index of the next line.
+        """
+        return self._request("GET", f"/jobs/{job_id}/logs?{urlencode({'since': since})}")
+
+    def follow(self, job_id: str, since: int = 0) -> Iterator[str]:
+        """
+        Yields the log lines of a job as they are written, until the job finishes.
+        """
+        # Lines may be minutes apart while the model generates
+        connection = self._connect(timeout=None)
+        try:
+            query = urlencode({"since": since, "follow": 1})
+            connection.request("GET", f"/jobs/{job_id}/logs?{query}", headers=self._headers())
+            response = connection.getresponse()
+            if response.status >= 400:
+                payload = json.loads(response.read() or b"{}")
+                raise WorkerError(payload.get("error", f"HTTP {response.status}"), response.status)
+            for raw in response:
+                record = json.loads(raw)
+                if "line" in record:
+                    yield record["line"]
+        except (OSError, http.client.HTTPException) as e:
+            raise WorkerError(f"Lost connection to worker at {self.address}: {e}") from e
+        finally:
+            connection.close()
+
+    def download(self, job_id: str, path: str) -> str:
+        """
+        Saves the ZIP archive of a succeeded job's output to ``path`` as it is streamed.
+
+        Returns:
+            str: ``path``.
+        """
+        connection = self._connect(timeout=None)
+        try:
+            connection.request("GET", f"/jobs/{job_id}/archive", headers=self._headers())
+            response = connection.getresponse()
+            if response.status >= 400:
+                payload = json.loads(response.read() or b"{}")
+                raise WorkerError(payload.get("error", f"HTTP {response.status}"), response.status)
+            with open(path, "wb") as f:
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        except (http.client.HTTPException, ConnectionError) as e:
+            raise WorkerError(f"Lost connection to worker at {self.address}: {e}") from e
+        finally:
+            connection.close()
+        return path
+
+    def result(self, job_id: str) -> Dict[str, Any]:
+        """
+        Returns the result of a finished job (status 409 while it is running).
+        """
+        return self._request("GET", f"/jobs/{job_id}/result")
@@ -0,0 +1,628 @@
+"""
+Resident pipeline worker with a local job API.
+
+Every ``python main.py`` invocation pays for importing torch, langchain and
+chromadb and for loading the embedding model before doing any work. The
+worker pays that once: ``python -m src.service.worker`` imports the pipeline,
+then serves jobs over HTTP on a local TCP port or a Unix socket. Jobs wait in
+a queue and a pool of threads runs them with ``main.main``. The LLM backend,
+the response cache and the embedding model stay warm between jobs, and a
+``StageMemo`` keeps the parsed and indexed project of recent jobs in memory.
+
+Every request except ``GET /health`` must carry the worker's token as
+``Authorization: Bearer <token>``, and ``POST`` bodies must be sent as
+``application/json``. Without them, any web page open in the user's browser
+could submit jobs to a worker on localhost. The token is ``FACTORY_WORKER_TOKEN``
+or, if that is not set, a random token the worker writes to
+``FACTORY_WORKER_TOKEN_FILE`` (readable by the user only), where the client
+finds it. Job paths are relative to the worker's root directory: absolute
+paths and ``..`` are rejected, and an output may not overlap its project.
+
+API (JSON bodies and responses)::
+
+    GET  /health                  worker status and queue length
+    POST /jobs                    submit {"prompt": ..., options} -> job
+    GET  /jobs                    all jobs
+    GET  /jobs/<id>               job status
+    GET  /jobs/<id>/logs?since=N  log lines from line N; with ``follow=1`` the
+                                  lines are streamed as JSON Lines until the job ends
+    GET  /jobs/<id>/result        run id, output path and files of a finished job
+    GET  /jobs/<id>/archive       ZIP of a succeeded job's output, streamed while it is
+                                  compressed (see ``src.utils.archive``)
+    GET  /metrics                 span and counter metrics of the worker (Prometheus text)
+
+Environment variables:
+    FACTORY_WORKER_ADDRESS: ``HOST:PORT`` or ``unix:PATH`` (default: ``127.0.0.1:8765``).
+    FACTORY_WORKER_POOL: Jobs run concurrently (default: 2).
+    FACTORY_WORKER_JOBS_DIR: Output of jobs submitted without ``output_path``
+        (default: ``runs/jobs``).
+    FACTORY_WORKER_ROOT: Directory job paths are relative to (default: the current directory).
+    FACTORY_WORKER_TOKEN: Token required by the job API (default: generated).
+    FACTORY_WORKER_TOKEN_FILE: Where a generated token is written (default: ``runs/worker.token``).
+"""
+
+import argparse
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import socketserver
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from src.pipeline.dag import StageMemo, check_run_id
+from src.utils.archive import directory_entries, stream_archive
+from src.utils.metrics import prometheus_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+DEFAULT_POOL_SIZE = 2
+DEFAULT_JOBS_DIR = os.path.join("runs", "jobs")
+DEFAULT_TOKEN_FILE = os.path.join("runs", "worker.token")
+
+# Finished jobs kept for status and result queries
+MAX_FINISHED_JOBS = 200
+
+# Project stages (see src.pipeline.stages) kept in memory across jobs
+MEMO_STAGES = ("parse", "index", "dependencies", "tree")
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# Options of ``main.main`` a job may set
+JOB_OPTIONS = {
+    "analysis_mode": str,
+    "output_mode": str,
+    "shard_large_files": bool,
+    "early_dispatch": bool,
+    "run_id": str,
+    "resume": bool,
+    "metrics": bool,
+    "profile": bool,
+}
+
+
+@dataclass
+class Job:
+    """
+    A feature request submitted to the worker.
+
+    Attributes:
+        id: Job identifier.
+        prompt: The feature request (empty when resuming a run).
+        options: ``main.main`` options (see ``JOB_OPTIONS``).
+        project_path: Directory of the existing project.
+        output_path: Directory receiving the updated project.
+        status: ``queued``, ``running``, ``succeeded`` or ``failed``.
+        run_id: Pipeline run identifier, to resume a failed job.
+        error: Error message of a failed job.
+        logs: Progress messages of the pipeline.
+    """
+
+    id: str
+    prompt: str
+    options: Dict[str, Any]
+    project_path: str
+    output_path: str
+    status: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    run_id: str = ""
+    error: str = ""
+    logs: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "prompt": self.prompt,
+            "options": self.options,
+            "project_path": self.project_path,
+            "output_path": self.output_path,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "run_id": self.run_id,
+            "error": self.error,
+            "log_lines": len(self.logs),
+        }
+
+
+class PipelineWorker:
+    """
+    Job queue and worker pool running the pipeline in-process.
+
+    Attributes:
+        pool_size: Jobs run concurrently.
+        root: Directory the project and output paths of jobs are relative to.
+        jobs_dir: Output directory of jobs submitted without ``output_path``.
+        run_pipeline: ``main.main`` or a compatible callable; imported by ``start``.
+        memo: Project stage outputs shared by the jobs.
+    """
+
+    def __init__(
+        self,
+        pool_size: Optional[int] = None,
+        jobs_dir: Optional[str] = None,
+        run_pipeline: Optional[Callable[..., str]] = None,
+        root: Optional[str] = None,
+    ):
+        self.pool_size = pool_size or int(os.getenv("FACTORY_WORKER_POOL", str(DEFAULT_POOL_SIZE)))
+        self.root = os.path.realpath(root or os.getenv("FACTORY_WORKER_ROOT", os.curdir))
+        self.jobs_dir = os.path.join(
+            self.root, jobs_dir or os.getenv("FACTORY_WORKER_JOBS_DIR", DEFAULT_JOBS_DIR)
+        )
+        self.run_pipeline = run_pipeline
+        self.memo = StageMemo(MEMO_STAGES)
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._changed = threading.Condition()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """
+        Loads the pipeline and starts the worker threads.
+        """
+        if self.run_pipeline is None:
+            # Imported once here instead of once per job: this is what the daemon is for
+            from main import main as run_pipeline
+
+            self.run_pipeline = run_pipeline
+        for index in range(self.pool_size):
+            thread = threading.Thread(
+                target=self._work, name=f"pipeline-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Pipeline worker started with {self.pool_size} threads")
+
+    def stop(self) -> None:
+        """
+        Stops the worker threads after their current jobs.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def _resolve(self, key: str, path: Any) -> str:
+        # A job path, relative to the root and inside it
+        if not isinstance(path, str) or not path:
+            raise ValueError(f"'{key}' must be a non-empty string")
+        if os.path.isabs(path) or os.pardir in re.split(r"[\\/]", path):
+            raise ValueError(f"'{key}' must be relative to the worker root, without '..'")
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if resolved == self.root or not resolved.startswith(self.root + os.sep):
+            raise ValueError(f"'{key}' must be inside the worker root")
+        return resolved
+
+    def submit(self, payload: Dict[str, Any]) -> Job:
+        """
+        Queues a job.
+
+        Args:
+            payload: ``prompt``, optional ``project_path`` and ``output_path`` (relative
+                to ``root``), and any of ``JOB_OPTIONS``.
+
+        Raises:
+            ValueError: If the payload is invalid, the run id is not a plain identifier,
+                or a path is absolute, leaves the root, or the output overlaps the
+                project (it would be overwritten).
+        """
+        prompt = payload.get("prompt") or ""
+        if not isinstance(prompt, str) or not (prompt.strip() or payload.get("resume")):
+            raise ValueError("'prompt' is required unless resuming a run")
+        options = {}
+        for key, expected in JOB_OPTIONS.items():
+            if key in payload:
+                if not isinstance(payload[key], expected):
+                    raise ValueError(f"'{key}' must be a {expected.__name__}")
+                options[key] = payload[key]
+        if "run_id" in options:
+            # Joined into the run directory, whose checkpoints a resumed job unpickles
+            check_run_id(options["run_id"])
+        unknown = set(payload) - set(JOB_OPTIONS) - {"prompt", "project_path", "output_path"}
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+
+        job_id = uuid.uuid4().hex[:12]
+        project_path = self._resolve("project_path", payload.get("project_path", "project_old"))
+        if "output_path" in payload:
+            output_path = self._resolve("output_path", payload["output_path"])
+        else:
+            output_path = os.path.join(self.jobs_dir, job_id)
+        # The output is made a copy of the project, deleting whatever else it contains
+        for inner, outer in ((output_path, project_path), (project_path, output_path)):
+            if inner == outer or inner.startswith(outer + os.sep):
+                raise ValueError("'output_path' and 'project_path' must not overlap")
+        job = Job(
+            id=job_id,
+            prompt=prompt.strip(),
+            options=options,
+            project_path=project_path,
+            output_path=output_path,
+        )
+        with self._changed:
+            self.jobs[job_id] = job
+            self._prune()
+        self._queue.put(job_id)
+        logger.info(f"Job {job_id} queued: {job.prompt}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._changed:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        with self._changed:
+            return list(self.jobs.values())
+
+    def queued(self) -> int:
+        with self._changed:
+            return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def wait_for_logs(self, job: Job, since: int, timeout: float = 1.0) -> Tuple[List[str], bool]:
+        """
+        Waits until ``job`` has log lines after ``since`` or finishes.
+
+        Returns:
+            Tuple[List[str], bool]: The new lines and whether the job has finished.
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(job.logs) > since or job.status in FINISHED, timeout=timeout
+            )
+            return job.logs[since:], job.status in FINISHED
+
+    def _log(self, job: Job, message: str) -> None:
+        with self._changed:
+            job.logs.append(message)
+            self._changed.notify_all()
+
+    def _set(self, job: Job, **values: Any) -> None:
+        with self._changed:
+            for key, value in values.items():
+                setattr(job, key, value)
+            self._changed.notify_all()
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED]
+        for job_id in finished[: max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def _work(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            job = self.get(job_id)
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job: Job) -> None:
+        self._set(job, status=RUNNING, started=time.time())
+        try:
+            run_id = self.run_pipeline(
+                job.prompt or None,
+                on_event=lambda kind, data: self._log(job, str(data)) if kind == "status" else None,
+                project_path=job.project_path,
+                output_path=job.output_path,
+                memo=self.memo,
+                **job.options,
+            )
+        except (Exception, SystemExit) as e:  # steps that still call exit() raise SystemExit
+            error = str(e) or e.__class__.__name__
+            self._log(job, f"✗ {error}")
+            run_id = getattr(e, "run_id", "")  # StageError: the run can be resumed
+            self._set(job, status=FAILED, error=error, run_id=run_id, finished=time.time())
+            logger.error(f"Job {job.id} failed: {error}")
+            return
+        self._set(job, status=SUCCEEDED, run_id=run_id or "", finished=time.time())
+        logger.info(f"Job {job.id} succeeded: {job.output_path}")
+
+
+def job_result(job: Job) -> Dict[str, Any]:
+    """
+    Returns the result of a finished job: status, run id and the files of its output.
+    """
+    files = []
+    if job.status == SUCCEEDED:
+        for root, _, names in os.walk(job.output_path):
+            for name in sorted(names):
+                files.append(os.path.relpath(os.path.join(root, name), job.output_path))
+    return {
+        "id": job.id,
+        "status": job.status,
+        "run_id": job.run_id,
+        "error": job.error,
+        "output_path": os.path.abspath(job.output_path),
+        "files": sorted(files),
+    }
+
+
+_JOB_PATH = re.compile(r"^/jobs/([0-9a-f]+)(?:/(logs|result|archive))?$")
+
+
+def load_token() -> Optional[str]:
+    """
+    Returns the job API token: ``FACTORY_WORKER_TOKEN``, or the token a local
+    worker wrote to ``FACTORY_WORKER_TOKEN_FILE`` (None if there is neither).
+    """
+    token = os.getenv("FACTORY_WORKER_TOKEN")
+    if token:
+        return token
+    try:
+        with open(os.getenv("FACTORY_WORKER_TOKEN_FILE", DEFAULT_TOKEN_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_token(path: str) -> str:
+    # A new random token, readable by the current user only
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path) or os.curdir, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
+
+
+class _JobAPIHandler(BaseHTTPRequestHandler):
+    server_version = "FactoryFeatureWorker/1.0"
+
+    @property
+    def worker(self) -> PipelineWorker:
+        return self.server.worker
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _authorized(self) -> bool:
+        # Compares the bearer token in constant time; answers 401 if it does not match
+        scheme, _, token = self.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(
+            token.strip().encode("utf-8"), self.server.token.encode("utf-8")
+        ):
+            return True
+        self._send_json(401, {"error": "Missing or invalid worker token"})
+        return False
+
+    def _send_json(self, status: int, data: Any) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/health":
+            self._send_json(
+                200,
+                {
+                    "status": "ok",
+                    "pool_size": self.worker.pool_size,
+                    "queued": self.worker.queued(),
+                },
+            )
+            return
+        if not self._authorized():
+            return
+        if url.path == "/metrics":
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if url.path == "/jobs":
+            self._send_json(200, {"jobs": [job.to_dict() for job in self.worker.list_jobs()]})
+            return
+
+        match = _JOB_PATH.match(url.path)
+        job = self.worker.get(match.group(1)) if match else None
+        if job is None:
+            self._send_json(404, {"error": f"Not found: {url.path}"})
+            return
+        action = match.group(2)
+        if action is None:
+            self._send_json(200, job.to_dict())
+        elif action == "result":
+            if job.status in FINISHED:
+                self._send_json(200, job_result(job))
+            else:
+                error = f"Job {job.id} is {job.status}"
+                self._send_json(409, {"error": error, "status": job.status})
+        elif action == "archive":
+            if job.status == SUCCEEDED:
+                self._send_archive(job)
+            else:
+                error = f"Job {job.id} is {job.status}, not {SUCCEEDED}"
+                self._send_json(409, {"error": error, "status": job.status})
+        else:
+            since = int(query.get("since", ["0"])[0])
+            if query.get("follow", ["0"])[0] in ("1", "true"):
+                self._follow(job, since)
+            else:
+                lines, finished = self.worker.wait_for_logs(job, since, timeout=0)
+                self._send_json(
+                    200,
+                    {
+                        "lines": lines,
+                        "next": since + len(lines),
+                        "status": job.status,
+                        "finished": finished,
+                    },
+                )
+
+    def _send_archive(self, job: Job) -> None:
+        # The length is unknown while compressing, so the connection delimits the body
+        chunks = stream_archive(directory_entries(job.output_path), name=f"job-{job.id}")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f'attachment; filename="{job.id}.zip"')
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(chunk)
+        self.close_connection = True
+
+    def _follow(self, job: Job, since: int) -> None:
+        # Stream log lines as JSON Lines until the job finishes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        finished = False
+        while not finished:
+            lines, finished = self.worker.wait_for_logs(job, since)
+            for line in lines:
+                self.wfile.write((json.dumps({"line": line}) + "\n").encode("utf-8"))
+            since += len(lines)
+            self.wfile.flush()
+        final = {"status": job.status, "error": job.error}
+        self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+        self.close_connection = True
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        if urlparse(self.path).path != "/jobs":
+            self._send_json(404, {"error": f"Not found: {self.path}"})
+            return
+        # Browsers send other content types cross-origin without a CORS preflight
+        if self.headers.get_content_type() != "application/json":
+            self._send_json(415, {"error": "Content-Type must be application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("Expected a JSON object")
+            job = self.worker.submit(payload)
+        except ValueError as e:  # includes JSON decode errors
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, job.to_dict())
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """
+    Parses ``HOST:PORT``, ``http://HOST:PORT`` or ``unix:PATH``.
+
+    Returns:
+        Tuple[str, Any]: ``("unix", path)`` or ``("tcp", (host, port))``.
+
+    Raises:
+        ValueError: If the address cannot be parsed.
+    """
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    address = re.sub(r"^https?://", "", address).rstrip("/")
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid worker address '{address}'; use HOST:PORT or unix:PATH")
+    return "tcp", (host, int(port))
+
+
+def create_server(
+    address: str, worker: PipelineWorker, token: Optional[str] = None
+) -> socketserver.BaseServer:
+    """
+    Creates the job API server for ``worker`` (not yet serving).
+
+    Args:
+        address: ``HOST:PORT`` or ``unix:PATH`` to listen on.
+        worker: The worker running the jobs.
+        token: Token required by the API (default: a random one, see ``server.token``).
+    """
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.unlink(target)  # stale socket of a previous worker
+        server = _UnixServer(target, _JobAPIHandler)
+    else:
+        server = _TCPServer(target, _JobAPIHandler)
+    server.worker = worker
+    server.token = token or secrets.token_urlsafe(32)
+    return server
+
+
+def serve(
+    address: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    jobs_dir: Optional[str] = None,
+) -> None:
+    """
+    Starts a worker and serves its job API until interrupted.
+    """
+    address = address or os.getenv("FACTORY_WORKER_ADDRESS", DEFAULT_ADDRESS)
+    worker = PipelineWorker(pool_size=pool_size, jobs_dir=jobs_dir)
+    token = os.getenv("FACTORY_WORKER_TOKEN")
+    if not token:
+        token_file = os.getenv("FACTORY_WORKER_TOKEN_FILE", DEFAULT_TOKEN_FILE)
+        token = _write_token(token_file)
+        logger.info(f"Worker token written to {token_file}")
+    worker.start()
+    server = create_server(address, worker, token)
+    logger.info(f"Pipeline worker listening on {address} (root {worker.root})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Pipeline worker stopping")
+    finally:
+        server.server_close()
+        worker.stop()
+        kind, target = parse_address(address)
+        if kind == "unix" and os.path.exists(target):
+            os.unlink(target)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    parser = argparse.ArgumentParser(description="Factory Feature pipeline worker daemon")
+    parser.add_argument(
+        "--listen", metavar="ADDRESS", help=f"HOST:PORT or unix:PATH (default: {DEFAULT_ADDRESS})"
+    )
+    parser.add_argument("--workers", type=int, metavar="N", help="Jobs run concurrently")
+    parser.add_argument(
+        "--jobs-dir", metavar="DIR", help="Output directory of jobs submitted without output_path"
+    )
+    args = parser.parse_args()
+    serve(args.listen, args.workers, args.jobs_dir)
@@ -0,0 +1,598 @@
+"""
+Streaming ZIP export of a project.
+
+``zipfile`` compresses one entry after the other and needs a seekable output,
+so a download waited for the whole project to be compressed, and already
+compressed assets (images, jars, archives) were deflated once more for
+nothing. ``iter_zip`` produces the archive as a stream of byte chunks:
+
+    * entries are compressed on a thread pool (zlib releases the GIL) and
+      written in order as soon as they are ready;
+    * incompressible types (see ``STORED_EXTENSIONS``), and entries that do not
+      shrink, are stored instead of deflated;
+    * files larger than ``STREAM_THRESHOLD`` are compressed chunk by chunk with
+      a data descriptor rather than held in memory. Streaming readers (Java's
+      ``ZipInputStream``, for one) only accept a descriptor on deflated
+      entries, so large stored files are read twice instead: once for the
+      CRC in the local header, then for the data.
+
+Entries can also carry a ``RawMember``: the same file inside an existing
+archive, typically the project ZIP the user uploaded. While the file on disk is
+still the one extracted from that archive (same size and modification time,
+the check ``materialize_tree`` uses), its compressed bytes and CRC are copied
+into the new archive as they are. Exporting an updated project then only
+compresses the files that changed.
+
+``stream_archive`` serves an archive from a content-addressed cache: its name
+is derived from the entries (paths, sizes and modification times of files,
+hashes of in-memory contents), so downloading an unchanged result again reads
+the cached file. A new archive is written to the cache while it is streamed.
+
+Archives are limited to 65535 entries and 4 GiB (no ZIP64).
+
+Environment variables:
+    ARCHIVE_WORKERS: Entries compressed in parallel (default: CPU count, at most 8).
+    ARCHIVE_CACHE_DIR: Directory of the cached archives (default: ``runs/archives``).
+    ARCHIVE_CACHE_ENTRIES: Archives kept in the cache (default: 8).
+"""
+
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join("runs", "archives")
+DEFAULT_CACHE_ENTRIES = 8
+COMPRESS_LEVEL = 6
+# Files above this size are streamed through a data descriptor instead of buffered
+STREAM_THRESHOLD = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# Changes whenever the archive layout changes, so older cached archives are not served
+FORMAT_VERSION = "1"
+
+# Already compressed formats, stored as they are
+STORED_EXTENSIONS = frozenset(
+    ".7z .aar .apk .avif .br .bz2 .docx .ear .eot .gif .gz .heic .ico .jar .jpeg .jpg .lz4 .mkv "
+    ".mov .mp3 .mp4 .npz .odt .ogg .otf .parquet .pdf .png .pptx .rar .tgz .war .webm .webp .whl "
+    ".woff .woff2 .xlsx .xz .zip .zst".split()
+)
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+_ZIP_LIMIT = 0xFFFFFFFF
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_UNIX = 3
+_VERSION = 20
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+_END_RECORD = struct.Struct("<4s4H2LH")
+_DATA_DESCRIPTOR = struct.Struct("<4s3L")
+
+
+@dataclass
+class RawMember:
+    """
+    A member of an existing ZIP archive, extracted to a file, whose compressed
+    bytes can be copied into a new archive.
+
+    Attributes:
+        zip_path: The archive.
+        offset: Offset of the member's local header in the archive.
+        method: ``ZIP_STORED`` or ``ZIP_DEFLATED``.
+        crc: CRC-32 of the content.
+        compressed_size: Size of the compressed bytes.
+        size: Size of the content.
+        mtime_ns: Modification time of the extracted file.
+        zip_stat: Size and modification time of the archive when it was indexed.
+    """
+
+    zip_path: str
+    offset: int
+    method: int
+    crc: int
+    compressed_size: int
+    size: int
+    mtime_ns: int
+    zip_stat: Tuple[int, int]
+
+    def matches(self, path: str) -> bool:
+        """
+        Whether ``path`` is still the extracted file and the archive is unchanged.
+        """
+        try:
+            stat, zip_stat = os.stat(path), os.stat(self.zip_path)
+        except OSError:
+            return False
+        return (
+            (stat.st_size, stat.st_mtime_ns) == (self.size, self.mtime_ns)
+            and (zip_stat.st_size, zip_stat.st_mtime_ns) == self.zip_stat
+        )
+
+
+@dataclass
+class ArchiveEntry:
+    """
+    A file to archive, read from disk (``path``) or held in memory (``data``).
+
+    Attributes:
+        name: Name in the archive (``/`` separated).
+        path: File to read.
+        data: Content, if the file is not on disk.
+        mtime: Modification time (default: the file's, or the time of archiving).
+        raw: The file in an existing archive, copied from there while the file is unchanged.
+    """
+
+    name: str
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+    mtime: Optional[float] = None
+    raw: Optional[RawMember] = None
+
+    def reusable(self) -> bool:
+        """
+        Whether the entry can be copied compressed from ``raw``.
+        """
+        return self.raw is not None and self.data is None and self.raw.matches(self.path)
+
+    def key(self) -> str:
+        """
+        Identifies the entry's content for the archive cache without reading files.
+        """
+        if self.data is not None:
+            return f"{self.name}\0data\0{hashlib.sha256(self.data).hexdigest()}"
+        stat = os.stat(self.path)
+        return f"{self.name}\0{os.path.abspath(self.path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+
+
+@dataclass
+class _Member:
+    # An entry ready to be written
+    method: int
+    crc: int
+    compressed_size: int
+    size: int
+    payload: bytes
+    mtime: float
+    mode: int
+
+
+def directory_entries(directory: str) -> List[ArchiveEntry]:
+    """
+    Lists every file below ``directory`` as archive entries named relative to it.
+    """
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            entries.append(
+                ArchiveEntry(os.path.relpath(path, directory).replace(os.sep, "/"), path=path)
+            )
+    return entries
+
+
+def raw_members(zip_path: str, members: Dict[str, str], directory: str) -> Dict[str, RawMember]:
+    """
+    Indexes the members of an archive that were extracted below ``directory``.
+
+    Call it right after extracting them: a file modified later no longer matches
+    its member. Encrypted members, and members that are neither stored nor
+    deflated, are left out.
+
+    Args:
+        zip_path: The archive.
+        members: Name in the archive of each member, by its path relative to
+            ``directory`` (``/`` separated).
+        directory: Where the members were extracted.
+
+    Returns:
+        Dict[str, RawMember]: The members by relative path, for ``attach_raw``.
+    """
+    zip_stat = os.stat(zip_path)
+    indexed = {}
+    with zipfile.ZipFile(zip_path) as archive:
+        for name, member in members.items():
+            info = archive.getinfo(member)
+            if info.flag_bits & 0x01 or info.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+                continue
+            if max(info.compress_size, info.file_size, info.header_offset) > _ZIP_LIMIT:
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_size != info.file_size:
+                continue
+            indexed[name] = RawMember(
+                zip_path,
+                info.header_offset,
+                info.compress_type,
+                info.CRC,
+                info.compress_size,
+                info.file_size,
+                stat.st_mtime_ns,
+                (zip_stat.st_size, zip_stat.st_mtime_ns),
+            )
+    return indexed
+
+
+def attach_raw(entries: List[ArchiveEntry], members: Dict[str, RawMember]) -> List[ArchiveEntry]:
+    """
+    Sets the ``raw`` member of the file entries found in ``members`` (see ``raw_members``).
+    """
+    for entry in entries:
+        if entry.data is None and entry.name in members:
+            entry.raw = members[entry.name]
+    return entries
+
+
+def is_incompressible(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+
+
+def _dos_time(mtime: float) -> Tuple[int, int]:
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _mode(entry: ArchiveEntry) -> int:
+    return os.stat(entry.path).st_mode if entry.path and entry.data is None else 0o100644
+
+
+def _compress(entry: ArchiveEntry, level: int) -> _Member:
+    if entry.data is not None:
+        data = entry.data
+        mtime = entry.mtime if entry.mtime is not None else time.time()
+    else:
+        with open(entry.path, "rb") as f:
+            data = f.read()
+        mtime = entry.mtime if entry.mtime is not None else os.path.getmtime(entry.path)
+    crc = zlib.crc32(data)
+    method, payload = ZIP_STORED, data
+    if not is_incompressible(entry.name) and data:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) < len(data):
+            method, payload = ZIP_DEFLATED, deflated
+    return _Member(method, crc, len(payload), len(data), payload, mtime, _mode(entry))
+
+
+class _ZipStream:
+    # Writes ZIP records as byte strings and keeps the central directory
+    def __init__(self):
+        self.offset = 0
+        self.central: List[bytes] = []
+
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        if self.offset > _ZIP_LIMIT:
+            raise ValueError("Archive exceeds 4 GiB, which needs ZIP64")
+        return data
+
+    def _record(self, name: str, flags: int, member: _Member, offset: int) -> None:
+        if len(self.central) == 0xFFFF:
+            raise ValueError("Archive exceeds 65535 entries, which needs ZIP64")
+        encoded = name.encode("utf-8")
+        header = _CENTRAL_HEADER.pack(
+            b"PK\x01\x02",
+            _VERSION,
+            _UNIX,
+            _VERSION,
+            0,
+            flags,
+            member.method,
+            *_dos_time(member.mtime),
+            member.crc,
+            member.compressed_size,
+            member.size,
+            len(encoded),
+            0,  # extra field
+            0,  # comment
+            0,  # disk number
+            0,  # internal attributes
+            (member.mode & 0xFFFF) << 16,
+            offset,
+        )
+        self.central.append(header + encoded)
+
+    def _local_header(self, encoded: bytes, flags: int, member: _Member) -> bytes:
+        return _LOCAL_HEADER.pack(
+            b"PK\x03\x04",
+            _VERSION,
+            0,
+            flags,
+            member.method,
+            *_dos_time(member.mtime),
+            member.crc,
+            member.compressed_size,
+            member.size,
+            len(encoded),
+            0,
+        )
+
+    def member(self, name: str, member: _Member) -> bytes:
+        """
+        Returns the local header and data of a member whose sizes are known.
+        """
+        encoded = name.encode("utf-8")
+        flags = 0 if encoded.isascii() else _FLAG_UTF8
+        offset = self.offset
+        data = self._emit(self._local_header(encoded, flags, member) + encoded + member.payload)
+        self._record(name, flags, member, offset)
+        return data
+
+    def streamed(self, entry: ArchiveEntry, level: int) -> Iterator[bytes]:
+        """
+        Yields a large file chunk by chunk: deflated and followed by its data
+        descriptor, or stored after a first pass that computes its CRC.
+        """
+        encoded = entry.name.encode("utf-8")
+        flags = 0 if encoded.isascii() else _FLAG_UTF8
+        mtime = entry.mtime if entry.mtime is not None else os.path.getmtime(entry.path)
+        member = _Member(ZIP_STORED, 0, 0, 0, b"", mtime, _mode(entry))
+        if is_incompressible(entry.name):
+            member.crc, member.size = self._checksum(entry.path)
+            member.compressed_size = member.size
+            compressor = None
+        else:
+            # The CRC and sizes follow the data, in the descriptor
+            flags |= _FLAG_DATA_DESCRIPTOR
+            member.method = ZIP_DEFLATED
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        offset = self.offset
+        yield self._emit(self._local_header(encoded, flags, member) + encoded)
+        crc = size = compressed_size = 0
+        with open(entry.path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                data = compressor.compress(chunk) if compressor else chunk
+                if data:
+                    compressed_size += len(data)
+                    yield self._emit(data)
+        if compressor:
+            data = compressor.flush()
+            compressed_size += len(data)
+            yield self._emit(data)
+            yield self._emit(_DATA_DESCRIPTOR.pack(b"PK\x07\x08", crc, compressed_size, size))
+            member.crc, member.compressed_size, member.size = crc, compressed_size, size
+        elif (crc, size) != (member.crc, member.size):
+            raise ValueError(f"{entry.path} changed while it was archived")
+        self._record(entry.name, flags, member, offset)
+
+    @staticmethod
+    def _checksum(path: str) -> Tuple[int, int]:
+        # CRC and size of a file, read in chunks
+        crc = size = 0
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return crc, size
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+
+    def copied(self, entry: ArchiveEntry) -> Iterator[bytes]:
+        """
+        Yields an entry's member copied compressed from its source archive.
+        """
+        raw = entry.raw
+        encoded = entry.name.encode("utf-8")
+        flags = 0 if encoded.isascii() else _FLAG_UTF8
+        mtime = entry.mtime if entry.mtime is not None else os.path.getmtime(entry.path)
+        member = _Member(
+            raw.method, raw.crc, raw.compressed_size, raw.size, b"", mtime, _mode(entry)
+        )
+        with open(raw.zip_path, "rb") as f:
+            # The source's local header may differ (extra fields, data descriptor); only
+            # the compressed bytes are copied
+            f.seek(raw.offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            if header[0] != b"PK\x03\x04":
+                raise ValueError(f"No member at offset {raw.offset} of {raw.zip_path}")
+            f.seek(header[10] + header[11], os.SEEK_CUR)
+            offset = self.offset
+            yield self._emit(self._local_header(encoded, flags, member) + encoded)
+            remaining = raw.compressed_size
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ValueError(f"{raw.zip_path} is truncated")
+                remaining -= len(chunk)
+                yield self._emit(chunk)
+        self._record(entry.name, flags, member, offset)
+
+    def close(self) -> bytes:
+        """
+        Returns the central directory and the end record.
+        """
+        directory = b"".join(self.central)
+        start = self.offset
+        self._emit(directory)
+        end = _END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, len(self.central), len(self.central), len(directory), start, 0
+        )
+        return directory + end
+
+
+def get_archive_workers() -> int:
+    return int(os.getenv("ARCHIVE_WORKERS", min(8, os.cpu_count() or 1)))
+
+
+def iter_zip(
+    entries: Iterable[ArchiveEntry],
+    workers: Optional[int] = None,
+    level: int = COMPRESS_LEVEL,
+    stream_threshold: int = STREAM_THRESHOLD,
+) -> Iterator[bytes]:
+    """
+    Yields a ZIP archive of ``entries`` as it is produced.
+
+    Args:
+        entries: Files to archive, in archive order.
+        workers: Entries compressed in parallel (default: ``ARCHIVE_WORKERS``).
+        level: zlib compression level.
+        stream_threshold: Files larger than this (bytes) are compressed chunk by chunk.
+            Entries copied from their source archive are always streamed.
+
+    Raises:
+        ValueError: If the archive would need ZIP64.
+    """
+    workers = workers or get_archive_workers()
+    stream = _ZipStream()
+    # Compressions run ahead of the writer by a bounded window, keeping memory in check
+    window = deque()
+    pending = iter(entries)
+    copied = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def fill() -> None:
+            while len(window) < 2 * workers:
+                entry = next(pending, None)
+                if entry is None:
+                    return
+                if entry.reusable():
+                    window.append((entry, "copy", None))
+                elif entry.data is None and os.path.getsize(entry.path) > stream_threshold:
+                    window.append((entry, "stream", None))
+                else:
+                    window.append((entry, "compress", executor.submit(_compress, entry, level)))
+
+        fill()
+        while window:
+            entry, action, future = window.popleft()
+            if action == "copy":
+                yield from stream.copied(entry)
+                copied += 1
+            elif action == "stream":
+                yield from stream.streamed(entry, level)
+            else:
+                yield stream.member(entry.name, future.result())
+            fill()
+    yield stream.close()
+    if copied:
+        logger.info(
+            f"Copied {copied} of {len(stream.central)} entries compressed from their source archive"
+        )
+
+
+def write_zip(entries: Iterable[ArchiveEntry], zip_path: str, **options) -> int:
+    """
+    Writes a ZIP archive of ``entries`` to ``zip_path`` (see ``iter_zip``).
+
+    Returns:
+        int: Number of files archived.
+    """
+    entries = list(entries)
+    with open(zip_path, "wb") as f:
+        for chunk in iter_zip(entries, **options):
+            f.write(chunk)
+    return len(entries)
+
+
+def archive_path(
+    entries: List[ArchiveEntry], name: str = "project", cache_dir: Optional[str] = None
+) -> str:
+    """
+    Returns the content-addressed cache path of the archive of ``entries``.
+    """
+    digest = hashlib.sha256(FORMAT_VERSION.encode("utf-8"))
+    for entry in entries:
+        digest.update(entry.key().encode("utf-8") + b"\n")
+    cache_dir = cache_dir or os.getenv("ARCHIVE_CACHE_DIR", DEFAULT_CACHE_DIR)
+    return os.path.join(cache_dir, f"{name}-{digest.hexdigest()[:16]}.zip")
+
+
+def _prune(cache_dir: str, keep: int) -> None:
+    # Keeps the most recently used archives
+    archives = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".zip"):
+            path = os.path.join(cache_dir, name)
+            archives.append((os.path.getmtime(path), path))
+    for _, path in sorted(archives, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def stream_archive(
+    entries: Iterable[ArchiveEntry],
+    name: str = "project",
+    cache_dir: Optional[str] = None,
+    **options,
+) -> Iterator[bytes]:
+    """
+    Yields the archive of ``entries``, from the cache if it was built before.
+
+    A new archive is saved to the cache (see ``archive_path``) once it has been
+    streamed completely.
+
+    Args:
+        entries: Files to archive.
+        name: Prefix of the cached file name.
+        cache_dir: Cache directory (default: ``ARCHIVE_CACHE_DIR``).
+        **options: ``workers``, ``level`` and ``stream_threshold`` (see ``iter_zip``).
+    """
+    entries = list(entries)
+    path = archive_path(entries, name, cache_dir)
+    if os.path.exists(path):
+        os.utime(path)
+        logger.info(f"Archive cache hit: {path}")
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_zip(entries, **options):
+                f.write(chunk)
+                yield chunk
+        os.replace(temp_path, path)
+    finally:
+        # Still there if the archive failed or the consumer stopped reading
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info(
+        f"Archived {len(entries)} files to {path} in {time.perf_counter() - started:.2f}s"
+    )
+    _prune(directory, int(os.getenv("ARCHIVE_CACHE_ENTRIES", DEFAULT_CACHE_ENTRIES)))
+
+
+def export_archive(
+    entries: Iterable[ArchiveEntry],
+    name: str = "project",
+    cache_dir: Optional[str] = None,
+    **options,
+) -> str:
+    """
+    Builds (or finds in the cache) the archive of ``entries`` and returns its path.
+    """
+    entries = list(entries)
+    for _ in stream_archive(entries, name, cache_dir, **options):
+        pass
+    return archive_path(entries, name, cache_dir)
@@ -1,5 +1,8 @@
 import os
 
+from src.utils.archive import directory_entries, write_zip
+from src.utils.materialize import detach
+
 def read_file(file_path):
     """
     Reads the content of a file.
@@ -26,3 +29,50 @@ def write_file(file_path, content):
     """
     with open(file_path, 'w', encoding='utf-8') as f:
         f.write(content)
+
+def stream_to_file(chunks, file_path, on_chunk=None):
+    """
+    Writes text chunks to a file as they arrive.
+
+    Each chunk is flushed immediately, so the file can be watched while the
+    content is still being generated. An existing file is replaced rather than
+    truncated, so a hard link to the original project is never written through.
+
+    Args:
+        chunks: Iterable of text chunks (e.g. a streamed LLM response).
+        file_path: Path to the file. Parent directories are created if needed.
+        on_chunk: Optional callback invoked with each chunk after it is written.
+
+    Returns:
+        The complete content written to the file.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    parts = []
+    detach(file_path)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+            parts.append(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+    return "".join(parts).strip()
+
+def zip_directory(directory, zip_path):
+    """
+    Writes every file below a directory into a ZIP archive.
+
+    Entries are compressed in parallel and incompressible types are stored
+    (see ``src.utils.archive``).
+
+    Args:
+        directory: Directory to archive. Archive names are relative to it.
+        zip_path: Path of the ZIP file to create (replaced if it exists).
+
+    Returns:
+        Number of files archived.
+    """
+    return write_zip(directory_entries(directory), zip_path)
@@ -0,0 +1,240 @@
+"""
+Copy-on-write materialization of a project tree.
+
+Step 8 used to delete the output project and copy the whole original project
+into it on every run, even when the feature changes two files.
+``materialize_tree`` makes the target an up-to-date copy of the source
+instead. It keeps the target files that already match the source, replaces
+those that differ, and removes those the source no longer has. Files are
+matched by size and modification time, the same snapshot ``path_fingerprint``
+takes, so nothing is read to compare them and an existing output project is
+reused.
+
+Files that need placing are cloned rather than copied where the filesystem
+allows it:
+
+    ``reflink``: a copy-on-write clone (Btrfs, XFS, ...) sharing the source's
+        blocks until one of them is written.
+    ``hardlink``: a second name for the source file. Nothing is copied, but
+        writing to the file in place also changes the original, so the
+        pipeline removes a file before rewriting it. Only use it if nothing
+        else edits the output project in place.
+    ``copy``: a plain copy.
+
+``auto`` (the default) tries a reflink and falls back to a copy. The other
+modes also fall back to a copy when the filesystem refuses them (e.g. across
+devices).
+
+Environment variables:
+    MATERIALIZE_MODE: ``auto``, ``reflink``, ``hardlink`` or ``copy`` (default: ``auto``).
+"""
+
+import errno
+import logging
+import os
+import shutil
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MATERIALIZE_MODES = ("auto", "reflink", "hardlink", "copy")
+DEFAULT_MODE = "auto"
+
+# Linux ioctl cloning a whole file (linux/fs.h)
+FICLONE = 0x40049409
+
+# Devices on which a reflink failed; copies go straight to the fallback
+_no_reflink: Set[Tuple[int, int]] = set()
+
+_FALLBACK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL)
+
+
+@dataclass
+class MaterializeStats:
+    """
+    What ``materialize_tree`` did.
+
+    Attributes:
+        kept: Target files already matching the source.
+        reflinked: Files cloned copy-on-write.
+        hardlinked: Files hard-linked to the source.
+        copied: Files copied.
+        removed: Target files removed because the source no longer has them.
+        excluded: Files left to be replaced by the caller (neither placed nor removed).
+        seconds: Elapsed time.
+    """
+
+    kept: int = 0
+    reflinked: int = 0
+    hardlinked: int = 0
+    copied: int = 0
+    removed: int = 0
+    excluded: int = 0
+    seconds: float = 0.0
+
+    @property
+    def placed(self) -> int:
+        return self.reflinked + self.hardlinked + self.copied
+
+
+def get_materialize_mode() -> str:
+    """
+    Returns the materialization mode (``MATERIALIZE_MODE`` or ``auto``).
+    """
+    return os.getenv("MATERIALIZE_MODE", DEFAULT_MODE).lower()
+
+
+def _scan(root: str) -> Tuple[Dict[str, os.stat_result], Set[str]]:
+    # Files (by relative path) and directories below root
+    files: Dict[str, os.stat_result] = {}
+    directories: Set[str] = set()
+    pending = [""]
+    while pending:
+        relative = pending.pop()
+        with os.scandir(os.path.join(root, relative) if relative else root) as entries:
+            for entry in entries:
+                path = os.path.join(relative, entry.name) if relative else entry.name
+                if entry.is_dir():
+                    directories.add(path)
+                    pending.append(path)
+                else:
+                    try:
+                        files[path] = entry.stat()
+                    except FileNotFoundError:
+                        continue  # dangling symbolic link
+    return files, directories
+
+
+def _unchanged(source: os.stat_result, target: os.stat_result) -> bool:
+    if (source.st_dev, source.st_ino) == (target.st_dev, target.st_ino):
+        return True
+    return source.st_size == target.st_size and source.st_mtime_ns == target.st_mtime_ns
+
+
+def _reflink(source_path: str, target_path: str) -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        devices = (os.fstat(source.fileno()).st_dev, os.fstat(target.fileno()).st_dev)
+        if devices in _no_reflink:
+            return False
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRORS:
+                raise
+            _no_reflink.add(devices)
+            return False
+    shutil.copystat(source_path, target_path)
+    return True
+
+
+def place_file(source_path: str, target_path: str, mode: str, stats: MaterializeStats) -> None:
+    """
+    Puts a copy of ``source_path`` at ``target_path`` (which must not exist) using ``mode``.
+    """
+    if mode in ("auto", "reflink") and _reflink(source_path, target_path):
+        stats.reflinked += 1
+        return
+    if mode == "hardlink":
+        try:
+            os.link(source_path, target_path)
+            stats.hardlinked += 1
+            return
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRORS:
+                raise
+    shutil.copy2(source_path, target_path)
+    stats.copied += 1
+
+
+def detach(path: str) -> None:
+    """
+    Removes ``path`` if it exists, before the file is rewritten.
+
+    A materialized file may be a hard link to the original project, so it must
+    be replaced with a new file rather than truncated and written in place.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def materialize_tree(
+    source: str, target: str, exclude: Iterable[str] = (), mode: Optional[str] = None
+) -> MaterializeStats:
+    """
+    Makes ``target`` a copy of ``source``, placing only the files that differ.
+
+    Args:
+        source: Directory to copy (the original project).
+        target: Directory to create or update (the output project).
+        exclude: Paths relative to ``source`` that are about to be replaced. They are
+            not placed, and a file already at such a path in ``target`` is left as
+            it is, so readers see it until it is replaced (with ``os.replace``, as
+            ``ProjectWriter`` does; a hard link must not be written through).
+        mode: ``auto``, ``reflink``, ``hardlink`` or ``copy`` (default:
+            ``MATERIALIZE_MODE``).
+
+    Returns:
+        MaterializeStats: Files kept, placed and removed.
+
+    Raises:
+        ValueError: If the mode is unknown.
+        FileNotFoundError: If ``source`` does not exist.
+    """
+    mode = (mode or get_materialize_mode()).lower()
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(f"Unknown materialize mode '{mode}'; use {', '.join(MATERIALIZE_MODES)}")
+    if not os.path.isdir(source):
+        raise FileNotFoundError(f"Project directory not found: {source}")
+    started = time.perf_counter()
+    stats = MaterializeStats()
+    excluded = {os.path.normpath(path) for path in exclude}
+
+    source_files, source_directories = _scan(source)
+    if os.path.lexists(target) and not os.path.isdir(target):
+        os.remove(target)
+    if os.path.isdir(target):
+        target_files, target_directories = _scan(target)
+    else:
+        os.makedirs(target)
+        target_files, target_directories = {}, set()
+
+    for path, target_stat in list(target_files.items()):
+        source_stat = source_files.get(path)
+        if path in excluded:
+            continue  # replaced by the caller
+        if source_stat is None:
+            os.remove(os.path.join(target, path))
+            stats.removed += 1
+        elif not _unchanged(source_stat, target_stat):
+            os.remove(os.path.join(target, path))  # stale, placed below
+            del target_files[path]
+    # Deepest first, so a directory is empty when it is removed
+    for directory in sorted(target_directories - source_directories, reverse=True):
+        shutil.rmtree(os.path.join(target, directory), ignore_errors=True)
+    for directory in sorted(source_directories - target_directories):
+        os.makedirs(os.path.join(target, directory), exist_ok=True)
+
+    for path in source_files:
+        if path in excluded:
+            stats.excluded += 1
+        elif path in target_files:
+            stats.kept += 1
+        else:
+            place_file(os.path.join(source, path), os.path.join(target, path), mode, stats)
+
+    stats.seconds = time.perf_counter() - started
+    logger.info(
+        f"Materialized {target} from {source} in {stats.seconds:.2f}s: {stats.kept} unchanged, "
+        f"{stats.placed} placed ({stats.reflinked} reflinked, {stats.hardlinked} hard-linked, "
+        f"{stats.copied} copied), {stats.removed} removed, {stats.excluded} left to rewrite"
+    )
+    return stats
@@ -0,0 +1,370 @@
+"""
+Run metrics: timing spans and counters of the pipeline.
+
+A span times one unit of work in wall-clock and CPU time: a pipeline stage, an
+LLM call, a retrieval pass or an embedding build. Spans carry attributes (e.g.
+the token counts of an LLM call), and counters accumulate totals such as
+prompt and completion tokens, bytes read and documents retrieved.
+
+Metrics are recorded by a process-wide ``Metrics`` instance (``get_metrics``),
+like the LLM cache and resilience counters. A process may run several
+pipelines, one after the other or at once (the worker daemon, the web
+interface), so each run also records into its own ``Metrics`` for the
+duration of ``run_metrics()``. That recorder is found through a context
+variable: thread pools that run the work of a run pass it on with
+``bind_run_metrics``. ``write_report`` saves a recorder as a JSON report and a
+Prometheus textfile, merged with the existing statistics.
+
+Usage::
+
+    with run_metrics() as recorder:
+        with get_metrics().span("plan", kind="stage") as span:
+            span.set(tasks=12)
+        get_metrics().count("llm_prompt_tokens", 1830, task_type="plan")
+    write_report(run_dir, recorder=recorder)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Mapping, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+PROMETHEUS_PREFIX = "factory_feature"
+REPORT_NAME = "metrics.json"
+PROMETHEUS_NAME = "metrics.prom"
+
+# Individual spans kept for the report; aggregates cover every span
+MAX_SPANS = 10000
+
+SPAN_KINDS = ("stage", "llm", "retrieval", "embedding")
+
+
+@dataclass
+class Span:
+    """
+    A timed unit of work.
+
+    Attributes:
+        name: Name of the work (stage name, task type of an LLM call, ...).
+        kind: ``stage``, ``llm``, ``retrieval`` or ``embedding``.
+        start: Start time in seconds since the metrics were reset.
+        wall_seconds: Elapsed wall-clock time.
+        cpu_seconds: CPU time of the thread that ran the span.
+        error: Exception class name if the span failed.
+        attributes: Measurements of the span (tokens, documents, cache hit, ...).
+    """
+
+    name: str
+    kind: str
+    start: float
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    error: str = ""
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes: Any) -> None:
+        """
+        Adds attributes to the span.
+        """
+        self.attributes.update(attributes)
+
+
+class Metrics:
+    """
+    Thread-safe recorder of spans and counters.
+
+    Attributes:
+        max_spans: Individual spans kept; older spans are dropped from the report
+            but remain in the aggregates.
+        forward: Also record into the recorder of the current run (see ``run_metrics``).
+    """
+
+    def __init__(self, max_spans: int = MAX_SPANS, forward: bool = False):
+        self.max_spans = max_spans
+        self.forward = forward
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _current_run(self) -> Optional["Metrics"]:
+        recorder = _run_recorder.get() if self.forward else None
+        return recorder if recorder is not self else None
+
+    def reset(self) -> None:
+        """
+        Drops every span and counter.
+        """
+        with self._lock:
+            self.started = time.time()
+            self._spans: Deque[Span] = deque(maxlen=self.max_spans)
+            self._aggregates: Dict[Tuple[str, str], Dict[str, float]] = {}
+            self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    @contextmanager
+    def span(self, name: str, kind: str = "stage", **attributes: Any) -> Iterator[Span]:
+        """
+        Times the body of a ``with`` block.
+
+        Args:
+            name: Name of the work.
+            kind: Kind of the work (see ``SPAN_KINDS``).
+            **attributes: Initial attributes of the span.
+
+        Yields:
+            Span: The span, to add attributes while it runs.
+        """
+        span = Span(name, kind, time.time() - self.started, attributes=dict(attributes))
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield span
+        except Exception as e:
+            span.error = e.__class__.__name__
+            raise
+        finally:
+            span.wall_seconds = time.perf_counter() - wall
+            span.cpu_seconds = time.thread_time() - cpu
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            aggregate = self._aggregates.setdefault((span.kind, span.name), _new_aggregate())
+            aggregate["count"] += 1
+            aggregate["errors"] += 1 if span.error else 0
+            aggregate["wall_seconds"] += span.wall_seconds
+            aggregate["cpu_seconds"] += span.cpu_seconds
+            aggregate["max_wall_seconds"] = max(aggregate["max_wall_seconds"], span.wall_seconds)
+        recorder = self._current_run()
+        if recorder is not None:
+            recorder._finish(span)
+
+    def count(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        Adds ``value`` to the counter ``name`` with ``labels``.
+        """
+        key = (name, tuple(sorted((label, str(text)) for label, text in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        recorder = self._current_run()
+        if recorder is not None:
+            recorder.count(name, value, **labels)
+
+    def total(self, name: str) -> float:
+        """
+        Returns the sum of the counter ``name`` over all its labels.
+        """
+        with self._lock:
+            return sum(value for (counter, _), value in self._counters.items() if counter == name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the recorded spans, their aggregates per kind and name, and the counters.
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "uptime_seconds": time.time() - self.started,
+                "summary": [
+                    {"kind": kind, "name": name, **aggregate}
+                    for (kind, name), aggregate in sorted(self._aggregates.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "spans": [asdict(span) for span in self._spans],
+            }
+
+
+def _new_aggregate() -> Dict[str, float]:
+    return {
+        "count": 0,
+        "errors": 0,
+        "wall_seconds": 0.0,
+        "cpu_seconds": 0.0,
+        "max_wall_seconds": 0.0,
+    }
+
+
+_default_metrics = Metrics(forward=True)
+
+# Recorder of the run the current thread works for
+_run_recorder: ContextVar[Optional[Metrics]] = ContextVar("run_metrics", default=None)
+
+
+def get_metrics() -> Metrics:
+    """
+    Returns the process-wide metrics recorder.
+    """
+    return _default_metrics
+
+
+@contextmanager
+def run_metrics() -> Iterator[Metrics]:
+    """
+    Records the spans and counters of the ``with`` block into a new ``Metrics``
+    as well, leaving out those of other runs of the process.
+
+    Yields:
+        Metrics: The recorder of the run.
+    """
+    recorder = Metrics()
+    token = _run_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _run_recorder.reset(token)
+
+
+def bind_run_metrics(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Wraps ``fn`` to record into the current run's metrics in whichever thread it
+    is called (threads do not inherit the context of the thread starting them).
+    """
+    recorder = _run_recorder.get()
+
+    def run(*args: Any, **kwargs: Any) -> T:
+        token = _run_recorder.set(recorder)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _run_recorder.reset(token)
+
+    return run
+
+
+def _labels(labels: Mapping[str, Any]) -> str:
+    if not labels:
+        return ""
+    escaped = {
+        key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(escaped.items())) + "}"
+
+
+def _metric_name(*parts: str) -> str:
+    name = "_".join((PROMETHEUS_PREFIX,) + parts)
+    return "".join(char if char.isalnum() or char == "_" else "_" for char in name)
+
+
+def _stat_samples(stats: Mapping[str, Any]) -> List[Tuple[str, Dict[str, str], float]]:
+    # Numeric leaves of the run statistics; one level of nesting becomes a "key" label
+    samples = []
+    for group, values in stats.items():
+        for key, value in values.items():
+            if isinstance(value, Mapping):
+                for label, nested in value.items():
+                    if isinstance(nested, (int, float)) and not isinstance(nested, bool):
+                        samples.append((_metric_name(group, key), {"key": str(label)}, nested))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                samples.append((_metric_name(group, key), {}, value))
+    return samples
+
+
+def prometheus_text(
+    snapshot: Optional[Dict[str, Any]] = None, stats: Optional[Mapping[str, Any]] = None
+) -> str:
+    """
+    Formats metrics in the Prometheus text exposition format.
+
+    Args:
+        snapshot: A ``Metrics.snapshot()`` (default: the process-wide metrics).
+        stats: Additional statistics, ``{group: {name: number or {key: number}}}``
+            (e.g. the LLM cache counters), exported as gauges.
+
+    Returns:
+        str: The metrics, for a node_exporter textfile or an HTTP ``/metrics`` endpoint.
+    """
+    snapshot = snapshot or get_metrics().snapshot()
+    lines: List[str] = []
+
+    def family(name: str, kind: str, help_text: str, samples) -> None:
+        samples = list(samples)
+        if not samples:
+            return
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if isinstance(value, float) and not math.isfinite(value):
+                continue
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+    summary = snapshot["summary"]
+    span_labels = [({"kind": row["kind"], "name": row["name"]}, row) for row in summary]
+    family(
+        _metric_name("spans_total"),
+        "counter",
+        "Completed spans.",
+        ((labels, row["count"]) for labels, row in span_labels),
+    )
+    family(
+        _metric_name("span_errors_total"),
+        "counter",
+        "Spans that raised an exception.",
+        ((labels, row["errors"]) for labels, row in span_labels),
+    )
+    family(
+        _metric_name("span_wall_seconds_total"),
+        "counter",
+        "Wall-clock seconds spent in spans.",
+        ((labels, float(row["wall_seconds"])) for labels, row in span_labels),
+    )
+    family(
+        _metric_name("span_cpu_seconds_total"),
+        "counter",
+        "CPU seconds of the threads running spans.",
+        ((labels, float(row["cpu_seconds"])) for labels, row in span_labels),
+    )
+
+    counters: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+    for counter in snapshot["counters"]:
+        counters.setdefault(counter["name"], []).append((counter["labels"], counter["value"]))
+    for name, samples in sorted(counters.items()):
+        family(_metric_name(name, "total"), "counter", f"Total {name.replace('_', ' ')}.", samples)
+
+    grouped: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+    for name, labels, value in _stat_samples(stats or {}):
+        grouped.setdefault(name, []).append((labels, value))
+    for name, samples in sorted(grouped.items()):
+        family(name, "gauge", "Run statistic.", samples)
+    return "\n".join(lines) + "\n"
+
+
+def write_report(
+    directory: str,
+    stats: Optional[Mapping[str, Any]] = None,
+    recorder: Optional[Metrics] = None,
+    **metadata: Any,
+) -> Tuple[str, str]:
+    """
+    Writes the metrics as ``metrics.json`` and ``metrics.prom`` into ``directory``.
+
+    Args:
+        directory: Output directory (the run directory of the pipeline).
+        stats: Additional statistics included in both files (see ``prometheus_text``).
+        recorder: Metrics to write, e.g. those of a run (default: the process-wide metrics).
+        **metadata: Included in the JSON report (run id, feature request, ...).
+
+    Returns:
+        Tuple[str, str]: Paths of the JSON report and the Prometheus textfile.
+    """
+    snapshot = (recorder or get_metrics()).snapshot()
+    os.makedirs(directory, exist_ok=True)
+    json_path = os.path.join(directory, REPORT_NAME)
+    prometheus_path = os.path.join(directory, PROMETHEUS_NAME)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({**metadata, **snapshot, "stats": dict(stats or {})}, f, indent=2, default=str)
+    # The textfile collector may read at any time: replace the file atomically
+    temporary_path = prometheus_path + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(snapshot, stats))
+    os.replace(temporary_path, prometheus_path)
+    return json_path, prometheus_path
@@ -0,0 +1,186 @@
+"""
+Staged, parallel writes of the generated project files.
+
+Step 8 used to write the output files one by one and exit halfway through on
+an error, leaving a partially updated project. ``ProjectWriter`` collects the
+files first. On ``commit`` it writes them all into a staging directory next to
+the project, in parallel batches, and flushes each batch to disk with fsync.
+Only once every file is staged are they moved into place with ``os.replace``.
+That step only renames files, so it is short, and each rename is atomic: a
+reader never sees a half-written file, and a failure while staging leaves the
+project untouched.
+
+Whatever else has to change in the project before the files are moved in,
+such as bringing it up to date with ``materialize_tree``, is passed to
+``commit`` as ``prepare``. It runs after staging has succeeded, so it never runs
+for a commit that fails while staging. ``materialize_tree`` leaves the files
+about to be replaced where they are, so they are never missing either.
+
+The files are swapped one by one rather than by renaming a complete copy of
+the project over it. A complete copy would have to include every unchanged
+file, which ``materialize_tree`` avoids placing again.
+
+Environment variables:
+    OUTPUT_WRITE_WORKERS: Batches written in parallel (default: 8).
+    OUTPUT_FSYNC_BATCH: Files written per batch before they are fsynced (default: 64).
+    OUTPUT_FSYNC: Set to ``off`` to skip fsync, e.g. on tmpfs or in tests (default: ``on``).
+"""
+
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_FSYNC_BATCH = 64
+
+
+def _fsync_directory(path: str) -> None:
+    # Makes the renames into the directory durable (not supported on Windows)
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ProjectWriter:
+    """
+    Writes a set of files into a project directory all at once.
+
+    Example:
+        writer = ProjectWriter("project_new")
+        writer.add("project_new/app.py", content)
+        writer.commit()
+
+    Attributes:
+        root: Project directory the files are written into.
+        workers: Batches written in parallel.
+        batch_size: Files written per batch before they are fsynced.
+        fsync: Whether staged files and updated directories are fsynced.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        workers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        fsync: Optional[bool] = None,
+    ):
+        self.root = root
+        self.workers = workers or int(os.getenv("OUTPUT_WRITE_WORKERS", DEFAULT_WORKERS))
+        self.batch_size = batch_size or int(os.getenv("OUTPUT_FSYNC_BATCH", DEFAULT_FSYNC_BATCH))
+        self.fsync = (
+            fsync if fsync is not None else os.getenv("OUTPUT_FSYNC", "on").lower() != "off"
+        )
+        self._files: Dict[str, str] = {}
+
+    def add(self, path: str, content: str) -> None:
+        """
+        Adds a file to write. A later ``add`` of the same path replaces the content.
+
+        Args:
+            path: Path of the file, inside the project directory.
+            content: Text content of the file.
+
+        Raises:
+            ValueError: If the path is outside the project directory.
+        """
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        if relative == os.curdir or relative.split(os.sep)[0] == os.pardir:
+            raise ValueError(f"Cannot write {path} outside of {self.root}")
+        self._files[relative] = content
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _stage(self, staging: str, batch: List[tuple]) -> None:
+        handles = []
+        try:
+            for index, _, content in batch:
+                f = open(os.path.join(staging, str(index)), "w", encoding="utf-8")
+                handles.append(f)
+                f.write(content)
+            for f in handles:
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        finally:
+            for f in handles:
+                f.close()
+
+    def commit(self, prepare: Optional[Callable[[], object]] = None) -> List[str]:
+        """
+        Stages every added file, then moves them into the project directory.
+
+        Args:
+            prepare: Called once every file is staged, before any is moved into
+                place (e.g. to materialize the rest of the project). Called
+                directly if there are no files.
+
+        Returns:
+            List[str]: Paths of the written files, in the order they were added.
+
+        Raises:
+            OSError: If a file cannot be staged or moved into place. Neither
+                ``prepare`` runs nor is anything moved into place if staging fails.
+        """
+        if not self._files:
+            if prepare:
+                prepare()
+            return []
+        started = time.perf_counter()
+        files = [
+            (index, relative, content)
+            for index, (relative, content) in enumerate(self._files.items())
+        ]
+        os.makedirs(self.root, exist_ok=True)
+        parent = os.path.dirname(os.path.abspath(self.root))
+        name = os.path.basename(os.path.abspath(self.root))
+        # A sibling of the project, so the final renames stay on one filesystem
+        staging = tempfile.mkdtemp(prefix=f".{name}.staging-", dir=parent)
+        try:
+            batches = [
+                files[i : i + self.batch_size] for i in range(0, len(files), self.batch_size)
+            ]
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as executor:
+                for future in [executor.submit(self._stage, staging, batch) for batch in batches]:
+                    future.result()
+            if prepare:
+                prepare()
+
+            directories = {
+                os.path.join(self.root, os.path.dirname(relative)) for _, relative, _ in files
+            }
+            for directory in sorted(directories):
+                os.makedirs(directory, exist_ok=True)
+            written = []
+            for index, relative, _ in files:
+                staged = os.path.join(staging, str(index))
+                target = os.path.join(self.root, relative)
+                try:
+                    # Keep the mode (e.g. executable scripts) of the file being replaced
+                    os.chmod(staged, stat.S_IMODE(os.stat(target).st_mode))
+                except FileNotFoundError:
+                    pass
+                os.replace(staged, target)
+                written.append(target)
+            if self.fsync:
+                for directory in sorted(directories):
+                    _fsync_directory(directory)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self._files.clear()
+        logger.info(
+            f"Wrote {len(written)} files to {self.root} in {time.perf_counter() - started:.2f}s "
+            f"({len(batches)} batches, fsync {'on' if self.fsync else 'off'})"
+        )
+        return written
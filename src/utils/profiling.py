@@ -0,0 +1,350 @@
+"""
+Per-stage CPU and memory profiles of a pipeline run.
+
+``StageProfiler`` profiles every stage of a ``Pipeline`` it is given to, in
+three complementary ways:
+
+    cProfile: deterministic call counts and self/cumulative time of every
+        function the stage thread ran, saved as ``<stage>.prof`` (open it with
+        ``python -m pstats``, snakeviz or tuna).
+    Sampling: the stack of every stage thread is sampled every
+        ``PROFILE_SAMPLE_INTERVAL`` seconds. Samples are wall-clock, so time the
+        stage spends waiting (on the LLM, a file or Chroma) shows up next to the
+        time it computes. They are saved as folded stacks, ``<stage>.folded``
+        and ``all.folded`` for the whole run, the input of flamegraph.pl,
+        speedscope and inferno.
+    tracemalloc: the peak traced memory while the stage ran and the source
+        lines that allocated the most memory it kept.
+
+Profiles are written to ``runs/<run_id>/profile/`` together with
+``profile.json``, a summary of every stage. Stages running concurrently share
+the memory peak, which is reported for each of them.
+
+Environment variables:
+    PROFILE_SAMPLE_INTERVAL: Seconds between stack samples (default: 0.005).
+
+Usage::
+
+    profiler = StageProfiler()
+    pipeline = Pipeline(profiler=profiler)
+    ...
+    with profiler:
+        pipeline.run()
+    profiler.write(os.path.join(pipeline.run_dir, PROFILE_DIR))
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_DIR = "profile"
+SUMMARY_NAME = "profile.json"
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Functions and allocation sites listed per stage in the summary
+TOP_ENTRIES = 10
+
+# Frames sampled per stack
+MAX_STACK_DEPTH = 128
+
+# tracemalloc is process-wide: it runs while any profiler needs it, and is left
+# running if it was started by someone else (e.g. PYTHONTRACEMALLOC)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def _start_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc() -> None:
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+@dataclass
+class StageProfile:
+    """
+    Profile of one stage.
+
+    Attributes:
+        stage: Stage name.
+        wall_seconds: Elapsed wall-clock time.
+        samples: Stack samples taken while the stage ran.
+        peak_memory_bytes: Peak traced memory of the process while the stage ran.
+        memory_growth_bytes: Traced memory the stage allocated and kept.
+        top_functions: Functions with the most self time (cProfile).
+        top_allocations: Source lines that allocated the most retained memory.
+        error: Why a profile is missing (e.g. another profiler was active).
+    """
+
+    stage: str
+    wall_seconds: float = 0.0
+    samples: int = 0
+    peak_memory_bytes: int = 0
+    memory_growth_bytes: int = 0
+    top_functions: List[Dict[str, Any]] = field(default_factory=list)
+    top_allocations: List[Dict[str, Any]] = field(default_factory=list)
+    error: str = ""
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    cwd = os.getcwd() + os.sep
+    if filename.startswith(cwd):
+        filename = filename[len(cwd):]
+    elif "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    else:
+        filename = os.path.basename(filename)
+    # ';' separates frames and ' ' the count in the folded format
+    return f"{code.co_name}@{filename}:{code.co_firstlineno}".replace(";", ":").replace(" ", "_")
+
+
+class StageProfiler:
+    """
+    Profiles the stages of a pipeline (see the module docstring).
+
+    The profiler is active between ``start`` and ``stop`` (or in a ``with``
+    block); ``Pipeline`` calls ``stage`` around each stage it runs.
+
+    Attributes:
+        sample_interval: Seconds between stack samples.
+        trace_memory: If False, tracemalloc is not used (it slows allocations down).
+        profiles: Finished stage profiles, in completion order.
+    """
+
+    def __init__(self, sample_interval: Optional[float] = None, trace_memory: bool = True):
+        self.sample_interval = sample_interval or float(
+            os.getenv("PROFILE_SAMPLE_INTERVAL", str(DEFAULT_SAMPLE_INTERVAL))
+        )
+        self.trace_memory = trace_memory
+        self.profiles: List[StageProfile] = []
+        self._cprofiles: Dict[str, cProfile.Profile] = {}
+        self._stacks: Dict[str, Counter] = {}
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts the stack sampler and tracemalloc.
+        """
+        if self._sampler is not None:
+            return
+        if self.trace_memory:
+            _start_tracemalloc()
+        self._stopped.clear()
+        self._sampler = threading.Thread(target=self._sample, name="stage-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        """
+        Stops the stack sampler and tracemalloc.
+        """
+        if self._sampler is None:
+            return
+        self._stopped.set()
+        self._sampler.join()
+        self._sampler = None
+        if self.trace_memory:
+            _stop_tracemalloc()
+
+    def __enter__(self) -> "StageProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageProfile]:
+        """
+        Profiles the body of a ``with`` block, run in the current thread, as stage ``name``.
+        """
+        profile = StageProfile(name)
+        thread_id = threading.get_ident()
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            with self._lock:
+                if not self._threads:
+                    # Concurrent stages share the peak rather than reset it for each other
+                    tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        cprofile: Optional[cProfile.Profile] = cProfile.Profile()
+        try:
+            cprofile.enable()
+        except ValueError as e:  # another profiler (e.g. a debugger) is active
+            cprofile, profile.error = None, str(e)
+        with self._lock:
+            self._threads[thread_id] = name
+            self._stacks.setdefault(name, Counter())
+        started = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            if cprofile is not None:
+                cprofile.disable()
+            profile.wall_seconds = time.perf_counter() - started
+            with self._lock:
+                self._threads.pop(thread_id, None)
+                profile.samples = sum(self._stacks[name].values())
+            if cprofile is not None:
+                profile.top_functions = _top_functions(cprofile)
+            if tracing:
+                profile.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+                after = tracemalloc.take_snapshot()
+                profile.memory_growth_bytes, profile.top_allocations = _top_allocations(
+                    before, after
+                )
+            with self._lock:
+                if cprofile is not None:
+                    self._cprofiles[name] = cprofile
+                self.profiles.append(profile)
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stopped.wait(self.sample_interval):
+            with self._lock:
+                threads = dict(self._threads)
+            if not threads:
+                continue
+            frames = sys._current_frames()
+            for thread_id, name in threads.items():
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                with self._lock:
+                    self._stacks[name][";".join(reversed(stack))] += 1
+
+    def folded(self, stage: Optional[str] = None) -> str:
+        """
+        Returns the sampled stacks in the folded format (``frame;frame;... count``).
+
+        Args:
+            stage: Stacks of this stage only; by default the stacks of every
+                stage, each rooted at a frame named after its stage.
+        """
+        with self._lock:
+            if stage is not None:
+                stacks = self._stacks.get(stage, Counter())
+                lines = [f"{stack} {count}" for stack, count in stacks.items()]
+            else:
+                lines = [
+                    f"{name};{stack} {count}"
+                    for name, stacks in self._stacks.items()
+                    for stack, count in stacks.items()
+                ]
+        return "\n".join(sorted(lines)) + ("\n" if lines else "")
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns the profile of every finished stage.
+        """
+        with self._lock:
+            return {
+                "sample_interval": self.sample_interval,
+                "stages": [asdict(profile) for profile in self.profiles],
+            }
+
+    def write(self, directory: str) -> str:
+        """
+        Writes ``<stage>.prof``, ``<stage>.folded``, ``all.folded`` and
+        ``profile.json`` into ``directory``.
+
+        Returns:
+            str: Path of the ``profile.json`` summary.
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            cprofiles = dict(self._cprofiles)
+            stages = list(self._stacks)
+        for name, cprofile in cprofiles.items():
+            cprofile.dump_stats(os.path.join(directory, f"{name}.prof"))
+        for name in stages:
+            with open(os.path.join(directory, f"{name}.folded"), "w", encoding="utf-8") as f:
+                f.write(self.folded(name))
+        with open(os.path.join(directory, "all.folded"), "w", encoding="utf-8") as f:
+            f.write(self.folded())
+        summary_path = os.path.join(directory, SUMMARY_NAME)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        return summary_path
+
+
+def _top_functions(cprofile: cProfile.Profile, top: int = TOP_ENTRIES) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(cprofile).stats  # type: ignore[attr-defined]
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+    return [
+        {
+            # Built-in functions have no file ("~")
+            "function": function if filename == "~" else f"{function}@{os.path.basename(filename)}:{line}",
+            "calls": calls,
+            "self_seconds": round(self_time, 6),
+            "cumulative_seconds": round(cumulative, 6),
+        }
+        for (filename, line, function), (_, calls, self_time, cumulative, _) in rows
+    ]
+
+
+def _top_allocations(
+    before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, top: int = TOP_ENTRIES
+) -> Tuple[int, List[Dict[str, Any]]]:
+    ignore = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ]
+    differences = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    growth = sum(difference.size_diff for difference in differences)
+    allocations = [
+        {
+            "location": f"{difference.traceback[0].filename}:{difference.traceback[0].lineno}",
+            "size_bytes": difference.size_diff,
+            "count": difference.count_diff,
+        }
+        for difference in sorted(differences, key=lambda d: d.size_diff, reverse=True)[:top]
+        if difference.size_diff > 0
+    ]
+    return growth, allocations
+
+
+def format_profile(summary: Dict[str, Any]) -> str:
+    """
+    Formats a ``StageProfiler.summary()`` as a text report.
+    """
+    lines = [f"{'stage':<24} {'wall':>9} {'samples':>8} {'peak MB':>9} {'kept MB':>9}  hottest"]
+    for profile in summary["stages"]:
+        hottest = profile["top_functions"][0]["function"] if profile["top_functions"] else "-"
+        lines.append(
+            f"{profile['stage']:<24} {profile['wall_seconds']:>8.2f}s {profile['samples']:>8} "
+            f"{profile['peak_memory_bytes'] / 1e6:>9.1f} "
+            f"{profile['memory_growth_bytes'] / 1e6:>9.1f}  {hottest}"
+        )
+    return "\n".join(lines)
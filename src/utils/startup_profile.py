@@ -0,0 +1,170 @@
+"""
+Start-up import profile of the CLI.
+
+Heavy dependencies (LangChain, Chroma, sentence-transformers, torch and the
+watsonx SDK) are imported by the stages that use them, not when ``main`` is
+imported, so ``--help``, argument errors and remote runs start quickly.
+``profile_startup`` checks this boundary: it imports ``main`` in a fresh
+interpreter with ``-X importtime`` and reports the slowest imports on the
+start-up path and what each deferred module costs when its stage first runs.
+
+Usage::
+
+    python main.py --profile-startup
+"""
+
+import json
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Tuple
+
+# Modules loaded on first use by the pipeline stages
+DEFERRED_MODULES = (
+    "src.vector_database.db_builder",
+    "src.vector_database.db_load",
+    "langchain_ibm",
+)
+
+# Imports the modules given as arguments and prints the failures as JSON.
+# json is imported last so that it is attributed to the modules that use it.
+_IMPORT_SCRIPT = """
+import sys
+errors = {}
+for name in sys.argv[1:]:
+    try:
+        __import__(name)
+    except Exception as e:
+        errors[name] = f"{type(e).__name__}: {e}"
+import json
+print(json.dumps(errors))
+"""
+
+
+@dataclass
+class ImportTiming:
+    """
+    Import time of one module.
+
+    Attributes:
+        module: Module name.
+        seconds: Cumulative import time, excluding modules imported before it.
+        error: Import error, e.g. when an optional dependency is not installed.
+    """
+
+    module: str
+    seconds: float
+    error: str = ""
+
+
+@dataclass
+class StartupProfile:
+    """
+    Start-up cost of an entry module.
+
+    Attributes:
+        entry: The profiled module (``main``).
+        wall_seconds: Interpreter start-up plus ``import entry``, without profiling.
+        import_seconds: Import time of ``entry``.
+        slowest: Slowest direct imports of ``entry``.
+        deferred: Import time of each deferred module once ``entry`` is loaded.
+    """
+
+    entry: str
+    wall_seconds: float
+    import_seconds: float
+    slowest: List[ImportTiming] = field(default_factory=list)
+    deferred: List[ImportTiming] = field(default_factory=list)
+
+
+def parse_importtime(output: str) -> List[Tuple[int, str, float]]:
+    """
+    Parses ``-X importtime`` output.
+
+    Returns:
+        List[Tuple[int, str, float]]: ``(depth, module, cumulative seconds)`` in
+        output order (a module is listed after the modules it imports).
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1_000_000))
+    return entries
+
+
+def profile_startup(
+    entry: str = "main", deferred: Sequence[str] = DEFERRED_MODULES, top: int = 8
+) -> StartupProfile:
+    """
+    Profiles the imports of ``entry`` and ``deferred`` in fresh interpreters.
+
+    Args:
+        entry: Module whose start-up is measured.
+        deferred: Modules expected to stay off the start-up path.
+        top: Number of slowest direct imports of ``entry`` reported.
+
+    Returns:
+        StartupProfile: The measured times.
+    """
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {entry}"], check=False, capture_output=True)
+    wall_seconds = time.perf_counter() - started
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _IMPORT_SCRIPT, entry, *deferred],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    errors: Dict[str, str] = {}
+    if result.stdout.strip():
+        errors = json.loads(result.stdout.strip().splitlines()[-1])
+
+    top_level: Dict[str, float] = {}
+    children: List[ImportTiming] = []
+    pending: List[ImportTiming] = []
+    for depth, name, seconds in parse_importtime(result.stderr):
+        if depth == 1:
+            pending.append(ImportTiming(name, seconds))
+        elif depth == 0:
+            top_level[name] = seconds
+            if name == entry:
+                children = pending
+            pending = []
+
+    return StartupProfile(
+        entry=entry,
+        wall_seconds=wall_seconds,
+        import_seconds=top_level.get(entry, 0.0),
+        slowest=sorted(children, key=lambda timing: timing.seconds, reverse=True)[:top],
+        deferred=[
+            ImportTiming(name, top_level.get(name, 0.0), errors.get(name, ""))
+            for name in deferred
+        ],
+    )
+
+
+def format_startup_profile(profile: StartupProfile) -> str:
+    """
+    Formats a start-up profile as a text report.
+    """
+    lines = [
+        f"Start-up: {profile.wall_seconds * 1000:.0f} ms "
+        f"(interpreter + import {profile.entry}), "
+        f"import {profile.entry}: {profile.import_seconds * 1000:.0f} ms",
+        f"Slowest imports of {profile.entry}:",
+    ]
+    lines += [f"  {timing.seconds * 1000:8.1f} ms  {timing.module}" for timing in profile.slowest]
+    lines.append("Deferred until their stage runs:")
+    for timing in profile.deferred:
+        if timing.error:
+            lines.append(f"  {'-':>8}     {timing.module} (not importable: {timing.error})")
+        else:
+            lines.append(f"  {timing.seconds * 1000:8.1f} ms  {timing.module}")
+    return "\n".join(lines)
@@ -1,6 +1,23 @@
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 from langchain_core.documents.base import Document
+from functools import lru_cache
+
+from src.utils.metrics import get_metrics
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+@lru_cache(maxsize=None)
+def get_embedding_function(model_name=EMBEDDING_MODEL):
+    """
+    Returns the embedding model, loaded once per process.
+
+    Loading the sentence-transformers model takes seconds, so batch runs and
+    the worker daemon share one instance across index builds and loads.
+    """
+    return SentenceTransformerEmbeddings(model_name=model_name)
+
 
 def build_vector_database(project_data, persist_directory=None):
     """
@@ -23,19 +40,21 @@ def build_vector_database(project_data, persist_directory=None):
     ]
     
     # Create embeddings and vector database
-    embedding = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    embedding = get_embedding_function()
     
-    if persist_directory:
-        # Create or load the persistent Chroma vector database
-        vector_db = Chroma.from_documents(
-            documents=documents,
-            embedding=embedding,  # Use 'embedding' instead of 'embedding_function'
-            persist_directory=persist_directory
-        )
-        vector_db.persist()
-    else:
-        # Create a transient Chroma vector database
-        vector_db = Chroma.from_documents(documents, embedding=embedding)  # Use 'embedding' instead of 'embedding_function'
+    with get_metrics().span("build_vector_database", kind="embedding", documents=len(documents)):
+        if persist_directory:
+            # Create or load the persistent Chroma vector database
+            vector_db = Chroma.from_documents(
+                documents=documents,
+                embedding=embedding,  # Use 'embedding' instead of 'embedding_function'
+                persist_directory=persist_directory
+            )
+            vector_db.persist()
+        else:
+            # Create a transient Chroma vector database
+            vector_db = Chroma.from_documents(documents, embedding=embedding)  # Use 'embedding' instead of 'embedding_function'
+    get_metrics().count("embedded_documents", len(documents))
     
     return vector_db
 
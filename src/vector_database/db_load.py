@@ -6,7 +6,7 @@ from langchain.vectorstores import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 from chromadb import PersistentClient
 import torch
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
+from src.vector_database.db_builder import get_embedding_function
 
 def load_vector_db_by_collection(collection_name, persist_directory="./chroma_db"):
     """
@@ -59,7 +59,7 @@ def load_vector_database(persist_directory):
     if not persist_directory:
         raise ValueError("persist_directory must be provided to load the database.")
 
-    embedding_function = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+    embedding_function = get_embedding_function()
     vector_db = Chroma(
         embedding_function=embedding_function, 
         persist_directory=persist_directory
@@ -1,3 +1,6 @@
+from src.utils.metrics import get_metrics
+
+
 def query_vector_database(vector_db, query, top_k=5):
     """
     Queries the vector database for relevant documents.
@@ -12,3 +15,42 @@ def query_vector_database(vector_db, query, top_k=5):
     """
     retriever = vector_db.as_retriever(search_kwargs={"k": top_k})
     return retriever.get_relevant_documents(query)
+
+
+def format_retrieved_context(documents):
+    """
+    Formats retrieved documents as grounding text for LLM prompts.
+
+    Args:
+        documents: Ranked list of retrieved documents.
+
+    Returns:
+        Grounding text with the documents in ranking order, or an empty string.
+    """
+    if not documents:
+        return ""
+    sections = [doc.page_content for doc in documents]
+    return "Relevant project context:\n\n" + "\n\n".join(sections)
+
+
+def retrieve_context(vector_db, query, top_k=5):
+    """
+    Runs a single retrieval pass and returns the ranked context as grounding text.
+
+    The pipeline calls this once per run with the feature request, then passes
+    the result to every LLM call through the ``grounding`` parameter instead of
+    letting each call embed its full prompt and search again.
+
+    Args:
+        vector_db: The vector database instance.
+        query: The search query (typically the feature request).
+        top_k: Number of top documents to retrieve.
+
+    Returns:
+        Tuple of (documents, grounding_text).
+    """
+    with get_metrics().span("retrieve_context", kind="retrieval", top_k=top_k) as span:
+        documents = query_vector_database(vector_db, query, top_k=top_k)
+        span.set(documents=len(documents))
+    get_metrics().count("retrieved_documents", len(documents))
+    return documents, format_retrieved_context(documents)
@@ -0,0 +1,82 @@
+import os
+import random
+import tempfile
+import unittest
+
+from benchmarks.compare import compare_results
+from benchmarks.run import latency_summary, percentile, run_suite
+from benchmarks.synthetic import ProjectSpec, generate_project, parse_mix, size_sampler
+
+
+class TestSyntheticProject(unittest.TestCase):
+    def test_generate_project(self):
+        spec = ProjectSpec(files=45, mix="python=3,markdown=1", sizes="fixed:200", seed=7)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            project = generate_project(os.path.join(tmp_dir, "a"), spec)
+            again = generate_project(os.path.join(tmp_dir, "b"), spec)
+            self.assertEqual(len(project.paths), 45)
+            self.assertTrue(all(os.path.getsize(path) >= 200 for path in project.paths))
+            self.assertEqual(sum(project.languages.values()), 45)
+            self.assertLessEqual(set(project.languages), {"python", "markdown"})
+            self.assertEqual(project.languages, again.languages)
+            self.assertEqual(project.total_bytes, again.total_bytes)
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "a", "requirements.txt")))
+            # Bounded fan-out: files beyond the first directory go to sub-packages
+            directories = [
+                os.path.dirname(os.path.relpath(path, project.path)) for path in project.paths
+            ]
+            self.assertEqual(directories[19], "src")
+            self.assertEqual(directories[20], os.path.join("src", "pkg0"))
+            self.assertEqual(directories[44], os.path.join("src", "pkg1"))
+
+    def test_invalid_specs(self):
+        self.assertEqual(parse_mix("python=0.5,json"), {"python": 0.5, "json": 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix("cobol=1")
+        with self.assertRaises(ValueError):
+            parse_mix("python=0")
+        with self.assertRaises(ValueError):
+            size_sampler("normal:10,2", random.Random(0))
+        sample = size_sampler("uniform:100,200", random.Random(0))
+        self.assertTrue(all(100 <= sample() <= 200 for _ in range(50)))
+
+
+class TestBenchmarkRun(unittest.TestCase):
+    def test_percentiles(self):
+        samples = [0.004, 0.001, 0.003, 0.002]
+        self.assertAlmostEqual(percentile(samples, 50), 0.0025)
+        self.assertEqual(percentile(samples, 100), 0.004)
+        summary = latency_summary(samples)
+        self.assertEqual(summary["p50"], 2.5)
+        self.assertEqual(summary["max"], 4.0)
+
+    def test_run_suite(self):
+        report = run_suite(files=[12], stages=["parse", "tree", "zip"], repeat=2)
+        stages = [result["stage"] for result in report["results"]]
+        self.assertEqual(stages, ["parse", "tree", "zip"])
+        for result in report["results"]:
+            self.assertEqual(result["error"], "")
+            self.assertEqual(len(result["seconds"]), 2)
+            self.assertGreater(result["items_per_second"], 0)
+        with self.assertRaises(ValueError):
+            run_suite(files=[1], stages=["deploy"])
+
+    def test_compare_results(self):
+        def result(p50):
+            return {
+                "latency_ms": {"p50": p50},
+                "items_per_second": 1000 / p50,
+                "peak_memory_mb": 1.0,
+                "error": "",
+            }
+
+        base = {("parse", 100): result(10.0), ("zip", 100): result(20.0)}
+        new = {("parse", 100): result(12.0), ("zip", 100): result(20.5)}
+        rows = compare_results(base, new, threshold=10)
+        self.assertEqual([row["stage"] for row in rows], ["parse", "zip"])
+        self.assertAlmostEqual(rows[0]["latency_change"], 20.0)
+        self.assertEqual([row["regression"] for row in rows], [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
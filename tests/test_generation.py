@@ -1,7 +1,316 @@
+import json
+import os
+import tempfile
 import unittest
+import unittest.mock
+import zipfile
+from src.generation.patching import MODE_FULL, MODE_UNIFIED_DIFF, apply_patch
+from src.generation.plan_stream import PlanStreamParser, repair_json
+from src.generation.preprocessing import extract_json_from_response, parse_feature_analysis
+from src.generation.region_sharding import generate_sharded, select_regions, split_regions
 from src.generation.project_generator import generate_project
+from src.generation.project_structure import (
+    build_overlay,
+    clone_project,
+    update_project_structure,
+)
+from src.generation.task_prompts import PromptTooLargeError, generate_task_prompts
+from src.models.token_budget import PromptBudget, TokenCounter
+from src.utils.output_writer import ProjectWriter
 
 class TestGeneration(unittest.TestCase):
     def test_generate_project(self):
         generate_project("./project_old", "./project_new", [{"file": "main.py", "content": "# Feature added"}])
         self.assertTrue(os.path.exists("./project_new/main.py"))
+
+
+class TestProjectOverlay(unittest.TestCase):
+    def test_overlay_serves_project_without_writing_it(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old, new = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+            os.makedirs(os.path.join(old, "pkg"))
+            for path, content in [("app.py", "a = 1\n"), ("pkg/util.py", "u = 1\n")]:
+                with open(os.path.join(old, path), "w", encoding="utf-8") as f:
+                    f.write(content)
+            plan = {
+                "existing_files": [{"file_path": os.path.join(old, "app.py")}],
+                "new_files": [{"file_path": "pkg/log.py"}],
+            }
+            overlay, _ = build_overlay(json.dumps(plan), ["a = 2\n", "LOG = 1\n"], old, new)
+
+            self.assertFalse(os.path.exists(new))
+            self.assertEqual(overlay.changed(), ["app.py", "pkg/log.py"])
+            self.assertEqual(overlay.read("app.py"), "a = 2\n")
+            self.assertEqual(overlay.read("pkg/util.py"), "u = 1\n")
+            self.assertTrue(overlay.exists("pkg/log.py"))
+            self.assertEqual(
+                overlay.tree(), "├── app.py\n└── pkg\n    ├── log.py\n    └── util.py\n"
+            )
+            diff = overlay.diff()
+            self.assertIn("-a = 1\n+a = 2\n", diff)
+            self.assertIn("--- /dev/null\n+++ b/pkg/log.py", diff)
+
+            zip_path = os.path.join(tmp_dir, "new.zip")
+            self.assertEqual(overlay.write_zip(zip_path), 3)
+            with zipfile.ZipFile(zip_path) as archive:
+                self.assertEqual(archive.read("app.py"), b"a = 2\n")
+                self.assertEqual(archive.read("pkg/util.py"), b"u = 1\n")
+
+            overlay.flush()
+            with open(os.path.join(new, "pkg", "log.py"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "LOG = 1\n")
+            with open(os.path.join(old, "app.py"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "a = 1\n")
+
+
+class TestProjectStructure(unittest.TestCase):
+    def test_failed_staging_leaves_project_untouched(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old, new = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+            os.makedirs(os.path.join(old, "pkg"))
+            for path, content in [("app.py", "a = 1\n"), ("pkg/util.py", "u = 1\n")]:
+                with open(os.path.join(old, path), "w", encoding="utf-8") as f:
+                    f.write(content)
+            clone_project(old, new)
+            with open(os.path.join(new, "stray.py"), "w", encoding="utf-8") as f:
+                f.write("")
+            files = [{"file_path": os.path.join(old, path)} for path in ("app.py", "pkg/util.py")]
+            plan = json.dumps({"existing_files": files})
+
+            failing = unittest.mock.patch.object(
+                ProjectWriter, "_stage", side_effect=OSError("disk full")
+            )
+            with failing:
+                with self.assertRaises(OSError):
+                    update_project_structure(plan, ["a = 2\n", "u = 2\n"], old, new)
+            # Neither the rewritten files nor the rest of the project were touched
+            for path, content in [("app.py", "a = 1\n"), ("pkg/util.py", "u = 1\n")]:
+                with open(os.path.join(new, path), encoding="utf-8") as f:
+                    self.assertEqual(f.read(), content)
+            self.assertTrue(os.path.exists(os.path.join(new, "stray.py")))
+
+            update_project_structure(plan, ["a = 2\n", "u = 2\n"], old, new)
+            with open(os.path.join(new, "app.py"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "a = 2\n")
+            with open(os.path.join(old, "app.py"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "a = 1\n")
+            self.assertFalse(os.path.exists(os.path.join(new, "stray.py")))
+
+
+class TestFeatureAnalysisParser(unittest.TestCase):
+    def test_parses_fenced_json_with_lists(self):
+        response = (
+            "Here is the analysis:\n```json\n"
+            '{"nodes": ["app.py: entry point", "db.py: storage",], '
+            '"edges": {"app.py -> db.py": "queries"}, "impact_report": "Low risk."}\n```'
+        )
+        analysis = parse_feature_analysis(response)
+        self.assertEqual(analysis["nodes"], "- app.py: entry point\n- db.py: storage")
+        self.assertEqual(analysis["edges"], "- app.py -> db.py: queries")
+        self.assertEqual(analysis["impact_report"], "Low risk.")
+
+    def test_unfenced_object_and_key_aliases(self):
+        response = 'Sure. {"Nodes": "a.py", "Dependencies": "a -> b", "Impact Report": "ok {x}"} Done.'
+        analysis = parse_feature_analysis(response)
+        self.assertEqual(analysis, {"nodes": "a.py", "edges": "a -> b", "impact_report": "ok {x}"})
+
+    def test_missing_section_or_invalid_json(self):
+        self.assertIsNone(parse_feature_analysis('{"nodes": "a.py", "edges": "a -> b"}'))
+        self.assertIsNone(parse_feature_analysis("The nodes are a.py and b.py."))
+        self.assertIsNone(parse_feature_analysis('{"nodes": [unquoted]}'))
+
+    def test_malformed_json_is_repaired(self):
+        response = "{'nodes': 'a.py', 'edges': 'a -> b', 'impact_report': 'Low risk"
+        analysis = parse_feature_analysis(response)
+        self.assertEqual(analysis, {"nodes": "a.py", "edges": "a -> b", "impact_report": "Low risk"})
+
+
+ORIGINAL_SOURCE = (
+    "import os\n"
+    "\n"
+    "def greet(name):\n"
+    "    print('hello', name)\n"
+    "    return name\n"
+    "\n"
+    "def main():\n"
+    "    greet('world')\n"
+)
+
+
+class TestPatching(unittest.TestCase):
+    def test_search_replace_blocks(self):
+        response = (
+            "```\n<<<<<<< SEARCH\n    print('hello', name)\n=======\n"
+            "    logger.info('hello %s', name)\n>>>>>>> REPLACE\n```\n"
+            "<<<<<<< SEARCH\n=======\n\nmain()\n>>>>>>> REPLACE\n"
+        )
+        result = apply_patch(ORIGINAL_SOURCE, response)
+        self.assertEqual(result.applied, 2)
+        self.assertFalse(result.conflicts)
+        self.assertIn("    logger.info('hello %s', name)\n", result.content)
+        self.assertTrue(result.content.endswith("greet('world')\n\nmain()\n"))
+
+    def test_whitespace_and_fuzzy_matching(self):
+        response = (
+            "<<<<<<< SEARCH\ndef greet(name):\nprint('hello', name)\n=======\n"
+            "def greet(name):\n    print('hi', name)\n>>>>>>> REPLACE\n"
+            "<<<<<<< SEARCH\ndef main():\n    greet('wrld')\n=======\n"
+            "def main():\n    greet('everyone')\n>>>>>>> REPLACE"
+        )
+        result = apply_patch(ORIGINAL_SOURCE, response)
+        self.assertEqual((result.applied, result.fuzzy), (2, 2))
+        self.assertIn("def greet(name):\n    print('hi', name)\n", result.content)
+        self.assertIn("    greet('everyone')\n", result.content)
+
+    def test_unified_diff_and_conflicts(self):
+        response = (
+            "--- a/app.py\n+++ b/app.py\n@@ -3,3 +3,4 @@\n def greet(name):\n"
+            "-    print('hello', name)\n+    print('hello', name)\n+    print('bye')\n"
+            "     return name\n@@ -20,1 +21,1 @@\n-class Missing(Exception):\n+class Found(Exception):\n"
+        )
+        result = apply_patch(ORIGINAL_SOURCE, response)
+        self.assertEqual(result.mode, MODE_UNIFIED_DIFF)
+        self.assertEqual(result.applied, 1)
+        self.assertEqual(len(result.conflicts), 1)
+        self.assertEqual(result.conflicts[0].index, 2)
+        self.assertIn("    print('bye')\n    return name\n", result.content)
+
+    def test_fences_and_dashes_in_edited_content(self):
+        readme = "# Demo\n\n```bash\nmake run\n```\n"
+        response = (
+            "```markdown\n<<<<<<< SEARCH\n```bash\nmake run\n```\n=======\n"
+            "```bash\nmake install\nmake run\n```\n>>>>>>> REPLACE\n```\n"
+        )
+        result = apply_patch(readme, response)
+        self.assertEqual(result.applied, 1)
+        self.assertEqual(result.content, "# Demo\n\n```bash\nmake install\nmake run\n```\n")
+
+        schema = "-- users\nCREATE TABLE users (id INT);\n-- old index\nCREATE INDEX users_id;\n"
+        response = (
+            "```diff\n--- a/schema.sql\n+++ b/schema.sql\n@@ -2,3 +2,1 @@\n"
+            " CREATE TABLE users (id INT);\n--- old index\n-CREATE INDEX users_id;\n```\n"
+        )
+        result = apply_patch(schema, response)
+        self.assertEqual((result.mode, result.applied), (MODE_UNIFIED_DIFF, 1))
+        self.assertEqual(result.content, "-- users\nCREATE TABLE users (id INT);\n")
+
+    def test_full_file_response_is_kept(self):
+        result = apply_patch(ORIGINAL_SOURCE, "print('rewritten')\n")
+        self.assertEqual(result.mode, MODE_FULL)
+        self.assertEqual(result.content, "print('rewritten')\n")
+
+    def test_full_file_response_to_truncated_content_is_a_conflict(self):
+        echoed = "import os\n... [truncated 120 tokens] ...\nprint('end')\n"
+        for response, allow_full in [(echoed, True), ("print('rewritten')\n", False)]:
+            result = apply_patch(ORIGINAL_SOURCE, response, allow_full=allow_full)
+            self.assertEqual(result.content, ORIGINAL_SOURCE)
+            self.assertEqual(len(result.conflicts), 1)
+        edits = "<<<<<<< SEARCH\n    return name\n=======\n    return name.upper()\n>>>>>>> REPLACE\n"
+        self.assertEqual(apply_patch(ORIGINAL_SOURCE, edits, allow_full=False).applied, 1)
+
+
+LARGE_SOURCE = (
+    "import os\n\nLIMIT = 3\n\n\n"
+    "def load(path):\n    return open(path).read()\n\n\n"
+    "class Store:\n    kind = 'memory'\n\n"
+    + "".join(f"    def get_{i}(self):\n        return {i}\n\n" for i in range(70))
+    + "\ndef save(path, data):\n    open(path, 'w').write(data)\n"
+)
+
+
+class TestRegionSharding(unittest.TestCase):
+    def test_regions_cover_file(self):
+        regions = split_regions(LARGE_SOURCE, "store.py")
+        self.assertEqual("".join(region.text for region in regions), LARGE_SOURCE)
+        names = [region.name for region in regions]
+        self.assertEqual(names[:4], ["<header>", "load", "Store.<class>", "Store.get_0"])
+        self.assertEqual(names[-1], "save")
+        selected = select_regions(regions, "Validate the path in save", "Add validation")
+        self.assertEqual([region.name for region in selected], ["<header>", "save"])
+
+    def test_edits_selected_regions_and_reverts_broken_ones(self):
+        prompts = []
+
+        def generate(prompt, source):
+            prompts.append(prompt)
+            if "Region Content (save)" in prompt:
+                return "```python\ndef save(path, data):\n    assert path\n    open(path, 'w').write(data)\n```"
+            return "import os\nimport (\n"
+
+        result = generate_sharded("store.py", LARGE_SOURCE, "Validate the path in save", "", "", generate)
+        self.assertEqual(len(prompts), 2)
+        self.assertEqual(result.edited, ["save"])
+        self.assertIn("<header>", result.reverted)
+        self.assertTrue(result.consistent)
+        self.assertTrue(result.content.startswith("import os\n\nLIMIT = 3\n"))
+        self.assertTrue(result.content.endswith("    assert path\n    open(path, 'w').write(data)\n"))
+
+    def test_file_content_is_truncated_only_in_patch_mode(self):
+        budget = PromptBudget(TokenCounter("unknown-model"), 400)
+        plan = json.dumps(
+            {
+                "feature_request": "Add validation",
+                "analysis_results": "Nodes: save",
+                "existing_files": [
+                    {"file_path": "store.py", "task": "Validate the path", "content": LARGE_SOURCE}
+                ],
+            }
+        )
+        self.assertEqual(generate_task_prompts(plan, budget=budget), [None])
+        roomy = PromptBudget(TokenCounter("unknown-model"), 4000)
+        prompt = generate_task_prompts(plan, budget=lambda file, existing: roomy)[0]
+        self.assertIn(LARGE_SOURCE.strip(), prompt)
+        patch_prompt = generate_task_prompts(plan, budget=budget, output_mode="patch")[0]
+        self.assertIn("truncated", patch_prompt)
+
+        calls = []
+
+        def generate(prompt, source):
+            calls.append((prompt, source))
+            return source
+
+        generate_sharded("store.py", LARGE_SOURCE, "Validate the path in save", "", "", generate, budget=budget)
+        self.assertTrue(calls)
+        for prompt, source in calls:
+            self.assertIn(source.rstrip("\n"), prompt)
+        with self.assertRaises(PromptTooLargeError):
+            generate_sharded(
+                "store.py", LARGE_SOURCE, "Validate the path in save", "", "", generate,
+                budget=PromptBudget(TokenCounter("unknown-model"), 20),
+            )
+
+
+class TestPlanStream(unittest.TestCase):
+    def test_entries_are_emitted_as_they_complete(self):
+        plan = {
+            "feature_request": "Add {logging}",
+            "analysis_results": 'Touches "app" only',
+            "existing_files": [{"file_path": "app.py", "task": "Log } calls"}],
+            "new_files": [{"file_path": "log.py", "purpose": "Logger setup"}],
+        }
+        text = "Plan:\n```json\n" + json.dumps(plan, indent=2) + "\n```\n"
+        parser = PlanStreamParser()
+        events = []
+        for start in range(0, len(text), 5):
+            for event in parser.feed(text[start:start + 5]):
+                events.append((start, event))
+        self.assertEqual([event for _, event in events], [
+            ("existing_files", 0, plan["existing_files"][0]),
+            ("new_files", 0, plan["new_files"][0]),
+        ])
+        self.assertLess(events[0][0], text.index("new_files"))
+        self.assertEqual(parser.fields["analysis_results"], 'Touches "app" only')
+        self.assertEqual(parser.close(), plan)
+
+    def test_repair_common_malformations(self):
+        text = (
+            "```json\n{'feature_request': 'Add logging', analysis_results: None, // note\n"
+            '"existing_files": [{"file_path": "app.py", "task": "Log\ncalls",},] "new_files": ['
+        )
+        self.assertEqual(json.loads(repair_json(text)), {
+            "feature_request": "Add logging",
+            "analysis_results": None,
+            "existing_files": [{"file_path": "app.py", "task": "Log\ncalls"}],
+            "new_files": [],
+        })
+        self.assertEqual(extract_json_from_response('{"a": [1, 2,]}'), {"a": [1, 2]})
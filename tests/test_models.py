@@ -0,0 +1,347 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from src.models.backends import OpenAICompatibleBackend, StubBackend, create_backend, set_backend
+from src.models.cassette import (
+    RECORD,
+    REPLAY,
+    CassetteBackend,
+    CassetteMissError,
+    LatencyModel,
+)
+from src.models.llm_cache import LLMResponseCache, hash_context, make_cache_key
+from src.models.llm_inference import query_llm, stream_llm
+from src.models.output_governor import (
+    FENCE_STOP,
+    output_budget,
+    output_stats,
+    reset_output_stats,
+)
+from src.models.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientCaller,
+    RetryPolicy,
+    is_transient_error,
+    retry_after_seconds,
+)
+from src.models.token_budget import PromptBudget, PromptSection, TokenCounter
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = LLMResponseCache(cache_dir=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_hit_and_miss(self):
+        key = make_cache_key("model", {"decoding_method": "greedy"}, "prompt", hash_context(["doc"]))
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, "response")
+        self.assertEqual(self.cache.get(key), "response")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_key_depends_on_context(self):
+        params = {"decoding_method": "greedy"}
+        self.assertNotEqual(
+            make_cache_key("model", params, "prompt", hash_context(["a"])),
+            make_cache_key("model", params, "prompt", hash_context(["b"])),
+        )
+
+    def test_bypass_and_refresh(self):
+        self.cache.put("ab" * 32, "response")
+        self.cache.refresh = True
+        self.assertIsNone(self.cache.get("ab" * 32))
+        self.cache.enabled = False
+        self.assertIsNone(self.cache.get("ab" * 32))
+        self.assertEqual(self.cache.stats()["bypassed"], 1)
+
+    def test_size_based_eviction(self):
+        self.cache.max_bytes = 600
+        for i in range(10):
+            self.cache.put(f"{i:064x}", "x" * 100)
+        self.assertLessEqual(self.cache.size(), 600)
+        self.assertGreater(self.cache.stats()["evictions"], 0)
+        self.assertTrue(os.path.isdir(self.tmp_dir.name))
+
+
+class TestPromptBudget(unittest.TestCase):
+    def setUp(self):
+        self.counter = TokenCounter("unknown-model")
+
+    def test_no_reduction_within_budget(self):
+        budget = PromptBudget(self.counter, max_tokens=1000)
+        fitted = budget.fit([PromptSection("context", "short text", priority=1)])
+        self.assertEqual(fitted["context"], "short text")
+
+    def test_lowest_priority_reduced_first(self):
+        budget = PromptBudget(self.counter, max_tokens=300)
+        fitted = budget.fit(
+            [
+                PromptSection("instructions", "i" * 400, fixed=True),
+                PromptSection("tree", "t" * 400, priority=30),
+                PromptSection("retrieved", "r" * 2000, priority=10),
+            ]
+        )
+        self.assertEqual(fitted["instructions"], "i" * 400)
+        self.assertEqual(fitted["tree"], "t" * 400)
+        self.assertIn("truncated", fitted["retrieved"])
+        total = sum(self.counter.count(text) for text in fitted.values())
+        self.assertLessEqual(total, 300)
+
+    def test_summary_preferred_over_truncation(self):
+        budget = PromptBudget(self.counter, max_tokens=100)
+        fitted = budget.fit(
+            [PromptSection("tree", "x" * 1000, priority=1, summarize=lambda _: "a.py\nb.py")]
+        )
+        self.assertEqual(fitted["tree"], "a.py\nb.py")
+
+    def test_tokenizer_is_never_downloaded(self):
+        with unittest.mock.patch(
+            "transformers.AutoTokenizer.from_pretrained", side_effect=OSError("not cached")
+        ) as load:
+            counter = TokenCounter("meta-llama/llama-3-70b-instruct")
+        load.assert_called_once_with("meta-llama/Meta-Llama-3-70B-Instruct", local_files_only=True)
+        self.assertFalse(counter.exact)
+        self.assertEqual(counter.count("x" * 40), 10)
+
+
+class _RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__("429 Too Many Requests")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"Retry-After": retry_after}})()
+
+
+class TestResilience(unittest.TestCase):
+    def make_caller(self, max_retries=3, threshold=5):
+        return ResilientCaller(
+            RetryPolicy(max_retries=max_retries, base_delay=0.0, max_delay=0.0),
+            CircuitBreaker(failure_threshold=threshold, reset_timeout=60),
+        )
+
+    def test_retries_transient_errors(self):
+        caller = self.make_caller()
+        outcomes = [_RateLimited("0"), TimeoutError("timed out"), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        self.assertEqual(caller.call(flaky), "ok")
+        stats = caller.stats()
+        self.assertEqual(stats["retries"], 2)
+        self.assertEqual(stats["retry_after_waits"], 1)
+
+    def test_non_transient_errors_are_not_retried(self):
+        caller = self.make_caller()
+        with self.assertRaises(ValueError):
+            caller.call(lambda: (_ for _ in ()).throw(ValueError("bad prompt")))
+        self.assertEqual(caller.stats()["attempts"], 1)
+
+    def test_circuit_breaker_opens(self):
+        caller = self.make_caller(max_retries=5, threshold=2)
+
+        def failing():
+            raise ConnectionError("connection reset")
+
+        with self.assertRaises(CircuitOpenError):
+            caller.call(failing)
+        self.assertEqual(caller.stats()["circuit_state"], CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            caller.call(lambda: "ok")
+
+    def test_retry_after_header(self):
+        self.assertEqual(retry_after_seconds(_RateLimited("7")), 7.0)
+        self.assertTrue(is_transient_error(_RateLimited("7")))
+        self.assertEqual(RetryPolicy(max_delay=5.0).delay(1, _RateLimited("4.5")), 4.5)
+
+        caller = self.make_caller()
+        with self.assertRaises(_RateLimited):
+            caller.call(lambda: (_ for _ in ()).throw(_RateLimited("60")))
+        self.assertEqual((caller.stats()["attempts"], caller.stats()["retries"]), (1, 0))
+
+    def test_hedged_request_wins(self):
+        caller = self.make_caller()
+        caller.hedge = True
+        for _ in range(5):
+            caller.latency.record(0.01)
+        calls = []
+
+        def slow_then_fast():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return "primary"
+            return "hedge"
+
+        self.assertEqual(caller.call(slow_then_fast), "hedge")
+        self.assertEqual(caller.stats()["hedge_wins"], 1)
+
+
+class _CompletionHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.payloads.append(payload)
+        self.send_response(200)
+        if payload["stream"]:
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for text in ("Hello", ", world"):
+                event = json.dumps({"choices": [{"text": text}]})
+                self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        else:
+            body = json.dumps({"choices": [{"text": "Hello, world"}]}).encode("utf-8")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestBackends(unittest.TestCase):
+    def test_openai_compatible_backend(self):
+        server = HTTPServer(("127.0.0.1", 0), _CompletionHandler)
+        server.payloads = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            backend = OpenAICompatibleBackend(
+                model_id="tiny", base_url=f"http://127.0.0.1:{server.server_port}/v1"
+            )
+            params = {"max_new_tokens": 10, "decoding_method": "greedy", "temperature": 0.7}
+            self.assertEqual(backend.generate("Hi", params), "Hello, world")
+            self.assertEqual("".join(backend.stream("Hi", params)), "Hello, world")
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(server.payloads[0]["max_tokens"], 10)
+        self.assertEqual(server.payloads[0]["temperature"], 0.0)
+
+    def test_stub_backend_plans_files_from_grounding(self):
+        prompt = (
+            "Path: project_old/app.py\nContent:\nprint('hi')\n"
+            'Output this information as a JSON file\n"existing_files"\nFeature Request: Add logging\n'
+        )
+        response = StubBackend().generate(prompt, {})
+        plan = json.loads(response.split("```json\n", 1)[1].split("```", 1)[0])
+        self.assertEqual(plan["existing_files"][0]["file_path"], "project_old/app.py")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_backend("missing", "model")
+
+    def test_stream_sends_the_same_prompt_as_query(self):
+        prompts, queries = [], []
+
+        class Retriever:
+            def invoke(self, query):
+                queries.append(query)
+                return [type("Document", (), {"page_content": "Retrieved context"})()]
+
+        vector_db = type("VectorDB", (), {"as_retriever": lambda self, **kwargs: Retriever()})()
+
+        def responder(prompt, params):
+            prompts.append(prompt)
+            return "Answer"
+
+        set_backend(StubBackend(responder=responder))
+        try:
+            query_llm("Question", vector_db, grounding="Notes", use_cache=False)
+            "".join(stream_llm("Question", vector_db, grounding="Notes", use_cache=False))
+        finally:
+            set_backend(None)
+        self.assertEqual(prompts[0], prompts[1])
+        self.assertEqual(queries[0], queries[1])
+        self.assertIn("Retrieved context", prompts[0])
+
+
+class TestCassette(unittest.TestCase):
+    def test_record_then_replay(self):
+        params = {"max_new_tokens": 10}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "run.cassette")
+            recorder = CassetteBackend(path, mode=RECORD, inner=StubBackend(latency=0.01))
+            recorded = recorder.generate("prompt one", params)
+            streamed = "".join(recorder.stream("prompt two", params))
+
+            replayer = CassetteBackend(path, mode=REPLAY)
+            self.assertEqual(replayer.generate("prompt one", params), recorded)
+            self.assertEqual("".join(replayer.stream("prompt two", params)), streamed)
+            with self.assertRaises(CassetteMissError):
+                replayer.generate("unrecorded prompt", params)
+
+    def test_recording_appends_to_the_cassette(self):
+        params = {"max_new_tokens": 10}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "run.cassette")
+            recorder = CassetteBackend(path, mode=RECORD, inner=StubBackend())
+            recorder.generate("prompt one", params)
+            size = os.path.getsize(path)
+            recorder.generate("prompt one", params)
+            # A repeated request only appends its latency
+            self.assertLess(os.path.getsize(path) - size, size)
+            CassetteBackend(path, mode=RECORD, inner=StubBackend()).generate("prompt two", params)
+            with open(path, "ab") as f:
+                f.write(b"\x1f\x8b\x08")
+
+            cassette = CassetteBackend(path, mode=REPLAY).cassette
+            self.assertEqual(len(cassette.entries), 2)
+            self.assertEqual(len(cassette.lookup("prompt one", params)["latencies"]), 2)
+
+    def test_latency_models(self):
+        self.assertEqual(LatencyModel.parse("none").sample(3.0), 0.0)
+        self.assertEqual(LatencyModel.parse("recorded*0.5").sample(3.0), 1.5)
+        self.assertEqual(LatencyModel.parse("fixed:0.2").sample(), 0.2)
+        self.assertGreater(LatencyModel.parse("lognormal:0,0.5", seed=1).sample(), 0.0)
+        with self.assertRaises(ValueError):
+            LatencyModel.parse("gamma:1,2")
+
+
+class TestOutputGovernor(unittest.TestCase):
+    def tearDown(self):
+        set_backend(None)
+        reset_output_stats()
+
+    def test_budget_from_task_type_and_source(self):
+        small = output_budget("code", "x = 1\n" * 10, model_id="unknown-model")
+        large = output_budget("code", "x = 1\n" * 500, model_id="unknown-model")
+        self.assertLess(small.max_new_tokens, large.max_new_tokens)
+        self.assertEqual(large.stop_sequences, (FENCE_STOP,))
+        self.assertEqual(output_budget("analysis").params()["min_new_tokens"], 0)
+        self.assertEqual(output_budget("default").params(), {"max_new_tokens": 900, "min_new_tokens": 50})
+        with self.assertRaises(ValueError):
+            output_budget("poetry")
+
+    def test_truncated_response_is_continued(self):
+        calls = []
+
+        def responder(prompt, params):
+            calls.append(params)
+            return "done." if prompt.endswith("a" * 1600) else "a" * 1600
+
+        set_backend(StubBackend(responder=responder))
+        budget = output_budget("code", model_id="unknown-model", max_new_tokens=400)
+        self.assertEqual(budget.reserved_tokens(), 400 + 2 * 100)
+        response = query_llm("Rewrite the file", use_cache=False, output=budget)
+        self.assertEqual(response, "a" * 1600 + "done.")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0]["stop_sequences"], [FENCE_STOP])
+        # The continuation gets its own, smaller limit
+        self.assertEqual((calls[0]["max_new_tokens"], calls[1]["max_new_tokens"]), (400, 100))
+        self.assertEqual(calls[1]["min_new_tokens"], 0)
+        stats = output_stats()
+        self.assertEqual((stats["truncations"], stats["continuations"]), (1, 1))
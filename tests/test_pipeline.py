@@ -0,0 +1,297 @@
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from src.pipeline.dag import (
+    CACHED,
+    FAILED,
+    RUN,
+    SKIPPED,
+    Pipeline,
+    Stage,
+    StageError,
+    StageMemo,
+    path_fingerprint,
+)
+from src.pipeline.planner import estimate_run, rank_files
+from src.pipeline.stages import TASK_WORKERS, FeatureOptions, FeatureStages
+from src.utils.profiling import StageProfiler
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self, run_id=None, resume=False, scale=2, fail=False):
+        pipeline = Pipeline(run_id, base_dir=self.tmp_dir.name, resume=resume)
+
+        def stage(name, fn):
+            def run(inputs):
+                self.calls.append(name)
+                return fn(inputs)
+
+            return run
+
+        def combine(inputs):
+            if fail:
+                raise RuntimeError("boom")
+            return inputs["left"] + inputs["right"]
+
+        pipeline.add(Stage("source", stage("source", lambda inputs: 3)))
+        pipeline.add(
+            Stage(
+                "left",
+                stage("left", lambda inputs: inputs["source"] * scale),
+                inputs=("source",),
+                params={"scale": scale},
+            )
+        )
+        pipeline.add(Stage("right", stage("right", lambda inputs: inputs["source"] + 1), inputs=("source",)))
+        pipeline.add(Stage("combine", stage("combine", combine), inputs=("left", "right")))
+        return pipeline
+
+    def test_independent_stages_run_in_parallel(self):
+        pipeline = Pipeline(base_dir=self.tmp_dir.name)
+        barrier = threading.Barrier(2, timeout=5)
+        pipeline.add(Stage("a", lambda inputs: barrier.wait() is not None))
+        pipeline.add(Stage("b", lambda inputs: barrier.wait() is not None))
+        pipeline.add(Stage("c", lambda inputs: inputs["a"] and inputs["b"], inputs=("a", "b")))
+
+        pipeline.run()
+        self.assertTrue(pipeline.value("c"))
+
+    def test_resume_reuses_checkpoints(self):
+        pipeline = self.build()
+        pipeline.run()
+        self.assertEqual(pipeline.value("combine"), 10)
+
+        self.calls.clear()
+        resumed = self.build(run_id=pipeline.run_id, resume=True)
+        status = resumed.run()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(set(status.values()), {CACHED})
+        self.assertEqual(resumed.value("combine"), 10)
+
+    def test_run_directory_stays_in_runs_dir(self):
+        for run_id in ("/tmp/run", "../run", "run/1", "run.1"):
+            with self.assertRaises(ValueError):
+                Pipeline(run_id, base_dir=self.tmp_dir.name, resume=True)
+        outside = tempfile.mkdtemp()
+        try:
+            os.symlink(outside, os.path.join(self.tmp_dir.name, "linked"))
+            with self.assertRaises(ValueError):
+                Pipeline("linked", base_dir=self.tmp_dir.name)
+        finally:
+            os.rmdir(outside)
+
+    def test_changed_params_invalidate_downstream_stages(self):
+        pipeline = self.build()
+        pipeline.run()
+
+        self.calls.clear()
+        resumed = self.build(run_id=pipeline.run_id, resume=True, scale=3)
+        status = resumed.run()
+        self.assertEqual(sorted(self.calls), ["combine", "left"])
+        self.assertEqual(status["right"], CACHED)
+        self.assertEqual(resumed.value("combine"), 13)
+
+    def test_failed_stage_is_rerun_on_resume(self):
+        pipeline = self.build(fail=True)
+        with self.assertRaises(StageError) as raised:
+            pipeline.run()
+        self.assertEqual(raised.exception.stage, "combine")
+
+        self.calls.clear()
+        resumed = self.build(run_id=raised.exception.run_id, resume=True)
+        status = resumed.run()
+        self.assertEqual(self.calls, ["combine"])
+        self.assertEqual(status["combine"], RUN)
+        self.assertEqual(resumed.value("combine"), 10)
+
+    def test_keep_going_skips_only_dependent_stages(self):
+        pipeline = self.build(fail=True)
+        pipeline.add(Stage("after", lambda inputs: inputs["combine"], inputs=("combine",)))
+        pipeline.add(Stage("other", lambda inputs: inputs["right"] * 2, inputs=("right",)))
+
+        status = pipeline.run(keep_going=True)
+        self.assertEqual(status["combine"], FAILED)
+        self.assertEqual(status["after"], SKIPPED)
+        self.assertEqual(pipeline.value("other"), 8)
+        self.assertEqual(list(pipeline.errors), ["combine"])
+
+    def test_memo_shares_outputs_between_runs(self):
+        memo = StageMemo(["source", "right"])
+        first = self.build()
+        first.memo = memo
+        first.run()
+
+        self.calls.clear()
+        second = self.build(scale=3)
+        second.memo = memo
+        status = second.run()
+        self.assertEqual(sorted(self.calls), ["combine", "left"])
+        self.assertEqual(status["source"], CACHED)
+        self.assertEqual(second.value("combine"), 13)
+
+    def test_profiler_profiles_executed_stages(self):
+        first = self.build()
+        first.run()
+
+        pipeline = self.build(first.run_id, resume=True, scale=3)
+        pipeline.profiler = StageProfiler(trace_memory=False)
+        with pipeline.profiler:
+            pipeline.run()
+        profiled = sorted(profile.stage for profile in pipeline.profiler.profiles)
+        self.assertEqual(profiled, ["combine", "left"])
+
+    def test_resume_unknown_run(self):
+        with self.assertRaises(FileNotFoundError):
+            Pipeline("missing", base_dir=self.tmp_dir.name, resume=True)
+
+
+class TestPlanner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.project = os.path.join(self.tmp_dir.name, "project")
+        os.makedirs(os.path.join(self.project, "utils"))
+        files = {
+            "app.py": "from utils.helpers import greet\n\nprint(greet('world'))\n",
+            os.path.join("utils", "helpers.py"): "def greet(name):\n    return f'Hello {name}'\n",
+            "README.md": "A tiny project.\n",
+        }
+        for path, content in files.items():
+            with open(os.path.join(self.project, path), "w", encoding="utf-8") as f:
+                f.write(content)
+        self.runs = os.path.join(self.tmp_dir.name, "runs")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_rank_files(self):
+        project_data = [
+            {"path": "project/app.py", "content": "print('hi')"},
+            {"path": "project/utils/helpers.py", "content": "def greet(name): ..."},
+        ]
+        ranked = rank_files(project_data, "Translate the greet helpers")
+        self.assertEqual([item["path"] for item in ranked], ["project/utils/helpers.py"])
+
+    def test_estimate_without_history(self):
+        plan = estimate_run("Add a farewell to the greet helpers", self.project, base_dir=self.runs)
+        self.assertEqual(plan.files, 3)
+        # helpers.py and app.py mention the request's words, plus one new file
+        self.assertEqual([call.step for call in plan.calls], [5, 5, 5, 6, 7, 7, 7])
+        self.assertEqual(plan.calls[4].label, os.path.join(self.project, "utils", "helpers.py"))
+        self.assertEqual(plan.calls[6].task_type, "new_file")
+        self.assertTrue(all(call.prompt_tokens > 0 for call in plan.calls))
+        self.assertIsNone(plan.seconds)
+        self.assertEqual(plan.fanout_source, "heuristic")
+
+    def test_estimate_from_recorded_timings(self):
+        os.makedirs(os.path.join(self.runs, "old"))
+        spans = [
+            {"kind": "llm", "name": "analysis", "wall_seconds": 2.0, "attributes": {}},
+            {"kind": "llm", "name": "analysis", "wall_seconds": 4.0, "attributes": {}},
+            {"kind": "llm", "name": "plan", "wall_seconds": 9.0, "attributes": {"cached": True}},
+        ]
+        with open(os.path.join(self.runs, "old", "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump({"spans": spans}, f)
+
+        plan = estimate_run(
+            "Add a farewell", self.project, analysis_mode="combined", base_dir=self.runs
+        )
+        self.assertEqual(plan.recorded_calls, 2)
+        self.assertEqual(plan.calls[0].label, "combined analysis")
+        # Every call is predicted from the analysis timings; the cached plan call is ignored
+        self.assertEqual(plan.seconds, 3.0 * len(plan.calls))
+
+    def test_previous_plan_needs_same_project_and_modes(self):
+        request = "Add a farewell"
+        run_dir = os.path.join(self.runs, "previous")
+        os.makedirs(run_dir)
+        metadata = {
+            "user_request": request,
+            "project_fingerprint": path_fingerprint(self.project),
+            "analysis_mode": "separate",
+            "output_mode": "full",
+        }
+        manifest = {"stages": {"plan": {"status": RUN}}, "metadata": metadata}
+        with open(os.path.join(run_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        with open(os.path.join(run_dir, "plan.pkl"), "wb") as f:
+            pickle.dump({"plan": {"existing_files": [], "new_files": []}}, f)
+
+        def source(**modes):
+            return estimate_run(request, self.project, base_dir=self.runs, **modes).fanout_source
+
+        self.assertEqual(source(), "run previous")
+        self.assertEqual(source(output_mode="patch"), "heuristic")
+        with open(os.path.join(self.project, "README.md"), "a", encoding="utf-8") as f:
+            f.write("Now with farewells.\n")
+        self.assertEqual(source(), "heuristic")
+
+
+class TestFeatureStages(unittest.TestCase):
+    def test_failed_plan_cancels_early_tasks(self):
+        new_files = [{"file_path": f"project_old/new_{i}.py", "purpose": "Helper"} for i in range(12)]
+        plan = json.dumps(
+            {"feature_request": "Add helpers", "analysis_results": "None", "new_files": new_files}
+        )
+        calls = []
+
+        def fake_query_llm(user_input, stream=False, **kwargs):
+            if stream:
+
+                def chunks():
+                    # The whole plan streams, then the connection drops
+                    yield plan[:-2]
+                    raise ConnectionError("connection reset")
+
+                return chunks()
+            calls.append(user_input)
+            time.sleep(0.2)
+            return "print('helper')"
+
+        stages = FeatureStages(FeatureOptions("Add helpers", early_dispatch=True))
+        inputs = {"analysis": "None", "context": {"retrieved_context": ""}}
+        with mock.patch("src.pipeline.stages.query_llm", fake_query_llm):
+            with self.assertRaises(ConnectionError):
+                stages.plan(inputs)
+            time.sleep(0.5)
+        # Only the tasks already running when the plan failed were executed
+        self.assertLessEqual(len(calls), TASK_WORKERS)
+
+    def test_resumed_stream_run_rewrites_streamed_new_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old, new = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+            os.makedirs(old)
+            with open(os.path.join(old, "app.py"), "w", encoding="utf-8") as f:
+                f.write("a = 1\n")
+            existing = {"file_path": os.path.join(old, "app.py"), "content": "a = 1\n"}
+            plan = {
+                "existing_files": [existing],
+                "new_files": [{"file_path": "pkg/log.py", "purpose": "Logging"}],
+            }
+            options = FeatureOptions(
+                "Add logging", stream=True, old_project_path=old, new_project_path=new
+            )
+            stages = FeatureStages(options)
+            # Step 7 was reused from its checkpoint, so the project is cloned again
+            stages.pipeline = mock.Mock(status={"tasks": CACHED})
+            plan_output = {"plan": plan, "json_data": json.dumps(plan)}
+            stages.update({"plan": plan_output, "tasks": ["a = 2\n", "LOG = 1\n"]})
+            for path, content in [("app.py", "a = 2\n"), ("pkg/log.py", "LOG = 1\n")]:
+                with open(os.path.join(new, path), encoding="utf-8") as f:
+                    self.assertEqual(f.read(), content)
+
+
+if __name__ == "__main__":
+    unittest.main()
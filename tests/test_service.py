@@ -0,0 +1,121 @@
+import http.client
+import json
+import os
+import tempfile
+import threading
+import unittest
+import unittest.mock
+import zipfile
+
+from src.service.client import WorkerClient, WorkerError
+from src.service.worker import PipelineWorker, create_server, parse_address
+
+
+class TestWorkerService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = []
+        self.worker = PipelineWorker(
+            pool_size=1, root=self.tmp_dir.name, jobs_dir="jobs", run_pipeline=self.fake_pipeline
+        )
+        self.worker.start()
+        self.server = create_server("127.0.0.1:0", self.worker, token="secret")
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address[:2]
+        self.client = WorkerClient(f"{host}:{port}", timeout=5, token="secret")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.worker.stop()
+        self.tmp_dir.cleanup()
+
+    def fake_pipeline(self, prompt, on_event, project_path, output_path, memo, **options):
+        self.calls.append((prompt, options))
+        if prompt == "fail":
+            raise RuntimeError("boom")
+        on_event("status", f"Working on: {prompt}")
+        os.makedirs(output_path, exist_ok=True)
+        with open(os.path.join(output_path, "main.py"), "w") as f:
+            f.write("print('updated')\n")
+        return "run-1"
+
+    def test_submit_follow_and_result(self):
+        job = self.client.submit("Add logging", output_mode="patch", run_id=None)
+        lines = list(self.client.follow(job["id"]))
+        self.assertEqual(lines, ["Working on: Add logging"])
+
+        result = self.client.result(job["id"])
+        self.assertEqual(result["status"], "succeeded")
+        self.assertEqual(result["run_id"], "run-1")
+        self.assertEqual(result["files"], ["main.py"])
+        self.assertEqual(self.calls, [("Add logging", {"output_mode": "patch"})])
+
+        zip_path = os.path.join(self.tmp_dir.name, "result.zip")
+        with unittest.mock.patch.dict(os.environ, {"ARCHIVE_CACHE_DIR": self.tmp_dir.name}):
+            self.client.download(job["id"], zip_path)
+        with zipfile.ZipFile(zip_path) as archive:
+            self.assertEqual(archive.read("main.py"), b"print('updated')\n")
+
+    def test_failed_job_reports_error(self):
+        job = self.client.submit("fail")
+        list(self.client.follow(job["id"]))
+        result = self.client.result(job["id"])
+        self.assertEqual(result["status"], "failed")
+        self.assertEqual(result["error"], "boom")
+        with self.assertRaises(WorkerError) as raised:
+            self.client.download(job["id"], os.path.join(self.tmp_dir.name, "result.zip"))
+        self.assertEqual(raised.exception.status, 409)
+
+    def test_invalid_job_is_rejected(self):
+        with self.assertRaises(WorkerError) as raised:
+            self.client.submit("Add logging", shard_large_files="yes")
+        self.assertEqual(raised.exception.status, 400)
+        with self.assertRaises(WorkerError):
+            self.client.submit(None)
+
+    def test_requests_need_token_and_json(self):
+        host, port = self.server.server_address[:2]
+
+        def post(headers):
+            connection = http.client.HTTPConnection(host, port, timeout=5)
+            try:
+                body = json.dumps({"prompt": "Add logging", "output_path": "/tmp"})
+                connection.request("POST", "/jobs", body=body, headers=headers)
+                return connection.getresponse().status
+            finally:
+                connection.close()
+
+        self.assertEqual(post({"Content-Type": "text/plain"}), 401)
+        self.assertEqual(post({"Authorization": "Bearer wrong"}), 401)
+        self.assertEqual(post({"Authorization": "Bearer secret", "Content-Type": "text/plain"}), 415)
+        with self.assertRaises(WorkerError) as raised:
+            WorkerClient(f"{host}:{port}", timeout=5, token="wrong").status("0" * 12)
+        self.assertEqual(raised.exception.status, 401)
+        self.assertEqual(self.calls, [])
+
+    def test_job_paths_stay_inside_root(self):
+        for output_path in ("/tmp/anything", "../outside", "out/../../outside", "project_old/out"):
+            with self.assertRaises(WorkerError) as raised:
+                self.client.submit("Add logging", output_path=output_path)
+            self.assertEqual(raised.exception.status, 400)
+        with self.assertRaises(WorkerError):
+            self.client.submit("Add logging", project_path="project_new/src", output_path="project_new")
+        for run_id in ("/tmp/run", "../run", "run/1", ""):
+            with self.assertRaises(WorkerError) as raised:
+                self.client.submit("Add logging", run_id=run_id, resume=True)
+            self.assertEqual(raised.exception.status, 400)
+        job = self.client.submit("Add logging", output_path="project_new")
+        self.assertEqual(job["output_path"], os.path.join(self.worker.root, "project_new"))
+        list(self.client.follow(job["id"]))
+        self.assertEqual(self.calls, [("Add logging", {})])
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("unix:/tmp/worker.sock"), ("unix", "/tmp/worker.sock"))
+        self.assertEqual(parse_address("http://localhost:8765/"), ("tcp", ("localhost", 8765)))
+        with self.assertRaises(ValueError):
+            parse_address("localhost")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+import io
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.archive import (
+    ArchiveEntry,
+    attach_raw,
+    directory_entries,
+    export_archive,
+    iter_zip,
+    raw_members,
+)
+from src.utils.file_operations import read_file, stream_to_file, write_file
+from src.utils.materialize import materialize_tree
+from src.utils.metrics import (
+    Metrics,
+    bind_run_metrics,
+    get_metrics,
+    prometheus_text,
+    run_metrics,
+)
+from src.utils.output_writer import ProjectWriter
+from src.utils.profiling import StageProfiler
+from src.utils.startup_profile import parse_importtime
+
+
+class TestFileOperations(unittest.TestCase):
+    def test_stream_to_file(self):
+        seen = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "pkg", "module.py")
+            content = stream_to_file(iter(["print(", "'hi')", "\n"]), path, on_chunk=seen.append)
+            self.assertEqual(content, "print('hi')")
+            self.assertEqual(read_file(path), "print('hi')\n")
+        self.assertEqual(seen, ["print(", "'hi')", "\n"])
+
+
+class TestArchive(unittest.TestCase):
+    def test_iter_zip_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            files = {
+                "src/app.py": b"print('hello')\n" * 200,
+                "assets/logo.png": os.urandom(2048),
+                "big.log": b"line\n" * 1000,
+                "empty.txt": b"",
+            }
+            for name, content in files.items():
+                os.makedirs(os.path.dirname(os.path.join(tmp_dir, name)), exist_ok=True)
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(content)
+            entries = directory_entries(tmp_dir) + [ArchiveEntry("notes/données.md", data=b"# ok")]
+
+            data = b"".join(iter_zip(entries, workers=2, stream_threshold=1000))
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                self.assertIsNone(archive.testzip())
+                self.assertEqual(archive.read("notes/données.md"), b"# ok")
+                for name, content in files.items():
+                    self.assertEqual(archive.read(name), content)
+                infos = {info.filename: info for info in archive.infolist()}
+                self.assertEqual(infos["assets/logo.png"].compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(infos["src/app.py"].compress_type, zipfile.ZIP_DEFLATED)
+                self.assertTrue(infos["big.log"].flag_bits & 0x08)
+                # Streaming readers need the CRC and sizes of large stored members up front
+                logo = infos["assets/logo.png"]
+                self.assertFalse(logo.flag_bits & 0x08)
+                local = struct.unpack(
+                    "<IIIHH", data[logo.header_offset + 14 : logo.header_offset + 30]
+                )
+                self.assertEqual(local, (logo.CRC, 2048, 2048, len(logo.filename), 0))
+
+    def test_unchanged_members_are_copied_from_source_archive(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            upload = os.path.join(tmp_dir, "upload.zip")
+            with zipfile.ZipFile(upload, "w") as archive:
+                # Stored, so a copied member is told apart from a compressed one
+                archive.writestr("demo/app.py", "print('old')\n" * 50)
+                archive.writestr("demo/lib/util.py", "def util():\n    pass\n" * 50)
+            project = os.path.join(tmp_dir, "project")
+            extracted = {}
+            with zipfile.ZipFile(upload) as archive:
+                for member in archive.namelist():
+                    name = member.split("/", 1)[1]
+                    os.makedirs(os.path.dirname(os.path.join(project, name)), exist_ok=True)
+                    with open(os.path.join(project, name), "wb") as f:
+                        f.write(archive.read(member))
+                    extracted[name] = member
+            members = raw_members(upload, extracted, project)
+            self.assertEqual(sorted(members), ["app.py", "lib/util.py"])
+
+            write_file(os.path.join(project, "app.py"), "print('new')\n" * 50)
+            os.utime(os.path.join(project, "app.py"), ns=(1, 1))
+            entries = attach_raw(directory_entries(project), members)
+            self.assertEqual([entry.reusable() for entry in entries], [False, True])
+
+            data = b"".join(iter_zip(entries, workers=2))
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                self.assertIsNone(archive.testzip())
+                self.assertEqual(archive.read("app.py"), b"print('new')\n" * 50)
+                self.assertEqual(archive.read("lib/util.py"), b"def util():\n    pass\n" * 50)
+                infos = {info.filename: info for info in archive.infolist()}
+                self.assertEqual(infos["app.py"].compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(infos["lib/util.py"].compress_type, zipfile.ZIP_STORED)
+
+    def test_export_archive_is_content_addressed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, "cache")
+            project = os.path.join(tmp_dir, "project")
+            os.makedirs(project)
+            write_file(os.path.join(project, "main.py"), "print(1)\n")
+
+            first = export_archive(directory_entries(project), "project", cache_dir)
+            again = export_archive(directory_entries(project), "project", cache_dir)
+            self.assertEqual(first, again)
+            self.assertTrue(os.path.basename(first).startswith("project-"))
+
+            write_file(os.path.join(project, "main.py"), "print(2)\n")
+            os.utime(os.path.join(project, "main.py"), ns=(1, 1))
+            changed = export_archive(directory_entries(project), "project", cache_dir)
+            self.assertNotEqual(changed, first)
+            self.assertEqual(sorted(os.listdir(cache_dir)), sorted(map(os.path.basename, [first, changed])))
+
+
+class TestMaterialize(unittest.TestCase):
+    def test_materialize_places_only_changed_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source, target = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+            for path in ["main.py", "pkg/a.py", "pkg/b.py"]:
+                os.makedirs(os.path.dirname(os.path.join(source, path)), exist_ok=True)
+                write_file(os.path.join(source, path), f"# {path}\n")
+            os.makedirs(os.path.join(source, "empty"))
+
+            stats = materialize_tree(source, target, mode="copy")
+            self.assertEqual((stats.copied, stats.kept), (3, 0))
+            self.assertTrue(os.path.isdir(os.path.join(target, "empty")))
+
+            write_file(os.path.join(source, "pkg/a.py"), "# changed\n")
+            os.utime(os.path.join(source, "pkg/a.py"), ns=(1, 1))
+            os.remove(os.path.join(source, "pkg/b.py"))
+            write_file(os.path.join(target, "stray.py"), "")
+            write_file(os.path.join(target, "main.py"), "# previous run\n")
+            stats = materialize_tree(source, target, exclude=["main.py"], mode="copy")
+            self.assertEqual((stats.copied, stats.kept), (1, 0))
+            self.assertEqual((stats.removed, stats.excluded), (2, 1))
+            self.assertEqual(read_file(os.path.join(target, "pkg/a.py")), "# changed\n")
+            # Left for the caller to replace
+            self.assertEqual(read_file(os.path.join(target, "main.py")), "# previous run\n")
+            self.assertEqual(sorted(os.listdir(target)), ["empty", "main.py", "pkg"])
+
+            stats = materialize_tree(source, target, mode="copy")
+            self.assertEqual((stats.copied, stats.kept, stats.removed), (1, 1, 0))
+            self.assertEqual(read_file(os.path.join(target, "main.py")), "# main.py\n")
+            with self.assertRaises(ValueError):
+                materialize_tree(source, target, mode="symlink")
+
+    def test_hardlinked_files_are_replaced_on_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source, target = os.path.join(tmp_dir, "old"), os.path.join(tmp_dir, "new")
+            os.makedirs(source)
+            write_file(os.path.join(source, "main.py"), "original\n")
+            stats = materialize_tree(source, target, mode="hardlink")
+            self.assertEqual(stats.hardlinked + stats.copied, 1)
+
+            stream_to_file(iter(["generated\n"]), os.path.join(target, "main.py"))
+            self.assertEqual(read_file(os.path.join(source, "main.py")), "original\n")
+            self.assertEqual(read_file(os.path.join(target, "main.py")), "generated\n")
+
+
+class TestProjectWriter(unittest.TestCase):
+    def test_commit_writes_all_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "project")
+            writer = ProjectWriter(root, batch_size=2)
+            for i in range(5):
+                writer.add(os.path.join(root, "pkg", f"m{i}.py"), f"x = {i}\n")
+            writer.add(os.path.join(root, "main.py"), "main\n")
+            with self.assertRaises(ValueError):
+                writer.add(os.path.join(tmp_dir, "outside.py"), "")
+
+            written = writer.commit()
+            self.assertEqual(len(written), 6)
+            self.assertEqual(read_file(os.path.join(root, "pkg", "m3.py")), "x = 3\n")
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["project"])
+            self.assertEqual(writer.commit(), [])
+
+    def test_failed_commit_writes_nothing(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "project")
+            os.makedirs(root)
+            write_file(os.path.join(root, "pkg"), "not a directory")
+            writer = ProjectWriter(root, fsync=False)
+            writer.add(os.path.join(root, "main.py"), "main\n")
+            writer.add(os.path.join(root, "pkg", "module.py"), "module\n")
+            with self.assertRaises(OSError):
+                writer.commit()
+            self.assertEqual(os.listdir(root), ["pkg"])
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["project"])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_spans_and_counters(self):
+        metrics = Metrics()
+        with metrics.span("plan", kind="llm") as span:
+            span.set(prompt_tokens=120)
+        with self.assertRaises(ValueError):
+            with metrics.span("plan", kind="llm"):
+                raise ValueError("bad plan")
+        metrics.count("llm_prompt_tokens", 120, task_type="plan")
+        metrics.count("llm_prompt_tokens", 30, task_type="code")
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["summary"][0]["count"], 2)
+        self.assertEqual(snapshot["summary"][0]["errors"], 1)
+        self.assertEqual(snapshot["spans"][0]["attributes"], {"prompt_tokens": 120})
+        self.assertEqual(snapshot["spans"][1]["error"], "ValueError")
+        self.assertEqual(metrics.total("llm_prompt_tokens"), 150)
+
+        text = prometheus_text(snapshot, {"llm_cache": {"hits": 3, "enabled": True}})
+        self.assertIn('factory_feature_spans_total{kind="llm",name="plan"} 2', text)
+        self.assertIn('factory_feature_llm_prompt_tokens_total{task_type="code"} 30', text)
+        self.assertIn("factory_feature_llm_cache_hits 3", text)
+        self.assertNotIn("enabled", text)
+
+    def test_run_metrics_leave_out_other_runs(self):
+        def work(name):
+            with get_metrics().span(name, kind="llm"):
+                get_metrics().count("llm_calls", task_type=name)
+
+        def run(name, recorders):
+            with run_metrics() as recorder:
+                # Also through a thread pool, as stages and Step 7 tasks run
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(executor.map(bind_run_metrics(work), [name, name]))
+                recorders[name] = recorder
+
+        recorders = {}
+        threads = [threading.Thread(target=run, args=(name, recorders)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        work("outside")
+        for name, recorder in recorders.items():
+            snapshot = recorder.snapshot()
+            self.assertEqual([row["name"] for row in snapshot["summary"]], [name])
+            self.assertEqual(snapshot["summary"][0]["count"], 2)
+            self.assertEqual(recorder.total("llm_calls"), 2)
+        self.assertGreaterEqual(get_metrics().total("llm_calls"), 5)
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stage_profiles(self):
+        def busy():
+            kept = [str(i) * 10 for i in range(20000)]
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+            return kept
+
+        with StageProfiler(sample_interval=0.002) as profiler:
+            with profiler.stage("busy"):
+                kept = busy()
+        self.assertEqual(len(kept), 20000)
+
+        profile = profiler.profiles[0]
+        self.assertEqual(profile.stage, "busy")
+        self.assertGreater(profile.samples, 0)
+        self.assertGreater(profile.peak_memory_bytes, 0)
+        self.assertTrue(any("busy@" in row["function"] for row in profile.top_functions))
+        self.assertTrue(any("test_utils.py" in row["location"] for row in profile.top_allocations))
+        self.assertIn("busy@", profiler.folded("busy"))
+        self.assertTrue(profiler.folded().startswith("busy;"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary_path = profiler.write(tmp_dir)
+            self.assertEqual(
+                sorted(os.listdir(tmp_dir)),
+                ["all.folded", "busy.folded", "busy.prof", "profile.json"],
+            )
+            self.assertTrue(summary_path.endswith("profile.json"))
+
+
+class TestStartupProfile(unittest.TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |   json.decoder\n"
+            "import time:       300 |       2420 | json\n"
+        )
+        self.assertEqual(
+            parse_importtime(output), [(1, "json.decoder", 0.00012), (0, "json", 0.00242)]
+        )
+
+    def test_main_does_not_import_heavy_modules(self):
+        heavy = ["torch", "chromadb", "langchain_community", "src.vector_database.db_builder"]
+        script = f"import sys, main; print([m for m in {heavy!r} if m in sys.modules])"
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout.strip(), "[]")